@@ -1,15 +1,88 @@
-"""Test configuration"""
+"""
+Test configuration
+
+Tests may run in parallel processes with pytest-xdist, e.g. pytest -n auto.
+Each process elaborates the designs shared between its tests once.
+"""
+import fnmatch
 import os
 import shutil
 
 import nmigen.sim
 import pytest
+from nmigen.hdl import ast
+import vcd
+
+from riscy_boi import compiled_sim
+from riscy_boi import reusable_sim
 
 
 VCD_TOP_DIR = os.path.join(
         os.path.dirname(os.path.realpath(__file__)),
         "tests",
         "vcd")
+CLOCK_PERIOD = 1 / 10e6
+# The window and signal patterns tracing everything, with nmigen's VCD writer
+FULL_TRACE = (slice(0, None), [])
+
+
+def pytest_addoption(parser):
+    parser.addoption(
+            "--sim-engine",
+            choices=["pysim", "cxxrtl"],
+            default=os.environ.get("RISCY_BOI_SIM_ENGINE", "pysim"),
+            help="simulation engine for the comb_sim and sync_sim fixtures, "
+                 "cxxrtl compiles designs with the yowasp-yosys package "
+                 "(default: $RISCY_BOI_SIM_ENGINE or pysim)")
+    parser.addoption(
+            "--vcd",
+            action="store_true",
+            default=bool(os.environ.get("RISCY_BOI_VCD")),
+            help=f"write a VCD trace of each simulation to {VCD_TOP_DIR} "
+                 "(default: on if $RISCY_BOI_VCD is set)")
+    parser.addoption(
+            "--vcd-window",
+            default=os.environ.get("RISCY_BOI_VCD_WINDOW", ""),
+            metavar="START:STOP",
+            help="trace only clock cycles START to STOP of sync_sim runs, "
+                 "either may be omitted (default: $RISCY_BOI_VCD_WINDOW)")
+    parser.addoption(
+            "--vcd-signals",
+            default=os.environ.get("RISCY_BOI_VCD_SIGNALS", ""),
+            metavar="PATTERN,...",
+            help="trace only signals of sync_sim runs whose dotted "
+                 "hierarchical names, e.g. cpu.alu.o, match a glob pattern, "
+                 "or which are in a submodule matching one "
+                 "(default: $RISCY_BOI_VCD_SIGNALS)")
+
+
+def pytest_configure(config):
+    # Only the controlling process clears the traces, not each pytest-xdist
+    # worker, which could delete the traces of tests already run by others
+    if config.getoption("vcd") and not hasattr(config, "workerinput"):
+        shutil.rmtree(VCD_TOP_DIR, ignore_errors=True)
+
+
+@pytest.fixture(scope="session", name="sim_engine")
+def sim_engine_fixture(pytestconfig):
+    engine = pytestconfig.getoption("sim_engine")
+    return compiled_sim.CXXRTLEngine if engine == "cxxrtl" else engine
+
+
+@pytest.fixture(scope="session", name="vcd_config")
+def vcd_config_fixture(pytestconfig):
+    """Whether tracing is on, the cycle window and the signal patterns"""
+    if not pytestconfig.getoption("vcd"):
+        return None
+    window = pytestconfig.getoption("vcd_window")
+    start, colon, stop = window.partition(":")
+    if window and not colon:
+        raise pytest.UsageError(f"VCD window {window!r} is not START:STOP")
+    patterns = [pattern for pattern in
+                pytestconfig.getoption("vcd_signals").split(",") if pattern]
+    return (
+            slice(int(start) if start else 0, int(stop) if stop else None),
+            patterns)
 
 
 def vcd_path(node):
@@ -18,17 +91,150 @@ def vcd_path(node):
     return os.path.join(directory, node.name + ".vcd")
 
 
-@pytest.fixture(scope="session", autouse=True)
-def clear_vcd_directory():
-    shutil.rmtree(VCD_TOP_DIR, ignore_errors=True)
+def signal_names(fragment, hierarchy=()):
+    """Map each signal used by a fragment and its subfragments to its name"""
+    # pylint: disable=protected-access
+    names = ast.SignalDict()
+    for statement in fragment.statements:
+        for signal in statement._lhs_signals() | statement._rhs_signals():
+            names.setdefault(signal, (*hierarchy, signal.name))
+    for index, (subfragment, name) in enumerate(fragment.subfragments):
+        sub_names = signal_names(
+                subfragment,
+                (*hierarchy, name if name is not None else f"U${index}"))
+        for signal, sub_name in sub_names.items():
+            names.setdefault(signal, sub_name)
+    return names
+
+
+class Tracer:
+    """
+    Samples chosen signals once per clock cycle into a VCD file
+
+    Unlike the simulator's own VCD output, which records every signal for the
+    whole simulation, only the signals and cycles asked for are read.
+    """
+
+    def __init__(self, fragment, path, window, patterns):
+        """
+        Initialiser
+
+        Args:
+            fragment (ir.Fragment): the prepared design to trace
+            path (str): the VCD file to write
+            window (slice): the clock cycles to trace
+            patterns (list of str): glob patterns of the dotted names of
+                signals or submodules to trace, or empty to trace all
+        """
+        self.window = window
+        # Closed by close(), once the simulation has run
+        self.file = open(  # pylint: disable=consider-using-with
+                path, "w", encoding="utf-8")
+        self.writer = vcd.VCDWriter(self.file, timescale="1 ps")
+        self.variables = []
+        registered = set()
+        for signal, name in signal_names(fragment).items():
+            dotted = ".".join(name)
+            if patterns and not any(
+                    fnmatch.fnmatchcase(dotted, pattern) or
+                    fnmatch.fnmatchcase(dotted, pattern + ".*")
+                    for pattern in patterns):
+                continue
+            # Signals in the same module may share a name
+            var_name = name[-1]
+            suffix = 0
+            while name[:-1] + (var_name,) in registered:
+                suffix += 1
+                var_name = f"{name[-1]}${suffix}"
+            registered.add(name[:-1] + (var_name,))
+            variable = self.writer.register_var(
+                    ("top",) + name[:-1],
+                    var_name,
+                    "wire",
+                    size=signal.width,
+                    init=signal.reset & ((1 << signal.width) - 1))
+            self.variables.append((signal, variable))
+        self.timestamp = 0
+
+    def process(self):
+        """Passive sync process reading the signals before each clock edge"""
+        yield nmigen.sim.Passive()
+        cycle = 0
+        while self.window.stop is None or cycle < self.window.stop:
+            yield
+            if cycle >= self.window.start:
+                self.timestamp = round(cycle * CLOCK_PERIOD * 1e12)
+                for signal, variable in self.variables:
+                    value = (yield signal) & ((1 << signal.width) - 1)
+                    self.writer.change(variable, self.timestamp, value)
+            cycle += 1
+
+    def close(self):
+        self.writer.close(self.timestamp)
+        self.file.close()
+
+
+class DesignCache:
+    """
+    Designs elaborated once per session and shared between tests
+
+    The comb_sim and sync_sim fixtures simulate a shared design by resetting
+    and rerunning the simulator made the first time it was simulated, rather
+    than elaborating it again, unless tracing. A testbench can not rely on
+    the state a previous test left the design in.
+    """
+
+    def __init__(self, engine):
+        self.engine = engine
+        self.designs = {}
+        self.simulators = {}
+
+    def get(self, constructor, *args, **kwargs):
+        """The design constructed with args, constructing it the first time"""
+        key = (constructor, args, tuple(sorted(kwargs.items())))
+        if key not in self.designs:
+            self.designs[key] = constructor(*args, **kwargs)
+        return self.designs[key]
+
+    def simulator(self, design, clock_period=None):
+        """The reusable simulator of a shared design, or None"""
+        if not any(design is shared for shared in self.designs.values()):
+            return None
+        key = (id(design), clock_period)
+        if key not in self.simulators:
+            self.simulators[key] = reusable_sim.ReusableSimulator(
+                    design,
+                    self.engine,
+                    clock_period)
+        return self.simulators[key]
+
+
+@pytest.fixture(scope="session", name="design_cache")
+def design_cache_fixture(sim_engine):
+    return DesignCache(sim_engine)
 
 
 @pytest.fixture
-def comb_sim(request):
+def shared_design(design_cache):
+    """Get a design shared between tests, see DesignCache"""
+    return design_cache.get
+
+
+@pytest.fixture
+def comb_sim(request, sim_engine, vcd_config, design_cache):
 
     def run(fragment, process):
-        sim = nmigen.sim.Simulator(fragment)
+        shared = design_cache.simulator(fragment)
+        if shared is not None and vcd_config is None:
+            shared.run(process, deadline=100e-6)
+            return
+        sim = nmigen.sim.Simulator(fragment, engine=sim_engine)
         sim.add_process(process)
+        # Combinational testbenches settle at time zero without a clock, so
+        # their traces are small and not windowed or filtered
+        if vcd_config is None:
+            sim.run_until(100e-6)
+            return
         with sim.write_vcd(vcd_path(request.node)):
             sim.run_until(100e-6)
 
@@ -36,13 +242,36 @@ def comb_sim(request):
 
 
 @pytest.fixture
-def sync_sim(request):
+def sync_sim(request, sim_engine, vcd_config, design_cache):
 
     def run(fragment, process):
-        sim = nmigen.sim.Simulator(fragment)
+        shared = design_cache.simulator(fragment, CLOCK_PERIOD)
+        if shared is not None and vcd_config is None:
+            shared.run(process)
+            return
+        sim = nmigen.sim.Simulator(fragment, engine=sim_engine)
+        tracer = None
+        if vcd_config is not None and vcd_config != FULL_TRACE:
+            # The tracer is added first so it runs before the testbench
+            # assigns to any signals after each clock edge
+            # The tracer reads the signals of the fragment simulated, rather
+            # than of another elaboration of the design
+            tracer = Tracer(
+                    sim._fragment,  # pylint: disable=protected-access
+                    vcd_path(request.node),
+                    *vcd_config)
+            sim.add_sync_process(tracer.process)
         sim.add_sync_process(process)
-        sim.add_clock(1 / 10e6)
-        with sim.write_vcd(vcd_path(request.node)):
+        sim.add_clock(CLOCK_PERIOD)
+        if tracer is not None:
+            try:
+                sim.run()
+            finally:
+                tracer.close()
+        elif vcd_config is not None:
+            with sim.write_vcd(vcd_path(request.node)):
+                sim.run()
+        else:
             sim.run()
 
     return run
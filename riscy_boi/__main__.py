@@ -1,13 +1,195 @@
 """Entry point"""
+import argparse
+import io
+import json
+import pathlib
+import zipfile
+
+from nmigen.build import run
 from nmigen_boards import blackice_ii
 
+from . import build_cache
+from . import loader
+from . import pll
 from . import top
 
+BUILD_DIR = "build"
+# The tools the iCE40 platform runs, and the files they produce
+TOOLS = ["yosys", "nextpnr-ice40", "icepack"]
+PRODUCTS = ["top.bin", "top.asc", "top.rpt", "top.tim"]
+
 
 def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    cpu_choice = parser.add_mutually_exclusive_group()
+    cpu_choice.add_argument(
+            "--pipelined",
+            action="store_true",
+            help="build the five-stage pipelined CPU")
+    cpu_choice.add_argument(
+            "--dual-issue",
+            action="store_true",
+            help="build the dual-issue CPU")
+    parser.add_argument(
+            "--program",
+            help="ELF file or flat binary to load into the memories "
+                 "(default: count up in the debug register)")
+    parser.add_argument(
+            "--imem-base",
+            type=lambda value: int(value, 0),
+            default=0,
+            help="address of the start of instruction memory (default: 0)")
+    parser.add_argument(
+            "--dmem-base",
+            type=lambda value: int(value, 0),
+            default=0,
+            help="address of the start of data memory (default: 0)")
+    parser.add_argument(
+            "--baud",
+            type=int,
+            default=top.BAUD,
+            help=f"UART baud rate after reset (default: {top.BAUD})")
+    parser.add_argument(
+            "--clock-config",
+            type=pathlib.Path,
+            help="JSON file of the PLL configuration and nextpnr seed, as "
+                 "written by riscy_boi.sweep (default: a 16 MHz sync clock)")
+    parser.add_argument(
+            "--no-cache",
+            action="store_true",
+            help="elaborate and build even if nothing has changed, rather "
+                 f"than reusing the results from {build_cache.CACHE_DIR}")
+    args = parser.parse_args()
+
+    image = None
+    if args.program is not None:
+        try:
+            image = loader.load(
+                    args.program,
+                    args.imem_base,
+                    args.dmem_base,
+                    top.MAX_MEMORY_WORDS)
+        except ValueError as error:
+            parser.error(f"{args.program}: {error}")
+        # The CPUs start from the first word of instruction memory
+        if image.entry != args.imem_base:
+            parser.error(
+                    f"{args.program}'s entry point {image.entry:#x} is not "
+                    f"the start of instruction memory {args.imem_base:#x}")
+
+    clock = None
+    if args.clock_config is not None:
+        clock = json.loads(args.clock_config.read_text())
+        # The dividers and seed only suit the design they were swept with
+        swept = "pipelined" if clock["pipelined"] else "single-cycle"
+        built = ("pipelined" if args.pipelined else
+                 "dual-issue" if args.dual_issue else
+                 "single-cycle")
+        if swept != built:
+            parser.error(
+                    f"{args.clock_config} was swept with the {swept} CPU, "
+                    f"not the {built} CPU")
+
     plat = blackice_ii.BlackIceIIPlatform()
-    top_inst = top.Top()
-    plat.build(top_inst)
+    cache = None if args.no_cache else build_cache.BuildCache()
+    plan = elaborate(
+            plat,
+            {"pipelined": args.pipelined, "dual_issue": args.dual_issue,
+             "baud": args.baud, "dmem_base": args.dmem_base},
+            image,
+            clock,
+            cache)
+    if build(plan, cache):
+        print(f"Reused the cached bitstream in {BUILD_DIR}")
+
+
+def elaborate(plat, top_options, image, clock, cache):
+    """
+    Elaborate Top into a build plan, or find the plan in the cache
+
+    The plan is keyed by the package's source, so is reused if neither the
+    design nor its arguments have changed.
+
+    Args:
+        plat (nmigen.build.Platform): the platform
+        top_options (dict): Top's pipelined, dual_issue, baud and dmem_base
+            arguments
+        image (loader.Image): the program, or None
+        clock (dict): the PLL configuration and seed from riscy_boi.sweep,
+            or None
+        cache (build_cache.BuildCache): the cache, or None to elaborate
+
+    Returns:
+        run.BuildPlan: the plan
+    """
+    def build_plan():
+        if clock is None:
+            return plat.build(
+                    top.Top(image=image, **top_options),
+                    do_build=False)
+        return plat.build(
+                top.Top(
+                    image=image,
+                    pll_config=pll.Config(**clock["pll"]),
+                    **top_options),
+                do_build=False,
+                nextpnr_opts=f"--seed {clock['seed']}")
+
+    if cache is None:
+        return build_plan()
+
+    sources = sorted(pathlib.Path(__file__).parent.glob("*.py"))
+    key = build_cache.digest(
+            "elaborate",
+            *(source.read_bytes() for source in sources),
+            build_cache.package_version("nmigen"),
+            build_cache.package_version("nmigen-boards"),
+            type(plat).__name__,
+            json.dumps(top_options, sort_keys=True),
+            json.dumps(clock, sort_keys=True),
+            *(() if image is None else (
+                image.imem.tobytes(), image.dmem.tobytes(), str(image.entry))))
+    files = cache.get(key)
+    if files is not None:
+        plan = run.BuildPlan(files["script"].decode())
+        with zipfile.ZipFile(io.BytesIO(files["plan.zip"])) as archive:
+            for name in archive.namelist():
+                plan.add_file(name, archive.read(name))
+        return plan
+
+    plan = build_plan()
+    archive = io.BytesIO()
+    plan.archive(archive)
+    cache.put(key, {
+            "script": plan.script.encode(),
+            "plan.zip": archive.getvalue()})
+    return plan
+
+
+def build(plan, cache):
+    """
+    Run the toolchain on a build plan, or restore its products from the cache
+
+    The products are keyed by the plan, which holds the elaborated design and
+    the tools' options, and the tools' versions.
+
+    Returns:
+        bool: True if the products were restored from the cache
+    """
+    if cache is None:
+        plan.execute_local(BUILD_DIR)
+        return False
+
+    key = build_cache.digest(
+            "toolchain",
+            plan.digest(),
+            *(build_cache.executable_version(tool) for tool in TOOLS))
+    plan.execute_local(BUILD_DIR, run_script=False)
+    return cache.run(
+            key,
+            BUILD_DIR,
+            PRODUCTS,
+            lambda: plan.execute_local(BUILD_DIR))
 
 
 if __name__ == "__main__":
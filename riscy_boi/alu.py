@@ -3,6 +3,8 @@ import enum
 
 import nmigen as nm
 
+SHAMT_WIDTH = 5
+
 
 class ALUOp(enum.IntEnum):
     """Operations for the ALU"""
@@ -16,50 +18,185 @@ class ALUOp(enum.IntEnum):
     SRA = 0b111
 
 
+class Adder(enum.Enum):
+    """Implementations of addition and subtraction"""
+    SEPARATE = "separate"          # an adder and a subtractor
+    SHARED = "shared"              # one adder, subtracting by inverting b
+    CARRY_SELECT = "carry_select"  # shared, the upper half computed for both
+                                   # carries from the lower half
+
+
+class Shifter(enum.Enum):
+    """Implementations of the shifts"""
+    SEPARATE = "separate"        # a dynamic shifter for each shift
+    BARREL = "barrel"            # one logarithmic right shifter, SLL
+                                 # shifting the bit-reversed operand
+    MULTI_CYCLE = "multi_cycle"  # shift by four or one bits per cycle
+
+
 class ALU(nm.Elaboratable):
     """
     Arithmetic Logic Unit
 
+    Subtraction is a - b, and shifts shift b by the lower five bits of a.
+
+    With the multi-cycle shifter, shifts take an extra cycle for each four
+    bits and each remaining bit of the shift amount. While busy, the inputs
+    must be held and o is not valid. Once the result is ready, it is held
+    while the inputs are, until advance is high.
+
     * op (in): the opcode
     * a (in): the first operand
     * b (in): the second operand
+    * valid (in): high if the operation should be performed, so multi-cycle
+      operations are only started for valid instructions. Defaults to high.
+    * advance (in): high when the result is used, so the next operation
+      starts afresh. Defaults to high.
 
     * o (out): the output
+    * busy (out): high while a multi-cycle operation is in progress
     """
 
-    def __init__(self, width):
+    def __init__(self, width, adder=Adder.SEPARATE, shifter=Shifter.SEPARATE):
         """
         Initialiser
 
         Args:
             width (int): data width
+            adder (Adder): the addition and subtraction implementation
+            shifter (Shifter): the shift implementation
         """
+        self.width = width
+        self.adder = adder
+        self.shifter = shifter
+
         self.op = nm.Signal(ALUOp)
         self.a = nm.Signal(width)
         self.b = nm.Signal(width)
+        self.valid = nm.Signal(reset=1)
+        self.advance = nm.Signal(reset=1)
         self.o = nm.Signal(width)
+        self.busy = nm.Signal()
 
     def elaborate(self, _):
         m = nm.Module()
-        shamt_width = 5
+
+        sum_ = nm.Signal(self.width)
+        shifted = nm.Signal(self.width)
+        self.elaborate_adder(m, sum_)
+        if self.shifter == Shifter.MULTI_CYCLE:
+            self.elaborate_multi_cycle_shifter(m, shifted)
+        elif self.shifter == Shifter.BARREL:
+            self.elaborate_barrel_shifter(m, shifted)
 
         with m.Switch(self.op):
-            with m.Case(ALUOp.ADD):
-                m.d.comb += self.o.eq(self.a + self.b)
-            with m.Case(ALUOp.SUB):
-                m.d.comb += self.o.eq(self.a - self.b)
+            with m.Case(ALUOp.ADD, ALUOp.SUB):
+                m.d.comb += self.o.eq(sum_)
             with m.Case(ALUOp.AND):
                 m.d.comb += self.o.eq(self.a & self.b)
             with m.Case(ALUOp.OR):
                 m.d.comb += self.o.eq(self.a | self.b)
             with m.Case(ALUOp.XOR):
                 m.d.comb += self.o.eq(self.a ^ self.b)
-            with m.Case(ALUOp.SLL):
-                m.d.comb += self.o.eq(self.b << self.a[:shamt_width])
-            with m.Case(ALUOp.SRL):
-                m.d.comb += self.o.eq(self.b >> self.a[:shamt_width])
-            with m.Case(ALUOp.SRA):
-                m.d.comb += self.o.eq(self.b.as_signed() >>
-                                      self.a[:shamt_width])
+            if self.shifter == Shifter.SEPARATE:
+                shamt = self.a[:SHAMT_WIDTH]
+                with m.Case(ALUOp.SLL):
+                    m.d.comb += self.o.eq(self.b << shamt)
+                with m.Case(ALUOp.SRL):
+                    m.d.comb += self.o.eq(self.b >> shamt)
+                with m.Case(ALUOp.SRA):
+                    m.d.comb += self.o.eq(self.b.as_signed() >> shamt)
+            else:
+                with m.Case(ALUOp.SLL, ALUOp.SRL, ALUOp.SRA):
+                    m.d.comb += self.o.eq(shifted)
 
         return m
+
+    def elaborate_adder(self, m, sum_):
+        subtract = self.op == ALUOp.SUB
+        if self.adder == Adder.SEPARATE:
+            m.d.comb += sum_.eq(nm.Mux(
+                    subtract,
+                    self.a - self.b,
+                    self.a + self.b))
+            return
+
+        # a - b is a + ~b + 1, so one carry chain does both
+        b = nm.Mux(subtract, ~self.b, self.b)
+        if self.adder == Adder.SHARED:
+            m.d.comb += sum_.eq(add_with_carry(self.a, b, subtract))
+            return
+
+        half = self.width // 2
+        low = add_with_carry(self.a[:half], b[:half], subtract)
+        carry = low[-1]
+        high_without_carry = add_with_carry(self.a[half:], b[half:], 0)
+        high_with_carry = add_with_carry(self.a[half:], b[half:], 1)
+        m.d.comb += sum_.eq(nm.Cat(
+                low[:half],
+                nm.Mux(carry, high_with_carry, high_without_carry)))
+
+    def elaborate_barrel_shifter(self, m, shifted):
+        left = self.op == ALUOp.SLL
+        fill = (self.op == ALUOp.SRA) & self.b[-1]
+        # A signal per stage, each shifting by the next power of two
+        stages = [nm.Signal(self.width, name=f"shift_stage{i}")
+                  for i in range(SHAMT_WIDTH + 1)]
+        m.d.comb += stages[0].eq(nm.Mux(left, self.b[::-1], self.b))
+        for i in range(SHAMT_WIDTH):
+            distance = 1 << i
+            m.d.comb += stages[i + 1].eq(nm.Mux(
+                    self.a[i],
+                    nm.Cat(stages[i][distance:], nm.Repl(fill, distance)),
+                    stages[i]))
+        m.d.comb += shifted.eq(nm.Mux(left, stages[-1][::-1], stages[-1]))
+
+    def elaborate_multi_cycle_shifter(self, m, shifted):
+        shifting = nm.Signal()
+        value = nm.Signal(self.width)
+        remaining = nm.Signal(SHAMT_WIDTH)
+        shamt = self.a[:SHAMT_WIDTH]
+        is_shift = ((self.op == ALUOp.SLL) |
+                    (self.op == ALUOp.SRL) |
+                    (self.op == ALUOp.SRA))
+
+        # The first step shifts b, and later steps the partial result
+        source = nm.Mux(shifting, value, self.b)
+        count = nm.Mux(shifting, remaining, shamt)
+        by_four = count >= 4
+        fill = (self.op == ALUOp.SRA) & source[-1]
+        left = nm.Mux(by_four, source << 4, source << 1)
+        right = nm.Mux(
+                by_four,
+                nm.Cat(source[4:], nm.Repl(fill, 4)),
+                nm.Cat(source[1:], fill))
+
+        m.d.comb += [
+                self.busy.eq(self.valid & is_shift & (count != 0)),
+                shifted.eq(source),
+        ]
+
+        with m.If(self.busy):
+            m.d.sync += [
+                    shifting.eq(1),
+                    value.eq(nm.Mux(self.op == ALUOp.SLL, left, right)),
+                    remaining.eq(count - nm.Mux(by_four, 4, 1)),
+            ]
+        with m.Elif(self.advance | ~self.valid):
+            m.d.sync += shifting.eq(0)
+        # Otherwise the result is ready but not used, e.g. while the
+        # pipelined CPU waits on the data memory, so is held by staying
+        # shifting with none remaining
+
+
+def add_with_carry(a, b, carry_in):
+    """
+    Add two values and a carry in with a single adder
+
+    The carry in is added as the least significant bit of operands one bit
+    wider, so it uses the adder's carry chain rather than a second adder.
+
+    Returns:
+        nm.Value: the sum, one bit wider than the operands for the carry out
+    """
+    return (nm.Cat(carry_in, a) + nm.Cat(nm.Const(1, 1), b))[1:]
@@ -0,0 +1,553 @@
+"""
+rv32im assembler
+
+Assembles source text with labels, all the rv32i instruction formats, the M
+extension's instructions and the common pseudo-instructions into a program
+image:
+
+    program = assembler.assemble('''
+            li a0, 10
+    loop:   addi a0, a0, -1
+            bnez a0, loop
+            j .
+    ''')
+
+Source is parsed into a table of instruction fields, one row per word, which
+is encoded with whole-array NumPy operations. Large generated programs can
+build a table with the FIELDS dtype directly and encode it in one call.
+"""
+import enum
+import re
+
+import numpy as np
+
+from . import encoding
+
+
+class Format(enum.IntEnum):
+    """Instruction formats, and plain data words"""
+    R = 0
+    I = 1  # noqa: E741
+    S = 2
+    B = 3
+    U = 4
+    J = 5
+    WORD = 6
+
+
+FIELDS = np.dtype([
+        ("format", np.uint8),
+        ("opcode", np.uint8),
+        ("rd", np.uint8),
+        ("funct", np.uint8),
+        ("rs1", np.uint8),
+        ("rs2", np.uint8),
+        ("funct7", np.uint8),
+        ("imm", np.int64),
+])
+
+ABI_NAMES = (
+        ["zero", "ra", "sp", "gp", "tp", "t0", "t1", "t2", "s0", "s1"] +
+        [f"a{i}" for i in range(8)] +
+        [f"s{i}" for i in range(2, 12)] +
+        [f"t{i}" for i in range(3, 7)])
+REGISTERS = {name: i for i, name in enumerate(ABI_NAMES)}
+REGISTERS.update({f"x{i}": i for i in range(32)})
+REGISTERS["fp"] = REGISTERS["s0"]
+
+CSRS = {csr.name.lower(): csr.value for csr in encoding.CSR}
+
+# Operand syntaxes, by the fields each operand is assembled into. "offset"
+# operands are relative to the instruction, and "imm(rs1)" is a base
+# register and offset.
+R_OPERANDS = ("rd", "rs1", "rs2")
+I_OPERANDS = ("rd", "rs1", "imm")
+SHIFT_OPERANDS = ("rd", "rs1", "shamt")
+LOAD_OPERANDS = ("rd", "imm(rs1)")
+STORE_OPERANDS = ("rs2", "imm(rs1)")
+BRANCH_OPERANDS = ("rs1", "rs2", "offset")
+CSR_OPERANDS = ("rd", "csr", "rs1")
+CSR_IMM_OPERANDS = ("rd", "csr", "zimm")
+
+
+def _instruction_table():
+    """The format, opcode, funct, funct7 and operand syntax by mnemonic"""
+    instructions = {}
+    for funct, funct7, name in (
+            (encoding.IntRegRegFunct.ADD_OR_SUB,
+                encoding.AddSubType.ADD, "add"),
+            (encoding.IntRegRegFunct.ADD_OR_SUB,
+                encoding.AddSubType.SUB, "sub"),
+            (encoding.IntRegRegFunct.SLL, 0, "sll"),
+            (encoding.IntRegRegFunct.SLT, 0, "slt"),
+            (encoding.IntRegRegFunct.SLTU, 0, "sltu"),
+            (encoding.IntRegRegFunct.XOR, 0, "xor"),
+            (encoding.IntRegRegFunct.SRL_OR_SRA,
+                encoding.RightShiftType.SRLI, "srl"),
+            (encoding.IntRegRegFunct.SRL_OR_SRA,
+                encoding.RightShiftType.SRAI, "sra"),
+            (encoding.IntRegRegFunct.OR, 0, "or"),
+            (encoding.IntRegRegFunct.AND, 0, "and")):
+        instructions[name] = (
+                Format.R, encoding.Opcode.OP, funct, funct7, R_OPERANDS)
+    for funct in encoding.MulDivFunct:
+        instructions[funct.name.lower()] = (
+                Format.R,
+                encoding.Opcode.OP,
+                funct,
+                encoding.MULDIV_FUNCT7,
+                R_OPERANDS)
+    for funct in (
+            encoding.IntRegImmFunct.ADDI,
+            encoding.IntRegImmFunct.SLTI,
+            encoding.IntRegImmFunct.SLTIU,
+            encoding.IntRegImmFunct.XORI,
+            encoding.IntRegImmFunct.ORI,
+            encoding.IntRegImmFunct.ANDI):
+        instructions[funct.name.lower()] = (
+                Format.I, encoding.Opcode.OP_IMM, funct, 0, I_OPERANDS)
+    for funct, funct7, name in (
+            (encoding.IntRegImmFunct.SLLI, 0, "slli"),
+            (encoding.IntRegImmFunct.SRLI_OR_SRAI,
+                encoding.RightShiftType.SRLI, "srli"),
+            (encoding.IntRegImmFunct.SRLI_OR_SRAI,
+                encoding.RightShiftType.SRAI, "srai")):
+        instructions[name] = (
+                Format.I,
+                encoding.Opcode.OP_IMM,
+                funct,
+                funct7,
+                SHIFT_OPERANDS)
+    for funct in encoding.LoadFunct:
+        instructions[funct.name.lower()] = (
+                Format.I, encoding.Opcode.LOAD, funct, 0, LOAD_OPERANDS)
+    for funct in encoding.StoreFunct:
+        instructions[funct.name.lower()] = (
+                Format.S, encoding.Opcode.STORE, funct, 0, STORE_OPERANDS)
+    for funct in encoding.BranchFunct:
+        instructions[funct.name.lower()] = (
+                Format.B, encoding.Opcode.BRANCH, funct, 0, BRANCH_OPERANDS)
+    for funct in encoding.SystemFunct:
+        if funct != encoding.SystemFunct.PRIV:
+            instructions[funct.name.lower()] = (
+                    Format.I,
+                    encoding.Opcode.SYSTEM,
+                    funct,
+                    0,
+                    CSR_IMM_OPERANDS if funct.name.endswith("I")
+                    else CSR_OPERANDS)
+    instructions.update({
+            "lui": (Format.U, encoding.Opcode.LUI, 0, 0, ("rd", "upper")),
+            "auipc": (Format.U, encoding.Opcode.AUIPC, 0, 0, ("rd", "upper")),
+            "jal": (Format.J, encoding.Opcode.JAL, 0, 0, ("rd", "offset")),
+            "jalr": (Format.I, encoding.Opcode.JALR, 0, 0, LOAD_OPERANDS),
+            # Instructions without operands have their immediate in funct7.
+            # FENCE orders all device input and output and memory accesses.
+            "fence": (Format.I, encoding.Opcode.MISC_MEM, 0, 0xff, ()),
+            "ecall": (Format.I, encoding.Opcode.SYSTEM, 0, 0, ()),
+            "ebreak": (Format.I, encoding.Opcode.SYSTEM, 0, 1, ()),
+    })
+    return instructions
+
+
+INSTRUCTIONS = _instruction_table()
+
+# Pseudo-instructions by mnemonic and number of operands, expanding to
+# instruction templates whose operands are formatted with the pseudo's
+PSEUDO_INSTRUCTIONS = {
+        ("nop", 0): ["addi x0, x0, 0"],
+        ("mv", 2): ["addi {0}, {1}, 0"],
+        ("not", 2): ["xori {0}, {1}, -1"],
+        ("neg", 2): ["sub {0}, x0, {1}"],
+        ("seqz", 2): ["sltiu {0}, {1}, 1"],
+        ("snez", 2): ["sltu {0}, x0, {1}"],
+        ("sltz", 2): ["slt {0}, {1}, x0"],
+        ("sgtz", 2): ["slt {0}, x0, {1}"],
+        ("beqz", 2): ["beq {0}, x0, {1}"],
+        ("bnez", 2): ["bne {0}, x0, {1}"],
+        ("blez", 2): ["bge x0, {0}, {1}"],
+        ("bgez", 2): ["bge {0}, x0, {1}"],
+        ("bltz", 2): ["blt {0}, x0, {1}"],
+        ("bgtz", 2): ["blt x0, {0}, {1}"],
+        ("bgt", 3): ["blt {1}, {0}, {2}"],
+        ("ble", 3): ["bge {1}, {0}, {2}"],
+        ("bgtu", 3): ["bltu {1}, {0}, {2}"],
+        ("bleu", 3): ["bgeu {1}, {0}, {2}"],
+        ("j", 1): ["jal x0, {0}"],
+        ("jal", 1): ["jal ra, {0}"],
+        ("jr", 1): ["jalr x0, 0({0})"],
+        ("jalr", 1): ["jalr ra, 0({0})"],
+        ("ret", 0): ["jalr x0, 0(ra)"],
+        ("call", 1): [
+            "auipc ra, %pcrel_hi({0})",
+            "jalr ra, %pcrel_lo({0})(ra)"],
+        ("tail", 1): [
+            "auipc t1, %pcrel_hi({0})",
+            "jalr x0, %pcrel_lo({0})(t1)"],
+        ("la", 2): [
+            "auipc {0}, %pcrel_hi({1})",
+            "addi {0}, {0}, %pcrel_lo({1})"],
+        ("csrr", 2): ["csrrs {0}, {1}, x0"],
+        ("csrw", 2): ["csrrw x0, {0}, {1}"],
+        ("csrs", 2): ["csrrs x0, {0}, {1}"],
+        ("csrc", 2): ["csrrc x0, {0}, {1}"],
+        ("csrwi", 2): ["csrrwi x0, {0}, {1}"],
+        ("csrsi", 2): ["csrrsi x0, {0}, {1}"],
+        ("csrci", 2): ["csrrci x0, {0}, {1}"],
+}
+PSEUDO_INSTRUCTIONS.update({
+        (f"rd{csr}", 1): [f"csrrs {{0}}, {csr}, x0"]
+        for csr in ("cycle", "cycleh", "time", "timeh", "instret", "instreth")
+})
+
+# The inclusive ranges of immediates and offsets, by operand and format
+IMMEDIATE_RANGES = {
+        "imm": (-(1 << 11), (1 << 11) - 1),
+        "shamt": (0, 31),
+        "csr": (0, (1 << 12) - 1),
+        "zimm": (0, 31),
+        "upper": (-(1 << 19), (1 << 20) - 1),
+        Format.B: (-(1 << 12), (1 << 12) - 2),
+        Format.J: (-(1 << 20), (1 << 20) - 2),
+}
+
+_SYMBOL = re.compile(r"[A-Za-z_.$][\w.$]*")
+_LABEL = re.compile(r"^\s*(" + _SYMBOL.pattern + r")\s*:")
+_BASE_OFFSET = re.compile(r"^(.*)\((\w+)\)$")
+_TERM = re.compile(r"\s*([+-]?)\s*([^+\-\s][^+\-]*)")
+_FUNCTION = re.compile(r"^%(\w+)\((.*)\)$")
+
+
+def hi_part(value):
+    """The upper 20 bits of a value, rounded to add the lo_part to"""
+    return ((value + 0x800) >> 12) & 0xfffff
+
+
+def lo_part(value):
+    """The sign-extended lower 12 bits of a value"""
+    return ((value & 0xfff) ^ 0x800) - 0x800
+
+
+# Immediate functions, of the value of their argument and the address
+FUNCTIONS = {
+        "hi": lambda value, _: hi_part(value),
+        "lo": lambda value, _: lo_part(value),
+        "pcrel_hi": lambda value, pc: hi_part(value - pc),
+        # Relative to the AUIPC preceding the instruction
+        "pcrel_lo": lambda value, pc: lo_part(value - (pc - 4)),
+}
+
+
+def encode(table):
+    """
+    Encode a table of instruction fields into a program image
+
+    Fields unused by a row's format are ignored, and immediates are truncated
+    to the width of their format. B and J-type immediates are the offsets to
+    the targets, and U-type immediates the upper 20 bits of the value. WORD
+    rows are assembled to their immediate.
+
+    Args:
+        table (np.ndarray): instruction fields, with the FIELDS dtype
+
+    Returns:
+        np.ndarray: the encoded instructions, as uint32
+    """
+    image = np.zeros(len(table), dtype=np.uint32)
+    formats = table["format"]
+    for format_, encoder in _ENCODERS.items():
+        rows = formats == format_
+        if rows.any():
+            fields = {name: table[name][rows].astype(np.int64)
+                      for name in FIELDS.names}
+            image[rows] = encoder(fields) & 0xffffffff
+    return image
+
+
+_ENCODERS = {
+        Format.R: lambda f: encoding.RType.encode(
+            f["rs1"], f["rs2"], f["funct"], f["funct7"], f["rd"]),
+        Format.I: lambda f: encoding.IType.encode(
+            f["imm"] & 0xfff, f["rs1"], f["funct"], f["rd"], f["opcode"]),
+        Format.S: lambda f: encoding.SType.encode(
+            f["imm"] & 0xfff, f["rs1"], f["rs2"], f["funct"]),
+        Format.B: lambda f: encoding.BType.encode(
+            f["imm"] & 0x1fff, f["rs1"], f["rs2"], f["funct"]),
+        Format.U: lambda f: encoding.UType.encode(
+            f["imm"] & 0xfffff, f["rd"], f["opcode"]),
+        Format.J: lambda f: encoding.JType.encode(
+            f["imm"] & 0x1fffff, f["rd"]),
+        Format.WORD: lambda f: f["imm"],
+}
+
+
+class AssemblyError(ValueError):
+    """An error in assembly source, with the line it is on"""
+
+    def __init__(self, line_number, message):
+        super().__init__(f"line {line_number}: {message}")
+        self.line_number = line_number
+
+
+def assemble(source, base=0, symbols=None):
+    """
+    Assemble rv32i source into a program image
+
+    Each line holds any number of labels, then optionally an instruction,
+    pseudo-instruction or directive. Comments start with #. Registers are
+    written by number (x0 to x31) or ABI name, and CSRs by number or name.
+
+    Immediates are sums and differences of numbers, symbols and the
+    functions %hi, %lo, %pcrel_hi and %pcrel_lo. %pcrel_lo is relative to
+    the preceding instruction, the AUIPC it completes. Branch and jump
+    operands which are symbols are assembled to the offset to the symbol,
+    and numbers are offsets. The symbol "." is the current address.
+
+    The directives are ".word value, ..." and ".equ name, value".
+
+    Args:
+        source (str): the assembly source
+        base (int): the address of the first word
+        symbols (dict): symbol values defined before assembly, by name
+
+    Returns:
+        np.ndarray: the encoded words, as uint32
+    """
+    return encode(assemble_fields(source, base, symbols))
+
+
+def assemble_fields(source, base=0, symbols=None):
+    """
+    Assemble rv32i source into a table of instruction fields
+
+    Args:
+        source (str): the assembly source, as for assemble
+        base (int): the address of the first word
+        symbols (dict): symbol values defined before assembly, by name
+
+    Returns:
+        np.ndarray: the instruction fields, with the FIELDS dtype
+    """
+    symbols = dict(symbols or {})
+    statements = _first_pass(source, base, symbols)
+    rows = []
+    for index, (line_number, mnemonic, operands) in enumerate(statements):
+        try:
+            rows.append(_fields(mnemonic, operands, symbols, base + 4 * index))
+        except (KeyError, ValueError) as error:
+            raise AssemblyError(line_number, error.args[0]) from None
+    return np.array(rows, dtype=FIELDS)
+
+
+def _first_pass(source, base, symbols):
+    """
+    Define labels and expand pseudo-instructions
+
+    Returns:
+        list: the line number, mnemonic and operands of each word
+    """
+    statements = []
+    for line_number, line in enumerate(source.splitlines(), start=1):
+        line = line.split("#", 1)[0]
+        while True:
+            label = _LABEL.match(line)
+            if label is None:
+                break
+            name = label.group(1)
+            if name in symbols:
+                raise AssemblyError(line_number, f"{name} is already defined")
+            symbols[name] = base + 4 * len(statements)
+            line = line[label.end():]
+
+        mnemonic, operands = _split(line)
+        if not mnemonic:
+            continue
+        mnemonic = mnemonic.lower()
+
+        try:
+            expanded = _expand(mnemonic, operands, symbols)
+        except (KeyError, ValueError) as error:
+            raise AssemblyError(line_number, error.args[0]) from None
+        if expanded is None:
+            raise AssemblyError(
+                    line_number,
+                    f"unknown instruction {mnemonic} with {len(operands)} "
+                    "operands")
+        statements.extend(
+                (line_number, expanded_mnemonic, expanded_operands)
+                for expanded_mnemonic, expanded_operands in expanded)
+    return statements
+
+
+def _expand(mnemonic, operands, symbols):
+    """
+    Expand a statement into the instructions or words it assembles to
+
+    Returns:
+        list: the mnemonic and operands of each word, or None if the
+            statement is not recognised
+    """
+    if mnemonic == ".equ":
+        name, value = operands
+        symbols[name] = _evaluate(value, symbols, None)
+        return []
+    if mnemonic == ".word":
+        return [(".word", [operand]) for operand in operands]
+    if mnemonic == "li" and len(operands) == 2:
+        return _expand_li(*operands, symbols)
+    pseudo = PSEUDO_INSTRUCTIONS.get((mnemonic, len(operands)))
+    if pseudo is not None:
+        return [_split(template.format(*operands)) for template in pseudo]
+    if mnemonic in INSTRUCTIONS:
+        return [(mnemonic, operands)]
+    return None
+
+
+def _expand_li(rd, expression, symbols):
+    """Load an immediate with the fewest instructions known to be enough"""
+    try:
+        value = _evaluate(expression, symbols, None)
+    except KeyError:
+        # Symbols defined later may need both instructions
+        return [("lui", [rd, f"%hi({expression})"]),
+                ("addi", [rd, rd, f"%lo({expression})"])]
+    if not -(1 << 31) <= value < (1 << 32):
+        raise ValueError(f"{value} does not fit in a register")
+    if lo_part(value) == value:
+        return [("addi", [rd, "x0", str(value)])]
+    expanded = [("lui", [rd, str(hi_part(value))])]
+    if lo_part(value):
+        expanded.append(("addi", [rd, rd, str(lo_part(value))]))
+    return expanded
+
+
+def _split(statement):
+    """The mnemonic and operands of a statement, split on any whitespace"""
+    words = statement.split(None, 1)
+    mnemonic = words[0] if words else ""
+    rest = words[1] if len(words) > 1 else ""
+    return mnemonic, [operand.strip() for operand in rest.split(",")
+                      if operand.strip()]
+
+
+def _fields(mnemonic, operands, symbols, pc):
+    """Assemble an instruction or word into a row of the fields table"""
+    if mnemonic == ".word":
+        value = _evaluate(operands[0], symbols, pc)
+        if not -(1 << 31) <= value < (1 << 32):
+            raise ValueError(f"{value} does not fit in a word")
+        return (Format.WORD, 0, 0, 0, 0, 0, 0, value)
+
+    format_, opcode, funct, funct7, syntax = INSTRUCTIONS[mnemonic]
+    if len(operands) != len(syntax):
+        raise ValueError(
+                f"{mnemonic} takes {len(syntax)} operands, not "
+                f"{len(operands)}")
+    fields = {"rd": 0, "rs1": 0, "rs2": 0, "imm": 0}
+    for kind, operand in zip(syntax, operands):
+        fields.update(_operand(kind, operand, format_, symbols, pc))
+
+    if syntax == SHIFT_OPERANDS:
+        fields["imm"] |= funct7 << 5
+    elif not syntax:
+        fields["imm"] = funct7
+    return (format_,
+            opcode,
+            fields["rd"],
+            funct,
+            fields["rs1"],
+            fields["rs2"],
+            funct7 if format_ == Format.R else 0,
+            fields["imm"])
+
+
+def _operand(kind, operand, format_, symbols, pc):
+    """The fields an operand is assembled into, and their values"""
+    if kind == "imm(rs1)":
+        match = _BASE_OFFSET.match(operand)
+        if match is None:
+            raise ValueError(f"{operand} is not of the form offset(base)")
+        imm, base = match.groups()
+        return {"rs1": _register(base),
+                "imm": _immediate(imm or "0", "imm", symbols, pc)}
+    if kind in ("rd", "rs1", "rs2"):
+        return {kind: _register(operand)}
+    if kind == "offset":
+        return {"imm": _offset(operand, format_, symbols, pc)}
+    if kind == "zimm":
+        return {"rs1": _immediate(operand, kind, symbols, pc)}
+    if kind == "csr" and operand.lower() in CSRS:
+        return {"imm": CSRS[operand.lower()]}
+    return {"imm": _immediate(operand, kind, symbols, pc)}
+
+
+def _register(operand):
+    register = REGISTERS.get(operand.lower())
+    if register is None:
+        raise ValueError(f"{operand} is not a register")
+    return register
+
+
+def _immediate(operand, kind, symbols, pc):
+    value = _evaluate(operand, symbols, pc)
+    low, high = IMMEDIATE_RANGES[kind]
+    if not low <= value <= high:
+        raise ValueError(f"{kind} {value} is not in [{low}, {high}]")
+    return value
+
+
+def _offset(operand, format_, symbols, pc):
+    """The offset to a branch or jump target"""
+    if operand.lstrip("+-").strip()[:1].isdigit():
+        offset = _evaluate(operand, symbols, pc)
+    else:
+        offset = _evaluate(operand, symbols, pc) - pc
+    low, high = IMMEDIATE_RANGES[format_]
+    if offset & 1 or not low <= offset <= high:
+        raise ValueError(
+                f"offset {offset} is odd or not in [{low}, {high}]")
+    return offset
+
+
+def _evaluate(expression, symbols, pc):
+    """
+    Evaluate an immediate expression
+
+    Raises:
+        KeyError: if a symbol is not defined
+        ValueError: if the expression cannot be parsed
+    """
+    expression = expression.strip()
+    function = _FUNCTION.match(expression)
+    if function is not None:
+        name, argument = function.groups()
+        if name not in FUNCTIONS:
+            raise ValueError(f"unknown function %{name}")
+        if name.startswith("pcrel") and pc is None:
+            raise KeyError("the address is not known")
+        return FUNCTIONS[name](_evaluate(argument, symbols, pc), pc)
+
+    total = 0
+    position = 0
+    for term in _TERM.finditer(expression):
+        if term.start() != position or (position and not term.group(1)):
+            break
+        position = term.end()
+        value = _term(term.group(2).strip(), symbols, pc)
+        total += -value if term.group(1) == "-" else value
+    if position != len(expression) or not expression:
+        raise ValueError(f"cannot evaluate {expression!r}")
+    return total
+
+
+def _term(text, symbols, pc):
+    """Evaluate a number or symbol"""
+    if text[0].isdigit():
+        return int(text, 0)
+    if text == "." and pc is not None:
+        return pc
+    if text in symbols:
+        return symbols[text]
+    if _SYMBOL.fullmatch(text):
+        raise KeyError(f"{text} is not defined")
+    raise ValueError(f"cannot evaluate {text!r}")
@@ -0,0 +1,595 @@
+"""
+Cycle-accurate benchmarks of the CPUs
+
+Each kernel is run on the RTL of each CPU configuration until it signals
+completion, and its results are checked against the instruction-level
+simulator. The cycles taken, instructions retired (read from the instret
+CSR), CPI and simulation speed are reported as JSON, and compared against a
+stored baseline so slower designs are caught:
+
+    python -m riscy_boi.benchmarks --output results.json
+    python -m riscy_boi.benchmarks --update-baseline
+"""
+import argparse
+import collections
+import json
+import pathlib
+import sys
+import time
+
+import nmigen as nm
+
+from . import alu
+from . import assembler
+from . import branch_predictor
+from . import cpu
+from . import dual_issue_cpu
+from . import isa_simulator
+from . import muldiv
+from . import pipelined_cpu
+from . import reusable_sim
+
+BASELINE = (pathlib.Path(__file__).parent.parent /
+            "benchmarks" / "baseline.json")
+TOLERANCE = 0.02
+DMEM_WORDS = 256
+# The last word of data memory is written with instret when a kernel is done
+DONE_ADDRESS = (DMEM_WORDS - 1) * 4
+RESULT_ADDRESS = 0x200
+# The instructions the instruction memory of a reusable simulation holds
+IMEM_DEPTH = 256
+
+
+def small_alu():
+    """An ALU with a shared adder and a multi-cycle shifter"""
+    return alu.ALU(32, adder=alu.Adder.SHARED, shifter=alu.Shifter.MULTI_CYCLE)
+
+
+def muldiv_unit(implementation=muldiv.Implementation.ITERATIVE):
+    """A multiply and divide unit"""
+    return muldiv.MulDiv(implementation)
+
+
+# A CPU configuration: the class of its CPU, whether it has the M extension,
+# and the function making the CPU. The CPU is only made to be simulated, as
+# nmigen warns about CPUs which are never elaborated.
+Configuration = collections.namedtuple(
+        "Configuration",
+        ["cpu_class", "muldiv", "make"])
+
+CPUS = {
+        "single_cycle": Configuration(cpu.CPU, False, cpu.CPU),
+        "single_cycle_small_alu": Configuration(
+            cpu.CPU,
+            False,
+            lambda: cpu.CPU(alu_unit=small_alu())),
+        "pipelined": Configuration(
+            pipelined_cpu.PipelinedCPU,
+            False,
+            pipelined_cpu.PipelinedCPU),
+        "pipelined_bimodal": Configuration(
+            pipelined_cpu.PipelinedCPU,
+            False,
+            lambda: pipelined_cpu.PipelinedCPU(
+                predictor=branch_predictor.BranchPredictor(
+                    branch_predictor.PredictorType.BIMODAL))),
+        "pipelined_small_alu": Configuration(
+            pipelined_cpu.PipelinedCPU,
+            False,
+            lambda: pipelined_cpu.PipelinedCPU(alu_unit=small_alu())),
+        "pipelined_registered_reads": Configuration(
+            pipelined_cpu.PipelinedCPU,
+            False,
+            lambda: pipelined_cpu.PipelinedCPU(registered_reads=True)),
+        "single_cycle_muldiv": Configuration(
+            cpu.CPU,
+            True,
+            lambda: cpu.CPU(muldiv_unit=muldiv_unit())),
+        "single_cycle_muldiv_unrolled": Configuration(
+            cpu.CPU,
+            True,
+            lambda: cpu.CPU(muldiv_unit=muldiv_unit(
+                muldiv.Implementation.UNROLLED))),
+        "pipelined_muldiv": Configuration(
+            pipelined_cpu.PipelinedCPU,
+            True,
+            lambda: pipelined_cpu.PipelinedCPU(muldiv_unit=muldiv_unit())),
+        "pipelined_muldiv_unrolled": Configuration(
+            pipelined_cpu.PipelinedCPU,
+            True,
+            lambda: pipelined_cpu.PipelinedCPU(muldiv_unit=muldiv_unit(
+                muldiv.Implementation.UNROLLED))),
+        "dual_issue": Configuration(
+            dual_issue_cpu.DualIssueCPU,
+            False,
+            lambda: dual_issue_cpu.DualIssueCPU(
+                events=dual_issue_cpu.PAIRING_EVENTS)),
+        "dual_issue_muldiv": Configuration(
+            dual_issue_cpu.DualIssueCPU,
+            True,
+            lambda: dual_issue_cpu.DualIssueCPU(
+                events=dual_issue_cpu.PAIRING_EVENTS,
+                muldiv_unit=muldiv_unit())),
+}
+
+# Kernels using the M extension set muldiv, and only run on CPUs with it
+Kernel = collections.namedtuple(
+        "Kernel",
+        ["program", "data", "result_address", "result_words", "muldiv"],
+        defaults=[False])
+Simulation = collections.namedtuple(
+        "Simulation",
+        ["cpu", "imem", "dmem", "simulator"])
+
+
+def assemble(body, **symbols):
+    """
+    Assemble a kernel, followed by the epilogue signalling completion
+
+    Args:
+        body (str): the kernel's assembly source
+        symbols: values of symbols used by the source, besides RESULT and
+            DONE, the result and completion addresses
+
+    Returns:
+        list of int: the program
+    """
+    # The nop keeps the kernels' alignment, which the dual-issue CPU's
+    # pairing depends on
+    source = f"""
+            nop
+            {body}
+            csrr x31, instret
+            sw x31, DONE(x0)
+            j .
+    """
+    return assembler.assemble(
+            source,
+            symbols=dict(
+                symbols,
+                RESULT=RESULT_ADDRESS,
+                DONE=DONE_ADDRESS)).tolist()
+
+
+def pseudo_random_words(count, seed=1):
+    """Deterministic pseudo-random data from a linear congruential generator"""
+    words = []
+    for _ in range(count):
+        seed = (seed * 1103515245 + 12345) & 0xffffffff
+        words.append(seed)
+    return words
+
+
+def loop_kernel(iterations=50):
+    """Sum the integers up to a number in a counted loop"""
+    program = assemble("""
+            li x1, ITERATIONS
+            li x2, 0
+    loop:   add x2, x2, x1
+            addi x1, x1, -1
+            bnez x1, loop
+            sw x2, RESULT(x0)
+    """, ITERATIONS=iterations)
+    return Kernel(program, [], RESULT_ADDRESS, 1)
+
+
+def memcpy_kernel(words=32):
+    """Copy words from the start of data memory to the result address"""
+    program = assemble("""
+            li x1, 0
+            li x2, RESULT
+            li x3, BYTES
+    loop:   lw x4, 0(x1)
+            sw x4, 0(x2)
+            addi x1, x1, 4
+            addi x2, x2, 4
+            bne x1, x3, loop
+    """, BYTES=words * 4)
+    return Kernel(
+            program,
+            pseudo_random_words(words),
+            RESULT_ADDRESS,
+            words)
+
+
+def crc32_kernel(length=8):
+    """Bitwise CRC-32 of the bytes at the start of data memory"""
+    # The polynomial is loaded 11 bits at a time, as the CPUs lack LUI
+    poly = 0xedb88320
+    program = assemble("""
+            li x5, POLY_31_22
+            slli x5, x5, 11
+            ori x5, x5, POLY_21_11
+            slli x5, x5, 11
+            ori x5, x5, POLY_10_0
+            li x1, -1
+            li x2, 0
+            li x3, LENGTH
+    byte:   lbu x4, 0(x2)
+            xor x1, x1, x4
+            li x6, 8
+    bit:    andi x7, x1, 1
+            srli x1, x1, 1
+            beqz x7, skip
+            xor x1, x1, x5
+    skip:   addi x6, x6, -1
+            bnez x6, bit
+            addi x2, x2, 1
+            bne x2, x3, byte
+            not x1, x1
+            sw x1, RESULT(x0)
+    """,
+            POLY_31_22=poly >> 22,
+            POLY_21_11=(poly >> 11) & 0x7ff,
+            POLY_10_0=poly & 0x7ff,
+            LENGTH=length)
+    return Kernel(
+            program,
+            pseudo_random_words((length + 3) // 4),
+            RESULT_ADDRESS,
+            1)
+
+
+def fib_kernel(count=30):
+    """Store the Fibonacci sequence at the result address"""
+    program = assemble("""
+            li x1, 0
+            li x2, 1
+            li x3, COUNT
+            li x4, RESULT
+    loop:   sw x1, 0(x4)
+            add x5, x1, x2
+            mv x1, x2
+            mv x2, x5
+            addi x4, x4, 4
+            addi x3, x3, -1
+            bnez x3, loop
+    """, COUNT=count)
+    return Kernel(program, [], RESULT_ADDRESS, count)
+
+
+def sort_kernel(words=12):
+    """Bubble sort signed words at the start of data memory in place"""
+    program = assemble("""
+            li x1, LAST
+    outer:  li x2, 0
+    inner:  lw x3, 0(x2)
+            lw x4, 4(x2)
+            bge x4, x3, ordered
+            sw x4, 0(x2)
+            sw x3, 4(x2)
+    ordered:
+            addi x2, x2, 4
+            bne x2, x1, inner
+            addi x1, x1, -4
+            bnez x1, outer
+    """, LAST=(words - 1) * 4)
+    return Kernel(program, pseudo_random_words(words), 0, words)
+
+
+def muldiv_kernel(count=8):
+    """Multiply pairs of words, and divide them by a loop counter"""
+    program = assemble("""
+            li x1, COUNT
+            li x2, 0
+            li x3, RESULT
+    loop:   lw x4, 0(x2)
+            lw x5, 4(x2)
+            mul x6, x4, x5
+            mulhu x7, x4, x5
+            div x8, x4, x1
+            remu x9, x5, x1
+            sw x6, 0(x3)
+            sw x7, 4(x3)
+            sw x8, 8(x3)
+            sw x9, 12(x3)
+            addi x2, x2, 8
+            addi x3, x3, 16
+            addi x1, x1, -1
+            bnez x1, loop
+    """, COUNT=count)
+    return Kernel(
+            program,
+            pseudo_random_words(2 * count),
+            RESULT_ADDRESS,
+            4 * count,
+            muldiv=True)
+
+
+KERNELS = {
+        "loop": loop_kernel,
+        "memcpy": memcpy_kernel,
+        "crc32": crc32_kernel,
+        "fib": fib_kernel,
+        "sort": sort_kernel,
+        "muldiv": muldiv_kernel,
+}
+
+
+def supported(cpu_name, kernel_name):
+    """Whether a CPU configuration has the instructions a kernel uses"""
+    return not KERNELS[kernel_name]().muldiv or CPUS[cpu_name].muldiv
+
+
+def imem_words(cpu_inst, program):
+    """
+    The words of a CPU's instruction memory holding a program
+
+    The dual-issue CPU fetches doublewords, so its instruction memory holds
+    pairs of instructions.
+    """
+    if len(cpu_inst.imem_data) == 64:
+        return [low | high << 32 for low, high in zip(
+                program[::2], program[1::2] + [0])]
+    return list(program)
+
+
+def harness(cpu_inst, kernel, imem_depth=None):
+    """
+    Connect a CPU to instruction and data memories holding a kernel
+
+    The single-cycle and dual-issue CPUs read their data memory
+    combinationally, so loads complete without waiting, while the pipelined
+    CPU reads it synchronously.
+
+    Args:
+        cpu_inst: the CPU
+        kernel (Kernel): the kernel the memories are initialised with
+        imem_depth (int): the instructions the instruction memory holds, or
+            None for just the kernel's
+
+    Returns:
+        tuple: the module, the instruction memory and the data memory
+    """
+    m = nm.Module()
+    m.submodules.cpu = cpu_inst
+    program = imem_words(cpu_inst, kernel.program)
+    # The instruction memory is addressed in words or doublewords
+    fetch_bytes = len(cpu_inst.imem_data) // 8
+    imem = nm.Memory(
+            width=len(cpu_inst.imem_data),
+            depth=(len(program) if imem_depth is None
+                   else imem_depth * 4 // fetch_bytes),
+            init=program)
+    imem_rp = m.submodules.imem_rp = imem.read_port()
+    dmem = nm.Memory(width=32, depth=DMEM_WORDS, init=kernel.data)
+    if isinstance(cpu_inst, (cpu.CPU, dual_issue_cpu.DualIssueCPU)):
+        dmem_rp = m.submodules.dmem_rp = dmem.read_port(domain="comb")
+    else:
+        dmem_rp = m.submodules.dmem_rp = dmem.read_port(transparent=True)
+    dmem_wp = m.submodules.dmem_wp = dmem.write_port(granularity=8)
+    m.d.comb += [
+            imem_rp.addr.eq(cpu_inst.imem_addr[fetch_bytes.bit_length() - 1:]),
+            cpu_inst.imem_data.eq(imem_rp.data),
+            dmem_rp.addr.eq(cpu_inst.dmem_r_addr),
+            cpu_inst.dmem_r_data.eq(dmem_rp.data),
+            dmem_wp.addr.eq(cpu_inst.dmem_w_addr),
+            dmem_wp.data.eq(cpu_inst.dmem_w_data),
+            dmem_wp.en.eq(cpu_inst.dmem_w_en),
+    ]
+    return m, imem, dmem
+
+
+def simulation(cpu_name, engine="pysim", cache=None):
+    """
+    A reusable simulator of a CPU configuration in a harness
+
+    The CPU is elaborated once, and each kernel run is loaded into the
+    harness's memories, which hold up to IMEM_DEPTH instructions.
+
+    Args:
+        cpu_name (str): a key of CPUS
+        engine: the nmigen simulation engine
+        cache (dict): simulations to reuse, by CPU name and engine, which a
+            new simulation is added to, or None
+
+    Returns:
+        Simulation: the CPU, its memories and the simulator
+    """
+    key = (cpu_name, engine)
+    if cache is not None and key in cache:
+        return cache[key]
+    cpu_inst = CPUS[cpu_name].make()
+    m, imem, dmem = harness(cpu_inst, Kernel([], [], 0, 0), IMEM_DEPTH)
+    result = Simulation(
+            cpu_inst,
+            imem,
+            dmem,
+            reusable_sim.ReusableSimulator(m, engine, clock_period=1e-6))
+    if cache is not None:
+        cache[key] = result
+    return result
+
+
+def memory_contents(sim, program, data):
+    """The memories of a simulation and their words holding a kernel"""
+    return [(sim.imem, imem_words(sim.cpu, program)), (sim.dmem, data)]
+
+
+def run(cpu_name, kernel_name, engine="pysim", max_cycles=100000,
+        cache=None):
+    """
+    Run a kernel on a CPU, checking its results against the ISA simulator
+
+    Args:
+        cpu_name (str): a key of CPUS
+        kernel_name (str): a key of KERNELS
+        engine: the nmigen simulation engine
+        max_cycles (int): the number of cycles after which the kernel is
+            considered to have hung
+        cache (dict): simulations to reuse, see simulation
+
+    Returns:
+        dict: the cycles taken, instructions retired, cycles per instruction
+            and simulated cycles per second, and for the dual-issue CPU, the
+            number of cycles retiring two instructions and breaking each
+            pairing rule
+    """
+    kernel = KERNELS[kernel_name]()
+    golden = isa_simulator.ISASimulator(
+            kernel.program,
+            kernel.data,
+            dmem_bytes=DMEM_WORDS * 4)
+    golden.run()
+    sim = simulation(cpu_name, engine, cache)
+    cpu_inst = sim.cpu
+    dmem = sim.dmem
+    result = {}
+
+    def process():
+        cycles = 0
+        while not (yield dmem[DONE_ADDRESS // 4]):
+            if cycles == max_cycles:
+                raise RuntimeError(
+                        f"{kernel_name} did not finish on {cpu_name} in "
+                        f"{max_cycles} cycles")
+            cycles += 1
+            yield
+        result["cycles"] = cycles
+        result["instret"] = yield dmem[DONE_ADDRESS // 4]
+        for i in range(kernel.result_words):
+            address = kernel.result_address + 4 * i
+            value = yield dmem[address // 4]
+            if value != golden.load_word(address):
+                raise RuntimeError(
+                        f"{kernel_name} on {cpu_name} stored {value:#x} at "
+                        f"{address:#x}, not {golden.load_word(address):#x}")
+        if isinstance(cpu_inst, dual_issue_cpu.DualIssueCPU):
+            csrs = cpu_inst.counters
+            result["pairing"] = {}
+            for event, count in zip(csrs.event_list, csrs.event_counts):
+                result["pairing"][event.value] = yield count
+
+    start = time.perf_counter()
+    sim.simulator.run(
+            process,
+            memory_contents(sim, kernel.program, kernel.data))
+    elapsed = time.perf_counter() - start
+
+    result["cpi"] = round(result["cycles"] / result["instret"], 4)
+    result["sim_cycles_per_second"] = round(result["cycles"] / elapsed)
+    return result
+
+
+def regressions(results, baseline, tolerance=TOLERANCE):
+    """
+    Find results worse than their baseline by more than a tolerance
+
+    Args:
+        results (dict): results by CPU name then kernel name, as from run
+        baseline (dict): baseline cycles and instret in the same structure
+        tolerance (float): the fraction a result may exceed its baseline by
+
+    Returns:
+        list of str: descriptions of each regression
+    """
+    found = []
+    for cpu_name, kernels in results.items():
+        for kernel_name, result in kernels.items():
+            expected = baseline.get(cpu_name, {}).get(kernel_name)
+            if expected is None:
+                continue
+            for metric in ("cycles", "instret"):
+                if result[metric] > expected[metric] * (1 + tolerance):
+                    found.append(
+                            f"{cpu_name} {kernel_name}: {metric} "
+                            f"{result[metric]} > baseline "
+                            f"{expected[metric]}")
+    return found
+
+
+def main():
+    """Run the benchmarks, reporting results and regressions"""
+    parser = argparse.ArgumentParser(description=main.__doc__)
+    parser.add_argument(
+            "--cpu",
+            choices=sorted(CPUS),
+            action="append",
+            help="CPU configuration to benchmark, may be repeated "
+                 "(default: all)")
+    parser.add_argument(
+            "--kernel",
+            choices=sorted(KERNELS),
+            action="append",
+            help="kernel to run, may be repeated (default: all)")
+    parser.add_argument(
+            "--engine",
+            choices=["pysim", "cxxrtl"],
+            default="pysim",
+            help="simulation engine (default: pysim)")
+    parser.add_argument(
+            "--output",
+            type=pathlib.Path,
+            default=pathlib.Path("benchmark_results.json"),
+            help="JSON file to write results to "
+                 "(default: benchmark_results.json)")
+    parser.add_argument(
+            "--baseline",
+            type=pathlib.Path,
+            default=BASELINE,
+            help=f"JSON file of baseline results (default: {BASELINE})")
+    parser.add_argument(
+            "--tolerance",
+            type=float,
+            default=TOLERANCE,
+            help="fraction by which cycles or instret may exceed the "
+                 f"baseline (default: {TOLERANCE})")
+    parser.add_argument(
+            "--update-baseline",
+            action="store_true",
+            help="write the results to the baseline file")
+    args = parser.parse_args()
+
+    engine = "pysim"
+    if args.engine == "cxxrtl":
+        # pylint: disable=import-outside-toplevel
+        from . import compiled_sim
+        engine = compiled_sim.CXXRTLEngine
+
+    results = {}
+    cache = {}
+    for cpu_name in args.cpu or CPUS:
+        results[cpu_name] = {}
+        for kernel_name in args.kernel or KERNELS:
+            if not supported(cpu_name, kernel_name):
+                continue
+            result = run(cpu_name, kernel_name, engine, cache=cache)
+            results[cpu_name][kernel_name] = result
+            print(f"{cpu_name:28} {kernel_name:8} "
+                  f"cycles {result['cycles']:6} "
+                  f"instret {result['instret']:6} "
+                  f"CPI {result['cpi']:.3f} "
+                  f"{result['sim_cycles_per_second']:8} cycles/s")
+            if "pairing" in result:
+                print(" " * 38 + " ".join(
+                        f"{event} {count}"
+                        for event, count in result["pairing"].items()))
+
+    args.output.write_text(json.dumps(
+            {"engine": args.engine, "results": results},
+            indent=4) + "\n")
+
+    if args.update_baseline:
+        baseline = {
+                cpu_name: {
+                    kernel_name: {
+                        metric: result[metric]
+                        for metric in ("cycles", "instret")}
+                    for kernel_name, result in kernels.items()}
+                for cpu_name, kernels in results.items()}
+        args.baseline.parent.mkdir(parents=True, exist_ok=True)
+        args.baseline.write_text(json.dumps(baseline, indent=4) + "\n")
+        return
+
+    found = regressions(
+            results,
+            json.loads(args.baseline.read_text()),
+            args.tolerance)
+    for regression in found:
+        print(f"Regression: {regression}", file=sys.stderr)
+    if found:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
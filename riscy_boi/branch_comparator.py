@@ -0,0 +1,49 @@
+"""Branch condition comparator"""
+import nmigen as nm
+
+from . import encoding
+
+
+class BranchComparator(nm.Elaboratable):
+    """
+    Branch condition comparator
+
+    * funct (in): the branch instruction's funct field
+    * a (in): the value of source register 1
+    * b (in): the value of source register 2
+
+    * taken (out): high if the branch condition holds
+    """
+
+    def __init__(self, width=32):
+        """
+        Initialiser
+
+        Args:
+            width (int): data width
+        """
+        self.funct = nm.Signal(encoding.BranchFunct)
+        self.a = nm.Signal(width)
+        self.b = nm.Signal(width)
+        self.taken = nm.Signal()
+
+    def elaborate(self, _):
+        m = nm.Module()
+
+        with m.Switch(self.funct):
+            with m.Case(encoding.BranchFunct.BEQ):
+                m.d.comb += self.taken.eq(self.a == self.b)
+            with m.Case(encoding.BranchFunct.BNE):
+                m.d.comb += self.taken.eq(self.a != self.b)
+            with m.Case(encoding.BranchFunct.BLT):
+                m.d.comb += self.taken.eq(
+                        self.a.as_signed() < self.b.as_signed())
+            with m.Case(encoding.BranchFunct.BGE):
+                m.d.comb += self.taken.eq(
+                        self.a.as_signed() >= self.b.as_signed())
+            with m.Case(encoding.BranchFunct.BLTU):
+                m.d.comb += self.taken.eq(self.a < self.b)
+            with m.Case(encoding.BranchFunct.BGEU):
+                m.d.comb += self.taken.eq(self.a >= self.b)
+
+        return m
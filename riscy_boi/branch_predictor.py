@@ -0,0 +1,243 @@
+"""Branch predictor"""
+import enum
+
+import nmigen as nm
+
+from . import program_counter
+
+
+class PredictorType(enum.Enum):
+    """How the direction of conditional branches is predicted"""
+    STATIC = "static"    # backward taken, forward not taken
+    BIMODAL = "bimodal"  # per-address two-bit saturating counters
+
+
+class BranchKind(enum.IntEnum):
+    """Kinds of control transfer instruction held in the branch target
+    buffer"""
+    BRANCH = 0
+    JUMP = 1
+    CALL = 2
+    RETURN = 3
+
+
+def index_width(entries, name):
+    """
+    Get the number of address bits needed to index a table
+
+    Args:
+        entries (int): the number of entries in the table
+        name (str): the name of the table, for error messages
+
+    Returns:
+        int: log2 of the number of entries
+    """
+    if entries < 1 or entries & (entries - 1):
+        raise ValueError(f"{name} must be a power of two, not {entries}")
+    return entries.bit_length() - 1
+
+
+class BranchPredictor(nm.Elaboratable):
+    # pylint: disable=too-many-instance-attributes
+    """
+    Branch predictor
+
+    Predicts the address following the instruction being decoded from the
+    address of that instruction, using a branch target buffer (BTB) of
+    previously taken control transfers. Conditional branches found in the BTB
+    are predicted taken if they jump backwards (static), or by a branch
+    history table of two-bit counters (bimodal). Returns are predicted from a
+    return address stack, pushed when a call is predicted, if ras_depth is
+    non-zero.
+
+    * lookup_pc (in): the address of the instruction being decoded
+    * lookup_enable (in): high if the instruction being decoded is valid and
+      advancing this cycle
+
+    * predict_taken (out): high if the instruction is predicted to transfer
+      control
+    * predict_target (out): the predicted address of the next instruction if
+      predict_taken is high
+
+    * update (in): high when a control transfer instruction is resolved
+    * update_pc (in): the address of the resolved instruction
+    * update_kind (in): the kind of the resolved instruction
+    * update_taken (in): whether the resolved instruction transferred control
+    * update_target (in): the address control was transferred to
+    * update_mispredict (in): high if the next address was mispredicted
+
+    * hits (out): count of correctly predicted control transfer instructions
+    * misses (out): count of mispredicted control transfer instructions
+    """
+
+    def __init__(
+            self,
+            predictor_type=PredictorType.BIMODAL,
+            btb_entries=16,
+            bht_entries=64,
+            ras_depth=0):
+        """
+        Initialiser
+
+        Args:
+            predictor_type (PredictorType): how to predict branch directions
+            btb_entries (int): number of branch target buffer entries
+            bht_entries (int): number of branch history table entries, for
+                bimodal prediction
+            ras_depth (int): depth of the return address stack, zero for none
+        """
+        self.predictor_type = predictor_type
+        self.btb_index_width = index_width(btb_entries, "btb_entries")
+        self.bht_index_width = index_width(bht_entries, "bht_entries")
+        self.ras_depth = ras_depth
+
+        self.lookup_pc = nm.Signal(32)
+        self.lookup_enable = nm.Signal()
+        self.predict_taken = nm.Signal()
+        self.predict_target = nm.Signal(32)
+
+        self.update = nm.Signal()
+        self.update_pc = nm.Signal(32)
+        self.update_kind = nm.Signal(BranchKind)
+        self.update_taken = nm.Signal()
+        self.update_target = nm.Signal(32)
+        self.update_mispredict = nm.Signal()
+
+        self.hits = nm.Signal(32)
+        self.misses = nm.Signal(32)
+
+    def elaborate(self, _):
+        m = nm.Module()
+
+        index_start = (program_counter.INSTR_BYTES - 1).bit_length()
+        tag_start = index_start + self.btb_index_width
+
+        btb_tags = nm.Memory(
+                width=32 - tag_start,
+                depth=2**self.btb_index_width)
+        btb_targets = nm.Memory(width=32, depth=2**self.btb_index_width)
+        btb_kinds = nm.Memory(width=2, depth=2**self.btb_index_width)
+        btb_valid = nm.Array(
+                nm.Signal(name=f"btb_valid_{i}")
+                for i in range(2**self.btb_index_width))
+
+        tag_rp = m.submodules.tag_rp = btb_tags.read_port(domain="comb")
+        target_rp = m.submodules.target_rp = btb_targets.read_port(
+                domain="comb")
+        kind_rp = m.submodules.kind_rp = btb_kinds.read_port(domain="comb")
+        tag_wp = m.submodules.tag_wp = btb_tags.write_port()
+        target_wp = m.submodules.target_wp = btb_targets.write_port()
+        kind_wp = m.submodules.kind_wp = btb_kinds.write_port()
+
+        lookup_index = self.lookup_pc[index_start:tag_start]
+        update_index = self.update_pc[index_start:tag_start]
+        hit = nm.Signal()
+        branch_taken = nm.Signal()
+
+        m.d.comb += [
+                tag_rp.addr.eq(lookup_index),
+                target_rp.addr.eq(lookup_index),
+                kind_rp.addr.eq(lookup_index),
+                hit.eq(btb_valid[lookup_index] &
+                       (tag_rp.data == self.lookup_pc[tag_start:])),
+        ]
+
+        # Only taken control transfers are allocated in the BTB
+        m.d.comb += [
+                tag_wp.addr.eq(update_index),
+                target_wp.addr.eq(update_index),
+                kind_wp.addr.eq(update_index),
+                tag_wp.data.eq(self.update_pc[tag_start:]),
+                target_wp.data.eq(self.update_target),
+                kind_wp.data.eq(self.update_kind),
+        ]
+        with m.If(self.update & self.update_taken):
+            m.d.comb += [
+                    tag_wp.en.eq(1),
+                    target_wp.en.eq(1),
+                    kind_wp.en.eq(1),
+            ]
+            m.d.sync += btb_valid[update_index].eq(1)
+
+        if self.predictor_type == PredictorType.STATIC:
+            m.d.comb += branch_taken.eq(target_rp.data < self.lookup_pc)
+        else:
+            self.elaborate_bht(m, index_start, branch_taken)
+
+        m.d.comb += self.predict_target.eq(target_rp.data)
+        with m.If(hit):
+            with m.Switch(kind_rp.data):
+                with m.Case(BranchKind.BRANCH):
+                    m.d.comb += self.predict_taken.eq(branch_taken)
+                with m.Case(BranchKind.JUMP, BranchKind.CALL):
+                    m.d.comb += self.predict_taken.eq(1)
+
+        if self.ras_depth:
+            self.elaborate_ras(m, hit, kind_rp.data)
+
+        with m.If(self.update & self.update_mispredict):
+            m.d.sync += self.misses.eq(self.misses + 1)
+        with m.Elif(self.update):
+            m.d.sync += self.hits.eq(self.hits + 1)
+
+        return m
+
+    def elaborate_bht(self, m, index_start, branch_taken):
+        """Add a branch history table of two-bit saturating counters"""
+        index_end = index_start + self.bht_index_width
+        weakly_not_taken = 0b01
+        bht = nm.Memory(
+                width=2,
+                depth=2**self.bht_index_width,
+                init=[weakly_not_taken] * 2**self.bht_index_width)
+
+        lookup_rp = m.submodules.bht_lookup_rp = bht.read_port(domain="comb")
+        update_rp = m.submodules.bht_update_rp = bht.read_port(domain="comb")
+        wp = m.submodules.bht_wp = bht.write_port()
+
+        counter = update_rp.data
+        m.d.comb += [
+                lookup_rp.addr.eq(self.lookup_pc[index_start:index_end]),
+                update_rp.addr.eq(self.update_pc[index_start:index_end]),
+                wp.addr.eq(self.update_pc[index_start:index_end]),
+                wp.en.eq(self.update &
+                         (self.update_kind == BranchKind.BRANCH)),
+                branch_taken.eq(lookup_rp.data[1]),
+        ]
+
+        with m.If(self.update_taken):
+            m.d.comb += wp.data.eq(nm.Mux(counter == 0b11, 0b11, counter + 1))
+        with m.Else():
+            m.d.comb += wp.data.eq(nm.Mux(counter == 0b00, 0b00, counter - 1))
+
+    def elaborate_ras(self, m, hit, kind):
+        """Add a return address stack, which overwrites its oldest entry when
+        full"""
+        stack = nm.Array(
+                nm.Signal(32, name=f"ras_{i}") for i in range(self.ras_depth))
+        top = nm.Signal(range(self.ras_depth))
+        count = nm.Signal(range(self.ras_depth + 1))
+        top_next = nm.Mux(top == self.ras_depth - 1, 0, top + 1)
+        top_prev = nm.Mux(top == 0, self.ras_depth - 1, top - 1)
+
+        with m.If(hit & (kind == BranchKind.RETURN) & (count != 0)):
+            m.d.comb += [
+                    self.predict_taken.eq(1),
+                    self.predict_target.eq(stack[top]),
+            ]
+            with m.If(self.lookup_enable):
+                m.d.sync += [
+                        top.eq(top_prev),
+                        count.eq(count - 1),
+                ]
+
+        with m.If(hit & (kind == BranchKind.CALL) & self.lookup_enable):
+            m.d.sync += [
+                    top.eq(top_next),
+                    stack[top_next].eq(
+                        self.lookup_pc + program_counter.INSTR_BYTES),
+                    count.eq(nm.Mux(
+                        count == self.ras_depth,
+                        count,
+                        count + 1)),
+            ]
@@ -0,0 +1,184 @@
+"""
+Content-addressed cache of build stages
+
+Each stage of a build, such as elaboration, synthesis or place and route, is
+keyed by a hash of its inputs: the design, the platform, the versions of the
+tools and the options they are run with. The files a stage produces are
+stored under its key, so rebuilding an unchanged design restores them rather
+than running the tools again:
+
+    cache = build_cache.BuildCache()
+    key = build_cache.digest(
+            rtlil_text, SCRIPT, build_cache.package_version("yowasp-yosys"))
+    cache.run(key, build_dir, ["design.json"], synthesise)
+
+Once the cache exceeds its maximum size, the least recently used entries are
+evicted.
+"""
+import hashlib
+import os
+import pathlib
+import shutil
+import tempfile
+from importlib import metadata
+
+CACHE_DIR = pathlib.Path(os.environ.get(
+        "RISCY_BOI_BUILD_CACHE",
+        pathlib.Path.home() / ".cache" / "riscy_boi" / "build"))
+MAX_SIZE = int(os.environ.get("RISCY_BOI_BUILD_CACHE_SIZE", 1 << 30))
+
+
+def digest(*parts):
+    """
+    Hash the inputs of a build stage
+
+    Args:
+        parts (str or bytes): the inputs
+
+    Returns:
+        str: the key, as hex
+    """
+    hasher = hashlib.sha256()
+    for part in parts:
+        if isinstance(part, str):
+            part = part.encode("utf-8")
+        # Each part's length is hashed too, so parts cannot run together
+        hasher.update(len(part).to_bytes(8, "little"))
+        hasher.update(part)
+    return hasher.hexdigest()
+
+
+def package_version(name):
+    """The version of an installed Python package, or "" if not installed"""
+    try:
+        return metadata.version(name)
+    except metadata.PackageNotFoundError:
+        return ""
+
+
+def executable_version(name):
+    """
+    Identify an executable on the path, or named by an environment variable
+
+    nmigen platforms run each tool from the environment variable named after
+    it, e.g. NEXTPNR_ICE40, if set. Not every tool reports its version, so
+    the executable is identified by its path, size and modification time,
+    which change when it is upgraded.
+
+    Returns:
+        str: the identity, or "" if the executable is not found
+    """
+    path = shutil.which(os.environ.get(name.upper().replace("-", "_"), name))
+    if path is None:
+        return ""
+    stat = os.stat(path)
+    return f"{path}:{stat.st_size}:{stat.st_mtime_ns}"
+
+
+class BuildCache:
+    """
+    A directory of build products, with a directory per entry named by key
+    """
+
+    def __init__(self, directory=CACHE_DIR, max_size=MAX_SIZE):
+        """
+        Initialiser
+
+        Args:
+            directory (pathlib.Path): the cache directory
+            max_size (int): the size in bytes the entries may total before
+                the least recently used are evicted
+        """
+        self.directory = pathlib.Path(directory)
+        self.max_size = max_size
+
+    def get(self, key):
+        """
+        Find an entry
+
+        Args:
+            key (str): the entry's key
+
+        Returns:
+            dict: the contents of each file by name, or None if not cached
+        """
+        entry = self.directory / key
+        try:
+            files = {path.name: path.read_bytes()
+                     for path in entry.iterdir()}
+        except FileNotFoundError:
+            return None
+        # The modification time of an entry is when it was last used
+        os.utime(entry)
+        return files
+
+    def put(self, key, files):
+        """
+        Store an entry, then evict entries until the cache fits its size
+
+        Args:
+            key (str): the entry's key
+            files (dict): the contents of each file by name, as bytes
+        """
+        self.directory.mkdir(parents=True, exist_ok=True)
+        # Write to a temporary directory and rename, so concurrent builds
+        # never find a partially written entry
+        partial = pathlib.Path(tempfile.mkdtemp(
+                prefix=".partial-", dir=self.directory))
+        for name, content in files.items():
+            (partial / name).write_bytes(content)
+        try:
+            os.rename(partial, self.directory / key)
+        except OSError:
+            # Another build stored the same entry first
+            shutil.rmtree(partial)
+        self.evict()
+
+    def evict(self):
+        """Remove the least recently used entries beyond the maximum size"""
+        entries = []
+        for entry in self.directory.iterdir():
+            if entry.name.startswith(".") or not entry.is_dir():
+                # Partially written, or not an entry
+                continue
+            try:
+                entries.append((
+                        entry.stat().st_mtime_ns,
+                        sum(path.stat().st_size for path in entry.iterdir()),
+                        entry))
+            except FileNotFoundError:
+                # Evicted by another build
+                continue
+        total = sum(size for _, size, _ in entries)
+        for _, size, entry in sorted(entries):
+            if total <= self.max_size:
+                break
+            shutil.rmtree(entry, ignore_errors=True)
+            total -= size
+
+    def run(self, key, directory, names, build):
+        """
+        Restore a stage's products from the cache, or build and store them
+
+        Args:
+            key (str): the stage's key
+            directory (pathlib.Path): the directory the stage builds in
+            names (list of str): the names of the files the stage produces
+                in the directory
+            build (callable): runs the stage
+
+        Returns:
+            bool: True if the products were restored from the cache
+        """
+        directory = pathlib.Path(directory)
+        files = self.get(key)
+        if files is not None:
+            for name, content in files.items():
+                (directory / name).write_bytes(content)
+            return True
+        build()
+        self.put(key, {
+                name: (directory / name).read_bytes()
+                for name in names
+                if (directory / name).exists()})
+        return False
@@ -0,0 +1,188 @@
+"""
+Checkpoints of single-cycle CPU simulations
+
+A checkpoint is the state of a cpu.CPU between two instructions: the address
+of the next instruction, the registers, the contents of the instruction and
+data memories, and the cycle and instret counters. It is saved to a compact
+binary file and restored into a fresh simulation of a CPU of the same
+configuration, so the instructions before a region of interest, such as boot
+code, are only simulated once:
+
+    def testbench():
+        for _ in range(warm_up_cycles):
+            yield
+        saved = yield from checkpoint.capture(cpu_inst, imem, dmem)
+        checkpoint.save(saved, "warm.ckpt")
+
+and in another simulation:
+
+    def restore():
+        yield from checkpoint.restore(
+                cpu_inst, imem, dmem, checkpoint.load("warm.ckpt"))
+
+    sim.add_process(restore)
+
+The file is a header followed by the state, compressed with zlib as the
+memories are mostly zero. Values are little-endian.
+"""
+import collections
+import pathlib
+import struct
+import zlib
+
+import nmigen.sim
+
+from . import reusable_sim
+
+MAGIC = b"RBCP"
+VERSION = 1
+# The magic number, the version, and the number of registers and of words in
+# the instruction and data memories
+HEADER = struct.Struct("<4sHHII")
+
+Checkpoint = collections.namedtuple(
+        "Checkpoint",
+        ["pc", "registers", "imem", "dmem", "cycle", "instret"])
+
+
+def _state_format(checkpoint_header):
+    _, _, registers, imem_words, dmem_words = checkpoint_header
+    # The pc, registers, memories, and 64-bit cycle and instret counters
+    return struct.Struct(f"<I{registers}I{imem_words}I{dmem_words}IQQ")
+
+
+def to_bytes(checkpoint):
+    """Encode a checkpoint as the contents of a checkpoint file"""
+    header = (MAGIC,
+              VERSION,
+              len(checkpoint.registers),
+              len(checkpoint.imem),
+              len(checkpoint.dmem))
+    state = _state_format(header).pack(
+            checkpoint.pc,
+            *checkpoint.registers,
+            *checkpoint.imem,
+            *checkpoint.dmem,
+            checkpoint.cycle,
+            checkpoint.instret)
+    return HEADER.pack(*header) + zlib.compress(state)
+
+
+def from_bytes(data):
+    """
+    Decode the contents of a checkpoint file
+
+    Raises:
+        ValueError: if the data is not a checkpoint of this version
+    """
+    if len(data) < HEADER.size:
+        raise ValueError("The data is too short to be a checkpoint")
+    header = HEADER.unpack_from(data)
+    magic, version, registers, imem_words, _ = header
+    if magic != MAGIC:
+        raise ValueError(f"The data starts with {magic!r}, not {MAGIC!r}")
+    if version != VERSION:
+        raise ValueError(
+                f"The checkpoint is version {version}, not {VERSION}")
+    try:
+        state = zlib.decompress(data[HEADER.size:])
+        values = _state_format(header).unpack(state)
+    except (zlib.error, struct.error) as error:
+        raise ValueError(f"The checkpoint is corrupt: {error}") from error
+    imem_start = 1 + registers
+    dmem_start = imem_start + imem_words
+    return Checkpoint(
+            pc=values[0],
+            registers=list(values[1:imem_start]),
+            imem=list(values[imem_start:dmem_start]),
+            dmem=list(values[dmem_start:-2]),
+            cycle=values[-2],
+            instret=values[-1])
+
+
+def save(checkpoint, path):
+    """Write a checkpoint to a file"""
+    pathlib.Path(path).write_bytes(to_bytes(checkpoint))
+
+
+def load(path):
+    """Read a checkpoint from a file"""
+    return from_bytes(pathlib.Path(path).read_bytes())
+
+
+def capture(cpu_inst, imem, dmem):
+    """
+    Checkpoint a simulated CPU after the next instruction it retires
+
+    For a sync process to delegate to, with yield from. The simulation is
+    run until an instruction retires, then the state after it is read, at
+    the start of the next instruction.
+
+    Args:
+        cpu_inst (cpu.CPU): the CPU
+        imem (nm.Memory): the memory it fetches instructions from
+        dmem (nm.Memory): the memory it loads from and stores to
+
+    Returns:
+        Checkpoint: the state
+    """
+    while True:
+        yield nmigen.sim.Settle()
+        if (yield cpu_inst.counters.retire):
+            break
+        yield
+    yield
+    yield nmigen.sim.Settle()
+
+    registers, imem_words, dmem_words = [], [], []
+    for memory, words in ((cpu_inst.register_file.memories[0], registers),
+                          (imem, imem_words),
+                          (dmem, dmem_words)):
+        for index in range(memory.depth):
+            words.append((yield memory[index]))
+    return Checkpoint(
+            pc=(yield cpu_inst.program_counter.pc),
+            registers=registers,
+            imem=imem_words,
+            dmem=dmem_words,
+            cycle=(yield cpu_inst.counters.cycle),
+            instret=(yield cpu_inst.counters.instret))
+
+
+def restore(cpu_inst, imem, dmem, checkpoint):
+    """
+    Restore a checkpoint into a simulated CPU at reset
+
+    For a process to delegate to, with yield from, before the first clock
+    edge. The CPU spends its first cycle fetching the instruction at the
+    checkpoint's address, as it does after reset. The cycle counter is
+    restored one lower, so it counts the same cycles at each instruction as
+    in the simulation checkpointed. The time and event counters restart from
+    zero.
+
+    Args:
+        cpu_inst (cpu.CPU): the CPU, of the configuration checkpointed
+        imem (nm.Memory): the memory it fetches instructions from
+        dmem (nm.Memory): the memory it loads from and stores to
+        checkpoint (Checkpoint): the state to restore
+
+    Raises:
+        ValueError: if the checkpoint's registers or memories do not fit
+    """
+    rf = cpu_inst.register_file
+    for name, words, depth in (("registers", checkpoint.registers,
+                                rf.num_registers),
+                               ("imem", checkpoint.imem, imem.depth),
+                               ("dmem", checkpoint.dmem, dmem.depth)):
+        if len(words) > depth:
+            raise ValueError(
+                    f"The checkpoint's {len(words)} {name} words do not fit "
+                    f"in {depth}")
+
+    yield cpu_inst.program_counter.pc.eq(checkpoint.pc)
+    for memory in rf.memories:
+        yield from reusable_sim.load_memory(memory, checkpoint.registers)
+    yield from reusable_sim.load_memory(imem, checkpoint.imem)
+    yield from reusable_sim.load_memory(dmem, checkpoint.dmem)
+    yield cpu_inst.counters.cycle.eq(max(checkpoint.cycle - 1, 0))
+    yield cpu_inst.counters.instret.eq(checkpoint.instret)
@@ -0,0 +1,652 @@
+"""
+Compiled simulation of designs with CXXRTL
+
+The design is converted to C++ by CXXRTL, using the yowasp-yosys package,
+compiled into a shared library with the local C++ compiler and driven through
+the CXXRTL C API. Compiled libraries are cached, keyed by a hash of the
+design and the tools, so each design is only compiled once.
+
+CXXRTLEngine is an nmigen simulation engine, so existing testbenches run on it
+unchanged:
+
+    sim = nmigen.sim.Simulator(design, engine=compiled_sim.CXXRTLEngine)
+"""
+import argparse
+import contextlib
+import ctypes
+import heapq
+import importlib
+import os
+import pathlib
+import subprocess
+import tempfile
+import time
+
+import nmigen as nm
+import nmigen.sim
+from nmigen.back import rtlil
+from nmigen.hdl import ast
+try:
+    from nmigen.sim._base import BaseEngine
+except ImportError:  # the nmigen compatibility package of amaranth
+    from amaranth.sim._base import BaseEngine
+
+from . import build_cache
+
+CACHE_DIR = pathlib.Path(os.environ.get(
+        "RISCY_BOI_CXXRTL_CACHE",
+        pathlib.Path.home() / ".cache" / "riscy_boi" / "cxxrtl"))
+MAX_CACHE_SIZE = int(os.environ.get(
+        "RISCY_BOI_CXXRTL_CACHE_SIZE",
+        build_cache.MAX_SIZE))
+# Public wires are kept rather than computed on demand when read, as the
+# computation omits asynchronous memory reads, e.g. of the register file
+WRITE_CXXRTL = "write_cxxrtl -O4"
+CXXFLAGS = ["-std=c++14", "-O2", "-shared", "-fPIC"]
+LIBRARY = "design.so"
+
+# Types and flags of CXXRTL objects, see cxxrtl_capi.h
+CXXRTL_WIRE = 1
+CXXRTL_ALIAS = 3
+CXXRTL_OUTLINE = 4
+CXXRTL_INPUT = 1 << 0
+
+
+# Operators of values read by testbenches, on operands converted to ints
+# according to their signedness
+OPERATORS = {
+        "~": lambda a: ~a,
+        "-": lambda a, b=None: -a if b is None else a - b,
+        "u": lambda a: a,
+        "s": lambda a: a,
+        "+": lambda a, b: a + b,
+        "*": lambda a, b: a * b,
+        "//": lambda a, b: a // b if b else 0,
+        "%": lambda a, b: a % b if b else 0,
+        "&": lambda a, b: a & b,
+        "|": lambda a, b: a | b,
+        "^": lambda a, b: a ^ b,
+        "<<": lambda a, b: a << b,
+        ">>": lambda a, b: a >> b,
+        "==": lambda a, b: int(a == b),
+        "!=": lambda a, b: int(a != b),
+        "<": lambda a, b: int(a < b),
+        "<=": lambda a, b: int(a <= b),
+        ">": lambda a, b: int(a > b),
+        ">=": lambda a, b: int(a >= b),
+        "m": lambda sel, a, b: a if sel else b,
+}
+# Reductions, on the bits and width of their operand
+REDUCTIONS = {
+        "b": lambda bits, width: int(bits != 0),
+        "r|": lambda bits, width: int(bits != 0),
+        "r&": lambda bits, width: int(bits == _mask(width)),
+        "r^": lambda bits, width: bin(bits).count("1") % 2,
+}
+
+
+def _mask(width):
+    return (1 << width) - 1
+
+
+def _as_int(bits, shape):
+    """Interpret the bits of a value according to its signedness"""
+    if shape.signed and bits >> (shape.width - 1) & 1:
+        return bits - (1 << shape.width)
+    return bits
+
+
+class _Object(ctypes.Structure):
+    """struct cxxrtl_object"""
+    _fields_ = [
+            ("type", ctypes.c_uint32),
+            ("flags", ctypes.c_uint32),
+            ("width", ctypes.c_size_t),
+            ("lsb_at", ctypes.c_size_t),
+            ("depth", ctypes.c_size_t),
+            ("zero_at", ctypes.c_size_t),
+            ("curr", ctypes.POINTER(ctypes.c_uint32)),
+            ("next", ctypes.POINTER(ctypes.c_uint32)),
+            ("outline", ctypes.c_void_p),
+            ("attrs", ctypes.c_void_p),
+    ]
+
+
+# The callback of cxxrtl_enum, called with each object's name and parts
+_ENUM_CALLBACK = ctypes.CFUNCTYPE(
+        None,
+        ctypes.c_void_p,
+        ctypes.c_char_p,
+        ctypes.POINTER(_Object),
+        ctypes.c_size_t)
+
+
+def runtime_dir():
+    """Find the CXXRTL runtime headers bundled with yowasp-yosys"""
+    yowasp_yosys = importlib.import_module("yowasp_yosys")
+    return (pathlib.Path(yowasp_yosys.__file__).parent /
+            "share" / "include" / "backends" / "cxxrtl" / "runtime")
+
+
+def build(rtlil_text, cache_dir=CACHE_DIR, max_size=MAX_CACHE_SIZE):
+    """
+    Compile RTLIL into a CXXRTL shared library, or find it in the cache
+
+    The libraries are cached in a build_cache.BuildCache, keyed by the
+    design, the yowasp-yosys version, which bundles the C API, and the
+    compiler and its options.
+
+    Args:
+        rtlil_text (str): the design, as RTLIL
+        cache_dir (pathlib.Path): directory of compiled libraries
+        max_size (int): the size in bytes the libraries may total before the
+            least recently used are evicted
+
+    Returns:
+        pathlib.Path: the path of the shared library
+    """
+    cxx = os.environ.get("CXX", "c++")
+    key = build_cache.digest(
+            rtlil_text,
+            WRITE_CXXRTL,
+            build_cache.package_version("yowasp-yosys"),
+            cxx,
+            *CXXFLAGS)
+    cache = build_cache.BuildCache(cache_dir, max_size)
+    library = cache.directory / key / LIBRARY
+    if library.exists():
+        # The modification time of an entry is when it was last used
+        os.utime(library.parent)
+        return library
+
+    yowasp_yosys = importlib.import_module("yowasp_yosys")
+    cache.directory.mkdir(parents=True, exist_ok=True)
+    # Yosys runs in a WebAssembly sandbox which mounts its own directory over
+    # /tmp, so build in the cache directory rather than the system's. The
+    # cache skips directories named like this when evicting.
+    with tempfile.TemporaryDirectory(
+            prefix=".partial-",
+            dir=cache.directory) as build_dir:
+        design_il = os.path.join(build_dir, "design.il")
+        design_cc = os.path.join(build_dir, "design.cc")
+        with open(design_il, "w", encoding="utf-8") as design_file:
+            design_file.write(rtlil_text)
+        status = yowasp_yosys.run_yosys([
+                "-q",
+                "-p",
+                f"read_rtlil {design_il}; {WRITE_CXXRTL} {design_cc}"])
+        if status:
+            raise RuntimeError(f"Yosys failed with status {status}")
+
+        include = runtime_dir()
+        capi = include / "cxxrtl" / "capi" / "cxxrtl_capi.cc"
+        capi_vcd = include / "cxxrtl" / "capi" / "cxxrtl_capi_vcd.cc"
+        partial = os.path.join(build_dir, LIBRARY)
+        subprocess.run(
+                [cxx, *CXXFLAGS, f"-I{include}", design_cc, str(capi),
+                 str(capi_vcd), "-o", partial],
+                check=True)
+        # Stored by renaming, so concurrent builds of the same design never
+        # load a partially written library
+        cache.put(key, {LIBRARY: pathlib.Path(partial).read_bytes()})
+
+    return library
+
+
+def load(library):
+    """Load a CXXRTL shared library and declare the C API functions used"""
+    lib = ctypes.CDLL(str(library))
+    lib.cxxrtl_design_create.restype = ctypes.c_void_p
+    lib.cxxrtl_create.restype = ctypes.c_void_p
+    lib.cxxrtl_create.argtypes = [ctypes.c_void_p]
+    lib.cxxrtl_destroy.argtypes = [ctypes.c_void_p]
+    lib.cxxrtl_eval.argtypes = [ctypes.c_void_p]
+    lib.cxxrtl_commit.argtypes = [ctypes.c_void_p]
+    lib.cxxrtl_get_parts.restype = ctypes.POINTER(_Object)
+    lib.cxxrtl_get_parts.argtypes = [
+            ctypes.c_void_p,
+            ctypes.c_char_p,
+            ctypes.POINTER(ctypes.c_size_t)]
+    lib.cxxrtl_enum.argtypes = [
+            ctypes.c_void_p,
+            ctypes.c_void_p,
+            _ENUM_CALLBACK]
+    lib.cxxrtl_outline_eval.argtypes = [ctypes.c_void_p]
+    lib.cxxrtl_vcd_create.restype = ctypes.c_void_p
+    lib.cxxrtl_vcd_destroy.argtypes = [ctypes.c_void_p]
+    lib.cxxrtl_vcd_timescale.argtypes = [
+            ctypes.c_void_p,
+            ctypes.c_int,
+            ctypes.c_char_p]
+    lib.cxxrtl_vcd_add_from.argtypes = [ctypes.c_void_p, ctypes.c_void_p]
+    lib.cxxrtl_vcd_sample.argtypes = [ctypes.c_void_p, ctypes.c_uint64]
+    lib.cxxrtl_vcd_read.argtypes = [
+            ctypes.c_void_p,
+            ctypes.POINTER(ctypes.c_char_p),
+            ctypes.POINTER(ctypes.c_size_t)]
+    return lib
+
+
+def memory_words(fragment, hierarchy=()):
+    """
+    Find the memories in a fragment, for reading their words in simulation
+
+    Args:
+        fragment (ir.Fragment): the prepared fragment
+        hierarchy (tuple): the names of the fragment's parents
+
+    Returns:
+        ast.SignalDict: the hierarchical memory name and index of each
+            simulation signal returned by indexing an nm.Memory
+    """
+    words = ast.SignalDict()
+    for subfragment, sub_name in fragment.subfragments:
+        for param in getattr(subfragment, "parameters", {}).values():
+            if isinstance(param, nm.Memory):
+                name = " ".join(hierarchy + (param.name,))
+                for index in range(param.depth):
+                    words.setdefault(param[index], (name, index))
+        if sub_name is not None:
+            words.update(memory_words(subfragment, hierarchy + (sub_name,)))
+    return words
+
+
+class _Process:
+    """A testbench coroutine and what it is waiting for"""
+
+    def __init__(self, constructor, default_cmd):
+        self.constructor = constructor
+        self.default_cmd = default_cmd
+        self.reset()
+
+    def reset(self):
+        self.coroutine = self.constructor()
+        self.passive = False
+        self.runnable = True
+        self.waiting_clock = None
+        self.send = None
+
+
+class CXXRTLEngine(BaseEngine):
+    # pylint: disable=too-many-instance-attributes
+    """
+    nmigen simulation engine running the design compiled with CXXRTL
+
+    Testbench processes may read signals and memory words, assign constants
+    to them, and yield Settle, Delay, Tick, Passive and Active commands, with
+    the same timing as the pure-Python engine: a process woken by a clock edge
+    reads the values from before the edge until it settles or assigns.
+    Resetting the simulation recreates the design, restarting the clocks and
+    processes.
+    """
+
+    def __init__(self, fragment):
+        """
+        Initialiser
+
+        Args:
+            fragment (ir.Fragment): the prepared design
+        """
+        self._fragment = fragment
+        # The top module's name can not clash with signals in the top module,
+        # as CXXRTL names the module's class and its signals' members alike
+        rtlil_text, self._name_map = rtlil.convert_fragment(
+                fragment,
+                name="cxxrtl_top")
+        self._lib = load(build(rtlil_text))
+        self._memory_words = memory_words(fragment)
+        self._handle = None
+        self._objects = ast.SignalDict()
+        self._wires = None
+        self._processes = []
+        self._clocks = []
+        self._clock_phases = []
+        self._clock_objects = []
+        self._timeline = []
+        self._now = 0
+        self._edge_pending = False
+        self._assigned = False
+        self._vcd = None
+        self._vcd_file = None
+        self.reset()
+
+    def __del__(self):
+        if getattr(self, "_handle", None):
+            self._lib.cxxrtl_destroy(self._handle)
+
+    def add_coroutine_process(self, process, *, default_cmd):
+        self._processes.append(_Process(process, default_cmd))
+
+    def add_clock_process(self, clock, *, phase, period):
+        self._clocks.append(clock)
+        self._clock_phases.append((phase, period // 2))
+        heapq.heappush(
+                self._timeline,
+                (phase, len(self._clocks) - 1, period // 2))
+
+    def reset(self):
+        if self._handle:
+            self._lib.cxxrtl_destroy(self._handle)
+        self._handle = self._lib.cxxrtl_create(
+                self._lib.cxxrtl_design_create())
+        self._objects = ast.SignalDict()
+        self._wires = None
+        self._clock_objects = []
+        self._now = 0
+        self._timeline = [
+                (phase, clock_index, half_period)
+                for clock_index, (phase, half_period)
+                in enumerate(self._clock_phases)]
+        heapq.heapify(self._timeline)
+        # Inputs nothing drives hold their reset values, as in nmigen.sim
+        for signal in self._name_map:
+            obj = self._object(signal)
+            if obj is not None and obj.flags & CXXRTL_INPUT and obj.next:
+                self._write(obj, signal.reset)
+        self._settle()
+        for process in self._processes:
+            process.reset()
+
+    @property
+    def now(self):
+        return self._now
+
+    def advance(self):
+        self._run_processes()
+        if self._timeline:
+            self._now, clock_index, half_period = heapq.heappop(self._timeline)
+            heapq.heappush(
+                    self._timeline,
+                    (self._now + half_period, clock_index, half_period))
+            self._toggle(clock_index)
+        return any(not process.passive for process in self._processes
+                   if process.coroutine is not None)
+
+    @contextlib.contextmanager
+    def write_vcd(self, *, vcd_file, gtkw_file, traces):
+        # pylint: disable=unused-argument
+        self._vcd = self._lib.cxxrtl_vcd_create()
+        self._lib.cxxrtl_vcd_timescale(self._vcd, 1, b"ps")
+        self._lib.cxxrtl_vcd_add_from(self._vcd, self._handle)
+        with open(vcd_file, "wb") as self._vcd_file:
+            self._sample_vcd()
+            try:
+                yield
+            finally:
+                self._sample_vcd()
+                self._lib.cxxrtl_vcd_destroy(self._vcd)
+                self._vcd = None
+
+    def _sample_vcd(self):
+        if self._vcd is None:
+            return
+        self._lib.cxxrtl_vcd_sample(self._vcd, self._now)
+        data = ctypes.c_char_p()
+        size = ctypes.c_size_t()
+        while True:
+            self._lib.cxxrtl_vcd_read(
+                    self._vcd,
+                    ctypes.byref(data),
+                    ctypes.byref(size))
+            if not size.value:
+                break
+            self._vcd_file.write(ctypes.string_at(data, size.value))
+
+    def _object(self, signal):
+        """Get the CXXRTL object for a signal, or None if it has none"""
+        if signal not in self._name_map:
+            return None
+        if signal not in self._objects:
+            # Drop the name of the top module
+            name = " ".join(self._name_map[signal][1:])
+            self._objects[signal] = self._named_object(name)
+        return self._objects[signal]
+
+    def _named_object(self, name):
+        """Get the CXXRTL object with a hierarchical name, or None"""
+        parts = ctypes.c_size_t()
+        obj = self._lib.cxxrtl_get_parts(
+                self._handle,
+                name.encode(),
+                ctypes.byref(parts))
+        return obj[0] if obj else None
+
+    def _aliased_wire(self, obj):
+        """
+        Get the wire an alias names, or the object if it is not an alias
+
+        A signal driven in a submodule and named after a port of its parent
+        is an alias in the parent, without a next value to assign to.
+        """
+        if obj.type != CXXRTL_ALIAS:
+            return obj
+        if self._wires is None:
+            # Wires by the address of their current value, which aliases share
+            self._wires = {}
+
+            def add(_, __, parts, count):
+                if count == 1 and parts[0].type == CXXRTL_WIRE:
+                    address = ctypes.cast(parts[0].curr, ctypes.c_void_p).value
+                    self._wires[address] = parts[0]
+
+            self._lib.cxxrtl_enum(self._handle, None, _ENUM_CALLBACK(add))
+        address = ctypes.cast(obj.curr, ctypes.c_void_p).value
+        return self._wires.get(address, obj)
+
+    @staticmethod
+    def _read(obj, index=0):
+        chunks = (obj.width + 31) // 32
+        value = 0
+        for chunk in range(chunks):
+            value |= obj.curr[index * chunks + chunk] << (32 * chunk)
+        return value
+
+    @staticmethod
+    def _write(obj, value):
+        value &= (1 << obj.width) - 1
+        for chunk in range((obj.width + 31) // 32):
+            obj.next[chunk] = (value >> (32 * chunk)) & 0xffffffff
+
+    def _settle(self):
+        # cxxrtl_step stops once eval converges, even if registers changed on
+        # a clock edge, leaving the logic they drive stale; evaluate until
+        # committing changes nothing instead
+        self._edge_pending = False
+        self._assigned = False
+        self._lib.cxxrtl_eval(self._handle)
+        while self._lib.cxxrtl_commit(self._handle):
+            self._lib.cxxrtl_eval(self._handle)
+        self._sample_vcd()
+
+    def _toggle(self, clock_index):
+        if not self._clock_objects:
+            self._clock_objects = [
+                    self._object(clock) for clock in self._clocks]
+        obj = self._clock_objects[clock_index]
+        value = obj.curr[0] ^ 1
+        obj.next[0] = value
+        self._edge_pending = True
+        if value:
+            clock = self._clocks[clock_index]
+            for process in self._processes:
+                if process.waiting_clock is clock:
+                    process.waiting_clock = None
+                    process.runnable = True
+        if not any(process.runnable for process in self._processes):
+            self._settle()
+
+    def _run_processes(self):
+        while any(process.runnable for process in self._processes):
+            for process in self._processes:
+                if process.runnable:
+                    self._run_process(process)
+        # Assignments are committed before the next clock edge, which would
+        # otherwise overwrite those to registers
+        if self._edge_pending or self._assigned:
+            self._settle()
+
+    def _run_process(self, process):
+        process.runnable = False
+        while True:
+            try:
+                command = process.coroutine.send(process.send)
+            except StopIteration:
+                process.coroutine = None
+                process.passive = True
+                return
+            process.send = None
+            if command is None:
+                command = process.default_cmd
+
+            if isinstance(command, nm.Value):
+                process.send = self._evaluate(command)
+            elif isinstance(command, ast.Assign):
+                if self._edge_pending:
+                    self._settle()
+                self._assign(command)
+            elif isinstance(command, (nmigen.sim.Settle, nmigen.sim.Delay)):
+                self._settle()
+            elif isinstance(command, nmigen.sim.Tick):
+                domain = command.domain
+                if isinstance(domain, str):
+                    domain = self._fragment.domains[domain]
+                process.waiting_clock = domain.clk
+                return
+            elif isinstance(command, nmigen.sim.Passive):
+                process.passive = True
+            elif isinstance(command, nmigen.sim.Active):
+                process.passive = False
+            else:
+                raise TypeError(
+                        f"Unsupported command {command!r} for the CXXRTL "
+                        "engine")
+
+    def _evaluate(self, value):
+        return _as_int(self._evaluate_bits(value), value.shape())
+
+    def _evaluate_bits(self, value):
+        """Evaluate a value to its bits, as a non-negative int"""
+        # pylint: disable=too-many-return-statements,too-many-branches
+        width = value.shape().width
+        if isinstance(value, nm.Const):
+            return value.value & _mask(width)
+        if isinstance(value, nm.Signal):
+            obj = self._object(value)
+            if obj is not None:
+                if obj.type == CXXRTL_OUTLINE:
+                    self._lib.cxxrtl_outline_eval(obj.outline)
+                return self._read(obj)
+            if value in self._memory_words:
+                name, index = self._memory_words[value]
+                return self._read(self._named_object(name), index)
+        elif isinstance(value, ast.Slice):
+            return (self._evaluate_bits(value.value) >> value.start
+                    & _mask(width))
+        elif isinstance(value, ast.Part):
+            offset = self._evaluate_bits(value.offset) * value.stride
+            return self._evaluate_bits(value.value) >> offset & _mask(width)
+        elif isinstance(value, ast.Cat):
+            bits = 0
+            for part in reversed(value.parts):
+                bits = (bits << len(part)) | self._evaluate_bits(part)
+            return bits
+        elif isinstance(value, ast.Repl):
+            part = self._evaluate_bits(value.value)
+            bits = 0
+            for _ in range(value.count):
+                bits = (bits << len(value.value)) | part
+            return bits
+        elif isinstance(value, ast.Operator) and value.operator in REDUCTIONS:
+            operand, = value.operands
+            return REDUCTIONS[value.operator](
+                    self._evaluate_bits(operand),
+                    len(operand))
+        elif isinstance(value, ast.Operator) and value.operator in OPERATORS:
+            operands = [_as_int(self._evaluate_bits(operand), operand.shape())
+                        for operand in value.operands]
+            return OPERATORS[value.operator](*operands) & _mask(width)
+        raise TypeError(
+                f"Unsupported value {value!r} for the CXXRTL engine, only "
+                "signals in the design, memory words and expressions of them "
+                "can be read")
+
+    def _assign(self, assign):
+        rhs = nm.Value.cast(assign.rhs)
+        obj = (self._object(assign.lhs)
+               if isinstance(assign.lhs, nm.Signal) else None)
+        if (obj is None and isinstance(rhs, nm.Const) and
+                assign.lhs in self._memory_words):
+            # Memories have no next state, their words are written directly
+            name, index = self._memory_words[assign.lhs]
+            memory = self._named_object(name)
+            chunks = (memory.width + 31) // 32
+            value = rhs.value & _mask(memory.width)
+            for chunk in range(chunks):
+                memory.curr[index * chunks + chunk] = (
+                        value >> (32 * chunk) & 0xffffffff)
+            self._assigned = True
+            return
+        if obj is not None:
+            obj = self._aliased_wire(obj)
+        if obj is None or not obj.next or not isinstance(rhs, nm.Const):
+            raise TypeError(
+                    f"Unsupported assignment {assign!r} for the CXXRTL "
+                    "engine, only constants can be assigned to inputs and "
+                    "memory words")
+        self._write(obj, rhs.value)
+        self._assigned = True
+
+
+def main():
+    """Run a program on the pipelined CPU, reporting simulation speed"""
+    # pylint: disable=import-outside-toplevel
+    from . import pipelined_cpu
+
+    parser = argparse.ArgumentParser(description=main.__doc__)
+    parser.add_argument(
+            "program",
+            type=argparse.FileType("r"),
+            help="file of instruction words in hexadecimal, one per line")
+    parser.add_argument(
+            "--cycles",
+            type=int,
+            default=100000,
+            help="number of clock cycles to simulate")
+    args = parser.parse_args()
+    program = [int(line, 16) for line in args.program if line.strip()]
+
+    m = nm.Module()
+    cpu_inst = m.submodules.cpu = pipelined_cpu.PipelinedCPU()
+    imem = nm.Memory(width=32, depth=1024, init=program)
+    imem_rp = m.submodules.imem_rp = imem.read_port()
+    dmem = nm.Memory(width=32, depth=1024)
+    dmem_rp = m.submodules.dmem_rp = dmem.read_port()
+    dmem_wp = m.submodules.dmem_wp = dmem.write_port(granularity=8)
+    m.d.comb += [
+            imem_rp.addr.eq(cpu_inst.imem_addr[2:]),
+            cpu_inst.imem_data.eq(imem_rp.data),
+            dmem_rp.addr.eq(cpu_inst.dmem_r_addr),
+            cpu_inst.dmem_r_data.eq(dmem_rp.data),
+            dmem_wp.addr.eq(cpu_inst.dmem_w_addr),
+            dmem_wp.data.eq(cpu_inst.dmem_w_data),
+            dmem_wp.en.eq(cpu_inst.dmem_w_en),
+    ]
+
+    sim = nmigen.sim.Simulator(m, engine=CXXRTLEngine)
+    sim.add_clock(1e-6)
+
+    def process():
+        for _ in range(args.cycles):
+            yield
+        print(f"debug register: {(yield cpu_inst.debug_out):#010x}")
+
+    sim.add_sync_process(process)
+    start = time.perf_counter()
+    sim.run()
+    elapsed = time.perf_counter() - start
+    print(f"{args.cycles} cycles in {elapsed:.2f} s: "
+          f"{args.cycles / elapsed:.0f} cycles/s")
+
+
+if __name__ == "__main__":
+    main()
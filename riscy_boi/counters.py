@@ -0,0 +1,105 @@
+"""Performance counters"""
+import enum
+
+import nmigen as nm
+
+from . import encoding
+
+COUNTER_WIDTH = 64
+FIRST_EVENT_COUNTER = 3
+MAX_EVENT_COUNTERS = 29
+
+
+class Event(enum.Enum):
+    """Events which can be counted by the hpmcounter CSRs"""
+    TAKEN_JUMP = "taken_jump"            # jumps and taken branches
+    MISPREDICT = "mispredict"            # wrong next addresses flushed
+    LOAD = "load"
+    STORE = "store"
+    LOAD_USE_STALL = "load_use_stall"    # cycles a load's user waits
+    IMEM_STALL = "imem_stall"            # cycles waiting for instructions
+    DMEM_STALL = "dmem_stall"            # cycles waiting for data accesses
+    DUAL_ISSUE = "dual_issue"            # cycles retiring two instructions
+    # Cycles retiring one instruction, by the first pairing rule broken
+    PAIR_MISALIGNED = "pair_misaligned"  # the first is the upper half of the
+                                         # fetched doubleword
+    PAIR_CONTROL = "pair_control"        # the first is a jump or branch
+    PAIR_STRUCTURAL = "pair_structural"  # the second needs more than an ALU
+    PAIR_DEPENDENCY = "pair_dependency"  # the second reads the first's rd
+
+
+class Counters(nm.Elaboratable):
+    """
+    Performance counters, read through the Zicntr and Zihpm CSRs
+
+    The cycle, time and instret counters and one hpmcounter per event are
+    64 bits wide, their upper halves read at the CSR address plus 0x80.
+    hpmcounter3 counts the first event, hpmcounter4 the second and so on;
+    the other hpmcounters read as zero. Counters are read only.
+
+    * address (in): the address of the CSR to read
+    * read_data (out): the value of the CSR
+
+    * retire (in): the number of instructions retiring
+    * time_tick (in): high when the time counter should count. Defaults to
+      high, so time counts clock cycles.
+    * events (in): one bit per counted event, high when the event occurs
+    """
+
+    def __init__(self, events=(), issue_width=1):
+        """
+        Initialiser
+
+        Args:
+            events (list of Event): the events counted by hpmcounter3 onwards
+            issue_width (int): the most instructions retiring in a cycle
+        """
+        if len(events) > MAX_EVENT_COUNTERS:
+            raise ValueError(
+                    f"At most {MAX_EVENT_COUNTERS} events can be counted, "
+                    f"not {len(events)}")
+        self.event_list = list(events)
+
+        self.address = nm.Signal(12)
+        self.read_data = nm.Signal(32)
+
+        self.retire = nm.Signal(range(issue_width + 1))
+        self.time_tick = nm.Signal(reset=1)
+        self.events = nm.Signal(len(self.event_list))
+
+        self.cycle = nm.Signal(COUNTER_WIDTH)
+        self.time = nm.Signal(COUNTER_WIDTH)
+        self.instret = nm.Signal(COUNTER_WIDTH)
+        self.event_counts = [
+                nm.Signal(COUNTER_WIDTH, name=f"hpmcounter{i}")
+                for i in range(
+                    FIRST_EVENT_COUNTER,
+                    FIRST_EVENT_COUNTER + len(self.event_list))]
+
+    def elaborate(self, _):
+        m = nm.Module()
+
+        m.d.sync += self.cycle.eq(self.cycle + 1)
+        with m.If(self.time_tick):
+            m.d.sync += self.time.eq(self.time + 1)
+        m.d.sync += self.instret.eq(self.instret + self.retire)
+        for i, count in enumerate(self.event_counts):
+            with m.If(self.events[i]):
+                m.d.sync += count.eq(count + 1)
+
+        counters = [
+                (encoding.CSR.CYCLE, self.cycle),
+                (encoding.CSR.TIME, self.time),
+                (encoding.CSR.INSTRET, self.instret),
+        ]
+        counters += [(encoding.CSR.HPMCOUNTER3 + i, count)
+                     for i, count in enumerate(self.event_counts)]
+
+        with m.Switch(self.address):
+            for csr, count in counters:
+                with m.Case(csr):
+                    m.d.comb += self.read_data.eq(count[:32])
+                with m.Case(csr + encoding.CSR_HIGH_HALF):
+                    m.d.comb += self.read_data.eq(count[32:])
+
+        return m
@@ -1,62 +1,190 @@
+# nmigen: UnusedElaboratable=no
 """The CPU"""
+import collections
+
 import nmigen as nm
 
 from . import alu
+from . import branch_comparator
+from . import counters
 from . import data_memory
 from . import instruction_decoder
 from . import program_counter
 from . import register_file
 
 
-class CPU(nm.Elaboratable):
-    """rv32i CPU"""
+# The events the single-cycle CPU can count
+EVENTS = (
+        counters.Event.TAKEN_JUMP,
+        counters.Event.LOAD,
+        counters.Event.STORE,
+)
+
+# The first slot's decoder and execute units, and whether it loads
+Slot = collections.namedtuple(
+        "Slot",
+        ["idec", "alu", "cmp", "dmem", "csrs", "load"])
+
+
+class BaseCPU(nm.Elaboratable):
+    # pylint: disable=too-many-instance-attributes
+    """
+    The ports and first slot of the CPUs executing an instruction a cycle
+
+    The ports are those of CPU, other than its trace ports. Subclasses
+    elaborate with elaborate_fetch and elaborate_first_slot.
+
+    The program counter, register file and counters are kept as attributes,
+    so testbenches can watch, checkpoint and restore the CPU's state.
+    """
 
-    def __init__(self, debug_reg=2):
+    def __init__(self, imem_width, debug_reg, events, alu_unit, muldiv_unit,
+                 counters_unit, program_counter_unit, register_file_unit):
+        """
+        Initialiser
+
+        Args:
+            imem_width (int): the width of imem_data
+            debug_reg (int): the register to output at debug_out
+            events (list of counters.Event): the events counted by
+                hpmcounter3 onwards
+            alu_unit (alu.ALU): the first slot's ALU, or None for one with
+                the default adder and shifter
+            muldiv_unit (muldiv.MulDiv): the first slot's multiply and divide
+                unit, or None to leave out the M extension
+            counters_unit (counters.Counters): the counters, for the events
+            program_counter_unit (program_counter.ProgramCounter): the
+                program counter
+            register_file_unit (register_file.RegisterFile): the register
+                file, its first ports used by the first slot
+        """
+        # pylint: disable=too-many-arguments
         self.imem_addr = nm.Signal(32)
-        self.imem_data = nm.Signal(32)
+        self.imem_data = nm.Signal(imem_width)
+        self.imem_valid = nm.Signal(reset=1)
 
         self.dmem_r_addr = nm.Signal(32)
+        self.dmem_r_en = nm.Signal()
         self.dmem_r_data = nm.Signal(32)
+        self.dmem_valid = nm.Signal(reset=1)
         self.dmem_w_addr = nm.Signal(32)
         self.dmem_w_data = nm.Signal(32)
+        self.dmem_w_en = nm.Signal(4)
 
         self.debug_reg = debug_reg
         self.debug_out = nm.Signal(32)
 
-    def elaborate(self, _):
-        m = nm.Module()
+        self.time_tick = nm.Signal(reset=1)
+        self.events = events
+        self.alu_unit = alu_unit
+        self.muldiv_unit = muldiv_unit
+        self.counters = counters_unit
+        self.program_counter = program_counter_unit
+        self.register_file = register_file_unit
+
+    def elaborate_fetch(self, m, stall):
+        """
+        Hold the instruction memory data while the CPU stalls
+
+        Returns:
+            tuple: a signal high when the data is valid, and the data
+        """
+        # Low in the first cycle, before the first instruction is fetched
+        started = nm.Signal()
+        m.d.sync += started.eq(1)
+        # While stalled, the data is held rather than waited for again
+        valid = nm.Signal()
+        held = nm.Signal()
+        held_data = nm.Signal.like(self.imem_data)
+        m.d.sync += held.eq(stall & valid)
+        with m.If(~held):
+            m.d.sync += held_data.eq(self.imem_data)
+        m.d.comb += valid.eq(started & (self.imem_valid | held))
+        return valid, nm.Mux(held, held_data, self.imem_data)
 
-        alu_inst = m.submodules.alu = alu.ALU(32)
+    def elaborate_first_slot(self, m, valid, stall):
+        """
+        Decode and execute the first slot's instruction
+
+        The program counter, register file, counters, decoder and execute
+        units are added as submodules. The instruction is read from and
+        written back to the register file's first ports, and the CPU stalls
+        while an execute unit is busy or the data memory is not ready. The
+        caller drives the decoder's instr, and the program counter's inputs.
+
+        Args:
+            m (nm.Module): the CPU's module
+            valid (nm.Signal): high when the instruction is valid
+            stall (nm.Signal): the signal to drive high when the CPU stalls
+
+        Returns:
+            Slot: the decoder and execute units
+        """
+        alu_inst = m.submodules.alu = (
+                alu.ALU(32) if self.alu_unit is None else self.alu_unit)
+        cmp = m.submodules.cmp = branch_comparator.BranchComparator(32)
+        csrs = m.submodules.csrs = self.counters
         dmem = m.submodules.dmem = data_memory.DataMemory()
-        idec = m.submodules.idec = instruction_decoder.InstructionDecoder()
-        pc = m.submodules.pc = program_counter.ProgramCounter()
-        rf = m.submodules.rf = register_file.RegisterFile(
-                debug_reg=self.debug_reg)
+        idec = m.submodules.idec = instruction_decoder.InstructionDecoder(
+                muldiv=self.muldiv_unit is not None)
+        pc = m.submodules.pc = self.program_counter
+        rf = m.submodules.rf = self.register_file
+
+        busy = nm.Signal()
+        load = idec.rd_mux_op == instruction_decoder.RdValue.LOAD
 
         m.d.comb += [
                 rf.read_select_1.eq(idec.rf_read_select_1),
                 rf.read_select_2.eq(idec.rf_read_select_2),
-                rf.write_enable.eq(idec.rf_write_enable),
+                rf.write_enable.eq(idec.rf_write_enable & ~stall),
                 rf.write_select.eq(idec.rf_write_select),
 
-                alu_inst.a.eq(idec.alu_imm),
                 alu_inst.op.eq(idec.alu_op),
+                alu_inst.valid.eq(valid),
+                alu_inst.advance.eq(~stall),
 
                 self.dmem_r_addr.eq(dmem.dmem_r_addr),
+                self.dmem_r_en.eq(valid & load),
                 dmem.byte_address.eq(alu_inst.o),
                 dmem.signed.eq(idec.dmem_signed),
                 dmem.address_mode.eq(idec.dmem_address_mode),
                 dmem.dmem_r_data.eq(self.dmem_r_data),
+                dmem.store.eq(valid & idec.dmem_store),
+                dmem.store_value.eq(rf.read_data_2),
+                self.dmem_w_addr.eq(dmem.dmem_w_addr),
+                self.dmem_w_data.eq(dmem.dmem_w_data),
+                self.dmem_w_en.eq(dmem.dmem_w_en),
 
-                pc.load.eq(idec.pc_load),
-                pc.input_address.eq(alu_inst.o),
+                cmp.funct.eq(idec.branch_funct),
+                cmp.a.eq(rf.read_data_1),
+                cmp.b.eq(rf.read_data_2),
 
-                self.imem_addr.eq(pc.pc_next),
-                idec.instr.eq(self.imem_data),
+                stall.eq(
+                    ~valid |
+                    busy |
+                    ((self.dmem_r_en | dmem.store) & ~self.dmem_valid)),
 
+                self.imem_addr.eq(pc.pc_next),
                 self.debug_out.eq(rf.debug_out),
+
+                csrs.address.eq(idec.csr),
+                csrs.time_tick.eq(self.time_tick),
         ]
 
+        if self.muldiv_unit is None:
+            m.d.comb += busy.eq(alu_inst.busy)
+        else:
+            muldiv_inst = m.submodules.muldiv = self.muldiv_unit
+            m.d.comb += [
+                    muldiv_inst.op.eq(idec.muldiv_op),
+                    muldiv_inst.a.eq(rf.read_data_1),
+                    muldiv_inst.b.eq(rf.read_data_2),
+                    muldiv_inst.valid.eq(valid & (
+                        idec.rd_mux_op == instruction_decoder.RdValue.MULDIV)),
+                    muldiv_inst.advance.eq(~stall),
+                    busy.eq(alu_inst.busy | muldiv_inst.busy),
+            ]
+
         with m.Switch(idec.rd_mux_op):
             with m.Case(instruction_decoder.RdValue.PC_INC):
                 m.d.comb += rf.write_data.eq(pc.pc_inc)
@@ -64,11 +192,155 @@ class CPU(nm.Elaboratable):
                 m.d.comb += rf.write_data.eq(alu_inst.o)
             with m.Case(instruction_decoder.RdValue.LOAD):
                 m.d.comb += rf.write_data.eq(dmem.load_value)
+            with m.Case(instruction_decoder.RdValue.CSR):
+                m.d.comb += rf.write_data.eq(csrs.read_data)
+            if self.muldiv_unit is not None:
+                with m.Case(instruction_decoder.RdValue.MULDIV):
+                    m.d.comb += rf.write_data.eq(muldiv_inst.o)
+
+        self.elaborate_alu_inputs(m, idec, alu_inst, pc.pc,
+                                  rf.read_data_1, rf.read_data_2)
 
+        return Slot(idec, alu_inst, cmp, dmem, csrs, load)
+
+    @staticmethod
+    def elaborate_alu_inputs(m, idec, alu_inst, pc, read_data_1, read_data_2):
+        """Select a slot's ALU inputs"""
+        # pylint: disable=too-many-arguments
         with m.Switch(idec.alu_mux_op):
             with m.Case(instruction_decoder.ALUInput.READ_DATA_1):
-                m.d.comb += alu_inst.b.eq(rf.read_data_1)
+                m.d.comb += alu_inst.b.eq(read_data_1)
             with m.Case(instruction_decoder.ALUInput.PC):
-                m.d.comb += alu_inst.b.eq(pc.pc)
+                m.d.comb += alu_inst.b.eq(pc)
+            with m.Case(instruction_decoder.ALUInput.READ_DATA_2):
+                m.d.comb += alu_inst.b.eq(read_data_2)
+
+        with m.Switch(idec.alu_a_mux_op):
+            with m.Case(instruction_decoder.ALUOperand.IMMEDIATE):
+                m.d.comb += alu_inst.a.eq(idec.alu_imm)
+            with m.Case(instruction_decoder.ALUOperand.READ_DATA_1):
+                m.d.comb += alu_inst.a.eq(read_data_1)
+            with m.Case(instruction_decoder.ALUOperand.READ_DATA_2):
+                m.d.comb += alu_inst.a.eq(read_data_2)
+
+
+class CPU(BaseCPU):
+    # pylint: disable=too-many-instance-attributes
+    """
+    rv32i CPU, or rv32im with a multiply and divide unit
+
+    The cycle, time and instret counters, and hpmcounters of chosen events,
+    can be read with CSR instructions, see counters.Counters.
+
+    * time_tick (in): high when the time counter should count. Defaults to
+      high, so time counts clock cycles.
+
+    Memories may take several cycles. While waiting, and while a multi-cycle
+    unit is busy, the CPU holds the instruction it is executing and presents
+    the same addresses again:
+
+    * imem_valid (in): high if imem_data holds the instruction at the address
+      presented last cycle. If low, the CPU presents the same address again.
+      Defaults to high.
+    * dmem_r_en (out): high when a load is presented at dmem_r_addr
+    * dmem_valid (in): high when the load or store presented has completed,
+      a load's data being at dmem_r_data. Until then, the CPU presents the
+      same access. Defaults to high, for a data memory read
+      combinationally.
+
+    Each instruction retired is output for tracing, like the RISC-V Formal
+    Interface's rvfi signals, see trace.py:
+
+    * trace_valid (out): high when an instruction retires
+    * trace_pc (out): its address
+    * trace_instr (out): the instruction
+    * trace_rd (out): the register it writes, or zero if none
+    * trace_rd_data (out): the value written, or zero if none
+    * trace_mem_en (out): high if it loads or stores
+    * trace_mem_addr (out): the byte address it loads from or stores to
+    """
+
+    def __init__(self, debug_reg=2, events=(), alu_unit=None,
+                 muldiv_unit=None):
+        """
+        Initialiser
+
+        Args:
+            debug_reg (int): the register to output at debug_out
+            events (list of counters.Event): the events counted by
+                hpmcounter3 onwards, from those in EVENTS
+            alu_unit (alu.ALU): the ALU, or None for one with the default
+                adder and shifter. While a multi-cycle ALU is busy, the
+                instruction is fetched again and not retired.
+            muldiv_unit (muldiv.MulDiv): the multiply and divide unit, or
+                None to leave out the M extension. Like a multi-cycle ALU,
+                the instruction is fetched again while it is busy.
+        """
+        unsupported = set(events) - set(EVENTS)
+        if unsupported:
+            raise ValueError(f"Events {unsupported} can not be counted")
+        super().__init__(
+                32,
+                debug_reg,
+                events,
+                alu_unit,
+                muldiv_unit,
+                # Created here, so testbenches can watch, checkpoint and
+                # restore the CPU's state. They are only elaborated with the
+                # CPU, which is warned about itself if it never is, so the
+                # first line of this file turns off nmigen's
+                # UnusedElaboratable warning for them.
+                counters.Counters(events),
+                program_counter.ProgramCounter(),
+                register_file.RegisterFile(debug_reg=debug_reg))
+
+        self.trace_valid = nm.Signal()
+        self.trace_pc = nm.Signal(32)
+        self.trace_instr = nm.Signal(32)
+        self.trace_rd = nm.Signal(5)
+        self.trace_rd_data = nm.Signal(32)
+        self.trace_mem_en = nm.Signal()
+        self.trace_mem_addr = nm.Signal(32)
+
+    def elaborate(self, _):
+        m = nm.Module()
+
+        stall = nm.Signal()
+        valid, instr = self.elaborate_fetch(m, stall)
+        slot = self.elaborate_first_slot(m, valid, stall)
+        idec = slot.idec
+        pc = self.program_counter
+        rf = self.register_file
+
+        taken = nm.Signal()
+        m.d.comb += [
+                idec.instr.eq(instr),
+
+                taken.eq(idec.pc_load | (idec.branch & slot.cmp.taken)),
+                pc.load.eq(taken | stall),
+                pc.input_address.eq(nm.Mux(stall, pc.pc, slot.alu.o)),
+
+                slot.csrs.retire.eq(~stall),
+
+                self.trace_valid.eq(~stall),
+                self.trace_pc.eq(pc.pc),
+                self.trace_instr.eq(instr),
+                self.trace_mem_en.eq(slot.load | idec.dmem_store),
+                self.trace_mem_addr.eq(
+                    nm.Mux(self.trace_mem_en, slot.alu.o, 0)),
+        ]
+        with m.If(idec.rf_write_enable & (idec.rf_write_select != 0)):
+            m.d.comb += [
+                    self.trace_rd.eq(idec.rf_write_select),
+                    self.trace_rd_data.eq(rf.write_data),
+            ]
+
+        events = {
+                counters.Event.TAKEN_JUMP: taken & ~stall,
+                counters.Event.LOAD: slot.load & ~stall,
+                counters.Event.STORE: idec.dmem_store & ~stall,
+        }
+        m.d.comb += slot.csrs.events.eq(
+                nm.Cat(events[e] for e in self.events))
 
         return m
@@ -0,0 +1,250 @@
+"""Data cache"""
+import nmigen as nm
+from nmigen.utils import log2_int
+
+
+class DataCache(nm.Elaboratable):
+    # pylint: disable=too-many-instance-attributes
+    """
+    Set-associative, write-back, write-allocate data cache
+
+    Accesses are presented like to a synchronous memory: the word at the
+    address presented at addr is output at r_data the following cycle, and
+    byte lanes enabled by w_en are written. valid is high the following cycle
+    if the access completed; if it is low, the same access must be presented
+    again until valid is high.
+
+    Missing lines replace a way chosen round-robin. If the replaced line has
+    been written to, it is first written back to the backing store. Lines are
+    written back and read one word at a time.
+
+    * addr (in): the word address to access
+    * r_en (in): high to read the word at addr
+    * w_en (in): the byte lanes of w_data to write to the word at addr
+    * w_data (in): the data to write
+    * r_data (out): the word read at the address presented last cycle
+    * valid (out): high if the access presented last cycle completed
+
+    * mem_addr (out): the word address to access in the backing store
+    * mem_req (out): high to request an access to the backing store
+    * mem_we (out): high if the access is a write of mem_w_data
+    * mem_w_data (out): the word to write to the backing store
+    * mem_r_data (in): the word read from the backing store
+    * mem_ack (in): high when the access to the backing store completes
+
+    * hits (out): count of accesses that hit in the cache
+    * misses (out): count of lines read from the backing store
+    * writebacks (out): count of lines written back to the backing store
+    """
+
+    def __init__(self, lines=64, ways=1, line_words=4):
+        """
+        Initialiser
+
+        Args:
+            lines (int): the total number of lines in the cache
+            ways (int): the associativity of the cache
+            line_words (int): the number of 32-bit words per line
+        """
+        if lines % ways:
+            raise ValueError(f"lines ({lines}) must be a multiple of ways")
+        self.ways = ways
+        self.offset_width = log2_int(line_words)
+        self.index_width = log2_int(lines // ways)
+
+        self.addr = nm.Signal(30)
+        self.r_en = nm.Signal()
+        self.w_en = nm.Signal(4)
+        self.w_data = nm.Signal(32)
+        self.r_data = nm.Signal(32)
+        self.valid = nm.Signal()
+
+        self.mem_addr = nm.Signal(30)
+        self.mem_req = nm.Signal()
+        self.mem_we = nm.Signal()
+        self.mem_w_data = nm.Signal(32)
+        self.mem_r_data = nm.Signal(32)
+        self.mem_ack = nm.Signal()
+
+        self.hits = nm.Signal(32)
+        self.misses = nm.Signal(32)
+        self.writebacks = nm.Signal(32)
+
+    def elaborate(self, _):
+        # pylint: disable=too-many-statements
+        m = nm.Module()
+
+        index_start = self.offset_width
+        tag_start = index_start + self.index_width
+        tag_width = 30 - tag_start
+        sets = 2**self.index_width
+        last_offset = 2**self.offset_width - 1
+
+        req_addr = nm.Signal(30)
+        req_r_en = nm.Signal()
+        req_w_en = nm.Signal(4)
+        req_w_data = nm.Signal(32)
+        # Set when a load follows a store to the same word, as the load read
+        # the word before the store wrote it
+        replay = nm.Signal()
+
+        line_index = nm.Signal(self.index_width)
+        line_tag = nm.Signal(tag_width)
+        evict_tag = nm.Signal(tag_width)
+        offset = nm.Signal(self.offset_width)
+        evict_word_read = nm.Signal()
+        victim = nm.Signal(range(self.ways))
+        hit = nm.Signal()
+        hit_way = nm.Signal(range(self.ways))
+        writing_back = nm.Signal()
+        refilling = nm.Signal()
+        store_hit = nm.Signal()
+
+        m.d.sync += [
+                req_addr.eq(self.addr),
+                req_r_en.eq(self.r_en),
+                req_w_en.eq(self.w_en),
+                req_w_data.eq(self.w_data),
+                replay.eq(0),
+        ]
+
+        tag_data = []
+        word_data = []
+        dirty = []
+        for way in range(self.ways):
+            # The MSB of each tag entry is its valid bit
+            tags = nm.Memory(width=tag_width + 1, depth=sets)
+            words = nm.Memory(width=32, depth=sets << self.offset_width)
+            tag_rp = m.submodules[f"tag_rp_{way}"] = tags.read_port()
+            tag_wp = m.submodules[f"tag_wp_{way}"] = tags.write_port()
+            word_rp = m.submodules[f"word_rp_{way}"] = words.read_port()
+            word_wp = m.submodules[f"word_wp_{way}"] = words.write_port(
+                    granularity=8)
+            tag_data.append(tag_rp.data)
+            word_data.append(word_rp.data)
+            dirty.append(nm.Array(
+                nm.Signal(name=f"dirty_{way}_{i}") for i in range(sets)))
+
+            refill_way = refilling & (victim == way)
+            m.d.comb += [
+                    tag_rp.addr.eq(self.addr[index_start:tag_start]),
+                    tag_wp.addr.eq(line_index),
+                    tag_wp.data.eq(nm.Cat(line_tag, nm.Const(1))),
+                    tag_wp.en.eq(
+                        refill_way & self.mem_ack & (offset == last_offset)),
+            ]
+
+            with m.If(writing_back):
+                m.d.comb += word_rp.addr.eq(nm.Cat(offset, line_index))
+            with m.Else():
+                m.d.comb += word_rp.addr.eq(self.addr[:tag_start])
+
+            with m.If(refill_way):
+                m.d.comb += [
+                        word_wp.addr.eq(nm.Cat(offset, line_index)),
+                        word_wp.data.eq(self.mem_r_data),
+                        word_wp.en.eq(nm.Mux(self.mem_ack, 0b1111, 0)),
+                ]
+            with m.Else():
+                m.d.comb += [
+                        word_wp.addr.eq(req_addr[:tag_start]),
+                        word_wp.data.eq(req_w_data),
+                        word_wp.en.eq(nm.Mux(
+                            store_hit & (hit_way == way),
+                            req_w_en,
+                            0)),
+                ]
+
+            with m.If(tag_rp.data == nm.Cat(
+                    req_addr[tag_start:],
+                    nm.Const(1))):
+                m.d.comb += [
+                        hit.eq(1),
+                        hit_way.eq(way),
+                        self.r_data.eq(word_rp.data),
+                ]
+
+        tag_data = nm.Array(tag_data)
+        word_data = nm.Array(word_data)
+        dirty = nm.Array(dirty)
+
+        m.d.comb += [
+                self.mem_addr.eq(nm.Cat(
+                    offset,
+                    line_index,
+                    nm.Mux(writing_back, evict_tag, line_tag))),
+                self.mem_w_data.eq(word_data[victim]),
+        ]
+
+        with m.FSM():
+            with m.State("LOOKUP"):
+                with m.If(replay):
+                    m.d.comb += self.valid.eq(0)
+                with m.Elif(~req_r_en & ~req_w_en.any()):
+                    m.d.comb += self.valid.eq(1)
+                with m.Elif(hit):
+                    m.d.comb += self.valid.eq(1)
+                    m.d.sync += self.hits.eq(self.hits + 1)
+                    with m.If(req_w_en.any()):
+                        m.d.comb += store_hit.eq(1)
+                        m.d.sync += [
+                                dirty[hit_way][req_addr[index_start:
+                                                        tag_start]].eq(1),
+                                replay.eq(self.r_en &
+                                          (self.addr == req_addr)),
+                        ]
+                with m.Else():
+                    victim_tag = tag_data[victim]
+                    m.d.sync += [
+                            line_index.eq(req_addr[index_start:tag_start]),
+                            line_tag.eq(req_addr[tag_start:]),
+                            evict_tag.eq(victim_tag[:tag_width]),
+                            offset.eq(0),
+                            evict_word_read.eq(0),
+                            self.misses.eq(self.misses + 1),
+                    ]
+                    with m.If(victim_tag[tag_width] &
+                              dirty[victim][req_addr[index_start:
+                                                     tag_start]]):
+                        m.next = "WRITEBACK"
+                    with m.Else():
+                        m.next = "REFILL"
+
+            with m.State("WRITEBACK"):
+                m.d.comb += writing_back.eq(1)
+                # The word is read from the victim way the cycle after its
+                # offset is presented
+                with m.If(~evict_word_read):
+                    m.d.sync += evict_word_read.eq(1)
+                with m.Else():
+                    m.d.comb += [
+                            self.mem_req.eq(1),
+                            self.mem_we.eq(1),
+                    ]
+                    with m.If(self.mem_ack):
+                        m.d.sync += [
+                                offset.eq(offset + 1),
+                                evict_word_read.eq(0),
+                        ]
+                        with m.If(offset == last_offset):
+                            m.d.sync += [
+                                    self.writebacks.eq(self.writebacks + 1),
+                                    dirty[victim][line_index].eq(0),
+                            ]
+                            m.next = "REFILL"
+
+            with m.State("REFILL"):
+                m.d.comb += [
+                        refilling.eq(1),
+                        self.mem_req.eq(1),
+                ]
+                with m.If(self.mem_ack):
+                    m.d.sync += offset.eq(offset + 1)
+                    with m.If(offset == last_offset):
+                        m.d.sync += victim.eq(nm.Mux(
+                                victim == self.ways - 1,
+                                0,
+                                victim + 1))
+                        m.next = "LOOKUP"
+
+        return m
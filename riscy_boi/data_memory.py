@@ -11,16 +11,40 @@ class AddressMode(enum.IntEnum):
     WORD = 0b10
 
 
+def extend(value, signed, desired_length=32):
+    """
+    Sign or zero extension
+
+    Args:
+        value (nm.Value): the value to be extended
+        signed (nm.Value): high to sign-extend, low to zero-extend
+        desired_length (int): the desired length of the extended output
+
+    Returns:
+        nm.hdl.ast.Cat: the extended value
+    """
+    return nm.Cat(
+            value,
+            nm.Repl(value[-1] & signed, desired_length - len(value)))
+
+
 class DataMemory(nm.Elaboratable):
     """
     Data memory interface
 
-    * byte_address (in): the byte address to read from the data memory
-    * address_mode (in): whether the output is byte, half-word or word
+    * byte_address (in): the byte address to read from or write to the data
+      memory
+    * address_mode (in): whether the access is byte, half-word or word
     * signed (in): whether to sign- or zero-extend output
+    * store (in): high to write store_value to the data memory
+    * store_value (in): the value to write, in its least significant bits
 
     * load_value (out): the value read from the data memory, sliced according
       to address mode
+    * dmem_w_data (out): store_value repeated across the word, so it is in
+      the byte lanes enabled by dmem_w_en
+    * dmem_w_en (out): the byte lanes of the word to write, each bit enabling
+      one byte
     """
 
     def __init__(self):
@@ -29,23 +53,49 @@ class DataMemory(nm.Elaboratable):
         self.address_mode = nm.Signal(AddressMode)
         self.signed = nm.Signal()
         self.dmem_r_data = nm.Signal(32)
+        self.store = nm.Signal()
+        self.store_value = nm.Signal(32)
 
         # Outputs
         self.dmem_r_addr = nm.Signal(30)
         self.load_value = nm.Signal(32)
+        self.dmem_w_addr = nm.Signal(30)
+        self.dmem_w_data = nm.Signal(32)
+        self.dmem_w_en = nm.Signal(4)
 
     def elaborate(self, _):
         m = nm.Module()
-        m.d.comb += self.dmem_r_addr.eq(self.byte_address[2:])
+        m.d.comb += [
+                self.dmem_r_addr.eq(self.byte_address[2:]),
+                self.dmem_w_addr.eq(self.byte_address[2:]),
+        ]
 
         with m.Switch(self.address_mode):
             with m.Case(AddressMode.BYTE):
-                m.d.comb += self.load_value.eq(self.dmem_r_data.word_select(
-                    self.byte_address[0:2], 8))
+                byte = self.dmem_r_data.word_select(self.byte_address[0:2], 8)
+                m.d.comb += [
+                        self.load_value.eq(extend(byte, self.signed)),
+                        self.dmem_w_data.eq(nm.Repl(self.store_value[:8], 4)),
+                        self.dmem_w_en.eq(
+                            nm.Mux(self.store, 0b0001, 0) <<
+                            self.byte_address[0:2]),
+                ]
             with m.Case(AddressMode.HALF):
-                m.d.comb += self.load_value.eq(self.dmem_r_data.word_select(
-                    self.byte_address[1], 16))
+                half = self.dmem_r_data.word_select(self.byte_address[1], 16)
+                m.d.comb += [
+                        self.load_value.eq(extend(half, self.signed)),
+                        self.dmem_w_data.eq(
+                            nm.Repl(self.store_value[:16], 2)),
+                        self.dmem_w_en.eq(nm.Mux(
+                            self.store,
+                            nm.Mux(self.byte_address[1], 0b1100, 0b0011),
+                            0)),
+                ]
             with m.Case(AddressMode.WORD):
-                m.d.comb += self.load_value.eq(self.dmem_r_data)
+                m.d.comb += [
+                        self.load_value.eq(self.dmem_r_data),
+                        self.dmem_w_data.eq(self.store_value),
+                        self.dmem_w_en.eq(nm.Mux(self.store, 0b1111, 0)),
+                ]
 
         return m
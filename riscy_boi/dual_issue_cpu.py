@@ -0,0 +1,187 @@
+# nmigen: UnusedElaboratable=no
+"""The dual-issue CPU"""
+import nmigen as nm
+
+from . import alu
+from . import branch_comparator
+from . import counters
+from . import cpu
+from . import instruction_decoder
+from . import program_counter
+from . import register_file
+
+# The events the dual-issue CPU can count
+EVENTS = (
+        counters.Event.TAKEN_JUMP,
+        counters.Event.LOAD,
+        counters.Event.STORE,
+        counters.Event.DUAL_ISSUE,
+        counters.Event.PAIR_MISALIGNED,
+        counters.Event.PAIR_CONTROL,
+        counters.Event.PAIR_STRUCTURAL,
+        counters.Event.PAIR_DEPENDENCY,
+)
+PAIRING_EVENTS = EVENTS[3:]
+
+
+class DualIssueCPU(cpu.BaseCPU):
+    """
+    Dual-issue rv32i CPU, or rv32im with a multiply and divide unit
+
+    Like the single-cycle CPU, but fetching the aligned doubleword holding
+    the instruction at the program counter, and executing the instruction
+    after it in the same cycle, in the second slot, when the pair follow the
+    pairing rules:
+
+    * the first instruction is in the lower half of the doubleword
+    * the first instruction is not a jump or branch, so the second is on the
+      path taken
+    * the second instruction only needs an ALU, or an ALU and a branch
+      comparator, so is not a jump, load, store, CSR read or multiply or
+      divide
+    * the second instruction does not read the first's destination register
+
+    Pairs may write the same register, the second's result being kept.
+
+    * imem_addr (out): the address of the doubleword to fetch, in bytes
+    * imem_data (in): the doubleword, the instruction at the lower address
+      in the lower word
+
+    * time_tick (in): high when the time counter should count. Defaults to
+      high, so time counts clock cycles.
+
+    imem_valid, dmem_r_en and dmem_valid are as in cpu.CPU.
+    """
+
+    def __init__(self, debug_reg=2, events=(), alu_unit=None,
+                 muldiv_unit=None):
+        """
+        Initialiser
+
+        Args:
+            debug_reg (int): the register to output at debug_out
+            events (list of counters.Event): the events counted by
+                hpmcounter3 onwards, from those in EVENTS
+            alu_unit (alu.ALU): the first slot's ALU, or None for one with the
+                default adder and shifter. While a multi-cycle ALU is busy,
+                the instructions are fetched again and not retired.
+            muldiv_unit (muldiv.MulDiv): the first slot's multiply and divide
+                unit, or None to leave out the M extension
+        """
+        unsupported = set(events) - set(EVENTS)
+        if unsupported:
+            raise ValueError(f"Events {unsupported} can not be counted")
+        super().__init__(
+                64,
+                debug_reg,
+                events,
+                alu_unit,
+                muldiv_unit,
+                # Created here, so benchmarks can read the pairing
+                # statistics. As in cpu.CPU, the first line of this file
+                # turns off the UnusedElaboratable warning for them.
+                counters.Counters(events, issue_width=2),
+                program_counter.ProgramCounter(),
+                register_file.RegisterFile(
+                    debug_reg=debug_reg,
+                    read_ports=4,
+                    write_ports=2))
+
+    def elaborate(self, _):
+        m = nm.Module()
+
+        stall = nm.Signal()
+        valid, imem_data = self.elaborate_fetch(m, stall)
+        slot = self.elaborate_first_slot(m, valid, stall)
+        idec = slot.idec
+        pc = self.program_counter
+        rf = self.register_file
+
+        alu_2 = m.submodules.alu_2 = alu.ALU(32)
+        cmp_2 = m.submodules.cmp_2 = branch_comparator.BranchComparator(32)
+        # Decodes M extension instructions too, so they are never paired
+        idec_2 = m.submodules.idec_2 = instruction_decoder.InstructionDecoder(
+                muldiv=self.muldiv_unit is not None)
+
+        taken = nm.Signal()
+        taken_2 = nm.Signal()
+        dual = nm.Signal()
+
+        aligned = valid & ~pc.pc[2]
+        sequential = ~idec.pc_load & ~idec.branch
+        alu_only = (
+                (idec_2.rd_mux_op == instruction_decoder.RdValue.ALU_OUTPUT) &
+                ~idec_2.pc_load &
+                ~idec_2.dmem_store)
+        # Branches compare both registers, and add to the program counter
+        operand = instruction_decoder.ALUOperand
+        alu_input = instruction_decoder.ALUInput
+        reads_1 = (
+                idec_2.branch |
+                (idec_2.alu_a_mux_op == operand.READ_DATA_1) |
+                (idec_2.alu_mux_op == alu_input.READ_DATA_1))
+        reads_2 = (
+                idec_2.branch |
+                (idec_2.alu_a_mux_op == operand.READ_DATA_2) |
+                (idec_2.alu_mux_op == alu_input.READ_DATA_2))
+        writes = idec.rf_write_enable & (idec.rf_write_select != 0)
+        dependent = writes & (
+                (reads_1 & (idec_2.rf_read_select_1 == idec.rf_write_select)) |
+                (reads_2 & (idec_2.rf_read_select_2 == idec.rf_write_select)))
+
+        m.d.comb += [
+                idec.instr.eq(nm.Mux(
+                    pc.pc[2],
+                    imem_data[32:],
+                    imem_data[:32])),
+                idec_2.instr.eq(imem_data[32:]),
+                dual.eq(aligned & sequential & alu_only & ~dependent),
+
+                rf.read_select_3.eq(idec_2.rf_read_select_1),
+                rf.read_select_4.eq(idec_2.rf_read_select_2),
+                rf.write_enable_2.eq(
+                    dual & idec_2.rf_write_enable & ~stall),
+                rf.write_select_2.eq(idec_2.rf_write_select),
+                rf.write_data_2.eq(alu_2.o),
+
+                alu_2.op.eq(idec_2.alu_op),
+
+                cmp_2.funct.eq(idec_2.branch_funct),
+                cmp_2.a.eq(rf.read_data_3),
+                cmp_2.b.eq(rf.read_data_4),
+
+                taken.eq(idec.pc_load | (idec.branch & slot.cmp.taken)),
+                taken_2.eq(dual & idec_2.branch & cmp_2.taken),
+                pc.load.eq(taken | stall | dual),
+                pc.input_address.eq(nm.Mux(
+                    stall,
+                    pc.pc,
+                    nm.Mux(
+                        taken_2,
+                        alu_2.o,
+                        nm.Mux(dual, pc.pc + 8, slot.alu.o)))),
+
+                slot.csrs.retire.eq(nm.Mux(stall, 0, 1 + dual)),
+        ]
+
+        # The pairing rule broken by cycles retiring one instruction
+        retire = ~stall
+        events = {
+                counters.Event.TAKEN_JUMP: (taken | taken_2) & retire,
+                counters.Event.LOAD: slot.load & retire,
+                counters.Event.STORE: idec.dmem_store & retire,
+                counters.Event.DUAL_ISSUE: retire & dual,
+                counters.Event.PAIR_MISALIGNED: retire & ~aligned,
+                counters.Event.PAIR_CONTROL: retire & aligned & ~sequential,
+                counters.Event.PAIR_STRUCTURAL: (
+                    retire & aligned & sequential & ~alu_only),
+                counters.Event.PAIR_DEPENDENCY: (
+                    retire & aligned & sequential & alu_only & dependent),
+        }
+        m.d.comb += slot.csrs.events.eq(
+                nm.Cat(events[e] for e in self.events))
+
+        self.elaborate_alu_inputs(m, idec_2, alu_2, pc.pc_inc,
+                                  rf.read_data_3, rf.read_data_4)
+
+        return m
@@ -134,12 +134,181 @@ class LoadFunct(enum.IntEnum):
     LHU = 0b101
 
 
+class StoreFunct(enum.IntEnum):
+    """Funct field values for store instructions"""
+    SB = 0b000
+    SH = 0b001
+    SW = 0b010
+
+
+class BranchFunct(enum.IntEnum):
+    """Funct field values for branch instructions"""
+    BEQ  = 0b000  # noqa: E221
+    BNE  = 0b001  # noqa: E221
+    BLT  = 0b100  # noqa: E221
+    BGE  = 0b101  # noqa: E221
+    BLTU = 0b110
+    BGEU = 0b111
+
+
+class SystemFunct(enum.IntEnum):
+    """Funct field values for SYSTEM instructions, PRIV being ECALL/EBREAK"""
+    PRIV   = 0b000  # noqa: E221
+    CSRRW  = 0b001  # noqa: E221
+    CSRRS  = 0b010  # noqa: E221
+    CSRRC  = 0b011  # noqa: E221
+    CSRRWI = 0b101
+    CSRRSI = 0b110
+    CSRRCI = 0b111
+
+
+class CSR(enum.IntEnum):
+    """Addresses of the counter CSRs, see the Zicntr and Zihpm extensions"""
+    CYCLE        = 0xc00  # noqa: E221
+    TIME         = 0xc01  # noqa: E221
+    INSTRET      = 0xc02  # noqa: E221
+    HPMCOUNTER3  = 0xc03  # noqa: E221
+    CYCLEH       = 0xc80  # noqa: E221
+    TIMEH        = 0xc81  # noqa: E221
+    INSTRETH     = 0xc82  # noqa: E221
+    HPMCOUNTER3H = 0xc83
+
+
+# The upper halves of 64-bit counters are read at this offset from the lower
+CSR_HIGH_HALF = CSR.CYCLEH - CSR.CYCLE
+
+
 class RightShiftType(enum.IntEnum):
     """Shift type for distinguishing between SRLI and SRAI instructions"""
     SRLI = 0b0000000
     SRAI = 0b0100000
 
 
+class IntRegRegFunct(enum.IntEnum):
+    """Funct field values for integer register-register instructions"""
+    ADD_OR_SUB = 0b000
+    SLL        = 0b001  # noqa: E221
+    SLT        = 0b010  # noqa: E221
+    SLTU       = 0b011  # noqa: E221
+    XOR        = 0b100  # noqa: E221
+    SRL_OR_SRA = 0b101
+    OR         = 0b110  # noqa: E221
+    AND        = 0b111  # noqa: E221
+
+
+class AddSubType(enum.IntEnum):
+    """Funct7 field values for distinguishing between ADD and SUB"""
+    ADD = 0b0000000
+    SUB = 0b0100000
+
+
+# The funct7 field value of the M extension's register-register instructions
+MULDIV_FUNCT7 = 0b0000001
+
+
+class MulDivFunct(enum.IntEnum):
+    """Funct field values for multiply and divide instructions"""
+    MUL    = 0b000  # noqa: E221
+    MULH   = 0b001  # noqa: E221
+    MULHSU = 0b010
+    MULHU  = 0b011  # noqa: E221
+    DIV    = 0b100  # noqa: E221
+    DIVU   = 0b101  # noqa: E221
+    REM    = 0b110  # noqa: E221
+    REMU   = 0b111  # noqa: E221
+
+
+class RType:
+    """R-type instruction format"""
+    FUNCT_START = 12
+    FUNCT_END = 15
+    FUNCT7_START = 25
+    FUNCT7_END = 32
+
+    OPCODE = Opcode.OP  # The only opcode in rv32i with R-type format
+
+    def __init__(self, instruction):
+        """
+        Initialiser
+
+        Args:
+            instruction (nm.Value): the instruction to decode
+        """
+        self.instr = instruction
+
+    @classmethod
+    def encode(cls, rs1_val, rs2_val, funct_val, funct7_val, rd_val):
+        """
+        Assembler method to encode an instruction
+
+        Args:
+            rs1_val (int): the source register 1 value
+            rs2_val (int): the source register 2 value
+            funct_val (IntRegRegFunct): the function field
+            funct7_val (int): the funct7 field, e.g. an AddSubType or
+                RightShiftType
+            rd_val (int): the destination register value
+
+        Returns:
+            int: the encoded instruction
+        """
+        return ((funct7_val << cls.FUNCT7_START) |
+                (rs2_val << RS2_START) |
+                (rs1_val << RS1_START) |
+                (funct_val << cls.FUNCT_START) |
+                (rd_val << RD_START) |
+                (cls.OPCODE << OPCODE_START))
+
+    def funct(self):
+        return self.instr[self.FUNCT_START:self.FUNCT_END]
+
+    def funct7(self):
+        return self.instr[self.FUNCT7_START:self.FUNCT7_END]
+
+
+class UType:
+    """U-type instruction format"""
+    IMM_START = 12
+    IMM_END = 32
+
+    def __init__(self, instruction):
+        """
+        Initialiser
+
+        Args:
+            instruction (nm.Value): the instruction to decode
+        """
+        self.instr = instruction
+
+    @classmethod
+    def encode(cls, imm_val, rd_val, opcode_val):
+        """
+        Assembler method to encode an instruction
+
+        Args:
+            imm_val (int): the upper 20 bits of the immediate value
+            rd_val (int): the destination register value
+            opcode_val (Opcode): the opcode, LUI or AUIPC
+
+        Returns:
+            int: the encoded instruction
+        """
+        return ((imm_val << cls.IMM_START) |
+                (rd_val << RD_START) |
+                (opcode_val << OPCODE_START))
+
+    def immediate(self):
+        """
+        Construct the immediate from the instruction
+
+        Returns:
+            nm.hdl.ast.Cat: the decoded immediate, with its lower 12 bits zero
+        """
+        return nm.Cat(
+                nm.Const(0, self.IMM_START),
+                self.instr[self.IMM_START:self.IMM_END])
+
+
 class IType:
     """I-type instruction format"""
     IMM_START = 20
@@ -197,13 +366,123 @@ class IType:
         """For SRLI and SRAI instructions, get the shift type"""
         return self.instr[self.IMM_START + 5:self.IMM_END]
 
+    def csr(self):
+        """For CSR instructions, get the unsigned CSR address"""
+        return self.instr[self.IMM_START:self.IMM_END]
+
+
+ImmediateField = collections.namedtuple(
+        "ImmediateField",
+        ["instr_start", "instr_end", "offset_start", "offset_end"],
+)
+
+
+def shuffle_immediate(offset, imm_fields):
+    """
+    Place the bits of an immediate at their positions in an instruction
+
+    Args:
+        offset (int): the immediate value
+        imm_fields (tuple): the ImmediateFields of the instruction format
+
+    Returns:
+        int: the immediate bits in their instruction positions
+    """
+
+    def shuffle_imm(result, field):
+        width = field.offset_end - field.offset_start
+        bits = (offset >> field.offset_start) & ((1 << width) - 1)
+        return result | (bits << field.instr_start)
+
+    return functools.reduce(shuffle_imm, imm_fields, 0)
+
+
+def unshuffle_immediate(instruction, imm_fields):
+    """
+    Construct the sign-extended immediate from its fields in an instruction
+
+    Note the least significant bit of the immediate is always zero.
+
+    Args:
+        instruction (nm.Value): the instruction to decode
+        imm_fields (tuple): the ImmediateFields of the instruction format
+
+    Returns:
+        nm.hdl.ast.Cat: the decoded immediate
+    """
+    sorted_imm_fields = sorted(
+            imm_fields,
+            key=lambda field: field.offset_start)
+
+    to_unshuffle = [instruction[field.instr_start:field.instr_end]
+                    for field in sorted_imm_fields]
+
+    unshuffled = nm.Cat(0, *to_unshuffle)
+    return sext(unshuffled)
+
+
+class SType:
+    """S-type instruction format"""
+    IMM_LOW_START = 7
+    IMM_LOW_END = 12
+    IMM_HIGH_START = 25
+    IMM_HIGH_END = 32
+    IMM_LOW_WIDTH = IMM_LOW_END - IMM_LOW_START
+    FUNCT_START = 12
+    FUNCT_END = 15
+
+    OPCODE = Opcode.STORE  # The only opcode in rv32i with S-type format
+
+    def __init__(self, instruction):
+        """
+        Initialiser
+
+        Args:
+            instruction (nm.Value): the instruction to decode
+        """
+        self.instr = instruction
+
+    @classmethod
+    def encode(cls, imm_val, rs1_val, rs2_val, funct_val):
+        """
+        Assembler method to encode an instruction
+
+        Args:
+            imm_val (int): the immediate value
+            rs1_val (int): the source register 1 value, the base address
+            rs2_val (int): the source register 2 value, the value to store
+            funct_val (StoreFunct): the function field
+
+        Returns:
+            int: the encoded instruction
+        """
+        imm_low = imm_val & ((1 << cls.IMM_LOW_WIDTH) - 1)
+        imm_high = imm_val >> cls.IMM_LOW_WIDTH
+        return ((imm_high << cls.IMM_HIGH_START) |
+                (rs2_val << RS2_START) |
+                (rs1_val << RS1_START) |
+                (funct_val << cls.FUNCT_START) |
+                (imm_low << cls.IMM_LOW_START) |
+                (cls.OPCODE << OPCODE_START))
+
+    def immediate(self):
+        """
+        Construct the sign-extended immediate from the instruction
+
+        Returns:
+            nm.hdl.ast.Cat: the decoded immediate
+        """
+        return sext(nm.Cat(
+                self.instr[self.IMM_LOW_START:self.IMM_LOW_END],
+                self.instr[self.IMM_HIGH_START:self.IMM_HIGH_END]))
+
+    def funct(self):
+        return self.instr[self.FUNCT_START:self.FUNCT_END]
+
 
 class JType:
     """J-type instruction format"""
-    ImmediateField = collections.namedtuple(
-            "ImmediateField",
-            ["instr_start", "instr_end", "offset_start", "offset_end"],
-    )
+    ImmediateField = ImmediateField
 
     IMM_FIELDS = (
             ImmediateField(
@@ -250,21 +529,76 @@ class JType:
         Returns:
             int: the encoded instruction
         """
+        return (shuffle_immediate(offset, cls.IMM_FIELDS) |
+                (rd_val << RD_START) |
+                (cls.OPCODE << OPCODE_START))
 
-        def shuffle_imm(result, field):
-            width = field.offset_end - field.offset_start
-            mask = int("1" * width, 2) << field.offset_start
+    def immediate(self):
+        """
+        Construct the sign-extended immediate from the instruction
 
-            return result | (
-                    (offset & mask) <<
-                    (field.instr_start - field.offset_start))
+        Returns:
+            nm.hdl.ast.Cat: the decoded immediate
+        """
+        return unshuffle_immediate(self.instr, self.IMM_FIELDS)
 
-        sorted_imm_fields = sorted(
-                cls.IMM_FIELDS,
-                key=lambda field: field.instr_start)
 
-        return (functools.reduce(shuffle_imm, sorted_imm_fields, 0) |
-                (rd_val << RD_START) |
+class BType:
+    """B-type instruction format"""
+    IMM_FIELDS = (
+            ImmediateField(
+                instr_start=7,
+                instr_end=8,
+                offset_start=11,
+                offset_end=12),
+            ImmediateField(
+                instr_start=8,
+                instr_end=12,
+                offset_start=1,
+                offset_end=5),
+            ImmediateField(
+                instr_start=25,
+                instr_end=31,
+                offset_start=5,
+                offset_end=11),
+            ImmediateField(
+                instr_start=31,
+                instr_end=32,
+                offset_start=12,
+                offset_end=13))
+
+    FUNCT_START = 12
+    FUNCT_END = 15
+
+    OPCODE = Opcode.BRANCH  # The only opcode in rv32i with B-type format
+
+    def __init__(self, instruction):
+        """
+        Initialiser
+
+        Args:
+            instruction (nm.Value): the instruction to decode
+        """
+        self.instr = instruction
+
+    @classmethod
+    def encode(cls, offset, rs1_val, rs2_val, funct_val):
+        """
+        Assembler method to encode an instruction
+
+        Args:
+            offset (int): the branch offset
+            rs1_val (int): the source register 1 value
+            rs2_val (int): the source register 2 value
+            funct_val (BranchFunct): the function field
+
+        Returns:
+            int: the encoded instruction
+        """
+        return (shuffle_immediate(offset, cls.IMM_FIELDS) |
+                (rs2_val << RS2_START) |
+                (rs1_val << RS1_START) |
+                (funct_val << cls.FUNCT_START) |
                 (cls.OPCODE << OPCODE_START))
 
     def immediate(self):
@@ -274,12 +608,7 @@ class JType:
         Returns:
             nm.hdl.ast.Cat: the decoded immediate
         """
-        sorted_imm_fields = sorted(
-                self.IMM_FIELDS,
-                key=lambda field: field.offset_start)
-
-        to_unshuffle = [self.instr[field.instr_start:field.instr_end]
-                        for field in sorted_imm_fields]
+        return unshuffle_immediate(self.instr, self.IMM_FIELDS)
 
-        unshuffled = nm.Cat(0, *to_unshuffle)
-        return sext(unshuffled)
+    def funct(self):
+        return self.instr[self.FUNCT_START:self.FUNCT_END]
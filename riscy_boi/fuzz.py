@@ -0,0 +1,417 @@
+"""
+Differential fuzzing of the single-cycle CPU against the ISA simulator
+
+Random programs of the instructions the decoder supports are run on the RTL
+of a cpu.CPU configuration and on the instruction-level simulator, in a pool
+of processes, and the register written by each instruction retired is
+compared. A failing program is minimised by removing instructions while it
+still fails, and the failures are written as JSON:
+
+    python -m riscy_boi.fuzz --programs 1000 --output failures.json
+
+Programs are generated from a seed, so a failure can be reproduced with
+--seed and --programs 1. Branches and jumps only go forwards, so every
+program reaches the jump to itself at its end.
+"""
+import argparse
+import collections
+import concurrent.futures
+import json
+import os
+import pathlib
+import random
+import sys
+
+import nmigen.sim
+
+from . import alu
+from . import benchmarks
+from . import counters
+from . import cpu
+from . import encoding
+from . import instruction_decoder
+from . import isa_simulator
+
+HALT = encoding.JType.encode(0, 0)
+SHIFTS = (alu.ALUOp.SLL, alu.ALUOp.SRL, alu.ALUOp.SRA)
+# Most cycles a single-cycle CPU takes for an instruction
+MAX_CPI = 40
+# Most instructions a branch or jump skips, so most of a program runs
+MAX_SKIP = 3
+# Operands are from the first few registers, so results are used again
+REGISTERS = 8
+# The simulations of each CPU configuration a process has run, reused for
+# the programs it runs after
+SIMULATIONS = {}
+
+# An instruction, with the index of the instruction it branches or jumps to,
+# or None. The offset is filled in by encode.
+Op = collections.namedtuple("Op", ["word", "target"])
+
+
+def instructions(muldiv=False):
+    """
+    The instructions programs are generated from
+
+    ECALL and EBREAK are left out, as the ISA simulator halts at them and
+    the CPUs do nothing.
+    """
+    return [instruction
+            for instruction in instruction_decoder.RV32I + (
+                instruction_decoder.RV32M if muldiv else ())
+            if instruction.name != "PRIV"]
+
+
+def counter_csrs(events=()):
+    """
+    The counter CSRs which read the same on a CPU and the ISA simulator
+
+    instret counts the instructions retired on both. The ISA simulator reads
+    the hpmcounters as zero, as does a CPU for those after the ones counting
+    its events.
+
+    Args:
+        events (list of counters.Event): the events the CPU counts
+
+    Returns:
+        list of int: the CSR addresses
+    """
+    csrs = [encoding.CSR.INSTRET, encoding.CSR.INSTRETH]
+    if len(events) < counters.MAX_EVENT_COUNTERS:
+        csrs.append(encoding.CSR.HPMCOUNTER3 + len(events))
+    return csrs
+
+
+def random_op(rng, instruction, index, length, csrs):
+    """
+    Generate an instruction with random operands
+
+    Args:
+        rng (random.Random): the random number generator
+        instruction (instruction_decoder.Instruction): the instruction
+        index (int): its index in the program
+        length (int): the index of the program's final jump to itself
+        csrs (list of int): the CSRs CSR instructions read, from
+            counter_csrs
+
+    Returns:
+        Op: the instruction
+    """
+    controls = instruction.controls
+    # Without a destination, the rd field is part of the immediate
+    rd = rng.randrange(REGISTERS if controls.rd_mux_op is not None else 32)
+    word = rng.getrandbits(32) & ~((1 << encoding.RS1_END) - 1)
+    word |= (instruction.opcode |
+             rd << encoding.RD_START |
+             rng.randrange(REGISTERS) << encoding.RS1_START)
+    if instruction.funct is not None:
+        word |= instruction.funct << encoding.IType.FUNCT_START
+    if controls.immediate in (None,
+                              instruction_decoder.Immediate.STYPE,
+                              instruction_decoder.Immediate.BTYPE):
+        word &= ~(((1 << encoding.RS2_END) - 1) ^
+                  ((1 << encoding.RS2_START) - 1))
+        word |= rng.randrange(REGISTERS) << encoding.RS2_START
+    # The funct7 field of register-register instructions and shifts by an
+    # immediate is zero where the decoder ignores it, as the ISA simulator
+    # decodes all of it
+    if controls.immediate is None or (
+            instruction.opcode == encoding.Opcode.OP_IMM and
+            controls.alu_op in SHIFTS):
+        funct7 = (instruction.funct7 or "0" * 7).replace("-", "0")
+        word &= (1 << encoding.RType.FUNCT7_START) - 1
+        word |= int(funct7, 2) << encoding.RType.FUNCT7_START
+
+    if instruction.opcode == encoding.Opcode.SYSTEM:
+        word &= (1 << encoding.IType.IMM_START) - 1
+        word |= rng.choice(csrs) << encoding.IType.IMM_START
+    if controls.immediate in (instruction_decoder.Immediate.BTYPE,
+                              instruction_decoder.Immediate.JTYPE):
+        return Op(
+                word,
+                rng.randint(index + 1, min(length, index + MAX_SKIP + 1)))
+    return Op(word, None)
+
+
+def generate(rng, length, muldiv=False, events=()):
+    """
+    Generate a random program
+
+    Args:
+        rng (random.Random): the random number generator
+        length (int): the number of instructions before the final jump to
+            itself
+        muldiv (bool): whether to use the M extension's instructions
+        events (list of counters.Event): the events the CPU counts
+
+    Returns:
+        list of Op: the program
+    """
+    choices = instructions(muldiv)
+    csrs = counter_csrs(events)
+    ops = [random_op(rng, rng.choice(choices), index, length, csrs)
+           for index in range(length)]
+    return ops + [Op(HALT, None)]
+
+
+def encode(ops):
+    """The instruction words of a program, with its branch offsets"""
+    words = []
+    for index, (word, target) in enumerate(ops):
+        if target is not None:
+            fields = (encoding.JType.IMM_FIELDS
+                      if word & 0x7f == encoding.Opcode.JAL
+                      else encoding.BType.IMM_FIELDS)
+            word &= ~encoding.shuffle_immediate(-1, fields)
+            word |= encoding.shuffle_immediate((target - index) * 4, fields)
+        words.append(word & isa_simulator.MASK)
+    return words
+
+
+def remove(ops, start, stop):
+    """
+    Remove instructions from a program
+
+    Branches and jumps to a removed instruction go to the one after it, so
+    they still go forwards.
+    """
+
+    def moved(target):
+        if target is None or target < start:
+            return target
+        return max(start, target - (stop - start))
+
+    return [Op(word, moved(target))
+            for word, target in ops[:start] + ops[stop:]]
+
+
+def minimise(ops, fails):
+    """
+    Remove instructions from a failing program while it still fails
+
+    Runs of instructions are removed, halving the length of the runs tried
+    until single instructions are. The final jump to itself is kept.
+
+    Args:
+        ops (list of Op): the failing program
+        fails (function): whether a program fails
+
+    Returns:
+        list of Op: the smaller program
+    """
+    run = max(1, (len(ops) - 1) // 2)
+    while True:
+        start = 0
+        while start < len(ops) - 1:
+            candidate = remove(ops, start, min(start + run, len(ops) - 1))
+            if fails(candidate):
+                ops = candidate
+            else:
+                start += run
+        if run == 1:
+            return ops
+        run //= 2
+
+
+def reference_writes(program, data):
+    """
+    The register writes of a program on the ISA simulator
+
+    Returns:
+        list of tuple: the address, register and value of each write, except
+            to x0
+    """
+    golden = isa_simulator.ISASimulator(
+            program,
+            data,
+            dmem_bytes=benchmarks.DMEM_WORDS * 4)
+    writes = []
+    while not golden.halted:
+        pc = golden.pc
+        golden.step()
+        instruction = instruction_decoder.lookup(program[pc >> 2], True)
+        rd = isa_simulator.field(
+                program[pc >> 2],
+                encoding.RD_START,
+                encoding.RD_END)
+        if instruction.controls.rd_mux_op is not None and rd:
+            writes.append((pc, rd, golden.registers[rd]))
+    return writes
+
+
+def rtl_writes(cpu_name, program, data, max_cycles, engine="pysim"):
+    """
+    The register writes of a program on a CPU's RTL
+
+    The CPU runs until it fetches the final jump to itself twice in a row.
+
+    Args:
+        cpu_name (str): a key of benchmarks.CPUS, for a cpu.CPU
+        program (list of int): the instruction memory words
+        data (list of int): the data memory words
+        max_cycles (int): the number of cycles after which the program is
+            considered to have hung
+        engine: the nmigen simulation engine
+
+    Returns:
+        list of tuple: the register and value of each write, except to x0
+    """
+    sim = benchmarks.simulation(cpu_name, engine, SIMULATIONS)
+    cpu_inst = sim.cpu
+    rf = cpu_inst.register_file
+    halt_address = (len(program) - 1) * isa_simulator.INSTRUCTION_BYTES
+    writes = []
+
+    def process():
+        halted = 0
+        for _ in range(max_cycles):
+            yield nmigen.sim.Settle()
+            if (yield rf.write_enable) and (yield rf.write_select):
+                writes.append((
+                        (yield rf.write_select),
+                        (yield rf.write_data)))
+            halted = halted + 1 if (
+                    yield cpu_inst.imem_addr) == halt_address else 0
+            if halted == 2:
+                return
+            yield
+        raise RuntimeError(f"The program did not halt in {max_cycles} cycles")
+
+    sim.simulator.run(process, benchmarks.memory_contents(sim, program, data))
+    return writes
+
+
+def compare(cpu_name, ops, data, engine="pysim"):
+    """
+    Run a program on a CPU and the ISA simulator, comparing register writes
+
+    Returns:
+        str: the first difference, or None if there are none
+    """
+    program = encode(ops)
+    expected = reference_writes(program, data)
+    try:
+        actual = rtl_writes(
+                cpu_name,
+                program,
+                data,
+                MAX_CPI * len(program),
+                engine)
+    except RuntimeError as error:
+        return str(error)
+    for (pc, rd, value), write in zip(expected, actual):
+        if write != (rd, value):
+            name = instruction_decoder.lookup(program[pc >> 2], True).name
+            return (f"{name} {program[pc >> 2]:#010x} at {pc:#x} wrote "
+                    f"x{write[0]} = {write[1]:#x}, not x{rd} = {value:#x}")
+    if len(actual) != len(expected):
+        return f"{len(actual)} registers written, not {len(expected)}"
+    return None
+
+
+def fuzz_one(job):
+    """
+    Generate a program from a seed, run it, and minimise it if it fails
+
+    Args:
+        job (tuple): the CPU name, the seed, the program length and the
+            engine name
+
+    Returns:
+        dict: the seed, and if the program failed, the difference and the
+            minimised program
+    """
+    cpu_name, seed, length, engine_name = job
+    engine = "pysim"
+    if engine_name == "cxxrtl":
+        # pylint: disable=import-outside-toplevel
+        from . import compiled_sim
+        engine = compiled_sim.CXXRTLEngine
+
+    rng = random.Random(seed)
+    events = benchmarks.simulation(
+            cpu_name,
+            engine,
+            SIMULATIONS).cpu.counters.event_list
+    ops = generate(rng, length, benchmarks.CPUS[cpu_name].muldiv, events)
+    data = [rng.getrandbits(32) for _ in range(benchmarks.DMEM_WORDS)]
+    difference = compare(cpu_name, ops, data, engine)
+    if difference is None:
+        return {"seed": seed}
+
+    ops = minimise(
+            ops,
+            lambda candidate: compare(cpu_name, candidate, data, engine)
+            is not None)
+    return {
+            "seed": seed,
+            "difference": compare(cpu_name, ops, data, engine),
+            "program": [f"{word:#010x}" for word in encode(ops)],
+    }
+
+
+def main():
+    """Fuzz a single-cycle CPU against the ISA simulator"""
+    cpu_names = sorted(name for name, configuration in benchmarks.CPUS.items()
+                       if configuration.cpu_class is cpu.CPU)
+    parser = argparse.ArgumentParser(description=main.__doc__)
+    parser.add_argument(
+            "--cpu",
+            choices=cpu_names,
+            default="single_cycle",
+            help="CPU configuration to fuzz (default: single_cycle)")
+    parser.add_argument(
+            "--programs",
+            type=int,
+            default=1000,
+            help="number of programs to run (default: 1000)")
+    parser.add_argument(
+            "--length",
+            type=int,
+            default=50,
+            help="instructions per program (default: 50)")
+    parser.add_argument(
+            "--seed",
+            type=int,
+            default=0,
+            help="seed of the first program, the others counting up from "
+                 "it (default: 0)")
+    parser.add_argument(
+            "--engine",
+            choices=["pysim", "cxxrtl"],
+            default="pysim",
+            help="simulation engine (default: pysim)")
+    parser.add_argument(
+            "--jobs",
+            type=int,
+            default=os.cpu_count(),
+            help=f"processes to run (default: {os.cpu_count()})")
+    parser.add_argument(
+            "--output",
+            type=pathlib.Path,
+            default=pathlib.Path("fuzz_failures.json"),
+            help="JSON file to write failing programs to "
+                 "(default: fuzz_failures.json)")
+    args = parser.parse_args()
+    if args.length >= benchmarks.IMEM_DEPTH:
+        parser.error(
+                f"programs must be shorter than {benchmarks.IMEM_DEPTH} "
+                "instructions")
+
+    jobs = [(args.cpu, seed, args.length, args.engine)
+            for seed in range(args.seed, args.seed + args.programs)]
+    failures = []
+    with concurrent.futures.ProcessPoolExecutor(args.jobs) as pool:
+        for result in pool.map(fuzz_one, jobs, chunksize=8):
+            if "difference" in result:
+                failures.append(result)
+                print(f"seed {result['seed']}: {result['difference']}")
+
+    args.output.write_text(json.dumps(failures, indent=4) + "\n")
+    print(f"{len(failures)} of {args.programs} programs failed on {args.cpu}")
+    if failures:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
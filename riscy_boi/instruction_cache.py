@@ -0,0 +1,151 @@
+"""Instruction cache"""
+import nmigen as nm
+from nmigen.utils import log2_int
+
+
+class InstructionCache(nm.Elaboratable):
+    # pylint: disable=too-many-instance-attributes
+    """
+    Set-associative instruction cache
+
+    The cache is read like a synchronous memory: the instruction at the byte
+    address presented at addr is output at data the following cycle, if
+    valid is high. If valid is low, the instruction missed and the same
+    address must be presented again until valid is high. Missing lines are
+    read from the backing store one word at a time, and replace a way chosen
+    round-robin.
+
+    * addr (in): the byte address of the instruction to fetch
+    * data (out): the instruction at the address presented last cycle
+    * valid (out): high if data holds the instruction
+
+    * mem_addr (out): the word address to read from the backing store
+    * mem_req (out): high to request a read from the backing store
+    * mem_data (in): the word read from the backing store
+    * mem_ack (in): high when mem_data holds the word at mem_addr
+
+    * hits (out): count of fetches that hit in the cache
+    * misses (out): count of lines read from the backing store
+    """
+
+    def __init__(self, lines=64, ways=1, line_words=4):
+        """
+        Initialiser
+
+        Args:
+            lines (int): the total number of lines in the cache
+            ways (int): the associativity of the cache
+            line_words (int): the number of 32-bit words per line
+        """
+        if lines % ways:
+            raise ValueError(f"lines ({lines}) must be a multiple of ways")
+        self.ways = ways
+        self.offset_width = log2_int(line_words)
+        self.index_width = log2_int(lines // ways)
+
+        self.addr = nm.Signal(32)
+        self.data = nm.Signal(32)
+        self.valid = nm.Signal()
+
+        self.mem_addr = nm.Signal(30)
+        self.mem_req = nm.Signal()
+        self.mem_data = nm.Signal(32)
+        self.mem_ack = nm.Signal()
+
+        self.hits = nm.Signal(32)
+        self.misses = nm.Signal(32)
+
+    def elaborate(self, _):
+        m = nm.Module()
+
+        offset_start = 2
+        index_start = offset_start + self.offset_width
+        tag_start = index_start + self.index_width
+        tag_width = 32 - tag_start
+        sets = 2**self.index_width
+
+        # No address has been presented in the first cycle after reset
+        started = nm.Signal()
+        req_addr = nm.Signal(32)
+        refill_addr = nm.Signal(32)
+        refill_offset = nm.Signal(self.offset_width)
+        victim = nm.Signal(range(self.ways))
+        hit = nm.Signal()
+        refilling = nm.Signal()
+
+        m.d.sync += [
+                started.eq(1),
+                req_addr.eq(self.addr),
+        ]
+        m.d.comb += self.mem_addr.eq(nm.Cat(
+                refill_offset,
+                refill_addr[index_start:]))
+
+        hit_ways = []
+        for way in range(self.ways):
+            # The MSB of each tag entry is its valid bit
+            tags = nm.Memory(width=tag_width + 1, depth=sets)
+            words = nm.Memory(width=32, depth=sets << self.offset_width)
+            tag_rp = m.submodules[f"tag_rp_{way}"] = tags.read_port()
+            tag_wp = m.submodules[f"tag_wp_{way}"] = tags.write_port()
+            word_rp = m.submodules[f"word_rp_{way}"] = words.read_port()
+            word_wp = m.submodules[f"word_wp_{way}"] = words.write_port()
+
+            way_hit = nm.Signal(name=f"hit_{way}")
+            hit_ways.append(way_hit)
+            refill_way = refilling & (victim == way)
+            m.d.comb += [
+                    tag_rp.addr.eq(self.addr[index_start:tag_start]),
+                    word_rp.addr.eq(self.addr[offset_start:tag_start]),
+                    way_hit.eq(tag_rp.data == nm.Cat(
+                        req_addr[tag_start:],
+                        nm.Const(1))),
+
+                    tag_wp.addr.eq(refill_addr[index_start:tag_start]),
+                    tag_wp.data.eq(nm.Cat(
+                        refill_addr[tag_start:],
+                        nm.Const(1))),
+                    tag_wp.en.eq(
+                        refill_way &
+                        self.mem_ack &
+                        (refill_offset == 2**self.offset_width - 1)),
+
+                    word_wp.addr.eq(nm.Cat(
+                        refill_offset,
+                        refill_addr[index_start:tag_start])),
+                    word_wp.data.eq(self.mem_data),
+                    word_wp.en.eq(refill_way & self.mem_ack),
+            ]
+            with m.If(way_hit):
+                m.d.comb += self.data.eq(word_rp.data)
+
+        m.d.comb += hit.eq(nm.Cat(*hit_ways).any())
+
+        with m.FSM():
+            with m.State("LOOKUP"):
+                m.d.comb += self.valid.eq(hit)
+                with m.If(hit):
+                    m.d.sync += self.hits.eq(self.hits + 1)
+                with m.Elif(started):
+                    m.d.sync += [
+                            refill_addr.eq(req_addr),
+                            refill_offset.eq(0),
+                            self.misses.eq(self.misses + 1),
+                    ]
+                    m.next = "REFILL"
+
+            with m.State("REFILL"):
+                m.d.comb += [
+                        refilling.eq(1),
+                        self.mem_req.eq(1),
+                ]
+                with m.If(self.mem_ack):
+                    m.d.sync += refill_offset.eq(refill_offset + 1)
+                    with m.If(refill_offset == 2**self.offset_width - 1):
+                        m.d.sync += victim.eq(nm.Mux(
+                                victim == self.ways - 1,
+                                0,
+                                victim + 1))
+                        m.next = "LOOKUP"
+
+        return m
@@ -1,6 +1,20 @@
-"""Instruction decoder"""
+"""
+Instruction decoder
+
+The instructions are described once, as data: each Instruction has the
+opcode, funct and funct7 fields it matches and the Controls it decodes to.
+From the table, InstructionDecoder generates flat decode logic, a match
+signal per instruction with each output an OR of matches, and lookup finds
+an instruction in software from a precomputed table.
+
+Adding an instruction whose datapath exists is adding a row to RV32I or
+RV32M.
+"""
+import collections
 import enum
-
+import functools
+import itertools
+import operator
 
 import nmigen as nm
 
@@ -14,27 +28,305 @@ class RdValue(enum.IntEnum):
     ALU_OUTPUT = 0
     PC_INC = 1
     LOAD = 2
+    CSR = 3
+    MULDIV = 4
 
 
 class ALUInput(enum.IntEnum):
     """MUX opcodes for the value inputted to the ALU"""
     READ_DATA_1 = 0
     PC = 1
+    READ_DATA_2 = 2
+
+
+class ALUOperand(enum.IntEnum):
+    """MUX opcodes for the value inputted to the ALU's a operand"""
+    IMMEDIATE = 0
+    READ_DATA_1 = 1
+    READ_DATA_2 = 2
+
+
+class Immediate(enum.Enum):
+    """The immediate formats, constructing alu_imm from the instruction"""
+    ITYPE = "itype"
+    STYPE = "stype"
+    BTYPE = "btype"
+    JTYPE = "jtype"
+
+
+Controls = collections.namedtuple(
+        "Controls",
+        ["immediate", "alu_op", "alu_mux_op", "alu_a_mux_op", "rd_mux_op",
+         "pc_load", "branch", "dmem_store"],
+        defaults=[None, alu.ALUOp.ADD, ALUInput.READ_DATA_1,
+                  ALUOperand.IMMEDIATE, None, False, False, False])
+Controls.__doc__ = """
+The decoder outputs of an instruction
+
+An immediate of None is zero, and an rd_mux_op of None does not write the
+destination register.
+"""
+
+Instruction = collections.namedtuple(
+        "Instruction",
+        ["name", "opcode", "funct", "funct7", "controls"])
+Instruction.__doc__ = """
+An instruction, and the fields it matches
+
+The funct field is an int, and the funct7 field a pattern of 0, 1 and -
+(don't care) bits, most significant first. Either may be None to match any
+value.
+"""
+
+# The bits of an instruction the table matches, least significant first
+KEY_FIELDS = (
+        (encoding.OPCODE_START, encoding.OPCODE_END),
+        (encoding.IType.FUNCT_START, encoding.IType.FUNCT_END),
+        (encoding.RType.FUNCT7_START, encoding.RType.FUNCT7_END),
+)
+KEY_WIDTH = sum(end - start for start, end in KEY_FIELDS)
+
+# Shifts take the whole I-type immediate too, the ALU only shifting by the
+# lower five bits of a
+_REG_IMM = Controls(immediate=Immediate.ITYPE, rd_mux_op=RdValue.ALU_OUTPUT)
+# The ALU shifts b by a, so rs1 is input to b
+_REG_REG = Controls(
+        alu_a_mux_op=ALUOperand.READ_DATA_2,
+        rd_mux_op=RdValue.ALU_OUTPUT)
+# Only bit 30 of funct7 distinguishes ADD/SUB and SRL/SRA
+_BIT_30_CLEAR = "-0-----"
+_BIT_30_SET = "-1-----"
+
+RV32I = (
+        Instruction(
+            "ADDI", encoding.Opcode.OP_IMM, encoding.IntRegImmFunct.ADDI, None,
+            _REG_IMM),
+        Instruction(
+            "XORI", encoding.Opcode.OP_IMM, encoding.IntRegImmFunct.XORI, None,
+            _REG_IMM._replace(alu_op=alu.ALUOp.XOR)),
+        Instruction(
+            "ORI", encoding.Opcode.OP_IMM, encoding.IntRegImmFunct.ORI, None,
+            _REG_IMM._replace(alu_op=alu.ALUOp.OR)),
+        Instruction(
+            "ANDI", encoding.Opcode.OP_IMM, encoding.IntRegImmFunct.ANDI, None,
+            _REG_IMM._replace(alu_op=alu.ALUOp.AND)),
+        Instruction(
+            "SLLI", encoding.Opcode.OP_IMM, encoding.IntRegImmFunct.SLLI, None,
+            _REG_IMM._replace(alu_op=alu.ALUOp.SLL)),
+        Instruction(
+            "SRLI", encoding.Opcode.OP_IMM,
+            encoding.IntRegImmFunct.SRLI_OR_SRAI, _BIT_30_CLEAR,
+            _REG_IMM._replace(alu_op=alu.ALUOp.SRL)),
+        Instruction(
+            "SRAI", encoding.Opcode.OP_IMM,
+            encoding.IntRegImmFunct.SRLI_OR_SRAI, _BIT_30_SET,
+            _REG_IMM._replace(alu_op=alu.ALUOp.SRA)),
+
+        Instruction(
+            "ADD", encoding.Opcode.OP, encoding.IntRegRegFunct.ADD_OR_SUB,
+            _BIT_30_CLEAR, _REG_REG),
+        # The ALU subtracts b from a
+        Instruction(
+            "SUB", encoding.Opcode.OP, encoding.IntRegRegFunct.ADD_OR_SUB,
+            _BIT_30_SET, _REG_REG._replace(
+                alu_op=alu.ALUOp.SUB,
+                alu_mux_op=ALUInput.READ_DATA_2,
+                alu_a_mux_op=ALUOperand.READ_DATA_1)),
+        Instruction(
+            "SLL", encoding.Opcode.OP, encoding.IntRegRegFunct.SLL, None,
+            _REG_REG._replace(alu_op=alu.ALUOp.SLL)),
+        Instruction(
+            "XOR", encoding.Opcode.OP, encoding.IntRegRegFunct.XOR, None,
+            _REG_REG._replace(alu_op=alu.ALUOp.XOR)),
+        Instruction(
+            "SRL", encoding.Opcode.OP, encoding.IntRegRegFunct.SRL_OR_SRA,
+            _BIT_30_CLEAR, _REG_REG._replace(alu_op=alu.ALUOp.SRL)),
+        Instruction(
+            "SRA", encoding.Opcode.OP, encoding.IntRegRegFunct.SRL_OR_SRA,
+            _BIT_30_SET, _REG_REG._replace(alu_op=alu.ALUOp.SRA)),
+        Instruction(
+            "OR", encoding.Opcode.OP, encoding.IntRegRegFunct.OR, None,
+            _REG_REG._replace(alu_op=alu.ALUOp.OR)),
+        Instruction(
+            "AND", encoding.Opcode.OP, encoding.IntRegRegFunct.AND, None,
+            _REG_REG._replace(alu_op=alu.ALUOp.AND)),
+
+        Instruction(
+            "JAL", encoding.Opcode.JAL, None, None,
+            Controls(
+                immediate=Immediate.JTYPE,
+                alu_mux_op=ALUInput.PC,
+                rd_mux_op=RdValue.PC_INC,
+                pc_load=True)),
+        *(Instruction(
+            funct.name, encoding.Opcode.BRANCH, funct, None,
+            Controls(
+                immediate=Immediate.BTYPE,
+                alu_mux_op=ALUInput.PC,
+                branch=True))
+          for funct in encoding.BranchFunct),
+
+        *(Instruction(
+            funct.name, encoding.Opcode.LOAD, funct, None,
+            Controls(immediate=Immediate.ITYPE, rd_mux_op=RdValue.LOAD))
+          for funct in encoding.LoadFunct),
+        *(Instruction(
+            funct.name, encoding.Opcode.STORE, funct, None,
+            Controls(immediate=Immediate.STYPE, dmem_store=True))
+          for funct in encoding.StoreFunct),
+
+        # ECALL and EBREAK are not supported, and do nothing
+        Instruction(
+            "PRIV", encoding.Opcode.SYSTEM, encoding.SystemFunct.PRIV, None,
+            Controls()),
+        *(Instruction(
+            funct.name, encoding.Opcode.SYSTEM, funct, None,
+            Controls(rd_mux_op=RdValue.CSR))
+          for funct in encoding.SystemFunct
+          if funct != encoding.SystemFunct.PRIV),
+)
+
+# Taking precedence over the RV32I register-register instructions they
+# overlap, whose funct7 patterns only look at bit 30
+RV32M = tuple(
+        Instruction(
+            funct.name, encoding.Opcode.OP, funct,
+            f"{encoding.MULDIV_FUNCT7:07b}",
+            _REG_REG._replace(rd_mux_op=RdValue.MULDIV))
+        for funct in encoding.MulDivFunct)
+
+
+def pattern(instruction):
+    """
+    The pattern of key bits an instruction matches
+
+    Returns:
+        str: the pattern of 0, 1 and - bits, most significant first, matching
+            the funct7, funct and opcode fields
+    """
+    funct7 = instruction.funct7 or "-" * 7
+    funct = "---" if instruction.funct is None else f"{instruction.funct:03b}"
+    return f"{funct7}{funct}{instruction.opcode:07b}"
+
+
+def key(instruction):
+    """The key bits of an instruction, as an int"""
+    result = 0
+    offset = 0
+    for start, end in KEY_FIELDS:
+        width = end - start
+        result |= ((instruction >> start) & ((1 << width) - 1)) << offset
+        offset += width
+    return result
+
+
+def _covers(general, specific):
+    """Whether every key matching one pattern matches another"""
+    return all(g in ("-", s) for g, s in zip(general, specific))
+
+
+def _overlap(pattern_1, pattern_2):
+    """Whether some key matches both patterns"""
+    return all("-" in (a, b) or a == b for a, b in zip(pattern_1, pattern_2))
+
+
+def precedence(instructions):
+    """
+    Find the instructions which take precedence over each instruction
+
+    Where two instructions' patterns overlap, one pattern must cover the
+    other, and the more specific instruction takes precedence.
+
+    Args:
+        instructions (tuple of Instruction): the instructions to decode
+
+    Returns:
+        dict: the instructions taking precedence, by instruction
+
+    Raises:
+        ValueError: if the patterns of two instructions overlap, but neither
+            covers the other
+    """
+    overriding = {instruction: [] for instruction in instructions}
+    for first, second in itertools.combinations(instructions, 2):
+        first_pattern = pattern(first)
+        second_pattern = pattern(second)
+        if not _overlap(first_pattern, second_pattern):
+            continue
+        if _covers(first_pattern, second_pattern):
+            overriding[first].append(second)
+        elif _covers(second_pattern, first_pattern):
+            overriding[second].append(first)
+        else:
+            raise ValueError(
+                    f"{first.name} and {second.name} are ambiguous")
+    return overriding
+
+
+@functools.lru_cache(maxsize=None)
+def lookup_table(instructions):
+    """
+    The instruction matching each key, for decoding in software
+
+    Args:
+        instructions (tuple of Instruction): the instructions to decode
+
+    Returns:
+        list: the Instruction, or None if illegal, indexed by key
+    """
+    table = [None] * (1 << KEY_WIDTH)
+    overriding = precedence(instructions)
+    # Instructions are written before those taking precedence over them
+    for instruction in sorted(instructions,
+                              key=lambda i: len(overriding[i]),
+                              reverse=True):
+        bits = pattern(instruction)[::-1]
+        fixed = int(bits[::-1].replace("-", "0"), 2)
+        free = [bit for bit, value in enumerate(bits) if value == "-"]
+        for values in itertools.product((0, 1), repeat=len(free)):
+            index = fixed
+            for bit, value in zip(free, values):
+                index |= value << bit
+            table[index] = instruction
+    return table
+
+
+def lookup(instruction, muldiv=False):
+    """
+    Decode an instruction in software
+
+    Args:
+        instruction (int): the instruction
+        muldiv (bool): whether to decode the M extension's instructions
+
+    Returns:
+        Instruction: the matching instruction, or None if it is illegal
+    """
+    return lookup_table(RV32I + (RV32M if muldiv else ()))[key(instruction)]
 
 
 class InstructionDecoder(nm.Elaboratable):
+    # pylint: disable=too-many-instance-attributes
     """
     Instruction decoder
 
+    The outputs for illegal instructions are undefined. The lowest two bits
+    of the opcode are not decoded, so the all-zero word decodes as a load.
+
     * instr (in): instruction to decode
 
     * pc_load (out): load signal to program counter
+    * branch (out): high for conditional branches, which load the program
+      counter if the branch condition holds
+    * branch_funct (out): the branch condition to test
 
     * alu_op (out): ALU operation to perform
     * alu_imm (out): the value to input to the ALU, constructed from the
       immediate value in the instruction
     * alu_mux_op (out): multiplexor operator defining what value is the first
       input to the ALU
+    * alu_a_mux_op (out): multiplexor operator defining whether alu_imm or a
+      register is input to the ALU's a operand
 
     * rf_write_enable (out): register file's write_enable input
     * rf_write_select (out): register files' write_select input
@@ -43,16 +335,34 @@ class InstructionDecoder(nm.Elaboratable):
     * rd_mux_op (out): multiplexor operation defining what value is written to
       the destination register
 
-    * dmem_address_mode (out): address mode for data memory reads
+    * dmem_address_mode (out): address mode for data memory reads and writes
     * dmem_signed (out): whether input to data memory should be sign-extended
+    * dmem_store (out): high to write register rs2 to data memory
+
+    * csr (out): the address of the CSR read into the destination register.
+      CSRs are read only, so CSR instructions never write them.
+
+    * muldiv_op (out): the multiply or divide operation of M extension
+      instructions, whose result is written with RdValue.MULDIV
     """
 
-    def __init__(self, num_registers=32):
+    def __init__(self, num_registers=32, muldiv=False):
+        """
+        Initialiser
+
+        Args:
+            num_registers (int): the number of registers
+            muldiv (bool): whether to decode the M extension's instructions
+        """
+        self.muldiv = muldiv
+        self.instructions = RV32I + (RV32M if muldiv else ())
         self.instr_width = 32
         self.instr = nm.Signal(self.instr_width)
 
         self.pc_load = nm.Signal()
-        self.alu_op = nm.Signal()
+        self.branch = nm.Signal()
+        self.branch_funct = nm.Signal(encoding.BranchFunct)
+        self.alu_op = nm.Signal(alu.ALUOp)
         self.alu_imm = nm.Signal(self.instr_width)
         self.rf_write_enable = nm.Signal()
         self.rf_write_select = nm.Signal(range(num_registers))
@@ -60,109 +370,110 @@ class InstructionDecoder(nm.Elaboratable):
         self.rf_read_select_2 = nm.Signal(range(num_registers))
         self.rd_mux_op = nm.Signal(RdValue)
         self.alu_mux_op = nm.Signal(ALUInput)
+        self.alu_a_mux_op = nm.Signal(ALUOperand)
         self.dmem_address_mode = nm.Signal(data_memory.AddressMode)
         self.dmem_signed = nm.Signal()
+        self.dmem_store = nm.Signal()
+        self.csr = nm.Signal(12)
+        self.muldiv_op = nm.Signal(encoding.MulDivFunct)
 
     def elaborate(self, _):
         m = nm.Module()
 
-        opcode = encoding.opcode(self.instr)
-        m.d.comb += self.rf_write_select.eq(encoding.rd(self.instr))
-        m.d.comb += self.rf_read_select_1.eq(encoding.rs1(self.instr))
-        m.d.comb += self.rf_read_select_2.eq(encoding.rs2(self.instr))
-
-        with m.Switch(opcode):
-            with m.Case(encoding.Opcode.OP_IMM):
-                m.d.comb += self.rf_write_enable.eq(1)
-
-                itype = encoding.IType(self.instr)
-                with m.Switch(itype.funct()):
-                    m.d.comb += [
-                            self.pc_load.eq(0),
-                            self.rd_mux_op.eq(RdValue.ALU_OUTPUT),
-                            self.alu_mux_op.eq(ALUInput.READ_DATA_1),
-                    ]
-
-                    with m.Case(encoding.IntRegImmFunct.ADDI):
-                        m.d.comb += [
-                                self.alu_op.eq(alu.ALUOp.ADD),
-                                self.alu_imm.eq(itype.immediate()),
-                        ]
-
-                    with m.Case(encoding.IntRegImmFunct.XORI):
-                        m.d.comb += [
-                                self.alu_op.eq(alu.ALUOp.XOR),
-                                self.alu_imm.eq(itype.immediate()),
-                        ]
-
-                    with m.Case(encoding.IntRegImmFunct.ORI):
-                        m.d.comb += [
-                                self.alu_op.eq(alu.ALUOp.OR),
-                                self.alu_imm.eq(itype.immediate()),
-                        ]
-
-                    with m.Case(encoding.IntRegImmFunct.ORI):
-                        m.d.comb += [
-                                self.alu_op.eq(alu.ALUOp.OR),
-                                self.alu_imm.eq(itype.immediate()),
-                        ]
-
-                    with m.Case(encoding.IntRegImmFunct.ANDI):
-                        m.d.comb += [
-                                self.alu_op.eq(alu.ALUOp.AND),
-                                self.alu_imm.eq(itype.immediate()),
-                        ]
-
-                    with m.Case(encoding.IntRegImmFunct.SLLI):
-                        m.d.comb += [
-                                self.alu_op.eq(alu.ALUOp.SLL),
-                                self.alu_imm.eq(itype.shift_amount()),
-                        ]
-
-                    with m.Case(encoding.IntRegImmFunct.SRLI_OR_SRAI):
-                        m.d.comb += self.alu_imm.eq(itype.shift_amount())
-                        with m.Switch(itype.right_shift_type()):
-                            with m.Case(encoding.RightShiftType.SRLI):
-                                m.d.comb += self.alu_op.eq(alu.ALUOp.SRL)
-                            with m.Case(encoding.RightShiftType.SRAI):
-                                m.d.comb += self.alu_op.eq(alu.ALUOp.SRA)
-
-            with m.Case(encoding.Opcode.JAL):
-                m.d.comb += self.rf_write_enable.eq(1)
-
-                jtype = encoding.JType(self.instr)
-                m.d.comb += [
-                        self.pc_load.eq(1),
-                        self.alu_op.eq(alu.ALUOp.ADD),
-                        self.alu_imm.eq(jtype.immediate()),
-                        self.rd_mux_op.eq(RdValue.PC_INC),
-                        self.alu_mux_op.eq(ALUInput.PC),
-                ]
-
-            with m.Case(encoding.Opcode.LOAD):
-                m.d.comb += [
-                        self.rf_write_enable.eq(1),
-                        self.pc_load.eq(0),
-                        self.alu_op.eq(alu.ALUOp.ADD),
-                        self.alu_imm.eq(itype.immediate()),
-                        self.rd_mux_op.eq(RdValue.LOAD),
-                        self.alu_mux_op.eq(ALUInput.READ_DATA_1),
-                ]
-
-                itype = encoding.IType(self.instr)
-                funct = itype.funct()
-                with m.If(funct == encoding.LoadFunct.LW):
-                    m.d.comb += self.dmem_address_mode.eq(
-                            data_memory.AddressMode.WORD)
-                with m.Elif((funct == encoding.LoadFunct.LH) |
-                            (funct == encoding.LoadFunct.LHU)):
-                    m.d.comb += self.dmem_address_mode.eq(
-                                data_memory.AddressMode.HALF)
-                with m.Elif((funct == encoding.LoadFunct.LB) |
-                            (funct == encoding.LoadFunct.LBU)):
-                    m.d.comb += self.dmem_address_mode.eq(
-                                data_memory.AddressMode.BYTE)
-
-                m.d.comb += self.dmem_signed.eq(funct[2] == 0)
+        itype = encoding.IType(self.instr)
+        m.d.comb += [
+                self.rf_write_select.eq(encoding.rd(self.instr)),
+                self.rf_read_select_1.eq(encoding.rs1(self.instr)),
+                self.rf_read_select_2.eq(encoding.rs2(self.instr)),
+
+                # Fields only meaningful to the instructions using them
+                self.branch_funct.eq(itype.funct()),
+                self.muldiv_op.eq(itype.funct()),
+                self.csr.eq(itype.csr()),
+                # The lower bits of the load and store funct values are the
+                # address mode values
+                self.dmem_address_mode.eq(itype.funct()[:2]),
+                self.dmem_signed.eq(~itype.funct()[2]),
+        ]
+
+        decode = self.elaborate_matches(m)
+        m.d.comb += [
+                self.pc_load.eq(decode(lambda c: c.pc_load)),
+                self.branch.eq(decode(lambda c: c.branch)),
+                self.dmem_store.eq(decode(lambda c: c.dmem_store)),
+                self.rf_write_enable.eq(
+                    decode(lambda c: c.rd_mux_op is not None)),
+        ]
+        for output, field in [(self.alu_op, "alu_op"),
+                              (self.alu_mux_op, "alu_mux_op"),
+                              (self.alu_a_mux_op, "alu_a_mux_op"),
+                              (self.rd_mux_op, "rd_mux_op")]:
+            m.d.comb += output.eq(nm.Cat(
+                    decode(lambda c, f=field, b=bit: (
+                        (getattr(c, f) or 0) >> b) & 1)
+                    for bit in range(len(output))))
+
+        immediates = {
+                Immediate.ITYPE: itype.immediate(),
+                Immediate.STYPE: encoding.SType(self.instr).immediate(),
+                Immediate.BTYPE: encoding.BType(self.instr).immediate(),
+                Immediate.JTYPE: encoding.JType(self.instr).immediate(),
+        }
+        m.d.comb += self.alu_imm.eq(functools.reduce(
+                operator.or_,
+                (nm.Mux(decode(lambda c, i=immediate: c.immediate == i),
+                        value,
+                        0)
+                 for immediate, value in immediates.items())))
 
         return m
+
+    def elaborate_matches(self, m):
+        """
+        Match the instruction against each instruction in the table
+
+        Returns:
+            callable: takes a predicate of Controls, and returns the OR of the
+                matches of the instructions it holds for. Where it holds for
+                every instruction with an opcode, the opcode match is used.
+        """
+        # The opcode's lowest two bits are 11 in every 32-bit instruction
+        opcode_bits = encoding.opcode(self.instr)[2:]
+        opcode_width = encoding.OPCODE_END - encoding.OPCODE_START
+        funct_key = nm.Cat(
+                self.instr[start:end] for start, end in KEY_FIELDS[1:])
+        opcode_matches = {}
+        by_opcode = collections.defaultdict(list)
+        for instruction in self.instructions:
+            by_opcode[instruction.opcode].append(instruction)
+        for opcode in by_opcode:
+            opcode_matches[opcode] = nm.Signal(
+                    name=f"{opcode.name.lower()}_match")
+            m.d.comb += opcode_matches[opcode].eq(opcode_bits == opcode >> 2)
+
+        matching = {}
+        for instruction in self.instructions:
+            matching[instruction] = nm.Signal(
+                    name=f"{instruction.name.lower()}_match")
+            m.d.comb += matching[instruction].eq(
+                    opcode_matches[instruction.opcode] &
+                    funct_key.matches(pattern(instruction)[:-opcode_width]))
+
+        matches = {}
+        for instruction, overriding in precedence(self.instructions).items():
+            matches[instruction] = matching[instruction] & ~functools.reduce(
+                    operator.or_,
+                    (matching[other] for other in overriding),
+                    nm.Const(0))
+
+        def decode(predicate):
+            terms = []
+            for opcode, instructions in by_opcode.items():
+                selected = [i for i in instructions if predicate(i.controls)]
+                if len(selected) == len(instructions):
+                    terms.append(opcode_matches[opcode])
+                else:
+                    terms.extend(matches[i] for i in selected)
+            return functools.reduce(operator.or_, terms, nm.Const(0))
+
+        return decode
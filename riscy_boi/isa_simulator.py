@@ -0,0 +1,569 @@
+"""Instruction-level rv32im simulator, for use as a fast golden model"""
+import struct
+
+from . import alu
+from . import encoding
+
+MASK = 0xffffffff
+SIGN_BIT = 0x80000000
+INSTRUCTION_BYTES = 4
+
+LOAD_FORMATS = {
+        encoding.LoadFunct.LB: (struct.Struct("<b"), ~0),
+        encoding.LoadFunct.LH: (struct.Struct("<h"), ~1),
+        encoding.LoadFunct.LW: (struct.Struct("<I"), ~3),
+        encoding.LoadFunct.LBU: (struct.Struct("<B"), ~0),
+        encoding.LoadFunct.LHU: (struct.Struct("<H"), ~1),
+}
+
+STORE_FORMATS = {
+        encoding.StoreFunct.SB: (struct.Struct("<B"), ~0, 0xff),
+        encoding.StoreFunct.SH: (struct.Struct("<H"), ~1, 0xffff),
+        encoding.StoreFunct.SW: (struct.Struct("<I"), ~3, MASK),
+}
+
+ALU_FUNCTIONS = {
+        alu.ALUOp.ADD: lambda a, b: (a + b) & MASK,
+        alu.ALUOp.SUB: lambda a, b: (a - b) & MASK,
+        alu.ALUOp.AND: lambda a, b: a & b,
+        alu.ALUOp.OR: lambda a, b: a | b,
+        alu.ALUOp.XOR: lambda a, b: a ^ b,
+        alu.ALUOp.SLL: lambda a, b: (a << (b & 0x1f)) & MASK,
+        alu.ALUOp.SRL: lambda a, b: a >> (b & 0x1f),
+        alu.ALUOp.SRA: lambda a, b: (signed(a) >> (b & 0x1f)) & MASK,
+}
+
+INT_REG_IMM_OPS = {
+        encoding.IntRegImmFunct.ADDI: alu.ALUOp.ADD,
+        encoding.IntRegImmFunct.XORI: alu.ALUOp.XOR,
+        encoding.IntRegImmFunct.ORI: alu.ALUOp.OR,
+        encoding.IntRegImmFunct.ANDI: alu.ALUOp.AND,
+        encoding.IntRegImmFunct.SLLI: alu.ALUOp.SLL,
+}
+
+INT_REG_REG_OPS = {
+        encoding.IntRegRegFunct.SLL: alu.ALUOp.SLL,
+        encoding.IntRegRegFunct.XOR: alu.ALUOp.XOR,
+        encoding.IntRegRegFunct.OR: alu.ALUOp.OR,
+        encoding.IntRegRegFunct.AND: alu.ALUOp.AND,
+}
+
+
+def divide(a, b):
+    """Signed division rounding towards zero, as the M extension specifies"""
+    if b == 0:
+        return MASK
+    quotient = abs(signed(a)) // abs(signed(b))
+    return (-quotient if (a ^ b) & SIGN_BIT else quotient) & MASK
+
+
+def remainder(a, b):
+    """Signed remainder, with the sign of the dividend"""
+    if b == 0:
+        return a
+    result = abs(signed(a)) % abs(signed(b))
+    return (-result if a & SIGN_BIT else result) & MASK
+
+
+MULDIV_FUNCTIONS = {
+        encoding.MulDivFunct.MUL: lambda a, b: (a * b) & MASK,
+        encoding.MulDivFunct.MULH: lambda a, b: (
+            (signed(a) * signed(b)) >> 32) & MASK,
+        encoding.MulDivFunct.MULHSU: lambda a, b: (
+            (signed(a) * b) >> 32) & MASK,
+        encoding.MulDivFunct.MULHU: lambda a, b: (a * b) >> 32,
+        encoding.MulDivFunct.DIV: divide,
+        encoding.MulDivFunct.DIVU: lambda a, b: a // b if b else MASK,
+        encoding.MulDivFunct.REM: remainder,
+        encoding.MulDivFunct.REMU: lambda a, b: a % b if b else a,
+}
+
+# The set-less-than funct values are the same for register-immediate and
+# register-register instructions
+SET_LESS_THAN_FUNCTIONS = {
+        encoding.IntRegImmFunct.SLTI: lambda a, b: int(signed(a) < signed(b)),
+        encoding.IntRegImmFunct.SLTIU: lambda a, b: int(a < b),
+}
+
+# Branches are executed by closures specialised to their comparison, to
+# avoid a function call per branch
+BRANCH_EXECUTORS = {
+        encoding.BranchFunct.BEQ: lambda regs, rs1, rs2, taken, not_taken: (
+            lambda: taken if regs[rs1] == regs[rs2] else not_taken),
+        encoding.BranchFunct.BNE: lambda regs, rs1, rs2, taken, not_taken: (
+            lambda: taken if regs[rs1] != regs[rs2] else not_taken),
+        encoding.BranchFunct.BLT: lambda regs, rs1, rs2, taken, not_taken: (
+            lambda: taken if (regs[rs1] ^ SIGN_BIT) < (regs[rs2] ^ SIGN_BIT)
+            else not_taken),
+        encoding.BranchFunct.BGE: lambda regs, rs1, rs2, taken, not_taken: (
+            lambda: taken if (regs[rs1] ^ SIGN_BIT) >= (regs[rs2] ^ SIGN_BIT)
+            else not_taken),
+        encoding.BranchFunct.BLTU: lambda regs, rs1, rs2, taken, not_taken: (
+            lambda: taken if regs[rs1] < regs[rs2] else not_taken),
+        encoding.BranchFunct.BGEU: lambda regs, rs1, rs2, taken, not_taken: (
+            lambda: taken if regs[rs1] >= regs[rs2] else not_taken),
+}
+
+
+# Counters modelled by the simulator, which executes one instruction per cycle
+COUNTER_CSRS = (encoding.CSR.CYCLE, encoding.CSR.TIME, encoding.CSR.INSTRET)
+
+
+class _CounterRead(Exception):
+    """
+    Raised by a CSR instruction, so the counters can be read with the count
+    of instructions executed, which is only known to ISASimulator.run
+    """
+
+    def __init__(self, rd, csr, next_pc):
+        super().__init__(rd, csr, next_pc)
+        self.rd = rd
+        self.csr = csr
+        self.next_pc = next_pc
+
+
+def signed(value):
+    """Interpret a 32-bit unsigned value as two's complement"""
+    return (value ^ SIGN_BIT) - SIGN_BIT
+
+
+def field(instruction, start, end):
+    """
+    Extract a field from an instruction
+
+    Args:
+        instruction (int): the instruction
+        start (int): the index of the field's least significant bit
+        end (int): the index after the field's most significant bit
+
+    Returns:
+        int: the unsigned field value
+    """
+    return (instruction >> start) & ((1 << (end - start)) - 1)
+
+
+def sext(value, length):
+    """Sign-extend a value of the given bit length to 32 bits"""
+    sign = 1 << (length - 1)
+    return ((value ^ sign) - sign) & MASK
+
+
+def unshuffle_immediate(instruction, imm_fields):
+    """
+    Construct the sign-extended immediate from its fields in an instruction
+
+    Args:
+        instruction (int): the instruction
+        imm_fields (tuple): the ImmediateFields of the instruction format
+
+    Returns:
+        int: the decoded immediate
+    """
+    offset = 0
+    for imm_field in imm_fields:
+        offset |= field(
+                instruction,
+                imm_field.instr_start,
+                imm_field.instr_end) << imm_field.offset_start
+    length = max(imm_field.offset_end for imm_field in imm_fields)
+    return sext(offset, length)
+
+
+def itype_immediate(instruction):
+    return sext(
+            field(
+                instruction,
+                encoding.IType.IMM_START,
+                encoding.IType.IMM_END),
+            encoding.IType.IMM_END - encoding.IType.IMM_START)
+
+
+def stype_immediate(instruction):
+    stype = encoding.SType
+    imm = (field(instruction, stype.IMM_LOW_START, stype.IMM_LOW_END) |
+           (field(instruction, stype.IMM_HIGH_START, stype.IMM_HIGH_END) <<
+            stype.IMM_LOW_WIDTH))
+    return sext(imm, stype.IMM_LOW_WIDTH + stype.IMM_HIGH_END -
+                stype.IMM_HIGH_START)
+
+
+class ISASimulator:
+    """
+    Instruction-level rv32im simulator
+
+    Like the CPUs, instruction and data memories are separate and both start
+    at address zero. Each instruction is decoded the first time it is
+    executed, into a function which executes it and returns the next program
+    counter, so later executions skip decoding.
+
+    Execution stops at an instruction which does not change the program
+    counter, such as a jump to itself or ECALL/EBREAK.
+
+    The cycle, time and instret CSRs all read as the number of instructions
+    executed before the read, and the hpmcounter CSRs as zero.
+
+    * pc: the program counter
+    * registers: the 32 general purpose registers, as unsigned values
+    * dmem: the data memory bytes
+    * instret: count of instructions executed
+    * halted: whether execution has stopped
+    """
+
+    def __init__(self, program, data=(), dmem_bytes=4096):
+        """
+        Initialiser
+
+        Args:
+            program (list): the instruction memory words
+            data (list): words to initialise the start of data memory with
+            dmem_bytes (int): the size of the data memory, a power of two
+        """
+        if dmem_bytes & (dmem_bytes - 1):
+            raise ValueError(
+                    f"dmem_bytes ({dmem_bytes}) must be a power of two")
+        self.program = [int(word) for word in program]
+        self.pc = 0
+        self.registers = [0] * 32
+        self.dmem = bytearray(dmem_bytes)
+        struct.pack_into(f"<{len(data)}I", self.dmem, 0, *data)
+        self.instret = 0
+        self.halted = False
+
+        self._address_mask = dmem_bytes - 1
+        self._decoded = [self._lazy(i) for i in range(len(self.program))]
+
+    def run(self, max_instructions=None):
+        """
+        Execute instructions until halted
+
+        Args:
+            max_instructions (int): the maximum number of instructions to
+                execute, or None for no limit
+
+        Returns:
+            int: the number of instructions executed
+        """
+        decoded = self._decoded
+        pc = self.pc
+        executed = 0
+        limit = -1 if max_instructions is None else max_instructions
+        try:
+            while executed != limit:
+                try:
+                    next_pc = decoded[pc >> 2]()
+                except _CounterRead as read:
+                    self._read_counter(read, self.instret + executed)
+                    next_pc = read.next_pc
+                executed += 1
+                if next_pc == pc:
+                    self.halted = True
+                    break
+                pc = next_pc
+        except IndexError:
+            raise ValueError(
+                    f"pc {pc:#x} is outside the instruction memory") from None
+        finally:
+            self.pc = pc
+            self.instret += executed
+
+        return executed
+
+    def step(self):
+        """Execute one instruction"""
+        self.run(max_instructions=1)
+
+    def load_word(self, address):
+        """Read a word from data memory"""
+        return LOAD_FORMATS[encoding.LoadFunct.LW][0].unpack_from(
+                self.dmem,
+                address & self._address_mask)[0]
+
+    def _read_counter(self, read, instret):
+        base = read.csr & ~encoding.CSR_HIGH_HALF
+        value = instret if base in COUNTER_CSRS else 0
+        if read.csr & encoding.CSR_HIGH_HALF:
+            value >>= 32
+        if read.rd:
+            self.registers[read.rd] = value & MASK
+
+    def _lazy(self, index):
+        """Make a function which decodes an instruction then executes it"""
+
+        def decode_and_execute():
+            execute = self.decode(index * INSTRUCTION_BYTES)
+            self._decoded[index] = execute
+            return execute()
+
+        return decode_and_execute
+
+    def decode(self, pc):
+        """
+        Decode the instruction at an address
+
+        Args:
+            pc (int): the instruction's address
+
+        Returns:
+            function: executes the instruction and returns the next pc
+        """
+        instruction = self.program[pc >> 2]
+        opcode = field(
+                instruction,
+                encoding.OPCODE_START,
+                encoding.OPCODE_END)
+        decoders = {
+                encoding.Opcode.OP_IMM: self._decode_op_imm,
+                encoding.Opcode.OP: self._decode_op,
+                encoding.Opcode.LUI: self._decode_upper,
+                encoding.Opcode.AUIPC: self._decode_upper,
+                encoding.Opcode.JAL: self._decode_jal,
+                encoding.Opcode.JALR: self._decode_jalr,
+                encoding.Opcode.BRANCH: self._decode_branch,
+                encoding.Opcode.LOAD: self._decode_load,
+                encoding.Opcode.STORE: self._decode_store,
+                encoding.Opcode.MISC_MEM: self._decode_nop,
+                encoding.Opcode.SYSTEM: self._decode_system,
+        }
+        if opcode not in decoders:
+            raise ValueError(
+                    f"Illegal instruction {instruction:#010x} at {pc:#x}")
+        return decoders[opcode](instruction, pc)
+
+    def _decode_nop(self, _, pc):
+        next_pc = (pc + INSTRUCTION_BYTES) & MASK
+        return lambda: next_pc
+
+    def _decode_system(self, instruction, pc):
+        funct = field(
+                instruction,
+                encoding.IType.FUNCT_START,
+                encoding.IType.FUNCT_END)
+        if funct == encoding.SystemFunct.PRIV:
+            # ECALL and EBREAK halt execution
+            return lambda: pc
+
+        # CSRs are read only, so CSR instructions only read them
+        rd = field(instruction, encoding.RD_START, encoding.RD_END)
+        csr = field(
+                instruction,
+                encoding.IType.IMM_START,
+                encoding.IType.IMM_END)
+        next_pc = (pc + INSTRUCTION_BYTES) & MASK
+
+        def read_counter():
+            raise _CounterRead(rd, csr, next_pc)
+
+        return read_counter
+
+    def _decode_op_imm(self, instruction, pc):
+        rd = field(instruction, encoding.RD_START, encoding.RD_END)
+        rs1 = field(instruction, encoding.RS1_START, encoding.RS1_END)
+        funct = field(
+                instruction,
+                encoding.IType.FUNCT_START,
+                encoding.IType.FUNCT_END)
+        imm = itype_immediate(instruction)
+        next_pc = (pc + INSTRUCTION_BYTES) & MASK
+        regs = self.registers
+
+        if funct in SET_LESS_THAN_FUNCTIONS:
+            function = SET_LESS_THAN_FUNCTIONS[funct]
+        elif funct == encoding.IntRegImmFunct.SRLI_OR_SRAI:
+            shift_type = field(
+                    instruction,
+                    encoding.IType.IMM_START + 5,
+                    encoding.IType.IMM_END)
+            function = ALU_FUNCTIONS[
+                    alu.ALUOp.SRA if shift_type == encoding.RightShiftType.SRAI
+                    else alu.ALUOp.SRL]
+        else:
+            function = ALU_FUNCTIONS[INT_REG_IMM_OPS[funct]]
+
+        if rd == 0:
+            return lambda: next_pc
+
+        if function is ALU_FUNCTIONS[alu.ALUOp.ADD]:
+            # The most common instruction, including li, mv and nop, so
+            # specialised to avoid a function call
+            def execute_addi():
+                regs[rd] = (regs[rs1] + imm) & MASK
+                return next_pc
+
+            return execute_addi
+
+        def execute():
+            regs[rd] = function(regs[rs1], imm)
+            return next_pc
+
+        return execute
+
+    def _decode_op(self, instruction, pc):
+        rd = field(instruction, encoding.RD_START, encoding.RD_END)
+        rs1 = field(instruction, encoding.RS1_START, encoding.RS1_END)
+        rs2 = field(instruction, encoding.RS2_START, encoding.RS2_END)
+        funct = field(
+                instruction,
+                encoding.RType.FUNCT_START,
+                encoding.RType.FUNCT_END)
+        funct7 = field(
+                instruction,
+                encoding.RType.FUNCT7_START,
+                encoding.RType.FUNCT7_END)
+        next_pc = (pc + INSTRUCTION_BYTES) & MASK
+        regs = self.registers
+
+        if funct7 == encoding.MULDIV_FUNCT7:
+            function = MULDIV_FUNCTIONS[funct]
+        elif funct in SET_LESS_THAN_FUNCTIONS:
+            function = SET_LESS_THAN_FUNCTIONS[funct]
+        elif funct == encoding.IntRegRegFunct.ADD_OR_SUB:
+            function = ALU_FUNCTIONS[
+                    alu.ALUOp.SUB if funct7 == encoding.AddSubType.SUB
+                    else alu.ALUOp.ADD]
+        elif funct == encoding.IntRegRegFunct.SRL_OR_SRA:
+            function = ALU_FUNCTIONS[
+                    alu.ALUOp.SRA if funct7 == encoding.RightShiftType.SRAI
+                    else alu.ALUOp.SRL]
+        else:
+            function = ALU_FUNCTIONS[INT_REG_REG_OPS[funct]]
+
+        if rd == 0:
+            return lambda: next_pc
+
+        if function is ALU_FUNCTIONS[alu.ALUOp.ADD]:
+            def execute_add():
+                regs[rd] = (regs[rs1] + regs[rs2]) & MASK
+                return next_pc
+
+            return execute_add
+
+        def execute():
+            regs[rd] = function(regs[rs1], regs[rs2])
+            return next_pc
+
+        return execute
+
+    def _decode_upper(self, instruction, pc):
+        rd = field(instruction, encoding.RD_START, encoding.RD_END)
+        value = instruction & ~((1 << encoding.UType.IMM_START) - 1) & MASK
+        opcode = field(
+                instruction,
+                encoding.OPCODE_START,
+                encoding.OPCODE_END)
+        if opcode == encoding.Opcode.AUIPC:
+            value = (value + pc) & MASK
+        next_pc = (pc + INSTRUCTION_BYTES) & MASK
+        regs = self.registers
+
+        if rd == 0:
+            return lambda: next_pc
+
+        def execute():
+            regs[rd] = value
+            return next_pc
+
+        return execute
+
+    def _decode_jal(self, instruction, pc):
+        rd = field(instruction, encoding.RD_START, encoding.RD_END)
+        offset = unshuffle_immediate(instruction, encoding.JType.IMM_FIELDS)
+        target = (pc + offset) & MASK
+        link = (pc + INSTRUCTION_BYTES) & MASK
+        regs = self.registers
+
+        if rd == 0:
+            return lambda: target
+
+        def execute():
+            regs[rd] = link
+            return target
+
+        return execute
+
+    def _decode_jalr(self, instruction, pc):
+        rd = field(instruction, encoding.RD_START, encoding.RD_END)
+        rs1 = field(instruction, encoding.RS1_START, encoding.RS1_END)
+        imm = itype_immediate(instruction)
+        link = (pc + INSTRUCTION_BYTES) & MASK
+        regs = self.registers
+
+        def execute():
+            target = (regs[rs1] + imm) & MASK & ~1
+            if rd:
+                regs[rd] = link
+            return target
+
+        return execute
+
+    def _decode_branch(self, instruction, pc):
+        rs1 = field(instruction, encoding.RS1_START, encoding.RS1_END)
+        rs2 = field(instruction, encoding.RS2_START, encoding.RS2_END)
+        funct = field(
+                instruction,
+                encoding.BType.FUNCT_START,
+                encoding.BType.FUNCT_END)
+        if funct not in BRANCH_EXECUTORS:
+            raise ValueError(
+                    f"Illegal instruction {instruction:#010x} at {pc:#x}")
+        offset = unshuffle_immediate(instruction, encoding.BType.IMM_FIELDS)
+        return BRANCH_EXECUTORS[funct](
+                self.registers,
+                rs1,
+                rs2,
+                (pc + offset) & MASK,
+                (pc + INSTRUCTION_BYTES) & MASK)
+
+    def _decode_load(self, instruction, pc):
+        rd = field(instruction, encoding.RD_START, encoding.RD_END)
+        rs1 = field(instruction, encoding.RS1_START, encoding.RS1_END)
+        funct = field(
+                instruction,
+                encoding.IType.FUNCT_START,
+                encoding.IType.FUNCT_END)
+        if funct not in LOAD_FORMATS:
+            raise ValueError(
+                    f"Illegal instruction {instruction:#010x} at {pc:#x}")
+        # Accesses are aligned down, as the data memory interface ignores the
+        # low address bits
+        load_format, alignment = LOAD_FORMATS[funct]
+        unpack_from = load_format.unpack_from
+        address_mask = self._address_mask & alignment
+        imm = itype_immediate(instruction)
+        next_pc = (pc + INSTRUCTION_BYTES) & MASK
+        regs = self.registers
+        dmem = self.dmem
+
+        if rd == 0:
+            return lambda: next_pc
+
+        def execute():
+            address = (regs[rs1] + imm) & address_mask
+            regs[rd] = unpack_from(dmem, address)[0] & MASK
+            return next_pc
+
+        return execute
+
+    def _decode_store(self, instruction, pc):
+        rs1 = field(instruction, encoding.RS1_START, encoding.RS1_END)
+        rs2 = field(instruction, encoding.RS2_START, encoding.RS2_END)
+        funct = field(
+                instruction,
+                encoding.SType.FUNCT_START,
+                encoding.SType.FUNCT_END)
+        if funct not in STORE_FORMATS:
+            raise ValueError(
+                    f"Illegal instruction {instruction:#010x} at {pc:#x}")
+        store_format, alignment, value_mask = STORE_FORMATS[funct]
+        pack_into = store_format.pack_into
+        address_mask = self._address_mask & alignment
+        imm = stype_immediate(instruction)
+        next_pc = (pc + INSTRUCTION_BYTES) & MASK
+        regs = self.registers
+        dmem = self.dmem
+
+        def execute():
+            address = (regs[rs1] + imm) & address_mask
+            pack_into(dmem, address, regs[rs2] & value_mask)
+            return next_pc
+
+        return execute
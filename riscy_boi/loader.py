@@ -0,0 +1,193 @@
+"""
+Program loading from ELF files and flat binaries
+
+The instruction and data memories are separate, both starting at address
+zero. An ELF file's executable segments are loaded into the instruction
+memory and its other segments into the data memory, at their addresses less
+the base address of each memory. A flat binary is loaded whole into the
+instruction memory.
+
+Files are memory-mapped, and their words are copied straight into NumPy
+arrays, which can initialise an nm.Memory or the ISA simulator.
+"""
+import collections
+import mmap
+import struct
+
+import numpy as np
+
+ELF_MAGIC = b"\x7fELF"
+ELFCLASS32 = 1
+ELFDATA2LSB = 1
+EM_RISCV = 243
+PT_LOAD = 1
+PF_X = 1
+
+# e_ident, then e_type to e_shstrndx
+ELF_HEADER = struct.Struct("<16sHHIIIIIHHHHHH")
+# p_type, p_offset, p_vaddr, p_paddr, p_filesz, p_memsz, p_flags, p_align
+PROGRAM_HEADER = struct.Struct("<IIIIIIII")
+
+Image = collections.namedtuple("Image", ["imem", "dmem", "entry"])
+Segment = collections.namedtuple(
+        "Segment",
+        ["offset", "address", "file_size", "memory_size", "executable"])
+
+
+def load(path, imem_base=0, dmem_base=0, max_words=None):
+    """
+    Load an ELF file or flat binary
+
+    Args:
+        path (str): the file to load
+        imem_base (int): the address of the start of instruction memory
+        dmem_base (int): the address of the start of data memory, for ELF
+            files
+        max_words (int): the words each memory holds, or None for no limit
+
+    Returns:
+        Image: the instruction and data memory words, as uint32 arrays, and
+            the entry point address
+    """
+    with open(path, "rb") as file:
+        is_elf = file.read(len(ELF_MAGIC)) == ELF_MAGIC
+    if is_elf:
+        return load_elf(path, imem_base, dmem_base, max_words)
+    return Image(
+            load_binary(path, max_words),
+            np.zeros(0, dtype=np.uint32),
+            imem_base)
+
+
+def load_binary(path, max_words=None):
+    """
+    Load a flat binary as little-endian words
+
+    The words are mapped from the file rather than read, except for a final
+    partial word, which is padded with zeros.
+
+    Args:
+        path (str): the file to load
+        max_words (int): the words the instruction memory holds, or None for
+            no limit
+
+    Returns:
+        np.ndarray: the words of the file, as uint32
+    """
+    with open(path, "rb") as file:
+        size = file.seek(0, 2)
+    _check_size((size + 3) // 4, max_words, "instruction")
+    if size == 0:
+        return np.zeros(0, dtype=np.uint32)
+    words = np.memmap(path, dtype="<u4", mode="r", shape=(size // 4,))
+    if size % 4 == 0:
+        return words
+    with open(path, "rb") as file:
+        file.seek(size - size % 4)
+        tail = file.read().ljust(4, b"\0")
+    return np.concatenate([words, np.frombuffer(tail, dtype="<u4")])
+
+
+def load_elf(path, imem_base=0, dmem_base=0, max_words=None):
+    """
+    Load the segments of a 32-bit little-endian RISC-V ELF file
+
+    Args:
+        path (str): the file to load
+        imem_base (int): the address of the start of instruction memory
+        dmem_base (int): the address of the start of data memory
+        max_words (int): the words each memory holds, or None for no limit
+
+    Returns:
+        Image: the instruction and data memory words, as uint32 arrays, and
+            the entry point address
+    """
+    with open(path, "rb") as file, \
+            mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+        entry, segments = parse_elf(mapped)
+        imem = _place(
+                mapped,
+                [s for s in segments if s.executable],
+                imem_base,
+                max_words,
+                "instruction")
+        dmem = _place(
+                mapped,
+                [s for s in segments if not s.executable],
+                dmem_base,
+                max_words,
+                "data")
+    return Image(imem, dmem, entry)
+
+
+def parse_elf(data):
+    """
+    Parse the header and loadable segments of an ELF file
+
+    Args:
+        data (bytes-like): the ELF file's contents
+
+    Returns:
+        tuple: the entry point address, and a list of the loadable Segments
+    """
+    if len(data) < ELF_HEADER.size:
+        raise ValueError("File is too short to be an ELF file")
+    (ident, _, machine, _, entry, phoff, _, _, _, phentsize, phnum, _, _,
+     _) = ELF_HEADER.unpack_from(data)
+    if ident[:4] != ELF_MAGIC:
+        raise ValueError("File is not an ELF file")
+    if ident[4] != ELFCLASS32 or ident[5] != ELFDATA2LSB:
+        raise ValueError("Only 32-bit little-endian ELF files can be loaded")
+    if machine != EM_RISCV:
+        raise ValueError(f"ELF machine {machine} is not RISC-V")
+
+    segments = []
+    for i in range(phnum):
+        (p_type, offset, address, _, file_size, memory_size, flags,
+         _) = PROGRAM_HEADER.unpack_from(data, phoff + i * phentsize)
+        if p_type != PT_LOAD or memory_size == 0:
+            continue
+        if offset + file_size > len(data):
+            raise ValueError(
+                    f"Segment at {address:#x} extends past the end of the "
+                    "file")
+        segments.append(Segment(
+                offset,
+                address,
+                file_size,
+                memory_size,
+                bool(flags & PF_X)))
+    return entry, segments
+
+
+def _check_size(words, max_words, memory):
+    """Raise ValueError if an image is larger than its memory"""
+    if max_words is not None and words > max_words:
+        raise ValueError(
+                f"The {memory} memory image is {words} words, more than the "
+                f"{max_words} the memory holds")
+
+
+def _place(data, segments, base, max_words, memory):
+    """Copy segments into a zeroed memory image, returning its words"""
+    if not segments:
+        return np.zeros(0, dtype=np.uint32)
+    lowest = min(segment.address for segment in segments)
+    if lowest < base:
+        raise ValueError(
+                f"Segment at {lowest:#x} is below the start of {memory} "
+                f"memory at {base:#x}")
+    end = max(segment.address + segment.memory_size for segment in segments)
+    # Checked before the image is allocated, as distant segments would make
+    # it huge
+    _check_size((end - base + 3) // 4, max_words, memory)
+    image = np.zeros((end - base + 3) // 4 * 4, dtype=np.uint8)
+    for segment in segments:
+        start = segment.address - base
+        if segment.file_size:
+            image[start:start + segment.file_size] = np.frombuffer(
+                    data,
+                    dtype=np.uint8,
+                    count=segment.file_size,
+                    offset=segment.offset)
+    return image.view("<u4").astype(np.uint32, copy=False)
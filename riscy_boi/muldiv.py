@@ -0,0 +1,212 @@
+"""Multiply and divide unit, for the M extension"""
+import enum
+
+import nmigen as nm
+
+from . import encoding
+
+WIDTH = 32
+
+
+class Implementation(enum.Enum):
+    """Implementations of the multiply and divide unit"""
+    ITERATIVE = "iterative"  # shift-and-add and restoring division, a few
+                             # bits per cycle
+    UNROLLED = "unrolled"    # a combinational multiplier and divider
+
+
+class MulDiv(nm.Elaboratable):
+    """
+    Multiply and divide unit
+
+    Signed operations are performed on the magnitudes of the operands, and
+    the result negated if needed. Division by zero and overflow give the
+    results the spec requires: dividing by zero gives a quotient of all ones
+    and a remainder of the dividend, and dividing the most negative number by
+    -1 gives a quotient of the dividend and a remainder of zero.
+
+    The iterative implementation takes an extra cycle for each step of 1 bit
+    at radix 2, or 2 bits at radix 4, so 32 or 16 extra cycles. While busy,
+    the inputs must be held and o is not valid. Once the result is ready, it
+    is held while the inputs are, until advance is high. The unrolled
+    implementation is never busy.
+
+    * op (in): the operation
+    * a (in): the first operand, rs1
+    * b (in): the second operand, rs2
+    * valid (in): high if the operation should be performed, so multi-cycle
+      operations are only started for valid instructions. Defaults to high.
+    * advance (in): high when the result is used, so the next operation
+      starts afresh. Defaults to high.
+
+    * o (out): the output
+    * busy (out): high while a multi-cycle operation is in progress
+    """
+
+    def __init__(self, implementation=Implementation.ITERATIVE, radix=4):
+        """
+        Initialiser
+
+        Args:
+            implementation (Implementation): the implementation
+            radix (int): 2 or 4, the radix of the iterative implementation
+        """
+        if radix not in (2, 4):
+            raise ValueError(f"Radix {radix} is not 2 or 4")
+        self.implementation = implementation
+        self.radix = radix
+
+        self.op = nm.Signal(encoding.MulDivFunct)
+        self.a = nm.Signal(WIDTH)
+        self.b = nm.Signal(WIDTH)
+        self.valid = nm.Signal(reset=1)
+        self.advance = nm.Signal(reset=1)
+        self.o = nm.Signal(WIDTH)
+        self.busy = nm.Signal()
+
+    def elaborate(self, _):
+        m = nm.Module()
+
+        divide = self.op[2]
+        a_signed = ((self.op == encoding.MulDivFunct.MULH) |
+                    (self.op == encoding.MulDivFunct.MULHSU) |
+                    (self.op == encoding.MulDivFunct.DIV) |
+                    (self.op == encoding.MulDivFunct.REM))
+        b_signed = ((self.op == encoding.MulDivFunct.MULH) |
+                    (self.op == encoding.MulDivFunct.DIV) |
+                    (self.op == encoding.MulDivFunct.REM))
+        a_negative = a_signed & self.a[-1]
+        b_negative = b_signed & self.b[-1]
+        a_magnitude = nm.Signal(WIDTH)
+        b_magnitude = nm.Signal(WIDTH)
+        m.d.comb += [
+                a_magnitude.eq(nm.Mux(a_negative, -self.a, self.a)),
+                b_magnitude.eq(nm.Mux(b_negative, -self.b, self.b)),
+        ]
+
+        # The product's upper and lower words, or the remainder and quotient
+        high = nm.Signal(WIDTH)
+        low = nm.Signal(WIDTH)
+        if self.implementation == Implementation.ITERATIVE:
+            self.elaborate_iterative(
+                    m, divide, a_magnitude, b_magnitude, high, low)
+        else:
+            self.elaborate_unrolled(
+                    m, divide, a_magnitude, b_magnitude, high, low)
+
+        product = nm.Signal(2 * WIDTH)
+        m.d.comb += product.eq(nm.Mux(
+                a_negative ^ b_negative,
+                -nm.Cat(low, high),
+                nm.Cat(low, high)))
+        with m.Switch(self.op):
+            with m.Case(encoding.MulDivFunct.MUL):
+                m.d.comb += self.o.eq(product[:WIDTH])
+            with m.Case(
+                    encoding.MulDivFunct.MULH,
+                    encoding.MulDivFunct.MULHSU,
+                    encoding.MulDivFunct.MULHU):
+                m.d.comb += self.o.eq(product[WIDTH:])
+            with m.Case(encoding.MulDivFunct.DIV, encoding.MulDivFunct.DIVU):
+                # The quotient of division by zero is all ones either way
+                m.d.comb += self.o.eq(nm.Mux(
+                        (a_negative ^ b_negative) & (self.b != 0),
+                        -low,
+                        low))
+            with m.Case(encoding.MulDivFunct.REM, encoding.MulDivFunct.REMU):
+                m.d.comb += self.o.eq(nm.Mux(a_negative, -high, high))
+
+        return m
+
+    def elaborate_iterative(self, m, divide, a, b, high, low):
+        # pylint: disable=too-many-arguments
+        bits = self.radix.bit_length() - 1
+        steps = WIDTH // bits
+        running = nm.Signal()
+        remaining = nm.Signal(range(steps + 1))
+        high_reg = nm.Signal(WIDTH)
+        low_reg = nm.Signal(WIDTH)
+
+        # The first step starts from the operands, and later steps from the
+        # partial result, which holds the result once no steps remain
+        count = nm.Mux(running, remaining, steps)
+        m.d.comb += [
+                high.eq(nm.Mux(running, high_reg, 0)),
+                low.eq(nm.Mux(running, low_reg, a)),
+                self.busy.eq(self.valid & (count != 0)),
+        ]
+
+        # A signal per step, so the steps are not each built from copies of
+        # the expressions of the steps before
+        stages = [(high, low)]
+        for i in range(bits):
+            step_high = nm.Signal(WIDTH, name=f"step{i}_high")
+            step_low = nm.Signal(WIDTH, name=f"step{i}_low")
+            m.d.comb += nm.Cat(step_low, step_high).eq(nm.Mux(
+                    divide,
+                    divide_step(*stages[-1], b),
+                    multiply_step(*stages[-1], b)))
+            stages.append((step_high, step_low))
+
+        with m.If(self.busy):
+            m.d.sync += [
+                    running.eq(1),
+                    remaining.eq(count - 1),
+                    high_reg.eq(stages[-1][0]),
+                    low_reg.eq(stages[-1][1]),
+            ]
+        with m.Elif(self.advance | ~self.valid):
+            m.d.sync += running.eq(0)
+        # Otherwise the result is ready but not used, e.g. while the
+        # pipelined CPU waits on the data memory, so is held by staying
+        # running with no steps remaining
+
+    def elaborate_unrolled(self, m, divide, a, b, high, low):
+        # pylint: disable=too-many-arguments
+        product = a * b
+        by_zero = b == 0
+        m.d.comb += [
+                high.eq(nm.Mux(
+                    divide,
+                    nm.Mux(by_zero, a, a % b),
+                    product[WIDTH:])),
+                low.eq(nm.Mux(
+                    divide,
+                    nm.Mux(by_zero, -1, a // b),
+                    product[:WIDTH])),
+        ]
+
+
+def multiply_step(high, low, multiplicand):
+    """
+    One step of shift-and-add multiplication
+
+    The multiplier starts in the lower word and the product accumulates in
+    the upper word. Each step adds the multiplicand if the multiplier's
+    lowest bit is set, then shifts both words right.
+
+    Returns:
+        nm.Value: the lower and upper words after the step
+    """
+    total = high + nm.Mux(low[0], multiplicand, 0)
+    return nm.Cat(low[1:], total)
+
+
+def divide_step(remainder, quotient, divisor):
+    """
+    One step of restoring division
+
+    The dividend starts in the quotient word. Each step shifts its top bit
+    into the remainder, and subtracts the divisor from the remainder if it
+    is no smaller, shifting a quotient bit of whether it was into the
+    quotient word.
+
+    Returns:
+        nm.Value: the quotient and remainder words after the step
+    """
+    shifted = nm.Cat(quotient[-1], remainder)
+    fits = shifted >= divisor
+    return nm.Cat(
+            fits,
+            quotient[:-1],
+            nm.Mux(fits, shifted - divisor, shifted)[:len(remainder)])
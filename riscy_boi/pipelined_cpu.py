@@ -0,0 +1,511 @@
+"""Five-stage pipelined CPU"""
+import nmigen as nm
+
+from . import alu
+from . import branch_comparator
+from . import branch_predictor
+from . import counters
+from . import data_memory
+from . import instruction_decoder
+from . import program_counter
+from . import register_file
+
+
+def forward(select, value, sources):
+    """
+    Operand forwarding multiplexor
+
+    Args:
+        select (nm.Value): the register the operand was read from
+        value (nm.Value): the value read from the register file
+        sources (list): (write_enable, write_select, write_data) tuples of
+            later pipeline stages, in order of priority
+
+    Returns:
+        nm.Value: the most recently written value of the register
+    """
+    result = value
+    for write_enable, write_select, write_data in reversed(sources):
+        result = nm.Mux(
+                write_enable & (write_select == select) & (select != 0),
+                write_data,
+                result)
+    return result
+
+
+class PipelinedCPU(nm.Elaboratable):
+    # pylint: disable=too-many-instance-attributes
+    """
+    rv32i or rv32im CPU with a five-stage pipeline
+
+    The stages are:
+
+    * IF: the address of the next instruction is presented to imem
+    * ID: the instruction arrives from imem, is decoded and its operands read
+    * EX: the ALU operation is performed and jumps are resolved
+    * MEM: the load value is sliced from the data read from dmem
+    * WB: the result is written to the register file
+
+    Both imem and dmem are expected to be synchronous reads in the same clock
+    domain as the CPU: loads and stores are presented to dmem from EX, and the
+    data read is used in MEM. Results are forwarded from MEM and WB to EX, and
+    from WB to ID. A load followed by an instruction using its result stalls
+    for one cycle.
+
+    Jumps and branches are resolved in EX. Without a branch predictor, the
+    next instruction is always fetched from the following address, so taken
+    jumps and branches flush the instruction fetched after them. With one,
+    the next address is predicted from the address of the instruction in ID,
+    and only mispredictions flush.
+
+    The ports are:
+
+    * imem_addr (out): the byte address of the instruction to fetch
+    * imem_data (in): the instruction at the address presented last cycle
+    * imem_valid (in): high if imem_data holds the instruction at the address
+      presented last cycle. If low, the CPU presents the same address again,
+      so imem can be an instruction cache. Defaults to high.
+
+    * dmem_r_addr (out): the word address of the load presented
+    * dmem_r_en (out): high when a load is presented at dmem_r_addr
+    * dmem_r_data (in): the word read for the load presented last cycle
+    * dmem_w_addr (out): the word address of the store presented
+    * dmem_w_data (out): the data to store, in its bytes' lanes
+    * dmem_w_en (out): the enables of the bytes of dmem_w_data to store
+    * dmem_valid (in): high if the load or store presented last cycle has
+      completed. If low, the whole pipeline stalls and the CPU presents the
+      same access again, so dmem can be a data cache. Defaults to high.
+    * dmem_repeat (out): high when the access presented is the one presented
+      last cycle again, while the pipeline is frozen, so peripherals whose
+      accesses have side effects can act on each access once
+
+    * debug_out (out): the value of the register debug_reg
+    * time_tick (in): high when the time counter should count. Defaults to
+      high, so time counts clock cycles.
+
+    Unlike cpu.CPU, it has no trace ports.
+
+    CSRs are read in EX, and instructions are counted as retired when they
+    leave EX, as nothing after EX can cancel them.
+
+    With registered reads, the register file's read registers are the ID/EX
+    operand registers, so it can be block RAM at no cost in cycles.
+    """
+
+    def __init__(self, debug_reg=2, predictor=None, events=(), alu_unit=None,
+                 muldiv_unit=None, registered_reads=False):
+        """
+        Initialiser
+
+        Args:
+            debug_reg (int): the register to output at debug_out
+            predictor (branch_predictor.BranchPredictor): the branch
+                predictor, or None to always predict not taken
+            events (list of counters.Event): the events counted by
+                hpmcounter3 onwards
+            alu_unit (alu.ALU): the ALU, or None for one with the default
+                adder and shifter. While a multi-cycle ALU is busy, the
+                whole pipeline stalls.
+            muldiv_unit (muldiv.MulDiv): the multiply and divide unit, or
+                None to leave out the M extension. It is in EX, and the
+                whole pipeline stalls while it is busy.
+            registered_reads (bool): whether the register file has registered
+                reads, see register_file.RegisterFile
+        """
+        # pylint: disable=too-many-arguments
+        self.imem_addr = nm.Signal(32)
+        self.imem_data = nm.Signal(32)
+        self.imem_valid = nm.Signal(reset=1)
+
+        self.dmem_r_addr = nm.Signal(32)
+        self.dmem_r_en = nm.Signal()
+        self.dmem_r_data = nm.Signal(32)
+        self.dmem_w_addr = nm.Signal(32)
+        self.dmem_w_data = nm.Signal(32)
+        self.dmem_w_en = nm.Signal(4)
+        self.dmem_valid = nm.Signal(reset=1)
+        self.dmem_repeat = nm.Signal()
+
+        self.debug_reg = debug_reg
+        self.debug_out = nm.Signal(32)
+
+        self.time_tick = nm.Signal(reset=1)
+
+        self.predictor = predictor
+        self.events = events
+        self.alu_unit = alu_unit
+        self.muldiv_unit = muldiv_unit
+        self.registered_reads = registered_reads
+
+    def elaborate(self, _):
+        # pylint: disable=too-many-statements
+        m = nm.Module()
+
+        alu_inst = m.submodules.alu = (
+                alu.ALU(32) if self.alu_unit is None else self.alu_unit)
+        cmp = m.submodules.cmp = branch_comparator.BranchComparator(32)
+        dmem = m.submodules.dmem = data_memory.DataMemory()
+        store_unit = m.submodules.store_unit = data_memory.DataMemory()
+        idec = m.submodules.idec = instruction_decoder.InstructionDecoder(
+                muldiv=self.muldiv_unit is not None)
+        pc = m.submodules.pc = program_counter.ProgramCounter()
+        rf = m.submodules.rf = register_file.RegisterFile(
+                debug_reg=self.debug_reg,
+                registered_reads=self.registered_reads)
+        csrs = m.submodules.csrs = counters.Counters(self.events)
+
+        # ID: pc.pc is the address of the instruction arriving from imem
+        id_started = nm.Signal()
+        id_valid = nm.Signal()
+
+        # ID/EX pipeline registers
+        ex_valid = nm.Signal()
+        ex_pc = nm.Signal(32)
+        ex_rs1 = nm.Signal.like(idec.rf_read_select_1, name="ex_rs1")
+        ex_rs1_data = nm.Signal(32)
+        ex_rs2 = nm.Signal.like(idec.rf_read_select_2, name="ex_rs2")
+        ex_rs2_data = nm.Signal(32)
+        ex_imm = nm.Signal(32)
+        ex_alu_op = nm.Signal.like(idec.alu_op, name="ex_alu_op")
+        ex_alu_mux_op = nm.Signal.like(idec.alu_mux_op, name="ex_alu_mux_op")
+        ex_alu_a_mux_op = nm.Signal.like(
+                idec.alu_a_mux_op,
+                name="ex_alu_a_mux_op")
+        ex_rd_mux_op = nm.Signal.like(idec.rd_mux_op, name="ex_rd_mux_op")
+        ex_pc_load = nm.Signal()
+        ex_branch = nm.Signal()
+        ex_branch_funct = nm.Signal.like(
+                idec.branch_funct,
+                name="ex_branch_funct")
+        ex_predicted_next = nm.Signal(32)
+        ex_rf_write_enable = nm.Signal()
+        ex_rd = nm.Signal.like(idec.rf_write_select, name="ex_rd")
+        ex_dmem_address_mode = nm.Signal.like(
+                idec.dmem_address_mode,
+                name="ex_dmem_address_mode")
+        ex_dmem_signed = nm.Signal()
+        ex_dmem_store = nm.Signal()
+        ex_csr = nm.Signal.like(idec.csr, name="ex_csr")
+        ex_muldiv_op = nm.Signal.like(idec.muldiv_op, name="ex_muldiv_op")
+
+        # EX/MEM pipeline registers
+        mem_rf_write_enable = nm.Signal()
+        mem_rd = nm.Signal.like(idec.rf_write_select, name="mem_rd")
+        mem_rd_mux_op = nm.Signal.like(idec.rd_mux_op, name="mem_rd_mux_op")
+        mem_result = nm.Signal(32)
+        mem_dmem_address_mode = nm.Signal.like(
+                idec.dmem_address_mode,
+                name="mem_dmem_address_mode")
+        mem_dmem_signed = nm.Signal()
+        mem_dmem_load = nm.Signal()
+        mem_dmem_store = nm.Signal()
+        mem_dmem_w_data = nm.Signal(32)
+        mem_dmem_w_en = nm.Signal(4)
+
+        # MEM/WB pipeline registers
+        wb_rf_write_enable = nm.Signal()
+        wb_rd = nm.Signal.like(idec.rf_write_select, name="wb_rd")
+        wb_data = nm.Signal(32)
+
+        id_predicted_next = nm.Signal(32)
+        ex_rs1_value = nm.Signal(32)
+        ex_rs2_value = nm.Signal(32)
+        ex_taken = nm.Signal()
+        ex_next = nm.Signal(32)
+        ex_result = nm.Signal(32)
+        mem_data = nm.Signal(32)
+        ex_dmem_load = nm.Signal()
+        redirect = nm.Signal()
+        load_use_stall = nm.Signal()
+        dmem_stall = nm.Signal()
+        busy = nm.Signal()
+        freeze = nm.Signal()
+
+        # IF
+        m.d.sync += id_started.eq(1)
+        m.d.comb += [
+                id_valid.eq(id_started & self.imem_valid),
+                self.imem_addr.eq(pc.pc_next),
+        ]
+
+        with m.If(freeze):
+            m.d.comb += [
+                    pc.load.eq(1),
+                    pc.input_address.eq(pc.pc),
+            ]
+        with m.Elif(redirect):
+            m.d.comb += [
+                    pc.load.eq(1),
+                    pc.input_address.eq(ex_next),
+            ]
+        with m.Elif(load_use_stall | ~id_valid):
+            # Fetch the instruction in ID again: after reset, this starts
+            # execution from address zero, and after an imem miss it retries
+            # the fetch
+            m.d.comb += [
+                    pc.load.eq(1),
+                    pc.input_address.eq(pc.pc),
+            ]
+        with m.Else():
+            m.d.comb += [
+                    pc.load.eq(1),
+                    pc.input_address.eq(id_predicted_next),
+            ]
+
+        if self.predictor is None:
+            m.d.comb += id_predicted_next.eq(pc.pc_inc)
+        else:
+            predictor = m.submodules.predictor = self.predictor
+            m.d.comb += [
+                    predictor.lookup_pc.eq(pc.pc),
+                    predictor.lookup_enable.eq(
+                        id_valid & ~load_use_stall & ~redirect & ~freeze),
+                    id_predicted_next.eq(nm.Mux(
+                        predictor.predict_taken,
+                        predictor.predict_target,
+                        pc.pc_inc)),
+
+                    predictor.update.eq(
+                        ex_valid & (ex_pc_load | ex_branch) & ~freeze),
+                    predictor.update_pc.eq(ex_pc),
+                    predictor.update_taken.eq(ex_taken),
+                    predictor.update_target.eq(alu_inst.o),
+                    predictor.update_mispredict.eq(redirect),
+            ]
+            with m.If(ex_branch):
+                m.d.comb += predictor.update_kind.eq(
+                        branch_predictor.BranchKind.BRANCH)
+            with m.Elif((ex_rd == 1) | (ex_rd == 5)):
+                # x1 and x5 are the link registers of the calling convention
+                m.d.comb += predictor.update_kind.eq(
+                        branch_predictor.BranchKind.CALL)
+            with m.Else():
+                m.d.comb += predictor.update_kind.eq(
+                        branch_predictor.BranchKind.JUMP)
+
+        # ID
+        uses_rs1 = (
+                (idec.alu_mux_op == instruction_decoder.ALUInput.READ_DATA_1) |
+                (idec.alu_a_mux_op ==
+                 instruction_decoder.ALUOperand.READ_DATA_1) |
+                idec.branch)
+        uses_rs2 = (
+                (idec.alu_mux_op == instruction_decoder.ALUInput.READ_DATA_2) |
+                (idec.alu_a_mux_op ==
+                 instruction_decoder.ALUOperand.READ_DATA_2) |
+                idec.branch |
+                idec.dmem_store)
+        m.d.comb += [
+                idec.instr.eq(self.imem_data),
+                rf.read_select_1.eq(idec.rf_read_select_1),
+                rf.read_select_2.eq(idec.rf_read_select_2),
+                load_use_stall.eq(
+                    id_valid &
+                    ex_valid &
+                    ex_rf_write_enable &
+                    (ex_rd_mux_op == instruction_decoder.RdValue.LOAD) &
+                    (ex_rd != 0) &
+                    (((ex_rd == idec.rf_read_select_1) & uses_rs1) |
+                     ((ex_rd == idec.rf_read_select_2) & uses_rs2))),
+        ]
+
+        with m.If(~freeze):
+            m.d.sync += [
+                    ex_valid.eq(id_valid & ~load_use_stall & ~redirect),
+                    ex_pc.eq(pc.pc),
+                    ex_rs1.eq(idec.rf_read_select_1),
+                    ex_rs2.eq(idec.rf_read_select_2),
+                    ex_imm.eq(idec.alu_imm),
+                    ex_alu_op.eq(idec.alu_op),
+                    ex_alu_mux_op.eq(idec.alu_mux_op),
+                    ex_alu_a_mux_op.eq(idec.alu_a_mux_op),
+                    ex_rd_mux_op.eq(idec.rd_mux_op),
+                    ex_pc_load.eq(idec.pc_load),
+                    ex_branch.eq(idec.branch),
+                    ex_branch_funct.eq(idec.branch_funct),
+                    ex_predicted_next.eq(id_predicted_next),
+                    ex_rf_write_enable.eq(idec.rf_write_enable),
+                    ex_rd.eq(idec.rf_write_select),
+                    ex_dmem_address_mode.eq(idec.dmem_address_mode),
+                    ex_dmem_signed.eq(idec.dmem_signed),
+                    ex_dmem_store.eq(idec.dmem_store),
+                    ex_csr.eq(idec.csr),
+                    ex_muldiv_op.eq(idec.muldiv_op),
+            ]
+
+        if self.registered_reads:
+            # The register file bypasses WB's write
+            m.d.comb += [
+                    rf.read_enable.eq(~freeze),
+                    ex_rs1_data.eq(rf.read_data_1),
+                    ex_rs2_data.eq(rf.read_data_2),
+            ]
+        else:
+            with m.If(~freeze):
+                m.d.sync += [
+                        ex_rs1_data.eq(forward(
+                            idec.rf_read_select_1,
+                            rf.read_data_1,
+                            [(wb_rf_write_enable, wb_rd, wb_data)])),
+                        ex_rs2_data.eq(forward(
+                            idec.rf_read_select_2,
+                            rf.read_data_2,
+                            [(wb_rf_write_enable, wb_rd, wb_data)])),
+                ]
+
+        # EX
+        later_writes = [
+                (mem_rf_write_enable, mem_rd, mem_result),
+                (wb_rf_write_enable, wb_rd, wb_data),
+        ]
+        m.d.comb += [
+                ex_rs1_value.eq(forward(ex_rs1, ex_rs1_data, later_writes)),
+                ex_rs2_value.eq(forward(ex_rs2, ex_rs2_data, later_writes)),
+
+                alu_inst.op.eq(ex_alu_op),
+                alu_inst.valid.eq(ex_valid),
+                alu_inst.advance.eq(~freeze),
+
+                cmp.funct.eq(ex_branch_funct),
+                cmp.a.eq(ex_rs1_value),
+                cmp.b.eq(ex_rs2_value),
+
+                ex_taken.eq(ex_pc_load | (ex_branch & cmp.taken)),
+                ex_next.eq(nm.Mux(
+                    ex_taken,
+                    alu_inst.o,
+                    ex_pc + program_counter.INSTR_BYTES)),
+                redirect.eq(ex_valid & (ex_next != ex_predicted_next)),
+
+                ex_dmem_load.eq(
+                    ex_valid &
+                    (ex_rd_mux_op == instruction_decoder.RdValue.LOAD)),
+                store_unit.byte_address.eq(alu_inst.o),
+                store_unit.address_mode.eq(ex_dmem_address_mode),
+                store_unit.store.eq(ex_valid & ex_dmem_store),
+                store_unit.store_value.eq(ex_rs2_value),
+        ]
+
+        # While frozen, the access in MEM is presented to dmem again
+        m.d.comb += self.dmem_repeat.eq(freeze)
+        with m.If(freeze):
+            m.d.comb += [
+                    self.dmem_r_addr.eq(mem_result[2:]),
+                    self.dmem_r_en.eq(mem_dmem_load),
+                    self.dmem_w_addr.eq(mem_result[2:]),
+                    self.dmem_w_data.eq(mem_dmem_w_data),
+                    self.dmem_w_en.eq(mem_dmem_w_en),
+            ]
+        with m.Else():
+            m.d.comb += [
+                    self.dmem_r_addr.eq(store_unit.dmem_r_addr),
+                    self.dmem_r_en.eq(ex_dmem_load),
+                    self.dmem_w_addr.eq(store_unit.dmem_w_addr),
+                    self.dmem_w_data.eq(store_unit.dmem_w_data),
+                    self.dmem_w_en.eq(store_unit.dmem_w_en),
+            ]
+
+        with m.Switch(ex_alu_mux_op):
+            with m.Case(instruction_decoder.ALUInput.READ_DATA_1):
+                m.d.comb += alu_inst.b.eq(ex_rs1_value)
+            with m.Case(instruction_decoder.ALUInput.PC):
+                m.d.comb += alu_inst.b.eq(ex_pc)
+            with m.Case(instruction_decoder.ALUInput.READ_DATA_2):
+                m.d.comb += alu_inst.b.eq(ex_rs2_value)
+
+        with m.Switch(ex_alu_a_mux_op):
+            with m.Case(instruction_decoder.ALUOperand.IMMEDIATE):
+                m.d.comb += alu_inst.a.eq(ex_imm)
+            with m.Case(instruction_decoder.ALUOperand.READ_DATA_1):
+                m.d.comb += alu_inst.a.eq(ex_rs1_value)
+            with m.Case(instruction_decoder.ALUOperand.READ_DATA_2):
+                m.d.comb += alu_inst.a.eq(ex_rs2_value)
+
+        if self.muldiv_unit is None:
+            m.d.comb += busy.eq(alu_inst.busy)
+        else:
+            muldiv_inst = m.submodules.muldiv = self.muldiv_unit
+            m.d.comb += [
+                    muldiv_inst.op.eq(ex_muldiv_op),
+                    muldiv_inst.a.eq(ex_rs1_value),
+                    muldiv_inst.b.eq(ex_rs2_value),
+                    muldiv_inst.valid.eq(
+                        ex_valid &
+                        (ex_rd_mux_op == instruction_decoder.RdValue.MULDIV)),
+                    muldiv_inst.advance.eq(~freeze),
+                    busy.eq(alu_inst.busy | muldiv_inst.busy),
+            ]
+
+        with m.If(ex_rd_mux_op == instruction_decoder.RdValue.PC_INC):
+            m.d.comb += ex_result.eq(ex_pc + program_counter.INSTR_BYTES)
+        with m.Elif(ex_rd_mux_op == instruction_decoder.RdValue.CSR):
+            m.d.comb += ex_result.eq(csrs.read_data)
+        if self.muldiv_unit is not None:
+            with m.Elif(ex_rd_mux_op == instruction_decoder.RdValue.MULDIV):
+                m.d.comb += ex_result.eq(muldiv_inst.o)
+        with m.Else():
+            m.d.comb += ex_result.eq(alu_inst.o)
+
+        m.d.comb += [
+                csrs.address.eq(ex_csr),
+                csrs.retire.eq(ex_valid & ~freeze),
+                csrs.time_tick.eq(self.time_tick),
+        ]
+        events = {
+                counters.Event.TAKEN_JUMP: ex_valid & ex_taken & ~freeze,
+                counters.Event.MISPREDICT: redirect & ~freeze,
+                counters.Event.LOAD: ex_dmem_load & ~freeze,
+                counters.Event.STORE: ex_valid & ex_dmem_store & ~freeze,
+                counters.Event.LOAD_USE_STALL: (
+                    load_use_stall & ~redirect & ~freeze),
+                counters.Event.IMEM_STALL: id_started & ~self.imem_valid,
+                counters.Event.DMEM_STALL: dmem_stall,
+        }
+        m.d.comb += csrs.events.eq(nm.Cat(events[e] for e in self.events))
+
+        with m.If(~freeze):
+            m.d.sync += [
+                    mem_rf_write_enable.eq(ex_valid & ex_rf_write_enable),
+                    mem_rd.eq(ex_rd),
+                    mem_rd_mux_op.eq(ex_rd_mux_op),
+                    mem_result.eq(ex_result),
+                    mem_dmem_address_mode.eq(ex_dmem_address_mode),
+                    mem_dmem_signed.eq(ex_dmem_signed),
+                    mem_dmem_load.eq(ex_dmem_load),
+                    mem_dmem_store.eq(ex_valid & ex_dmem_store),
+                    mem_dmem_w_data.eq(store_unit.dmem_w_data),
+                    mem_dmem_w_en.eq(store_unit.dmem_w_en),
+            ]
+
+        # MEM
+        m.d.comb += [
+                dmem_stall.eq(
+                    (mem_dmem_load | mem_dmem_store) & ~self.dmem_valid),
+                freeze.eq(dmem_stall | busy),
+                dmem.byte_address.eq(mem_result),
+                dmem.address_mode.eq(mem_dmem_address_mode),
+                dmem.signed.eq(mem_dmem_signed),
+                dmem.dmem_r_data.eq(self.dmem_r_data),
+        ]
+
+        with m.If(mem_rd_mux_op == instruction_decoder.RdValue.LOAD):
+            m.d.comb += mem_data.eq(dmem.load_value)
+        with m.Else():
+            m.d.comb += mem_data.eq(mem_result)
+
+        with m.If(~freeze):
+            m.d.sync += [
+                    wb_rf_write_enable.eq(mem_rf_write_enable),
+                    wb_rd.eq(mem_rd),
+                    wb_data.eq(mem_data),
+            ]
+
+        # WB
+        m.d.comb += [
+                rf.write_enable.eq(wb_rf_write_enable),
+                rf.write_select.eq(wb_rd),
+                rf.write_data.eq(wb_data),
+                self.debug_out.eq(rf.debug_out),
+        ]
+
+        return m
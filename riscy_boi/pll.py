@@ -0,0 +1,56 @@
+"""
+iCE40 PLL configuration
+
+The SB_PLL40_CORE with simple feedback divides its reference clock by DIVR+1
+to the phase detector, multiplies it by DIVF+1 in the VCO, then divides it by
+2**DIVQ. Each frequency must be within the ranges of the iCE40 datasheet, as
+icepll checks.
+"""
+import collections
+
+# The BlackIce II's clk100
+INPUT_MHZ = 100
+PFD_MHZ = (10, 133)
+VCO_MHZ = (533, 1066)
+OUTPUT_MHZ = (16, 275)
+
+Config = collections.namedtuple("Config", ["divr", "divf", "divq"])
+
+# 16.02 MHz
+DEFAULT = Config(divr=3, divf=40, divq=6)
+
+
+def frequency(config, input_mhz=INPUT_MHZ):
+    """The output frequency of a configuration in MHz"""
+    return input_mhz / (config.divr + 1) * (config.divf + 1) / 2**config.divq
+
+
+def filter_range(config, input_mhz=INPUT_MHZ):
+    """The loop filter range for a configuration's phase detector frequency"""
+    pfd = input_mhz / (config.divr + 1)
+    for filter_range_, below in enumerate([17, 26, 44, 66, 101], start=1):
+        if pfd < below:
+            return filter_range_
+    return 6
+
+
+def configs(input_mhz=INPUT_MHZ):
+    """Generate every valid configuration"""
+    for divr in range(16):
+        pfd = input_mhz / (divr + 1)
+        if not PFD_MHZ[0] <= pfd <= PFD_MHZ[1]:
+            continue
+        for divf in range(128):
+            vco = pfd * (divf + 1)
+            if not VCO_MHZ[0] <= vco <= VCO_MHZ[1]:
+                continue
+            for divq in range(1, 7):
+                if OUTPUT_MHZ[0] <= vco / 2**divq <= OUTPUT_MHZ[1]:
+                    yield Config(divr, divf, divq)
+
+
+def closest(target_mhz, input_mhz=INPUT_MHZ):
+    """The configuration with the output frequency closest to a target"""
+    return min(
+            configs(input_mhz),
+            key=lambda config: abs(frequency(config, input_mhz) - target_mhz))
@@ -3,6 +3,7 @@ import nmigen as nm
 
 
 class RegisterFile(nm.Elaboratable):
+    # pylint: disable=too-many-instance-attributes
     """
     Register file
 
@@ -14,9 +15,48 @@ class RegisterFile(nm.Elaboratable):
     * write_enable (in): assert to trigger write to register file
     * write_select (in): select which register to write to
     * write_data (in): data to write to register selected by write_select
+
+    With four read ports, there are also read_select_3, read_select_4,
+    read_data_3 and read_data_4. With two write ports, there are also
+    write_enable_2, write_select_2 and write_data_2. If both write ports
+    write the same register, the second port's data is written, as it is the
+    later instruction's.
+
+    With registered reads, each read port has its own copy of the registers
+    in a memory with a synchronous read port, so the copies can be iCE40 block
+    RAMs rather than logic. read_data is then the value of the register
+    selected the cycle before, including a write in that cycle, which is
+    bypassed around the memory. The debug register is shadowed in flip-flops.
+    Registered reads need one write port.
+
+    * read_enable (in): with registered reads, low to hold read_data rather
+      than read. Defaults to high.
     """
 
-    def __init__(self, num_registers=32, register_width=32, debug_reg=2):
+    def __init__(self, num_registers=32, register_width=32, debug_reg=2,
+                 read_ports=2, write_ports=1, registered_reads=False):
+        """
+        Initialiser
+
+        Args:
+            num_registers (int): the number of registers
+            register_width (int): the width of each register
+            debug_reg (int): the register to output at debug_out
+            read_ports (int): 2 or 4
+            write_ports (int): 1 or 2
+            registered_reads (bool): whether reads are registered, so the
+                registers can be block RAMs
+        """
+        # pylint: disable=too-many-arguments
+        if read_ports not in (2, 4):
+            raise ValueError(f"{read_ports} read ports is not 2 or 4")
+        if write_ports not in (1, 2):
+            raise ValueError(f"{write_ports} write ports is not 1 or 2")
+        if registered_reads and write_ports != 1:
+            raise ValueError("Registered reads need one write port")
+        self.read_ports = read_ports
+        self.write_ports = write_ports
+        self.registered_reads = registered_reads
         self.num_registers = num_registers
         self.register_width = register_width
 
@@ -32,11 +72,41 @@ class RegisterFile(nm.Elaboratable):
         self.debug_out = nm.Signal(self.register_width)
         self.debug_reg = debug_reg
 
+        if read_ports == 4:
+            self.read_select_3 = nm.Signal(range(self.num_registers))
+            self.read_select_4 = nm.Signal(range(self.num_registers))
+            self.read_data_3 = nm.Signal(self.register_width)
+            self.read_data_4 = nm.Signal(self.register_width)
+        if write_ports == 2:
+            self.write_enable_2 = nm.Signal()
+            self.write_select_2 = nm.Signal(range(self.num_registers))
+            self.write_data_2 = nm.Signal(self.register_width)
+        if registered_reads:
+            self.read_enable = nm.Signal(reset=1)
+
+        # The registers, or with registered reads, a copy per read port
+        self.memories = [
+                nm.Memory(
+                    width=self.register_width,
+                    depth=self.num_registers,
+                    name="registers")
+                for _ in range(read_ports if registered_reads else 1)]
+
+    def read_port_signals(self):
+        """The (read_select, read_data) pairs of each read port"""
+        ports = [(self.read_select_1, self.read_data_1),
+                 (self.read_select_2, self.read_data_2)]
+        if self.read_ports == 4:
+            ports += [(self.read_select_3, self.read_data_3),
+                      (self.read_select_4, self.read_data_4)]
+        return ports
+
     def elaborate(self, _):
+        if self.registered_reads:
+            return self.elaborate_registered_reads()
+
         m = nm.Module()
-        registers = nm.Memory(
-                width=self.register_width,
-                depth=self.num_registers)
+        registers, = self.memories
 
         rp1 = m.submodules.rp1 = registers.read_port(domain="comb")
         rp2 = m.submodules.rp2 = registers.read_port(domain="comb")
@@ -46,8 +116,29 @@ class RegisterFile(nm.Elaboratable):
         # The first register, x0, has a special function: Reading it always
         # returns 0 and writes to it are ignored.
         # https://github.com/riscv/riscv-asm-manual/blob/master/riscv-asm.md
+        write_enable = self.write_enable
+        if self.write_ports == 2:
+            wp2 = m.submodules.wp2 = registers.write_port(domain="sync")
+            m.d.comb += [
+                    wp2.en.eq(nm.Mux(
+                        self.write_select_2 == 0, 0, self.write_enable_2)),
+                    wp2.addr.eq(self.write_select_2),
+                    wp2.data.eq(self.write_data_2),
+            ]
+            write_enable = self.write_enable & ~(
+                    wp2.en & (self.write_select == self.write_select_2))
         m.d.comb += wp.en.eq(
-                nm.Mux(self.write_select == 0, 0, self.write_enable))
+                nm.Mux(self.write_select == 0, 0, write_enable))
+
+        if self.read_ports == 4:
+            rp3 = m.submodules.rp3 = registers.read_port(domain="comb")
+            rp4 = m.submodules.rp4 = registers.read_port(domain="comb")
+            m.d.comb += [
+                    rp3.addr.eq(self.read_select_3),
+                    rp4.addr.eq(self.read_select_4),
+                    self.read_data_3.eq(rp3.data),
+                    self.read_data_4.eq(rp4.data),
+            ]
 
         m.d.comb += [
                 rp1.addr.eq(self.read_select_1),
@@ -61,3 +152,40 @@ class RegisterFile(nm.Elaboratable):
         ]
 
         return m
+
+    def elaborate_registered_reads(self):
+        m = nm.Module()
+
+        # Writes to x0 are ignored, so it stays zero in every copy
+        write_enable = self.write_enable & (self.write_select != 0)
+
+        for i, ((read_select, read_data), registers) in enumerate(
+                zip(self.read_port_signals(), self.memories), start=1):
+            read_port = registers.read_port(domain="sync", transparent=False)
+            write_port = registers.write_port(domain="sync")
+            m.submodules[f"rp{i}"] = read_port
+            m.submodules[f"wp{i}"] = write_port
+
+            bypass = nm.Signal(name=f"bypass_{i}")
+            bypass_data = nm.Signal(self.register_width,
+                                    name=f"bypass_data_{i}")
+            with m.If(self.read_enable):
+                m.d.sync += [
+                        bypass.eq(
+                            write_enable & (self.write_select == read_select)),
+                        bypass_data.eq(self.write_data),
+                ]
+
+            m.d.comb += [
+                    read_port.addr.eq(read_select),
+                    read_port.en.eq(self.read_enable),
+                    write_port.addr.eq(self.write_select),
+                    write_port.data.eq(self.write_data),
+                    write_port.en.eq(write_enable),
+                    read_data.eq(nm.Mux(bypass, bypass_data, read_port.data)),
+            ]
+
+        with m.If(write_enable & (self.write_select == self.debug_reg)):
+            m.d.sync += self.debug_out.eq(self.write_data)
+
+        return m
@@ -0,0 +1,89 @@
+"""
+Simulation of a design elaborated once and rerun with each testbench
+
+Constructing an nmigen simulator elaborates the design and compiles it for the
+simulation engine, which for a CPU takes longer than most testbenches run. A
+ReusableSimulator does that once, then resets the simulation to the design's
+reset state before each testbench, loading new contents into its memories:
+
+    sim = reusable_sim.ReusableSimulator(m, clock_period=1e-6)
+    sim.run(testbench, memories=[(imem, program), (dmem, data)])
+"""
+import nmigen.sim
+
+
+def load_memory(memory, words):
+    """Testbench commands writing words to a memory, zeroing those after"""
+    for index in range(memory.depth):
+        yield memory[index].eq(words[index] if index < len(words) else 0)
+
+
+class ReusableSimulator:
+    """
+    Simulator of a design, reset and rerun with each testbench
+
+    Signals hold their reset values at the start of each run, whatever the
+    previous testbench assigned to them. Memories hold their initial contents
+    unless they are loaded.
+    """
+
+    def __init__(self, design, engine="pysim", clock_period=None):
+        """
+        Initialiser
+
+        Args:
+            design (nm.Elaboratable): the design to simulate
+            engine: the nmigen simulation engine
+            clock_period (float): the period of the sync domain's clock in
+                seconds, for testbenches run as sync processes, or None for
+                combinational testbenches without a clock
+        """
+        self.design = design
+        self.runs = 0
+        self._simulator = nmigen.sim.Simulator(design, engine=engine)
+        self._process = None
+        self._memories = ()
+        if clock_period is None:
+            self._simulator.add_process(self._loaded_testbench)
+        else:
+            # Memories are loaded at time zero, before the first clock edge
+            self._simulator.add_process(self._load)
+            self._simulator.add_sync_process(self._testbench)
+            self._simulator.add_clock(clock_period)
+
+    def _load(self):
+        for memory, words in self._memories:
+            yield from load_memory(memory, words)
+
+    def _testbench(self):
+        yield from self._process()
+
+    def _loaded_testbench(self):
+        yield from self._load()
+        yield from self._process()
+
+    def run(self, process, memories=(), deadline=None):
+        """
+        Reset the simulation and run a testbench
+
+        Args:
+            process (function): the testbench generator function
+            memories (iterable): pairs of an nm.Memory and the words to load
+                into it, the words after them being zeroed
+            deadline (float): the simulated time in seconds to run until, or
+                None to run until the testbench returns
+        """
+        self._memories = list(memories)
+        for memory, words in self._memories:
+            if len(words) > memory.depth:
+                raise ValueError(
+                        f"{len(words)} words do not fit in memory "
+                        f"{memory.name} of depth {memory.depth}")
+        self._process = process
+        if self.runs:
+            self._simulator.reset()
+        self.runs += 1
+        if deadline is None:
+            self._simulator.run()
+        else:
+            self._simulator.run_until(deadline)
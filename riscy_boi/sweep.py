@@ -0,0 +1,192 @@
+"""
+Sweep of PLL frequencies and nextpnr seeds, finding the fastest clock Top
+meets timing at
+
+Top is synthesised with the PLL configured for each candidate sync clock
+frequency, and placed and routed with nextpnr, in a pool of processes. Each
+frequency is first tried with one seed. Frequencies which fail, but are
+faster than the fastest to pass, are then tried with more seeds, as timing
+varies with placement. The fastest passing configuration is written as JSON,
+which the entry point builds with:
+
+    python -m riscy_boi.sweep --min-mhz 16 --max-mhz 60 --output clock.json
+    python -m riscy_boi --clock-config clock.json
+
+Synthesis is cached, see build_cache, so each frequency is only synthesised
+once. Needs nmigen_boards and the yowasp-nextpnr-ice40 package.
+"""
+import argparse
+import concurrent.futures
+import json
+import os
+import pathlib
+import sys
+
+from . import build_cache
+from . import pll
+from . import synthesis
+
+
+def candidates(min_mhz, max_mhz, step_mhz):
+    """
+    The PLL configurations closest to evenly spaced frequencies
+
+    Returns:
+        list of pll.Config: the configurations, fastest first, without
+            duplicates
+    """
+    configs = set()
+    target = min_mhz
+    while target <= max_mhz:
+        config = pll.closest(target)
+        if min_mhz <= pll.frequency(config) <= max_mhz:
+            configs.add(config)
+        target += step_mhz
+    return sorted(configs, key=pll.frequency, reverse=True)
+
+
+def place_and_route(job):
+    """
+    Synthesise, place and route Top with a PLL configuration and seed
+
+    Args:
+        job (tuple): whether Top has the pipelined CPU, the pll.Config and
+            the seed
+
+    Returns:
+        tuple: the job, and the maximum frequency in MHz by clock domain
+    """
+    pipelined, config, seed = job
+    rtlil_text, pcf = synthesis.top_rtlil(pipelined, config)
+    result = synthesis.synthesise_rtlil(
+            rtlil_text,
+            pcf,
+            cache=build_cache.BuildCache(),
+            seed=seed)
+    if result["fmax_mhz"] is None:
+        raise ImportError("the yowasp-nextpnr-ice40 package is needed")
+    return job, result["fmax_mhz"]
+
+
+def passes(config, fmax):
+    """Whether the sync clock meets its constraint"""
+    return fmax.get("sync", 0) >= pll.frequency(config)
+
+
+def best(results):
+    """
+    The fastest passing result
+
+    Args:
+        results (dict): the maximum frequencies by clock domain, by job
+
+    Returns:
+        tuple: the job and its maximum frequencies, or None if none pass
+    """
+    passing = [(job, fmax) for job, fmax in results.items()
+               if passes(job[1], fmax)]
+    if not passing:
+        return None
+    return max(
+            passing,
+            key=lambda result: (pll.frequency(result[0][1]),
+                                result[1]["sync"]))
+
+
+def sweep(pipelined, configs, seeds, workers=None):
+    """
+    Find the fastest configuration meeting timing
+
+    Args:
+        pipelined (bool): whether Top has the pipelined CPU
+        configs (list of pll.Config): the configurations to try
+        seeds (int): the number of seeds to try a configuration with before
+            it is considered failing
+        workers (int): the number of processes, or None for one per CPU
+
+    Returns:
+        dict: the maximum frequencies by clock domain, by job
+    """
+    results = {}
+    with concurrent.futures.ProcessPoolExecutor(workers) as pool:
+        jobs = [(pipelined, config, 1) for config in configs]
+        results.update(pool.map(place_and_route, jobs))
+        found = best(results)
+        fastest_passing = pll.frequency(found[0][1]) if found else 0
+        jobs = [(pipelined, config, seed)
+                for config in configs
+                if pll.frequency(config) > fastest_passing and
+                not passes(config, results[(pipelined, config, 1)])
+                for seed in range(2, seeds + 1)]
+        results.update(pool.map(place_and_route, jobs))
+    return results
+
+
+def main():
+    """Find the fastest sync clock Top meets timing at"""
+    parser = argparse.ArgumentParser(description=main.__doc__)
+    parser.add_argument(
+            "--pipelined",
+            action="store_true",
+            help="sweep Top with the five-stage pipelined CPU")
+    parser.add_argument(
+            "--min-mhz",
+            type=float,
+            default=pll.OUTPUT_MHZ[0],
+            help=f"slowest frequency to try (default: {pll.OUTPUT_MHZ[0]})")
+    parser.add_argument(
+            "--max-mhz",
+            type=float,
+            default=80,
+            help="fastest frequency to try (default: 80)")
+    parser.add_argument(
+            "--step-mhz",
+            type=float,
+            default=2,
+            help="spacing of the frequencies to try (default: 2)")
+    parser.add_argument(
+            "--seeds",
+            type=int,
+            default=8,
+            help="seeds to try failing frequencies with (default: 8)")
+    parser.add_argument(
+            "--jobs",
+            type=int,
+            default=os.cpu_count(),
+            help=f"processes to run (default: {os.cpu_count()})")
+    parser.add_argument(
+            "--output",
+            type=pathlib.Path,
+            default=pathlib.Path("clock.json"),
+            help="JSON file to write the fastest configuration to "
+                 "(default: clock.json)")
+    args = parser.parse_args()
+
+    configs = candidates(args.min_mhz, args.max_mhz, args.step_mhz)
+    results = sweep(args.pipelined, configs, args.seeds, args.jobs)
+    for (_, config, seed), fmax in sorted(
+            results.items(),
+            key=lambda result: (pll.frequency(result[0][1]), result[0][2])):
+        achieved = ", ".join(
+                f"{domain} {mhz:.1f} MHz" for domain, mhz in fmax.items())
+        print(f"{pll.frequency(config):7.2f} MHz seed {seed:3} "
+              f"{'pass' if passes(config, fmax) else 'fail'}: {achieved}")
+
+    found = best(results)
+    if found is None:
+        print("No frequency meets timing", file=sys.stderr)
+        sys.exit(1)
+    (_, config, seed), fmax = found
+    args.output.write_text(json.dumps({
+            "pipelined": args.pipelined,
+            "pll": config._asdict(),
+            "frequency_mhz": pll.frequency(config),
+            "seed": seed,
+            "fmax_mhz": fmax,
+    }, indent=4) + "\n")
+    print(f"Fastest: top.Top(pll_config=pll.{config}) at "
+          f"{pll.frequency(config):.2f} MHz with seed {seed}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,580 @@
+"""
+Synthesis benchmarks, recording the resource use and timing of each component
+
+Top, and each component standalone, is synthesised for the iCE40 with Yosys,
+using the yowasp-yosys package, and placed and routed with nextpnr if the
+yowasp-nextpnr-ice40 package is installed. The LUTs, carries, flip-flops and
+block RAMs used, the longest combinational path, and the maximum frequency of
+each clock domain are reported as JSON, and compared against a stored
+baseline so designs which are larger or slower are caught:
+
+    python -m riscy_boi.synthesis --output results.json
+    python -m riscy_boi.synthesis --component cpu --component alu
+    python -m riscy_boi.synthesis --update-baseline
+
+A component with no baseline, or with an fmax measured but none in its
+baseline, fails the comparison, so the baseline must be updated with
+nextpnr installed for timing to be checked. Without nextpnr, fmax is not
+measured, and a warning says so.
+
+Top is built with the BlackIce II platform from nmigen_boards, so is skipped
+if it is not installed. The products of Yosys and nextpnr are cached, see
+build_cache, so only changed components are rebuilt.
+"""
+import argparse
+import importlib
+import json
+import os
+import pathlib
+import re
+import sys
+import tempfile
+
+import nmigen as nm
+from nmigen.back import rtlil
+
+from . import alu
+from . import build_cache
+from . import cpu
+from . import dual_issue_cpu
+from . import instruction_decoder
+from . import muldiv
+from . import pipelined_cpu
+from . import pll
+from . import register_file
+from . import top
+from . import uart
+
+BASELINE = (pathlib.Path(__file__).parent.parent /
+            "benchmarks" / "synthesis_baseline.json")
+WORK_DIR = pathlib.Path(os.environ.get(
+        "RISCY_BOI_SYNTHESIS_DIR",
+        pathlib.Path.home() / ".cache" / "riscy_boi" / "synthesis"))
+# The fraction resource use may exceed, or fmax fall below, the baseline by.
+# fmax varies more between builds, with placement.
+TOLERANCE = 0.02
+FMAX_TOLERANCE = 0.05
+RESOURCES = ("luts", "carries", "flip_flops", "brams")
+# The longest path is found through the wires and logic cells only, as
+# Yosys's ltp does not recognise the iCE40 flip-flops as ending paths
+SYNTH_SCRIPT = (
+        "read_rtlil {build_dir}/design.il; "
+        "synth_ice40 -top top -json {build_dir}/design.json; "
+        "tee -q -o {build_dir}/stat.json stat -json; "
+        "tee -q -o {build_dir}/ltp.txt ltp w:* t:SB_LUT4 t:SB_CARRY %u %u")
+# For the HX4K on the BlackIce II, which is an HX8K die in a smaller package.
+# The fmax is measured rather than required, so designs slower than
+# nextpnr's default target, such as the unrolled MulDiv, are still reported.
+NEXTPNR_OPTIONS = ["--quiet", "--hx8k", "--package", "tq144:4k",
+                   "--timing-allow-fail"]
+
+
+class Harness(nm.Elaboratable):
+    """
+    Connects a design's ports to shift registers
+
+    A component has too many ports to place on the FPGA's pins, so its
+    inputs are shifted in from one pin, and its outputs loaded into a shift
+    register shifted out to another. Every port of the design is then
+    registered, so timing analysis measures the paths between them, and none
+    of its logic is optimised away.
+
+    * serial_in (in): shifted into the inputs each cycle
+    * load (in): high to load the outputs into the output shift register,
+      rather than shift it
+    * serial_out (out): the end of the output shift register
+    """
+
+    def __init__(self, design, inputs, outputs):
+        """
+        Initialiser
+
+        Args:
+            design (nm.Elaboratable): the design
+            inputs (list of nm.Signal): the design's inputs
+            outputs (list of nm.Signal): the design's outputs
+        """
+        self.design = design
+        self.inputs = inputs
+        self.outputs = outputs
+
+        self.serial_in = nm.Signal()
+        self.load = nm.Signal()
+        self.serial_out = nm.Signal()
+        self.ports = [self.serial_in, self.load, self.serial_out]
+
+    def elaborate(self, _):
+        m = nm.Module()
+        m.submodules.design = self.design
+
+        inputs = nm.Cat(*self.inputs)
+        outputs = nm.Cat(*self.outputs)
+        input_chain = nm.Signal(len(inputs))
+        output_chain = nm.Signal(len(outputs))
+        m.d.sync += input_chain.eq(nm.Cat(input_chain[1:], self.serial_in))
+        with m.If(self.load):
+            m.d.sync += output_chain.eq(outputs)
+        with m.Else():
+            m.d.sync += output_chain.eq(output_chain[1:])
+        m.d.comb += [
+                inputs.eq(input_chain),
+                self.serial_out.eq(output_chain[0]),
+        ]
+        return m
+
+
+def synthesise(design, ports, work_dir=WORK_DIR, cache=None):
+    """
+    Synthesise a design, then place and route it if nextpnr is installed
+
+    Args:
+        design (nm.Elaboratable): the design
+        ports (list of nm.Signal): the design's ports
+        work_dir (pathlib.Path): directory to build in
+        cache (build_cache.BuildCache): cache of each stage's products, or
+            None to always run the tools
+
+    Returns:
+        dict: see synthesise_rtlil
+    """
+    return synthesise_rtlil(
+            rtlil.convert(design, ports=ports),
+            work_dir=work_dir,
+            cache=cache)
+
+
+def synthesise_rtlil(rtlil_text, pcf=None, work_dir=WORK_DIR, cache=None,
+                     seed=1):
+    """
+    Synthesise an RTLIL design, then place and route it if nextpnr is
+    installed
+
+    Args:
+        rtlil_text (str): the design, with a top module named top
+        pcf (str): the pin constraints, or None to let nextpnr place the
+            design's ports
+        work_dir (pathlib.Path): directory to build in
+        cache (build_cache.BuildCache): cache of each stage's products, or
+            None to always run the tools
+        seed (int): nextpnr's placement seed
+
+    Returns:
+        dict: the number of each cell type, LUTs, carries, flip-flops and
+            block RAMs, the longest path in logic cells, and the maximum
+            frequency in MHz by clock domain, or None if the design was not
+            placed and routed
+    """
+    work_dir = pathlib.Path(work_dir)
+    work_dir.mkdir(parents=True, exist_ok=True)
+    # Yosys runs in a WebAssembly sandbox which mounts its own directory over
+    # /tmp, so build in the work directory rather than the system's
+    with tempfile.TemporaryDirectory(dir=work_dir) as build_dir:
+        build_dir = pathlib.Path(build_dir)
+
+        def run_yosys():
+            yowasp_yosys = importlib.import_module("yowasp_yosys")
+            (build_dir / "design.il").write_text(rtlil_text, encoding="utf-8")
+            status = yowasp_yosys.run_yosys([
+                    "-q", "-p", SYNTH_SCRIPT.format(build_dir=build_dir)])
+            if status:
+                raise RuntimeError(f"Yosys failed with status {status}")
+
+        run_stage(
+                cache,
+                build_cache.digest(
+                    "synth",
+                    rtlil_text,
+                    SYNTH_SCRIPT,
+                    build_cache.package_version("yowasp-yosys")),
+                build_dir,
+                ["design.json", "stat.json", "ltp.txt"],
+                run_yosys)
+
+        stat = json.loads((build_dir / "stat.json").read_text())
+        cells = stat["design"]["num_cells_by_type"]
+        depth = re.search(
+                r"length=(\d+)",
+                (build_dir / "ltp.txt").read_text())
+        if pcf is not None:
+            (build_dir / "design.pcf").write_text(pcf, encoding="utf-8")
+        result = {
+                "cells": cells,
+                "luts": cells.get("SB_LUT4", 0),
+                "carries": cells.get("SB_CARRY", 0),
+                "flip_flops": sum(
+                    count for cell, count in cells.items()
+                    if cell.startswith("SB_DFF")),
+                "brams": sum(
+                    count for cell, count in cells.items()
+                    if cell.startswith("SB_RAM40_4K")),
+                "logic_depth": int(depth.group(1)) if depth else None,
+                "fmax_mhz": place_and_route(build_dir, pcf, cache, seed),
+        }
+    return result
+
+
+def place_and_route(build_dir, pcf, cache=None, seed=1):
+    """
+    Place and route a synthesised design
+
+    Args:
+        build_dir (pathlib.Path): the directory holding design.json, and
+            design.pcf if constrained
+        pcf (str): the pin constraints, or None if unconstrained
+        cache (build_cache.BuildCache): cache of the report, or None to
+            always run nextpnr
+        seed (int): the placement seed
+
+    Returns:
+        dict: the maximum frequency in MHz by clock domain, or None if
+            nextpnr is not installed
+    """
+    try:
+        yowasp_nextpnr = importlib.import_module("yowasp_nextpnr_ice40")
+    except ImportError:
+        return None
+    report = build_dir / "report.json"
+    constraints = (["--pcf", str(build_dir / "design.pcf")] if pcf is not None
+                   else ["--pcf-allow-unconstrained"])
+
+    def run_nextpnr():
+        status = yowasp_nextpnr.run_nextpnr_ice40([
+                *NEXTPNR_OPTIONS,
+                *constraints,
+                "--seed", str(seed),
+                "--json", str(build_dir / "design.json"),
+                "--report", str(report)])
+        if status:
+            raise RuntimeError(f"nextpnr failed with status {status}")
+
+    run_stage(
+            cache,
+            build_cache.digest(
+                "pnr",
+                (build_dir / "design.json").read_bytes(),
+                pcf or "",
+                *NEXTPNR_OPTIONS,
+                str(seed),
+                build_cache.package_version("yowasp-nextpnr-ice40")),
+            build_dir,
+            [report.name],
+            run_nextpnr)
+    fmax = json.loads(report.read_text()).get("fmax", {})
+    return {
+            clock_domain(net): round(clock["achieved"], 2)
+            for net, clock in fmax.items()}
+
+
+def run_stage(cache, key, build_dir, names, build):
+    """Run a build stage, through the cache if there is one"""
+    # pylint: disable=too-many-arguments
+    if cache is None:
+        build()
+    else:
+        cache.run(key, build_dir, names, build)
+
+
+def clock_domain(net):
+    """
+    The clock domain of a clock net in a nextpnr report
+
+    nmigen names the sync domain's clock clk, and other domains' clocks
+    <domain>_clk, and nextpnr adds suffixes to nets such as $glb_clk.
+    """
+    name = net.split("$")[0].rstrip("_")
+    if name == "clk":
+        return "sync"
+    if name.endswith("_clk"):
+        return name[:-len("_clk")]
+    return name
+
+
+def harness_rtlil(design, inputs, outputs):
+    """The RTLIL of a design connected to a Harness, with no constraints"""
+    harness = Harness(design, inputs, outputs)
+    return rtlil.convert(harness, ports=harness.ports), None
+
+
+def top_rtlil(pipelined=False, pll_config=pll.DEFAULT):
+    """The RTLIL and pin constraints of Top on the BlackIce II"""
+    blackice_ii = importlib.import_module("nmigen_boards.blackice_ii")
+    plan = blackice_ii.BlackIceIIPlatform().build(
+            top.Top(pipelined=pipelined, pll_config=pll_config),
+            name="top",
+            do_build=False)
+    return plan.files["top.il"], plan.files["top.pcf"]
+
+
+def alu_rtlil(adder=alu.Adder.SEPARATE, shifter=alu.Shifter.SEPARATE):
+    alu_inst = alu.ALU(32, adder=adder, shifter=shifter)
+    return harness_rtlil(
+            alu_inst,
+            [alu_inst.op, alu_inst.a, alu_inst.b, alu_inst.valid,
+             alu_inst.advance],
+            [alu_inst.o, alu_inst.busy])
+
+
+def muldiv_rtlil(implementation):
+    muldiv_inst = muldiv.MulDiv(implementation)
+    return harness_rtlil(
+            muldiv_inst,
+            [muldiv_inst.op, muldiv_inst.a, muldiv_inst.b, muldiv_inst.valid,
+             muldiv_inst.advance],
+            [muldiv_inst.o, muldiv_inst.busy])
+
+
+def instruction_decoder_rtlil():
+    idec = instruction_decoder.InstructionDecoder()
+    return harness_rtlil(
+            idec,
+            [idec.instr],
+            [idec.pc_load, idec.branch, idec.branch_funct, idec.alu_op,
+             idec.alu_imm, idec.alu_mux_op, idec.alu_a_mux_op,
+             idec.rf_write_enable, idec.rf_write_select,
+             idec.rf_read_select_1, idec.rf_read_select_2, idec.rd_mux_op,
+             idec.dmem_address_mode, idec.dmem_signed, idec.dmem_store,
+             idec.csr])
+
+
+def register_file_rtlil(registered_reads=False):
+    rf = register_file.RegisterFile(registered_reads=registered_reads)
+    inputs = [rf.read_select_1, rf.read_select_2, rf.write_enable,
+              rf.write_select, rf.write_data]
+    if registered_reads:
+        inputs += [rf.read_enable]
+    return harness_rtlil(
+            rf,
+            inputs,
+            [rf.read_data_1, rf.read_data_2, rf.debug_out])
+
+
+def uart_rtlil():
+    uart_inst = uart.UART(
+            round(pll.frequency(pll.DEFAULT) * 1e6 / top.BAUD))
+    return harness_rtlil(
+            uart_inst,
+            [uart_inst.addr, uart_inst.r_en, uart_inst.w_en, uart_inst.w_data,
+             uart_inst.rx],
+            [uart_inst.r_data, uart_inst.irq, uart_inst.tx])
+
+
+def cpu_rtlil(cpu_inst):
+    outputs = [cpu_inst.imem_addr, cpu_inst.dmem_r_addr, cpu_inst.dmem_w_addr,
+               cpu_inst.dmem_w_data, cpu_inst.dmem_w_en, cpu_inst.dmem_r_en,
+               cpu_inst.debug_out]
+    inputs = [cpu_inst.imem_data, cpu_inst.dmem_r_data, cpu_inst.time_tick,
+              cpu_inst.imem_valid, cpu_inst.dmem_valid]
+    if isinstance(cpu_inst, pipelined_cpu.PipelinedCPU):
+        outputs += [cpu_inst.dmem_repeat]
+    return harness_rtlil(cpu_inst, inputs, outputs)
+
+
+# Functions returning the RTLIL and pin constraints of each component, with
+# an ALU for each non-default adder and shifter
+COMPONENTS = {
+        "top": top_rtlil,
+        "cpu": lambda: cpu_rtlil(cpu.CPU()),
+        "pipelined_cpu": lambda: cpu_rtlil(pipelined_cpu.PipelinedCPU()),
+        "pipelined_cpu_registered_reads": lambda: cpu_rtlil(
+            pipelined_cpu.PipelinedCPU(registered_reads=True)),
+        "dual_issue_cpu": lambda: cpu_rtlil(dual_issue_cpu.DualIssueCPU()),
+        "alu": alu_rtlil,
+        **{
+            f"alu_{adder.value}_{shifter.value}": (
+                lambda adder=adder, shifter=shifter: alu_rtlil(
+                    adder, shifter))
+            for adder in alu.Adder
+            for shifter in alu.Shifter
+            if (adder, shifter) != (alu.Adder.SEPARATE,
+                                    alu.Shifter.SEPARATE)
+        },
+        "instruction_decoder": instruction_decoder_rtlil,
+        "register_file": register_file_rtlil,
+        "register_file_registered_reads": lambda: register_file_rtlil(True),
+        "muldiv": lambda: muldiv_rtlil(muldiv.Implementation.ITERATIVE),
+        "muldiv_unrolled": lambda: muldiv_rtlil(
+            muldiv.Implementation.UNROLLED),
+        "uart": uart_rtlil,
+}
+
+
+def run(component, work_dir=WORK_DIR, cache=None):
+    """
+    Synthesise a component
+
+    Args:
+        component (str): a key of COMPONENTS
+        work_dir (pathlib.Path): directory to build in
+        cache (build_cache.BuildCache): cache of each stage's products, or
+            None to always run the tools
+
+    Returns:
+        dict: see synthesise_rtlil
+    """
+    rtlil_text, pcf = COMPONENTS[component]()
+    return synthesise_rtlil(rtlil_text, pcf, work_dir, cache)
+
+
+def regressions(results, baseline, tolerance=TOLERANCE,
+                fmax_tolerance=FMAX_TOLERANCE):
+    """
+    Find results worse than their baseline by more than a tolerance
+
+    Args:
+        results (dict): results by component name, as from run
+        baseline (dict): baseline resources and fmax in the same structure
+        tolerance (float): the fraction resource use may exceed its baseline
+            by
+        fmax_tolerance (float): the fraction fmax may fall below its
+            baseline by
+
+    Returns:
+        list of str: descriptions of each regression
+    """
+    found = []
+    for component, result in results.items():
+        expected = baseline.get(component)
+        if expected is None:
+            continue
+        for resource in RESOURCES:
+            if result[resource] > expected[resource] * (1 + tolerance):
+                found.append(
+                        f"{component}: {resource} {result[resource]} > "
+                        f"baseline {expected[resource]}")
+        expected_fmax = expected.get("fmax_mhz") or {}
+        for domain, fmax in (result["fmax_mhz"] or {}).items():
+            if domain not in expected_fmax:
+                continue
+            if fmax < expected_fmax[domain] * (1 - fmax_tolerance):
+                found.append(
+                        f"{component}: {domain} fmax {fmax} MHz < baseline "
+                        f"{expected_fmax[domain]} MHz")
+    return found
+
+
+def unchecked(results, baseline):
+    """
+    Find results which can not be compared against the baseline
+
+    Args:
+        results (dict): results by component name, as from run
+        baseline (dict): baseline resources and fmax in the same structure
+
+    Returns:
+        tuple: descriptions of results with no baseline, and of components
+            whose fmax was not measured
+    """
+    missing = []
+    unmeasured = []
+    for component, result in results.items():
+        expected = baseline.get(component)
+        if expected is None:
+            missing.append(f"{component}: no baseline")
+            continue
+        if result["fmax_mhz"] is None:
+            unmeasured.append(component)
+            continue
+        expected_fmax = expected.get("fmax_mhz") or {}
+        for domain in result["fmax_mhz"]:
+            if domain not in expected_fmax:
+                missing.append(f"{component}: no {domain} fmax baseline")
+    return missing, unmeasured
+
+
+def main():
+    """Synthesise the components, reporting results and regressions"""
+    parser = argparse.ArgumentParser(description=main.__doc__)
+    parser.add_argument(
+            "--component",
+            choices=sorted(COMPONENTS),
+            action="append",
+            help="component to synthesise, may be repeated (default: all)")
+    parser.add_argument(
+            "--output",
+            type=pathlib.Path,
+            default=pathlib.Path("synthesis_results.json"),
+            help="JSON file to write results to "
+                 "(default: synthesis_results.json)")
+    parser.add_argument(
+            "--baseline",
+            type=pathlib.Path,
+            default=BASELINE,
+            help=f"JSON file of baseline results (default: {BASELINE})")
+    parser.add_argument(
+            "--tolerance",
+            type=float,
+            default=TOLERANCE,
+            help="fraction by which resource use may exceed the baseline "
+                 f"(default: {TOLERANCE})")
+    parser.add_argument(
+            "--fmax-tolerance",
+            type=float,
+            default=FMAX_TOLERANCE,
+            help="fraction by which fmax may fall below the baseline "
+                 f"(default: {FMAX_TOLERANCE})")
+    parser.add_argument(
+            "--update-baseline",
+            action="store_true",
+            help="write the results to the baseline file")
+    parser.add_argument(
+            "--no-cache",
+            action="store_true",
+            help="run the tools even if a component is unchanged, rather "
+                 f"than reusing their results from {build_cache.CACHE_DIR}")
+    args = parser.parse_args()
+
+    cache = None if args.no_cache else build_cache.BuildCache()
+    results = {}
+    for component in args.component or COMPONENTS:
+        try:
+            result = run(component, cache=cache)
+        except ImportError as error:
+            print(f"{component:30} skipped: {error}", file=sys.stderr)
+            continue
+        results[component] = result
+        fmax = ", ".join(
+                f"{domain} {mhz:.1f} MHz"
+                for domain, mhz in (result["fmax_mhz"] or {}).items())
+        depth = result["logic_depth"]
+        print(f"{component:30} "
+              f"LUTs {result['luts']:5} "
+              f"carries {result['carries']:4} "
+              f"FFs {result['flip_flops']:5} "
+              f"BRAMs {result['brams']:2} "
+              f"depth {'-' if depth is None else depth:>4} "
+              f"fmax {fmax or '-'}")
+
+    args.output.write_text(json.dumps(results, indent=4) + "\n")
+
+    if args.update_baseline:
+        baseline = {
+                component: {
+                    key: result[key]
+                    for key in RESOURCES + ("fmax_mhz",)}
+                for component, result in results.items()}
+        args.baseline.parent.mkdir(parents=True, exist_ok=True)
+        args.baseline.write_text(json.dumps(baseline, indent=4) + "\n")
+        return
+
+    baseline = json.loads(args.baseline.read_text())
+    found = regressions(
+            results,
+            baseline,
+            args.tolerance,
+            args.fmax_tolerance)
+    for regression in found:
+        print(f"Regression: {regression}", file=sys.stderr)
+    missing, unmeasured = unchecked(results, baseline)
+    for description in missing:
+        print(f"Not in baseline: {description}, run with --update-baseline",
+              file=sys.stderr)
+    if unmeasured:
+        print(f"WARNING: timing not checked, as yowasp-nextpnr-ice40 is not "
+              f"installed to measure the fmax of {', '.join(unmeasured)}",
+              file=sys.stderr)
+    if found or missing:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,12 +1,212 @@
 """Top level hardware"""
 import nmigen as nm
+import numpy as np
 
+from . import assembler
 from . import cpu
-from . import encoding
+from . import dual_issue_cpu
+from . import pipelined_cpu
+from . import pll
+from . import uart
+
+MIN_MEMORY_WORDS = 256
+# Each memory may use up to 8 of the iCE40HX4K's 20 4 kbit block RAMs,
+# leaving the rest for the register file
+MAX_MEMORY_WORDS = 8 * 4096 // 32
+# Data accesses at or above this byte address go to the UART's registers
+UART_BASE = 0x8000_0000
+BAUD = 115200
+
+
+class System(nm.Elaboratable):
+    """
+    A CPU with its instruction and data memories and a UART
+
+    The UART's registers are mapped into data memory from UART_BASE, a word
+    for each uart.Register, so firmware can send results to the host. The
+    data memory is mapped from its base address up to UART_BASE.
+
+    Ports:
+
+    * tx (out): the UART's serial output
+    * rx (in): the UART's serial input
+    * debug_out (out): the value of the CPU's debug register
+    """
+
+    def __init__(self, divisor, pipelined=False, image=None, dmem_base=0,
+                 dual_issue=False, debug_reg=2):
+        """
+        Initialiser
+
+        Args:
+            divisor (int): the sync clock cycles per UART bit after reset
+            pipelined (bool): use the five-stage pipelined CPU rather than the
+                single-cycle CPU
+            image (loader.Image): the program to run from the first word of
+                its instruction memory, whatever its entry point, or None to
+                count up in the debug register
+            dmem_base (int): the byte address of the first word of the
+                image's data memory
+            dual_issue (bool): use the dual-issue CPU rather than the
+                single-cycle CPU
+            debug_reg (int): the register output on debug_out
+        """
+        # pylint: disable=too-many-arguments
+        if pipelined and dual_issue:
+            raise ValueError("The CPU can't be both pipelined and dual-issue")
+        if image is None:
+            self.program = assembler.assemble(f"""
+            loop:   addi x{debug_reg}, x{debug_reg}, 1
+                    jal x5, loop
+            """)
+            self.data = []
+        else:
+            self.program, self.data = image.imem, image.dmem
+        for name, words in [("instruction", self.program),
+                            ("data", self.data)]:
+            if len(words) > MAX_MEMORY_WORDS:
+                raise ValueError(
+                        f"{len(words)} words of {name} memory is more than "
+                        f"the {MAX_MEMORY_WORDS} the block RAMs can hold")
+        dmem_end = dmem_base + 4 * max(MIN_MEMORY_WORDS, len(self.data))
+        if dmem_base % 4 or dmem_end > UART_BASE:
+            raise ValueError(
+                    f"Data memory from {dmem_base:#x} to {dmem_end:#x} is not "
+                    f"word aligned below the UART's registers at "
+                    f"{UART_BASE:#x}")
+        self.divisor = divisor
+        self.pipelined = pipelined
+        self.dual_issue = dual_issue
+        self.dmem_base = dmem_base
+        self.debug_reg = debug_reg
+
+        self.tx = nm.Signal(reset=1)
+        self.rx = nm.Signal(reset=1)
+        self.debug_out = nm.Signal(32)
+
+    def elaborate(self, _):
+        m = nm.Module()
+
+        if self.pipelined:
+            cpu_inst = m.submodules.cpu = pipelined_cpu.PipelinedCPU(
+                    debug_reg=self.debug_reg)
+        elif self.dual_issue:
+            cpu_inst = m.submodules.cpu = dual_issue_cpu.DualIssueCPU(
+                    debug_reg=self.debug_reg)
+        else:
+            cpu_inst = m.submodules.cpu = cpu.CPU(debug_reg=self.debug_reg)
+        m.d.comb += self.debug_out.eq(cpu_inst.debug_out)
+
+        # The dual-issue CPU fetches doublewords of two instructions
+        program = self.program
+        fetch_bytes = len(cpu_inst.imem_data) // 8
+        if fetch_bytes == 8:
+            program = np.append(program, np.zeros(len(program) % 2, np.uint32))
+            program = (program[::2].astype(np.uint64) |
+                       program[1::2].astype(np.uint64) << np.uint64(32))
+        imem = nm.Memory(
+                width=len(cpu_inst.imem_data),
+                depth=max(MIN_MEMORY_WORDS * 4 // fetch_bytes, len(program)),
+                init=[int(word) for word in program])
+        imem_rp = m.submodules.imem_rp = imem.read_port()
+        m.d.comb += [
+                imem_rp.addr.eq(
+                    cpu_inst.imem_addr[fetch_bytes.bit_length() - 1:]),
+                cpu_inst.imem_data.eq(imem_rp.data),
+        ]
+
+        # The pipelined CPU presents a load's address in the same cycle as
+        # the previous instruction's store, so the read port must be
+        # transparent. The single-cycle and dual-issue CPUs wait for loads
+        # until the data is read, the cycle after they are presented.
+        dmem = nm.Memory(
+                width=32,
+                depth=max(MIN_MEMORY_WORDS, len(self.data)),
+                init=self.data)
+        dmem_rp = m.submodules.dmem_rp = dmem.read_port(
+                transparent=self.pipelined)
+        dmem_wp = m.submodules.dmem_wp = dmem.write_port(granularity=8)
+        # Reading or writing the UART's registers has side effects, so it
+        # only sees the first cycle an access is presented in
+        first = nm.Signal()
+        if self.pipelined:
+            m.d.comb += first.eq(~cpu_inst.dmem_repeat)
+        else:
+            load_read = nm.Signal()
+            m.d.sync += load_read.eq(cpu_inst.dmem_r_en & ~load_read)
+            m.d.comb += [
+                    cpu_inst.dmem_valid.eq(~cpu_inst.dmem_r_en | load_read),
+                    first.eq(~load_read),
+            ]
+
+        uart_inst = m.submodules.uart = uart.UART(self.divisor)
+        uart_bit = (UART_BASE >> 2).bit_length() - 1
+        uart_read = cpu_inst.dmem_r_addr[uart_bit]
+        uart_write = cpu_inst.dmem_w_addr[uart_bit]
+        uart_was_read = nm.Signal()
+        m.d.sync += uart_was_read.eq(uart_read)
+        # The data memory is indexed from its base address
+        dmem_base = self.dmem_base >> 2
+        m.d.comb += [
+                dmem_rp.addr.eq(cpu_inst.dmem_r_addr - dmem_base),
+                cpu_inst.dmem_r_data.eq(
+                    nm.Mux(uart_was_read, uart_inst.r_data, dmem_rp.data)),
+                dmem_wp.addr.eq(cpu_inst.dmem_w_addr - dmem_base),
+                dmem_wp.data.eq(cpu_inst.dmem_w_data),
+                dmem_wp.en.eq(nm.Mux(uart_write, 0, cpu_inst.dmem_w_en)),
+
+                uart_inst.addr.eq(nm.Mux(
+                    cpu_inst.dmem_r_en,
+                    cpu_inst.dmem_r_addr,
+                    cpu_inst.dmem_w_addr)),
+                uart_inst.r_en.eq(cpu_inst.dmem_r_en & uart_read & first),
+                uart_inst.w_en.eq(
+                    nm.Mux(uart_write & first, cpu_inst.dmem_w_en, 0)),
+                uart_inst.w_data.eq(cpu_inst.dmem_w_data),
+                self.tx.eq(uart_inst.tx),
+                uart_inst.rx.eq(self.rx),
+        ]
+
+        return m
 
 
 class Top(nm.Elaboratable):
-    """Top level"""
+    """
+    Top level
+
+    A System clocked by the PLL, with the UART on the board's serial pins
+    and the debug register on its LEDs.
+    """
+
+    def __init__(self, pipelined=False, image=None, pll_config=pll.DEFAULT,
+                 dual_issue=False, baud=BAUD, dmem_base=0):
+        """
+        Initialiser
+
+        Args:
+            pipelined (bool): use the five-stage pipelined CPU rather than the
+                single-cycle CPU
+            image (loader.Image): the program to run from the first word of
+                its instruction memory, whatever its entry point, or None to
+                count up in the debug register
+            pll_config (pll.Config): the dividers of the PLL generating the
+                sync clock from the 100 MHz clock
+            dual_issue (bool): use the dual-issue CPU rather than the
+                single-cycle CPU
+            baud (int): the UART's baud rate after reset
+            dmem_base (int): the byte address of the first word of the
+                image's data memory
+        """
+        # pylint: disable=too-many-arguments
+        self.pll_config = pll_config
+        # Built here, so an image that doesn't fit is rejected before
+        # elaborating
+        self.system = System(
+                round(pll.frequency(pll_config) * 1e6 / baud),
+                pipelined=pipelined,
+                image=image,
+                dmem_base=dmem_base,
+                dual_issue=dual_issue)
 
     def elaborate(self, platform):
         m = nm.Module()
@@ -15,55 +215,32 @@ class Top(nm.Elaboratable):
         m.domains += cd_sync
 
         clk100 = platform.request("clk100")
-        cd_fast = nm.ClockDomain("fast")
-        m.domains += cd_fast
-        m.d.comb += cd_fast.clk.eq(clk100.i)
 
         m.submodules.pll = nm.Instance(
                 "SB_PLL40_CORE",
                 p_FEEDBACK_PATH="SIMPLE",
-                p_DIVR=3,
-                p_DIVF=40,
-                p_DIVQ=6,
-                p_FILTER_RANGE=2,
+                p_DIVR=self.pll_config.divr,
+                p_DIVF=self.pll_config.divf,
+                p_DIVQ=self.pll_config.divq,
+                p_FILTER_RANGE=pll.filter_range(self.pll_config),
                 i_RESETB=1,
                 i_BYPASS=0,
                 i_REFERENCECLK=clk100.i,
                 o_PLLOUTCORE=cd_sync.clk)
+        # So nextpnr reports whether the sync domain meets timing
+        platform.add_clock_constraint(
+                cd_sync.clk,
+                pll.frequency(self.pll_config) * 1e6)
 
-        reg = 2
-        cpu_inst = m.submodules.cpu = cpu.CPU(debug_reg=reg)
-        link_reg = 5
-        program = [encoding.IType.encode(
-                        1,
-                        reg,
-                        encoding.IntRegImmFunct.ADDI,
-                        reg,
-                        encoding.Opcode.OP_IMM),
-                   # jump back to the previous instruction for infinite loop
-                   encoding.JType.encode(0x1ffffc, link_reg)]
-
-        imem = nm.Memory(width=32, depth=256, init=program)
-        imem_rp = m.submodules.imem_rp = imem.read_port()
+        system = m.submodules.system = self.system
+        uart_pins = platform.request("uart")
         m.d.comb += [
-                imem_rp.addr.eq(cpu_inst.imem_addr),
-                cpu_inst.imem_data.eq(imem_rp.data),
-        ]
-
-        dmem = nm.Memory(width=32, depth=256)
-        dmem_rp = m.submodules.dmem_rp = dmem.read_port(
-                transparent=False,
-                domain="fast")
-        dmem_wp = m.submodules.dmem_wp = dmem.write_port(domain="fast")
-        m.d.comb += [
-                dmem_rp.addr.eq(cpu_inst.dmem_r_addr),
-                cpu_inst.dmem_r_data.eq(dmem_rp.data),
-                dmem_wp.addr.eq(cpu_inst.dmem_w_addr),
-                dmem_wp.data.eq(cpu_inst.dmem_w_data),
+                uart_pins.tx.o.eq(system.tx),
+                system.rx.eq(uart_pins.rx.i),
         ]
 
         colours = ["b", "g", "o", "r"]
         leds = nm.Cat(platform.request(f"led_{c}") for c in colours)
-        m.d.sync += leds.eq(cpu_inst.debug_out[13:17])
+        m.d.sync += leds.eq(system.debug_out[13:17])
 
         return m
@@ -0,0 +1,275 @@
+"""
+Compact traces of the instructions a single-cycle CPU retires
+
+The trace ports of a cpu.CPU are recorded each cycle of a simulation by a
+passive process, and streamed to a binary trace file:
+
+    with trace.TraceWriter("run.trace") as writer:
+        sim.add_sync_process(trace.recorder(cpu_inst, writer))
+        sim.add_sync_process(testbench)
+        sim.run()
+
+    for record in trace.read("run.trace"):
+        ...
+
+or printed with:
+
+    python -m riscy_boi.trace run.trace
+
+Each record is encoded as a change from what came before, so a typical
+instruction takes two or three bytes: a byte of flags, then only the fields
+which can not be predicted. The cycle is predicted to be the next, the pc to
+follow on from the last, and the instruction to be the last one retired from
+the same address. The register written and the address accessed are encoded
+as differences from the register's last value and the last address.
+Integers are LEB128, signed ones zigzag encoded first.
+"""
+import argparse
+import collections
+import pathlib
+import struct
+
+import nmigen.sim
+
+from . import instruction_decoder
+
+MAGIC = b"RBTR"
+VERSION = 1
+HEADER = struct.Struct("<4sH")
+INSTRUCTION = struct.Struct("<I")
+MASK = 0xffffffff
+
+# Flags of the fields a record holds, as they differ from the predictions
+CYCLE = 1 << 0   # the cycles since the last record, if not one
+JUMP = 1 << 1    # the pc, relative to that after the last, if not it
+INSTR = 1 << 2   # the instruction, if not the last retired from the pc
+RD = 1 << 3      # the register written and the change in its value
+MEM = 1 << 4     # the change in the address accessed
+
+# An instruction retired, in the cycle counted from zero. rd is zero and
+# mem_addr is None if the instruction does not write a register or access
+# memory.
+Record = collections.namedtuple(
+        "Record",
+        ["cycle", "pc", "instr", "rd", "rd_data", "mem_addr"])
+
+
+def _signed(value):
+    """A 32-bit difference as the signed integer closest to zero"""
+    value &= MASK
+    return value - (1 << 32) if value >> 31 else value
+
+
+def _write_varint(out, value):
+    while True:
+        byte = value & 0x7f
+        value >>= 7
+        if value:
+            out.append(byte | 0x80)
+        else:
+            out.append(byte)
+            return
+
+
+def _write_signed(out, value):
+    _write_varint(out, -2 * value - 1 if value < 0 else 2 * value)
+
+
+class _State:
+    """The predictions of the next record, shared by writer and reader"""
+
+    def __init__(self):
+        self.cycle = -1
+        self.pc = -4
+        self.instructions = {}
+        self.registers = [0] * 32
+        self.mem_addr = 0
+
+    def update(self, record):
+        self.cycle = record.cycle
+        self.pc = record.pc
+        self.instructions[record.pc] = record.instr
+        if record.rd:
+            self.registers[record.rd] = record.rd_data
+        if record.mem_addr is not None:
+            self.mem_addr = record.mem_addr
+
+
+class TraceWriter:
+    """Streams records to a trace file"""
+
+    def __init__(self, path):
+        """
+        Initialiser
+
+        Args:
+            path (str or pathlib.Path): the trace file to write
+        """
+        # Closed by close(), usually on leaving a with statement
+        self.file = open(  # pylint: disable=consider-using-with
+                path, "wb")
+        self.file.write(HEADER.pack(MAGIC, VERSION))
+        self.records = 0
+        self._state = _State()
+
+    def write(self, record):
+        """Append a record, retired after the last record written"""
+        state = self._state
+        flags = 0
+        fields = bytearray()
+        if record.cycle != state.cycle + 1:
+            flags |= CYCLE
+            _write_varint(fields, record.cycle - state.cycle)
+        if record.pc != (state.pc + 4) & MASK:
+            flags |= JUMP
+            _write_signed(fields, _signed(record.pc - state.pc - 4))
+        if record.instr != state.instructions.get(record.pc):
+            flags |= INSTR
+            fields += INSTRUCTION.pack(record.instr)
+        if record.rd:
+            flags |= RD
+            fields.append(record.rd)
+            _write_signed(
+                    fields,
+                    _signed(record.rd_data - state.registers[record.rd]))
+        if record.mem_addr is not None:
+            flags |= MEM
+            _write_signed(fields, _signed(record.mem_addr - state.mem_addr))
+        self.file.write(bytes([flags]) + fields)
+        state.update(record)
+        self.records += 1
+
+    def close(self):
+        self.file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *_):
+        self.close()
+
+
+def _records(data):
+    """Decode the records of a trace file's contents, after its header"""
+    state = _State()
+    offset = HEADER.size
+
+    def varint():
+        nonlocal offset
+        value = 0
+        shift = 0
+        while True:
+            byte = data[offset]
+            offset += 1
+            value |= (byte & 0x7f) << shift
+            shift += 7
+            if not byte & 0x80:
+                return value
+
+    def signed():
+        value = varint()
+        return -(value >> 1) - 1 if value & 1 else value >> 1
+
+    while offset < len(data):
+        flags = data[offset]
+        offset += 1
+        cycle = state.cycle + (varint() if flags & CYCLE else 1)
+        pc = (state.pc + 4 + (signed() if flags & JUMP else 0)) & MASK
+        if flags & INSTR:
+            instr, = INSTRUCTION.unpack_from(data, offset)
+            offset += INSTRUCTION.size
+        else:
+            instr = state.instructions[pc]
+        rd = rd_data = 0
+        if flags & RD:
+            rd = data[offset]
+            offset += 1
+            rd_data = (state.registers[rd] + signed()) & MASK
+        mem_addr = None
+        if flags & MEM:
+            mem_addr = (state.mem_addr + signed()) & MASK
+        record = Record(cycle, pc, instr, rd, rd_data, mem_addr)
+        state.update(record)
+        yield record
+
+
+def read(path):
+    """
+    Read the records of a trace file
+
+    Raises:
+        ValueError: if the file is not a trace of this version, or is
+            truncated or corrupt
+    """
+    data = pathlib.Path(path).read_bytes()
+    if len(data) < HEADER.size:
+        raise ValueError(f"{path} is too short to be a trace")
+    magic, version = HEADER.unpack_from(data)
+    if magic != MAGIC:
+        raise ValueError(f"{path} starts with {magic!r}, not {MAGIC!r}")
+    if version != VERSION:
+        raise ValueError(f"{path} is version {version}, not {VERSION}")
+    try:
+        yield from _records(data)
+    except (IndexError, KeyError, struct.error) as error:
+        raise ValueError(f"{path} is truncated or corrupt") from error
+
+
+def recorder(cpu_inst, writer):
+    """
+    A passive sync process writing each instruction a CPU retires to a trace
+
+    It is added before the testbench, so it reads the trace ports before the
+    testbench assigns to any signals after each clock edge.
+
+    Args:
+        cpu_inst (cpu.CPU): the CPU
+        writer (TraceWriter): the trace to write to
+
+    Returns:
+        function: the process
+    """
+
+    def process():
+        yield nmigen.sim.Passive()
+        cycle = 0
+        while True:
+            # Woken by a clock edge, the values of the cycle before it are read
+            yield
+            if (yield cpu_inst.trace_valid):
+                writer.write(Record(
+                        cycle=cycle,
+                        pc=(yield cpu_inst.trace_pc),
+                        instr=(yield cpu_inst.trace_instr),
+                        rd=(yield cpu_inst.trace_rd),
+                        rd_data=(yield cpu_inst.trace_rd_data),
+                        mem_addr=((yield cpu_inst.trace_mem_addr)
+                                  if (yield cpu_inst.trace_mem_en)
+                                  else None)))
+            cycle += 1
+
+    return process
+
+
+def main():
+    """Print the instructions in a trace file"""
+    parser = argparse.ArgumentParser(description=main.__doc__)
+    parser.add_argument("trace", type=pathlib.Path, help="trace file")
+    args = parser.parse_args()
+
+    table = instruction_decoder.lookup_table(
+            instruction_decoder.RV32I + instruction_decoder.RV32M)
+    for record in read(args.trace):
+        instruction = table[instruction_decoder.key(record.instr)]
+        name = "?" if instruction is None else instruction.name
+        line = (f"{record.cycle:10} {record.pc:08x} {record.instr:08x} "
+                f"{name:8}")
+        if record.rd:
+            line += f" x{record.rd} = {record.rd_data:#010x}"
+        if record.mem_addr is not None:
+            line += f" [{record.mem_addr:#010x}]"
+        print(line)
+
+
+if __name__ == "__main__":
+    main()
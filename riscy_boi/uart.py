@@ -0,0 +1,300 @@
+"""Memory-mapped UART"""
+import enum
+
+import nmigen as nm
+from nmigen.lib import cdc
+from nmigen.lib import fifo
+
+DIVISOR_WIDTH = 16
+REGISTER_WIDTH = 32
+
+
+class Register(enum.IntEnum):
+    """Word offsets of the UART's registers"""
+    DATA = 0     # write to send a byte, read to receive one
+    STATUS = 1
+    LEVELS = 2   # the bytes in the TX FIFO in [15:0], the RX FIFO in [31:16]
+    CONTROL = 3
+    DIVISOR = 4  # clock cycles per bit
+
+
+class Status(enum.IntEnum):
+    """Bits of the STATUS register"""
+    RX_VALID = 0     # the RX FIFO holds a byte
+    TX_READY = 1     # the TX FIFO has space for a byte
+    TX_IDLE = 2      # the TX FIFO is empty and its last byte has been sent
+    RX_OVERRUN = 3   # a byte was received with the RX FIFO full, and lost
+    FRAME_ERROR = 4  # a byte was received without its stop bit, and lost
+
+
+STATUS_BITS = len(Status)
+
+
+class Control(enum.IntEnum):
+    """Bits of the CONTROL register, above the interrupt enables"""
+    LOOPBACK = 8  # connect tx to rx, rather than to the pins
+
+
+class Transmitter(nm.Elaboratable):
+    """
+    UART transmitter, sending 8 data bits, no parity and one stop bit
+
+    Bytes taken back to back are sent without gaps between them.
+
+    * divisor (in): clock cycles per bit
+    * data (in): the byte to send
+    * valid (in): high when data holds a byte to send
+    * ready (out): high when the transmitter takes the byte at data
+
+    * tx (out): the serial output, high when idle
+    """
+
+    def __init__(self):
+        self.divisor = nm.Signal(DIVISOR_WIDTH)
+        self.data = nm.Signal(8)
+        self.valid = nm.Signal()
+        self.ready = nm.Signal()
+
+        self.tx = nm.Signal(reset=1)
+
+    def elaborate(self, _):
+        m = nm.Module()
+
+        # The start bit, data and stop bit, sent from the least significant
+        shift = nm.Signal(10, reset=-1)
+        bits_left = nm.Signal(range(len(shift) + 1))
+        count = nm.Signal(DIVISOR_WIDTH)
+
+        m.d.comb += [
+                self.ready.eq(bits_left == 0),
+                self.tx.eq(shift[0]),
+        ]
+        with m.If(bits_left == 0):
+            with m.If(self.valid):
+                m.d.sync += [
+                        shift.eq(nm.Cat(0, self.data, 1)),
+                        bits_left.eq(len(shift)),
+                        count.eq(self.divisor - 1),
+                ]
+        with m.Elif(count == 0):
+            m.d.sync += [
+                    shift.eq(nm.Cat(shift[1:], 1)),
+                    bits_left.eq(bits_left - 1),
+                    count.eq(self.divisor - 1),
+            ]
+        with m.Else():
+            m.d.sync += count.eq(count - 1)
+
+        return m
+
+
+class Receiver(nm.Elaboratable):
+    """
+    UART receiver, for 8 data bits, no parity and one stop bit
+
+    The falling edge of the start bit is found, then each bit is sampled
+    near its middle. A start bit which has risen again by then is ignored as
+    a glitch. The divisor must be at least 2.
+
+    * divisor (in): clock cycles per bit
+    * rx (in): the serial input, synchronised to the clock
+    * data (out): the byte received
+    * valid (out): high for a cycle when data holds a byte received
+    * frame_error (out): high for a cycle when a byte was received without
+      its stop bit
+    """
+
+    def __init__(self):
+        self.divisor = nm.Signal(DIVISOR_WIDTH)
+        self.rx = nm.Signal(reset=1)
+        self.data = nm.Signal(8)
+        self.valid = nm.Signal()
+        self.frame_error = nm.Signal()
+
+    def elaborate(self, _):
+        m = nm.Module()
+
+        # The samples of the start bit, data and stop bit, the last sampled
+        # shifted in at the most significant end
+        shift = nm.Signal(10)
+        bits_left = nm.Signal(range(len(shift) + 1))
+        count = nm.Signal(DIVISOR_WIDTH)
+
+        m.d.comb += self.data.eq(shift[1:9])
+        m.d.sync += [
+                self.valid.eq(0),
+                self.frame_error.eq(0),
+        ]
+        with m.If(bits_left == 0):
+            with m.If(~self.rx):
+                m.d.sync += [
+                        bits_left.eq(len(shift)),
+                        count.eq(self.divisor[1:] - 1),
+                ]
+        with m.Elif(count != 0):
+            m.d.sync += count.eq(count - 1)
+        with m.Elif((bits_left == len(shift)) & self.rx):
+            m.d.sync += bits_left.eq(0)
+        with m.Else():
+            m.d.sync += [
+                    shift.eq(nm.Cat(shift[1:], self.rx)),
+                    bits_left.eq(bits_left - 1),
+                    count.eq(self.divisor - 1),
+            ]
+            with m.If(bits_left == 1):
+                m.d.sync += [
+                        self.valid.eq(self.rx),
+                        self.frame_error.eq(~self.rx),
+                ]
+
+        return m
+
+
+def write_lanes(m, register, w_en, w_data):
+    """Write the byte lanes of w_data enabled by w_en to a register"""
+    for lane, enable in enumerate(w_en):
+        with m.If(enable):
+            m.d.sync += register.word_select(lane, 8).eq(
+                    w_data.word_select(lane, 8))
+
+
+class UART(nm.Elaboratable):
+    # pylint: disable=too-many-instance-attributes
+    """
+    UART with transmit and receive FIFOs, read and written as registers
+
+    The registers are accessed like a synchronous memory: the register at
+    the word offset presented at addr is output at r_data the following
+    cycle. Each cycle r_en or w_en is high is a separate access, so an
+    access must be presented for one cycle only.
+
+    * DATA: writing pushes the byte in [7:0] onto the TX FIFO, or drops it
+      if the FIFO is full. Reading pops a byte off the RX FIFO, reading as
+      the byte with bit 8 set, or as zero if the FIFO is empty.
+    * STATUS: the Status bits. The sticky RX_OVERRUN and FRAME_ERROR bits
+      are cleared by writing one to them.
+    * LEVELS: the number of bytes in each FIFO, so firmware can send and
+      receive bursts without reading STATUS for each byte
+    * CONTROL: bits 0 to 4 enable irq for the STATUS bit of the same index,
+      and the Control bits
+    * DIVISOR: the clock cycles per bit, at least 2. The baud rate is the
+      clock frequency divided by it.
+
+    * addr (in): the word offset of the register to access
+    * r_en (in): high to read the register at addr
+    * r_data (out): the register read last cycle
+    * w_en (in): the byte lanes of w_data to write to the register at addr
+    * w_data (in): the data to write
+
+    * irq (out): high while an enabled STATUS bit is high
+    * tx (out): the serial output
+    * rx (in): the serial input, synchronised inside the UART
+    """
+
+    def __init__(self, divisor, tx_depth=16, rx_depth=16):
+        """
+        Initialiser
+
+        Args:
+            divisor (int): the clock cycles per bit after reset
+            tx_depth (int): the bytes the transmit FIFO holds
+            rx_depth (int): the bytes the receive FIFO holds
+        """
+        if not 2 <= divisor < 2**DIVISOR_WIDTH:
+            raise ValueError(
+                    f"The divisor must be from 2 to {2**DIVISOR_WIDTH - 1}, "
+                    f"not {divisor}")
+        self.divisor = divisor
+        self.tx_depth = tx_depth
+        self.rx_depth = rx_depth
+
+        self.addr = nm.Signal(range(len(Register)))
+        self.r_en = nm.Signal()
+        self.r_data = nm.Signal(REGISTER_WIDTH)
+        self.w_en = nm.Signal(REGISTER_WIDTH // 8)
+        self.w_data = nm.Signal(REGISTER_WIDTH)
+
+        self.irq = nm.Signal()
+        self.tx = nm.Signal(reset=1)
+        self.rx = nm.Signal(reset=1)
+
+    def elaborate(self, _):
+        m = nm.Module()
+        transmitter = m.submodules.transmitter = Transmitter()
+        receiver = m.submodules.receiver = Receiver()
+        tx_fifo = m.submodules.tx_fifo = fifo.SyncFIFOBuffered(
+                width=8,
+                depth=self.tx_depth)
+        rx_fifo = m.submodules.rx_fifo = fifo.SyncFIFOBuffered(
+                width=8,
+                depth=self.rx_depth)
+
+        divisor = nm.Signal(DIVISOR_WIDTH, reset=self.divisor)
+        control = nm.Signal(REGISTER_WIDTH)
+        sticky = nm.Signal(STATUS_BITS)
+        status = nm.Signal(STATUS_BITS)
+        rx_sync = nm.Signal(reset=1)
+        loopback = control[Control.LOOPBACK]
+
+        m.submodules.rx_sync = cdc.FFSynchronizer(self.rx, rx_sync, reset=1)
+        m.d.comb += [
+                transmitter.divisor.eq(divisor),
+                transmitter.data.eq(tx_fifo.r_data),
+                transmitter.valid.eq(tx_fifo.r_rdy),
+                tx_fifo.r_en.eq(transmitter.ready),
+                self.tx.eq(transmitter.tx | loopback),
+
+                receiver.divisor.eq(divisor),
+                receiver.rx.eq(nm.Mux(loopback, transmitter.tx, rx_sync)),
+                rx_fifo.w_data.eq(receiver.data),
+                rx_fifo.w_en.eq(receiver.valid),
+
+                status[Status.RX_VALID].eq(rx_fifo.r_rdy),
+                status[Status.TX_READY].eq(tx_fifo.w_rdy),
+                status[Status.TX_IDLE].eq(
+                    (tx_fifo.level == 0) & transmitter.ready),
+                status[Status.RX_OVERRUN].eq(sticky[Status.RX_OVERRUN]),
+                status[Status.FRAME_ERROR].eq(sticky[Status.FRAME_ERROR]),
+                self.irq.eq((status & control[:STATUS_BITS]).any()),
+        ]
+
+        with m.If(self.r_en):
+            with m.Switch(self.addr):
+                with m.Case(Register.DATA):
+                    m.d.comb += rx_fifo.r_en.eq(1)
+                    m.d.sync += self.r_data.eq(
+                            nm.Mux(
+                                rx_fifo.r_rdy,
+                                nm.Cat(rx_fifo.r_data, 1),
+                                0))
+                with m.Case(Register.STATUS):
+                    m.d.sync += self.r_data.eq(status)
+                with m.Case(Register.LEVELS):
+                    m.d.sync += self.r_data.eq(
+                            tx_fifo.level | (rx_fifo.level << 16))
+                with m.Case(Register.CONTROL):
+                    m.d.sync += self.r_data.eq(control)
+                with m.Case(Register.DIVISOR):
+                    m.d.sync += self.r_data.eq(divisor)
+
+        with m.Switch(self.addr):
+            with m.Case(Register.DATA):
+                m.d.comb += [
+                        tx_fifo.w_data.eq(self.w_data[:8]),
+                        tx_fifo.w_en.eq(self.w_en[0]),
+                ]
+            with m.Case(Register.STATUS):
+                with m.If(self.w_en[0]):
+                    m.d.sync += sticky.eq(sticky & ~self.w_data[:STATUS_BITS])
+            with m.Case(Register.CONTROL):
+                write_lanes(m, control, self.w_en, self.w_data)
+            with m.Case(Register.DIVISOR):
+                write_lanes(m, divisor, self.w_en[:2], self.w_data[:16])
+
+        # An error in the same cycle as its bit is cleared is kept
+        with m.If(receiver.valid & ~rx_fifo.w_rdy):
+            m.d.sync += sticky[Status.RX_OVERRUN].eq(1)
+        with m.If(receiver.frame_error):
+            m.d.sync += sticky[Status.FRAME_ERROR].eq(1)
+
+        return m
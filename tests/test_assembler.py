@@ -0,0 +1,112 @@
+"""Assembler tests"""
+import numpy as np
+import pytest
+
+from riscy_boi import assembler, encoding, isa_simulator
+
+
+@pytest.mark.parametrize(
+        "source, expected",
+        [
+            ("add x3, x1, x2", encoding.RType.encode(
+                1, 2, encoding.IntRegRegFunct.ADD_OR_SUB, 0, 3)),
+            ("sub gp, ra, sp", encoding.RType.encode(
+                1, 2, encoding.IntRegRegFunct.ADD_OR_SUB,
+                encoding.AddSubType.SUB, 3)),
+            ("mulhsu x3, x1, x2", encoding.RType.encode(
+                1, 2, encoding.MulDivFunct.MULHSU, encoding.MULDIV_FUNCT7,
+                3)),
+            ("addi a0, zero, -1", encoding.IType.encode(
+                0xfff, 0, encoding.IntRegImmFunct.ADDI, 10,
+                encoding.Opcode.OP_IMM)),
+            ("srai t0, t1, 3", encoding.IType.encode(
+                0x403, 6, encoding.IntRegImmFunct.SRLI_OR_SRAI, 5,
+                encoding.Opcode.OP_IMM)),
+            ("lbu s1, -4(sp)", encoding.IType.encode(
+                0xffc, 2, encoding.LoadFunct.LBU, 9, encoding.Opcode.LOAD)),
+            ("sh a1, 2047(a2)", encoding.SType.encode(
+                0x7ff, 12, 11, encoding.StoreFunct.SH)),
+            ("bgeu x4, x5, -4096", encoding.BType.encode(
+                0x1000, 4, 5, encoding.BranchFunct.BGEU)),
+            ("lui x1, 0xfffff", encoding.UType.encode(
+                0xfffff, 1, encoding.Opcode.LUI)),
+            ("jal x5, -4", encoding.JType.encode(0x1ffffc, 5)),
+            ("csrrs x7, instreth, x0", encoding.IType.encode(
+                encoding.CSR.INSTRETH, 0, encoding.SystemFunct.CSRRS, 7,
+                encoding.Opcode.SYSTEM)),
+            ("ebreak", 0x00100073),
+            ("beqz a0, 8", encoding.BType.encode(
+                8, 10, 0, encoding.BranchFunct.BEQ)),
+            ("ret", encoding.IType.encode(
+                0, 1, 0, 0, encoding.Opcode.JALR)),
+            ("\taddi\ta0,\ta0, 1", encoding.IType.encode(
+                1, 10, encoding.IntRegImmFunct.ADDI, 10,
+                encoding.Opcode.OP_IMM)),
+            ("loop:\tbnez\ta0, loop", encoding.BType.encode(
+                0, 10, 0, encoding.BranchFunct.BNE)),
+        ])
+def test_encodings(source, expected):
+    assert assembler.assemble(source).tolist() == [expected]
+
+
+def test_labels_and_pseudo_instructions():
+    program = assembler.assemble("""
+            li a0, 5            # addi
+            li a1, 0x12345fff   # lui and addi
+            li a2, 0x20000      # lui
+            la a3, data
+            call double
+    loop:   addi a0, a0, -1
+            bgtz a0, loop
+            j .
+    double: add a1, a1, a1
+            ret
+    data:   .word 0xcafef00d, data - loop
+    """)
+    assert len(program) == 15
+    assert program[-2:].tolist() == [0xcafef00d, 0x34 - 0x20]
+
+    sim = isa_simulator.ISASimulator(program)
+    sim.run()
+    assert sim.pc == 0x28
+    assert sim.registers[10] == 0
+    assert sim.registers[11] == 0x2468bffe
+    assert sim.registers[12] == 0x20000
+    assert sim.registers[13] == 0x34
+
+
+@pytest.mark.parametrize(
+        "source, message",
+        [
+            ("addi x1, x2, 2048", "line 1: imm 2048"),
+            ("\nbeq x1, x2, far", "line 2: far is not defined"),
+            ("jal x1, 3", "line 1: offset 3 is odd"),
+            ("add x1, x2, x32", "line 1: x32 is not a register"),
+            ("frobnicate x1", "line 1: unknown instruction frobnicate"),
+            ("a: nop\na: nop", "line 2: a is already defined"),
+        ])
+def test_errors(source, message):
+    with pytest.raises(assembler.AssemblyError, match=message):
+        assembler.assemble(source)
+
+
+def test_bulk_encoding_matches_assembly():
+    rng = np.random.default_rng(0)
+    count = 4096
+    table = np.zeros(count, dtype=assembler.FIELDS)
+    table["format"] = assembler.Format.I
+    table["opcode"] = encoding.Opcode.OP_IMM
+    table["rd"] = rng.integers(0, 32, count)
+    table["rs1"] = rng.integers(0, 32, count)
+    table["imm"] = rng.integers(-2048, 2048, count)
+    table["format"][::2] = assembler.Format.B
+    table["imm"][::2] &= ~1
+
+    source = "\n".join(
+            f"addi x{row['rd']}, x{row['rs1']}, {row['imm']}"
+            if row["format"] == assembler.Format.I else
+            f"beq x{row['rs1']}, x0, {row['imm']}"
+            for row in table)
+    assert np.array_equal(
+            assembler.encode(table),
+            assembler.assemble(source))
@@ -0,0 +1,52 @@
+"""Benchmark tests"""
+import json
+
+import pytest
+
+from riscy_boi import benchmarks
+
+
+@pytest.fixture(scope="module", name="simulations")
+def simulations_fixture():
+    """Each CPU configuration's simulation, reused for each kernel"""
+    return {}
+
+
+@pytest.mark.parametrize(
+        "cpu_name, kernel_name",
+        [
+            (cpu_name, kernel_name)
+            for cpu_name in sorted(benchmarks.CPUS)
+            for kernel_name in sorted(benchmarks.KERNELS)
+            if benchmarks.supported(cpu_name, kernel_name)
+        ])
+def test_benchmark(cpu_name, kernel_name, sim_engine, simulations):
+    # run checks the kernel's results against the ISA simulator
+    result = benchmarks.run(
+            cpu_name,
+            kernel_name,
+            sim_engine,
+            cache=simulations)
+    baseline = json.loads(benchmarks.BASELINE.read_text())
+
+    # The dual-issue CPU fetches and may retire two instructions a cycle
+    issue_width = len(simulations[cpu_name, sim_engine].cpu.imem_data) // 32
+    assert result["cycles"] * issue_width >= result["instret"]
+    assert not benchmarks.regressions(
+            {cpu_name: {kernel_name: result}},
+            baseline)
+
+
+def test_regressions():
+    baseline = {"cpu": {"loop": {"cycles": 100, "instret": 50}}}
+
+    def results(cycles, instret):
+        return {"cpu": {"loop": {"cycles": cycles, "instret": instret}}}
+
+    assert not benchmarks.regressions(results(102, 50), baseline)
+    assert not benchmarks.regressions(results(90, 40), baseline)
+    assert len(benchmarks.regressions(results(103, 50), baseline)) == 1
+    assert len(benchmarks.regressions(results(200, 60), baseline)) == 2
+    assert not benchmarks.regressions(
+            {"other": {"loop": {"cycles": 1000, "instret": 1000}}},
+            baseline)
@@ -0,0 +1,40 @@
+"""Branch comparator tests"""
+import nmigen.sim
+import pytest
+
+from riscy_boi import branch_comparator, encoding
+
+
+@pytest.mark.parametrize(
+        "funct, a, b, taken", [
+            (encoding.BranchFunct.BEQ, 5, 5, 1),
+            (encoding.BranchFunct.BEQ, 5, 6, 0),
+
+            (encoding.BranchFunct.BNE, 5, 5, 0),
+            (encoding.BranchFunct.BNE, 5, 6, 1),
+
+            (encoding.BranchFunct.BLT, 1, 2, 1),
+            (encoding.BranchFunct.BLT, 2, 1, 0),
+            (encoding.BranchFunct.BLT, 2**32 - 1, 0, 1),
+            (encoding.BranchFunct.BLT, 0, 2**32 - 1, 0),
+
+            (encoding.BranchFunct.BGE, 2, 2, 1),
+            (encoding.BranchFunct.BGE, 1, 2, 0),
+            (encoding.BranchFunct.BGE, 0, 2**32 - 1, 1),
+
+            (encoding.BranchFunct.BLTU, 1, 2, 1),
+            (encoding.BranchFunct.BLTU, 2**32 - 1, 0, 0),
+
+            (encoding.BranchFunct.BGEU, 2**32 - 1, 0, 1),
+            (encoding.BranchFunct.BGEU, 0, 1, 0)])
+def test_branch_comparator(comb_sim, funct, a, b, taken):
+    cmp = branch_comparator.BranchComparator(32)
+
+    def testbench():
+        yield cmp.funct.eq(funct)
+        yield cmp.a.eq(a)
+        yield cmp.b.eq(b)
+        yield nmigen.sim.Settle()
+        assert (yield cmp.taken) == taken
+
+    comb_sim(cmp, testbench)
@@ -0,0 +1,128 @@
+"""Branch predictor tests"""
+import nmigen.sim
+import pytest
+
+from riscy_boi import branch_predictor
+
+
+def resolve(predictor, pc, kind, taken, target, mispredict):
+    yield predictor.update.eq(1)
+    yield predictor.update_pc.eq(pc)
+    yield predictor.update_kind.eq(kind)
+    yield predictor.update_taken.eq(taken)
+    yield predictor.update_target.eq(target)
+    yield predictor.update_mispredict.eq(mispredict)
+    yield
+    yield predictor.update.eq(0)
+
+
+def lookup(predictor, pc):
+    yield predictor.lookup_pc.eq(pc)
+    yield nmigen.sim.Settle()
+    taken = yield predictor.predict_taken
+    target = yield predictor.predict_target
+    return taken, target
+
+
+def test_jump_predicted_after_first_resolution(sync_sim):
+    predictor = branch_predictor.BranchPredictor()
+
+    def testbench():
+        kind = branch_predictor.BranchKind.JUMP
+        assert (yield from lookup(predictor, 0x40)) == (0, 0)
+
+        yield from resolve(predictor, 0x40, kind, 1, 0x10, 1)
+        assert (yield from lookup(predictor, 0x40)) == (1, 0x10)
+        yield from resolve(predictor, 0x40, kind, 1, 0x10, 0)
+
+        # An aliasing address with a different tag misses
+        taken, _ = yield from lookup(predictor, 0x40 + 16 * 4)
+        assert taken == 0
+
+        yield
+        assert (yield predictor.hits) == 1
+        assert (yield predictor.misses) == 1
+
+    sync_sim(predictor, testbench)
+
+
+@pytest.mark.parametrize(
+        "target, predicted", [
+            (0x10, 1),
+            (0x80, 0)])
+def test_static_backward_taken(sync_sim, target, predicted):
+    predictor = branch_predictor.BranchPredictor(
+            branch_predictor.PredictorType.STATIC)
+
+    def testbench():
+        kind = branch_predictor.BranchKind.BRANCH
+        yield from resolve(predictor, 0x40, kind, 1, target, 1)
+        assert (yield from lookup(predictor, 0x40)) == (predicted, target)
+
+    sync_sim(predictor, testbench)
+
+
+def test_bimodal_counters_saturate(sync_sim):
+    predictor = branch_predictor.BranchPredictor(
+            branch_predictor.PredictorType.BIMODAL)
+
+    def testbench():
+        kind = branch_predictor.BranchKind.BRANCH
+        pc = 0x20
+        for _ in range(3):
+            yield from resolve(predictor, pc, kind, 1, 0x80, 0)
+        taken, _ = yield from lookup(predictor, pc)
+        assert taken == 1
+
+        # One not-taken resolution leaves the counter weakly taken
+        yield from resolve(predictor, pc, kind, 0, 0x80, 1)
+        taken, _ = yield from lookup(predictor, pc)
+        assert taken == 1
+
+        yield from resolve(predictor, pc, kind, 0, 0x80, 1)
+        taken, _ = yield from lookup(predictor, pc)
+        assert taken == 0
+
+    sync_sim(predictor, testbench)
+
+
+def test_return_address_stack(sync_sim):
+    predictor = branch_predictor.BranchPredictor(ras_depth=2)
+
+    def testbench():
+        call_pc = 0x100
+        return_pc = 0x204
+        yield from resolve(
+                predictor,
+                call_pc,
+                branch_predictor.BranchKind.CALL,
+                1,
+                0x200,
+                1)
+        yield from resolve(
+                predictor,
+                return_pc,
+                branch_predictor.BranchKind.RETURN,
+                1,
+                0,
+                1)
+
+        # Nothing has been pushed, so the return can't be predicted
+        taken, _ = yield from lookup(predictor, return_pc)
+        assert taken == 0
+
+        yield predictor.lookup_enable.eq(1)
+        assert (yield from lookup(predictor, call_pc)) == (1, 0x200)
+        yield
+        assert (yield from lookup(predictor, return_pc)) == (1, call_pc + 4)
+        yield
+        taken, _ = yield from lookup(predictor, return_pc)
+        assert taken == 0
+
+    sync_sim(predictor, testbench)
+
+
+def test_table_size_must_be_power_of_two():
+    assert branch_predictor.index_width(16, "btb_entries") == 4
+    with pytest.raises(ValueError):
+        branch_predictor.index_width(12, "btb_entries")
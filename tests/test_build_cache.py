@@ -0,0 +1,39 @@
+"""Build cache tests"""
+import os
+
+from riscy_boi import build_cache
+
+
+def test_digest():
+    assert build_cache.digest("a", "b") == build_cache.digest("a", b"b")
+    assert build_cache.digest("ab", "c") != build_cache.digest("a", "bc")
+    assert build_cache.digest("a") != build_cache.digest("a", "")
+
+
+def test_run(tmp_path):
+    cache = build_cache.BuildCache(tmp_path / "cache")
+    builds = []
+
+    def build():
+        builds.append(None)
+        (tmp_path / "design.json").write_text("{}")
+
+    assert not cache.run("key", tmp_path, ["design.json", "missing"], build)
+    (tmp_path / "design.json").unlink()
+    assert cache.run("key", tmp_path, ["design.json"], build)
+    assert (tmp_path / "design.json").read_text() == "{}"
+    assert len(builds) == 1
+    assert cache.get("other") is None
+
+
+def test_evict_least_recently_used(tmp_path):
+    cache = build_cache.BuildCache(tmp_path, max_size=250)
+    for i, key in enumerate(["a", "b"]):
+        cache.put(key, {"file": bytes(100)})
+        os.utime(tmp_path / key, ns=(i, i))
+    assert cache.get("a") is not None
+
+    cache.put("c", {"file": bytes(100)})
+    assert cache.get("a") is not None
+    assert cache.get("b") is None
+    assert cache.get("c") is not None
@@ -0,0 +1,94 @@
+"""Checkpoint tests"""
+import nmigen.sim
+import pytest
+
+from riscy_boi import benchmarks
+from riscy_boi import checkpoint
+from riscy_boi import cpu
+
+
+def run_kernel(engine, kernel, warm_up=None, restored=None):
+    """
+    Run a kernel to completion, from reset or from a checkpoint
+
+    Returns:
+        dict: the final cycle count, registers and data memory, and the
+            checkpoint taken after warm_up cycles, if any
+    """
+    cpu_inst = cpu.CPU()
+    m, imem, dmem = benchmarks.harness(
+            cpu_inst,
+            kernel,
+            benchmarks.IMEM_DEPTH)
+    result = {}
+
+    def restore():
+        yield from checkpoint.restore(cpu_inst, imem, dmem, restored)
+
+    def testbench():
+        if warm_up is not None:
+            for _ in range(warm_up):
+                yield
+            result["checkpoint"] = yield from checkpoint.capture(
+                    cpu_inst,
+                    imem,
+                    dmem)
+        while not (yield dmem[benchmarks.DONE_ADDRESS // 4]):
+            yield
+        yield nmigen.sim.Settle()
+        result["cycle"] = yield cpu_inst.counters.cycle
+        result["state"] = []
+        for memory in (cpu_inst.register_file.memories[0], dmem):
+            for index in range(memory.depth):
+                result["state"].append((yield memory[index]))
+
+    sim = nmigen.sim.Simulator(m, engine=engine)
+    sim.add_clock(1e-6)
+    if restored is not None:
+        sim.add_process(restore)
+    sim.add_sync_process(testbench)
+    sim.run()
+    return result
+
+
+def test_restore(sim_engine, tmp_path):
+    kernel = benchmarks.KERNELS["sort"]()
+    original = run_kernel(sim_engine, kernel, warm_up=200)
+    saved = original["checkpoint"]
+    assert saved.instret > 0
+    assert saved.cycle > 200
+    assert saved.dmem != kernel.data + [0] * (
+            benchmarks.DMEM_WORDS - len(kernel.data))
+
+    checkpoint.save(saved, tmp_path / "sort.ckpt")
+    assert checkpoint.load(tmp_path / "sort.ckpt") == saved
+    # Most of the memories are zero
+    assert (tmp_path / "sort.ckpt").stat().st_size < benchmarks.DMEM_WORDS
+
+    # A different program's memories are replaced by the checkpoint's
+    restored = run_kernel(
+            sim_engine,
+            benchmarks.KERNELS["loop"](),
+            restored=saved)
+    assert restored["state"] == original["state"]
+    assert restored["cycle"] == original["cycle"]
+
+
+def test_bad_checkpoints():
+    data = checkpoint.to_bytes(checkpoint.Checkpoint(
+            pc=4,
+            registers=[0, 1],
+            imem=[2],
+            dmem=[],
+            cycle=2**40,
+            instret=3))
+    assert checkpoint.from_bytes(data).cycle == 2**40
+
+    with pytest.raises(ValueError, match="not b'RBCP'"):
+        checkpoint.from_bytes(b"ELF" + data[3:])
+    with pytest.raises(ValueError, match="version"):
+        checkpoint.from_bytes(data[:4] + b"\x09\x00" + data[6:])
+    with pytest.raises(ValueError, match="corrupt"):
+        checkpoint.from_bytes(data[:-3])
+    with pytest.raises(ValueError, match="too short"):
+        checkpoint.from_bytes(data[:5])
@@ -0,0 +1,113 @@
+"""Compiled simulation tests"""
+import pathlib
+import tempfile
+
+import nmigen as nm
+import nmigen.sim
+from nmigen.back import rtlil
+import pytest
+
+from riscy_boi import build_cache
+from riscy_boi import compiled_sim
+
+pytest.importorskip("yowasp_yosys")
+
+
+class Counter(nm.Elaboratable):
+    """Counter which also stores each count in a memory"""
+
+    def __init__(self):
+        self.enable = nm.Signal()
+        self.count = nm.Signal(8)
+        self.wrapped = nm.Signal()
+        self.memory = nm.Memory(width=8, depth=4, init=[7, 6, 5, 4])
+
+    def elaborate(self, _):
+        m = nm.Module()
+        wp = m.submodules.wp = self.memory.write_port()
+        m.d.comb += [
+                self.wrapped.eq(self.count == 0xff),
+                wp.addr.eq(self.count),
+                wp.data.eq(self.count),
+                wp.en.eq(self.enable),
+        ]
+        with m.If(self.enable):
+            m.d.sync += self.count.eq(self.count + 1)
+        return m
+
+
+def trace(engine):
+    counter = Counter()
+    sim = nmigen.sim.Simulator(counter, engine=engine)
+    sim.add_clock(1e-6)
+    values = []
+
+    def process():
+        yield counter.count.eq(0xfd)
+        yield counter.enable.eq(1)
+        for _ in range(4):
+            yield
+            values.append((yield counter.count))
+            values.append((yield counter.wrapped))
+            yield nmigen.sim.Settle()
+            values.append((yield counter.count))
+            values.append((yield counter.wrapped))
+        values.append((yield counter.count + 1))
+        values.append((yield counter.count.as_signed() >> 2))
+        values.append((yield nm.Cat(counter.count[4:], counter.wrapped)))
+        values.append((yield counter.count.any() & ~counter.wrapped))
+        yield counter.enable.eq(0)
+        yield
+        values.append((yield counter.memory[1]))
+        values.append((yield counter.memory[3]))
+
+    sim.add_sync_process(process)
+    sim.run()
+    return values
+
+
+def test_cxxrtl_engine_matches_pysim():
+    assert trace(compiled_sim.CXXRTLEngine) == trace("pysim")
+
+
+def test_cxxrtl_engine_unsupported_value():
+    counter = Counter()
+    sim = nmigen.sim.Simulator(counter, engine=compiled_sim.CXXRTLEngine)
+
+    def process():
+        yield nm.Signal()
+
+    sim.add_process(process)
+    with pytest.raises(TypeError):
+        sim.run()
+
+
+@pytest.fixture(name="cache_dir")
+def fixture_cache_dir():
+    # Yosys's sandbox mounts its own /tmp, which hides pytest's tmp_path
+    compiled_sim.CACHE_DIR.mkdir(parents=True, exist_ok=True)
+    with tempfile.TemporaryDirectory(
+            prefix=".test-",
+            dir=compiled_sim.CACHE_DIR) as directory:
+        yield pathlib.Path(directory)
+
+
+def test_build_cache(cache_dir, monkeypatch):
+    rtlil_text = rtlil.convert(Counter())
+    # A library left by an older cache layout is not an entry
+    (cache_dir / "old.so").write_bytes(b"")
+    library = compiled_sim.build(rtlil_text, cache_dir)
+    assert compiled_sim.build(rtlil_text, cache_dir) == library
+
+    # A new yosys may change the C++ and the C API, so it compiles again,
+    # and the older library is evicted
+    monkeypatch.setattr(
+            build_cache,
+            "package_version",
+            lambda name: "upgraded")
+    max_size = library.stat().st_size * 3 // 2
+    upgraded = compiled_sim.build(rtlil_text, cache_dir, max_size)
+    assert upgraded != library
+    assert upgraded.exists()
+    assert not library.exists()
+    compiled_sim.load(upgraded)
@@ -0,0 +1,59 @@
+"""Performance counter tests"""
+import nmigen.sim
+import pytest
+
+from riscy_boi import counters, encoding
+
+
+def test_counters(sync_sim):
+    events = [counters.Event.LOAD, counters.Event.STORE]
+    csrs = counters.Counters(events)
+
+    def testbench():
+        yield csrs.retire.eq(1)
+        yield csrs.events.eq(0b10)
+        for _ in range(3):
+            yield
+        yield csrs.retire.eq(0)
+        yield csrs.time_tick.eq(0)
+        yield csrs.events.eq(0b01)
+        yield
+        yield csrs.events.eq(0)
+        yield
+
+        # The clock edge before the testbench starts is counted too
+        expected = {
+                encoding.CSR.CYCLE: 6,
+                encoding.CSR.TIME: 4,
+                encoding.CSR.INSTRET: 3,
+                encoding.CSR.HPMCOUNTER3: 1,
+                encoding.CSR.HPMCOUNTER3 + 1: 3,
+                encoding.CSR.HPMCOUNTER3 + 2: 0,
+                encoding.CSR.CYCLEH: 0,
+        }
+        for csr, value in expected.items():
+            yield csrs.address.eq(csr)
+            yield nmigen.sim.Settle()
+            assert (yield csrs.read_data) == value
+
+    sync_sim(csrs, testbench)
+
+
+def test_counters_upper_half(sync_sim):
+    csrs = counters.Counters()
+
+    def testbench():
+        # Settle first, so the clock edge's increment cannot overwrite this
+        yield nmigen.sim.Settle()
+        yield csrs.cycle.eq(0xffffffff)
+        yield
+        yield csrs.address.eq(encoding.CSR.CYCLEH)
+        yield nmigen.sim.Settle()
+        assert (yield csrs.read_data) == 1
+
+    sync_sim(csrs, testbench)
+
+
+def test_counters_too_many_events():
+    with pytest.raises(ValueError):
+        counters.Counters([counters.Event.LOAD] * 30)
@@ -1,7 +1,23 @@
 """CPU tests"""
 import nmigen as nm
+import pytest
 
-from riscy_boi import cpu, encoding
+from riscy_boi import assembler, cpu, encoding, isa_simulator, muldiv
+
+MULDIV_PROGRAM = """
+        nop
+        li x1, -100
+        li x3, 7
+        mul x4, x1, x3
+        mulh x5, x4, x4
+        div x6, x4, x3
+        rem x7, x1, x3
+        divu x8, x1, x3
+        add x2, x6, x7
+        add x2, x2, x8
+        add x2, x2, x5
+        j .
+"""
 
 
 def test_cpu(sync_sim):
@@ -31,3 +47,182 @@ def test_cpu(sync_sim):
             yield
 
     sync_sim(m, testbench)
+
+
+def test_cpu_branch_loop(sync_sim):
+    m = nm.Module()
+    reg = 2
+    cpu_inst = m.submodules.cpu = cpu.CPU(debug_reg=reg)
+
+    def addi(rd, rs1, imm):
+        return encoding.IType.encode(
+                imm & 0xfff,
+                rs1,
+                encoding.IntRegImmFunct.ADDI,
+                rd,
+                encoding.Opcode.OP_IMM)
+
+    iterations = 5
+    program = [addi(0, 0, 0),
+               addi(1, 0, iterations),
+               addi(reg, reg, 3),
+               addi(1, 1, -1),
+               encoding.BType.encode(
+                   -8 & 0x1fff,
+                   1,
+                   0,
+                   encoding.BranchFunct.BNE),
+               addi(reg, reg, 1000),
+               encoding.JType.encode(0, 0)]
+
+    imem = nm.Memory(width=32, depth=1024, init=program)
+    imem_rp = m.submodules.imem_rp = imem.read_port(domain="sync")
+    m.d.comb += [
+            imem_rp.addr.eq(cpu_inst.imem_addr[2:]),
+            cpu_inst.imem_data.eq(imem_rp.data),
+    ]
+
+    def testbench():
+        for _ in range(30):
+            yield
+        assert (yield cpu_inst.debug_out) == iterations * 3 + 1000
+
+    sync_sim(m, testbench)
+
+
+def test_cpu_store_load(sync_sim):
+    m = nm.Module()
+    reg = 2
+    cpu_inst = m.submodules.cpu = cpu.CPU(debug_reg=reg)
+
+    def addi(rd, rs1, imm):
+        return encoding.IType.encode(
+                imm & 0xfff,
+                rs1,
+                encoding.IntRegImmFunct.ADDI,
+                rd,
+                encoding.Opcode.OP_IMM)
+
+    program = [addi(0, 0, 0),
+               addi(1, 0, 0x7ff),
+               encoding.SType.encode(0x22, 0, 1, encoding.StoreFunct.SH),
+               encoding.IType.encode(
+                   0x20,
+                   0,
+                   encoding.LoadFunct.LW,
+                   reg,
+                   encoding.Opcode.LOAD),
+               encoding.JType.encode(0, 0)]
+
+    imem = nm.Memory(width=32, depth=1024, init=program)
+    imem_rp = m.submodules.imem_rp = imem.read_port(domain="sync")
+    dmem = nm.Memory(width=32, depth=64, init=[0] * 8 + [0x1234])
+    dmem_rp = m.submodules.dmem_rp = dmem.read_port(domain="comb")
+    dmem_wp = m.submodules.dmem_wp = dmem.write_port(granularity=8)
+    m.d.comb += [
+            imem_rp.addr.eq(cpu_inst.imem_addr[2:]),
+            cpu_inst.imem_data.eq(imem_rp.data),
+            dmem_rp.addr.eq(cpu_inst.dmem_r_addr),
+            cpu_inst.dmem_r_data.eq(dmem_rp.data),
+            dmem_wp.addr.eq(cpu_inst.dmem_w_addr),
+            dmem_wp.data.eq(cpu_inst.dmem_w_data),
+            dmem_wp.en.eq(cpu_inst.dmem_w_en),
+    ]
+
+    def testbench():
+        for _ in range(20):
+            yield
+        assert (yield cpu_inst.debug_out) == 0x07ff1234
+
+    sync_sim(m, testbench)
+
+
+@pytest.mark.parametrize(
+        "implementation, radix",
+        [
+            (muldiv.Implementation.ITERATIVE, 2),
+            (muldiv.Implementation.ITERATIVE, 4),
+            (muldiv.Implementation.UNROLLED, 4),
+        ])
+def test_cpu_muldiv(sync_sim, implementation, radix):
+    program = assembler.assemble(MULDIV_PROGRAM).tolist()
+    golden = isa_simulator.ISASimulator(program)
+    golden.run()
+
+    m = nm.Module()
+    cpu_inst = m.submodules.cpu = cpu.CPU(
+            muldiv_unit=muldiv.MulDiv(implementation, radix))
+    imem = nm.Memory(width=32, depth=len(program), init=program)
+    imem_rp = m.submodules.imem_rp = imem.read_port(domain="sync")
+    m.d.comb += [
+            imem_rp.addr.eq(cpu_inst.imem_addr[2:]),
+            cpu_inst.imem_data.eq(imem_rp.data),
+    ]
+
+    def testbench():
+        for _ in range(5 * 34 + 10):
+            yield
+        assert (yield cpu_inst.debug_out) == golden.registers[2]
+
+    sync_sim(m, testbench)
+
+
+@pytest.mark.parametrize("imem_wait, dmem_wait", [(0, 1), (1, 1), (2, 3)])
+def test_cpu_slow_memories(sync_sim, imem_wait, dmem_wait):
+    program = assembler.assemble("""
+            nop
+            li x1, 0x7ff
+            sh x1, 0x22(x0)
+            lw x2, 0x20(x0)
+            li x3, 3
+    loop:   lw x4, 0x24(x0)
+            addi x4, x4, 1
+            sw x4, 0x24(x0)
+            addi x3, x3, -1
+            bnez x3, loop
+            lw x4, 0x24(x0)
+            add x2, x2, x4
+            j .
+    """).tolist()
+    data = [0] * 8 + [0x1234]
+    golden = isa_simulator.ISASimulator(program, data)
+    golden.run()
+
+    m = nm.Module()
+    cpu_inst = m.submodules.cpu = cpu.CPU()
+    imem = nm.Memory(width=32, depth=len(program), init=program)
+    imem_rp = m.submodules.imem_rp = imem.read_port(domain="sync")
+    dmem = nm.Memory(width=32, depth=64, init=data)
+    dmem_rp = m.submodules.dmem_rp = dmem.read_port(transparent=False)
+    dmem_wp = m.submodules.dmem_wp = dmem.write_port(granularity=8)
+
+    # Each fetch and each access completes after its number of wait cycles
+    imem_waited = nm.Signal(range(imem_wait + 1))
+    dmem_waited = nm.Signal(range(dmem_wait + 1))
+    dmem_access = cpu_inst.dmem_r_en | cpu_inst.dmem_w_en.any()
+    m.d.comb += [
+            cpu_inst.imem_valid.eq(imem_waited == imem_wait),
+            cpu_inst.dmem_valid.eq(dmem_waited == dmem_wait),
+    ]
+    m.d.sync += [
+            imem_waited.eq(nm.Mux(
+                cpu_inst.imem_valid, 0, imem_waited + 1)),
+            dmem_waited.eq(nm.Mux(
+                dmem_access & ~cpu_inst.dmem_valid, dmem_waited + 1, 0)),
+    ]
+    m.d.comb += [
+            imem_rp.addr.eq(cpu_inst.imem_addr[2:]),
+            cpu_inst.imem_data.eq(imem_rp.data),
+            dmem_rp.addr.eq(cpu_inst.dmem_r_addr),
+            cpu_inst.dmem_r_data.eq(dmem_rp.data),
+            dmem_wp.addr.eq(cpu_inst.dmem_w_addr),
+            dmem_wp.data.eq(cpu_inst.dmem_w_data),
+            dmem_wp.en.eq(cpu_inst.dmem_w_en),
+    ]
+
+    def testbench():
+        for _ in range(200):
+            yield
+        assert (yield cpu_inst.debug_out) == golden.registers[2]
+
+    sync_sim(m, testbench)
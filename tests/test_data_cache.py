@@ -0,0 +1,204 @@
+"""Data cache tests"""
+import nmigen as nm
+import nmigen.sim
+import pytest
+
+from riscy_boi import data_cache, encoding, pipelined_cpu
+
+
+def backing_store(m, dcache, init, latency):
+    """Add a backing store which completes accesses after latency cycles"""
+    store = nm.Memory(width=32, depth=1024, init=init)
+    store_rp = m.submodules.store_rp = store.read_port(domain="comb")
+    store_wp = m.submodules.store_wp = store.write_port()
+    wait = nm.Signal(range(latency + 1))
+
+    m.d.comb += [
+            store_rp.addr.eq(dcache.mem_addr),
+            store_wp.addr.eq(dcache.mem_addr),
+            store_wp.data.eq(dcache.mem_w_data),
+            dcache.mem_r_data.eq(store_rp.data),
+    ]
+    with m.If(dcache.mem_req & (wait == latency)):
+        m.d.comb += [
+                dcache.mem_ack.eq(1),
+                store_wp.en.eq(dcache.mem_we),
+        ]
+        m.d.sync += wait.eq(0)
+    with m.Elif(dcache.mem_req):
+        m.d.sync += wait.eq(wait + 1)
+
+    return store
+
+
+def access(dcache, addr, w_en=0, w_data=0):
+    yield dcache.addr.eq(addr)
+    yield dcache.r_en.eq(w_en == 0)
+    yield dcache.w_en.eq(w_en)
+    yield dcache.w_data.eq(w_data)
+    yield
+    yield nmigen.sim.Settle()
+    cycles = 1
+    while not (yield dcache.valid):
+        yield
+        yield nmigen.sim.Settle()
+        cycles += 1
+    yield dcache.r_en.eq(0)
+    yield dcache.w_en.eq(0)
+    return (yield dcache.r_data), cycles
+
+
+def test_dcache_read_hits_after_refill(sync_sim):
+    m = nm.Module()
+    dcache = m.submodules.dcache = data_cache.DataCache(lines=4, line_words=4)
+    init = [0x5000 + i for i in range(1024)]
+    backing_store(m, dcache, init, latency=2)
+
+    def testbench():
+        data, cycles = yield from access(dcache, 9)
+        assert data == init[9]
+        assert cycles > 4
+
+        for addr in (8, 10, 11, 9):
+            data, cycles = yield from access(dcache, addr)
+            assert data == init[addr]
+            assert cycles == 1
+
+        # Let the counters register the last access
+        yield
+        yield
+        assert (yield dcache.hits) == 5
+        assert (yield dcache.misses) == 1
+        assert (yield dcache.writebacks) == 0
+
+    sync_sim(m, testbench)
+
+
+def test_dcache_byte_lane_writes(sync_sim):
+    m = nm.Module()
+    dcache = m.submodules.dcache = data_cache.DataCache(lines=4, line_words=2)
+    backing_store(m, dcache, [0x11223344] * 16, latency=1)
+
+    def testbench():
+        yield from access(dcache, 3, w_en=0b0010, w_data=0xaaaaaaaa)
+        yield from access(dcache, 3, w_en=0b1000, w_data=0xbbbbbbbb)
+        data, _ = yield from access(dcache, 3)
+        assert data == 0xbb22aa44
+
+    sync_sim(m, testbench)
+
+
+def test_dcache_load_after_store_to_same_word(sync_sim):
+    m = nm.Module()
+    dcache = m.submodules.dcache = data_cache.DataCache(lines=4, line_words=2)
+    backing_store(m, dcache, [0] * 16, latency=1)
+
+    def testbench():
+        yield from access(dcache, 5)
+
+        # Present the load in the cycle after the store, without waiting
+        yield dcache.addr.eq(5)
+        yield dcache.w_en.eq(0b1111)
+        yield dcache.w_data.eq(0x12345678)
+        yield
+        yield dcache.w_en.eq(0)
+        yield dcache.r_en.eq(1)
+        yield nmigen.sim.Settle()
+        assert (yield dcache.valid)
+
+        data, _ = yield from access(dcache, 5)
+        assert data == 0x12345678
+
+    sync_sim(m, testbench)
+
+
+@pytest.mark.parametrize("ways", [1, 2])
+def test_dcache_writes_back_evicted_lines(sync_sim, ways):
+    m = nm.Module()
+    dcache = m.submodules.dcache = data_cache.DataCache(
+            lines=2 * ways,
+            ways=ways,
+            line_words=2)
+    store = backing_store(m, dcache, list(range(64)), latency=1)
+
+    def testbench():
+        # Addresses mapping to the same set of either configuration
+        conflicting = [0, 4, 8]
+        for addr in conflicting:
+            yield from access(dcache, addr, w_en=0b1111, w_data=addr + 100)
+
+        for addr in conflicting:
+            data, _ = yield from access(dcache, addr)
+            assert data == addr + 100
+            # The untouched word of each line survives the round trip
+            data, _ = yield from access(dcache, addr + 1)
+            assert data == addr + 1
+
+        assert (yield store[0]) == 100
+        assert (yield dcache.writebacks) >= len(conflicting)
+
+    sync_sim(m, testbench)
+
+
+def test_pipelined_cpu_through_dcache(sync_sim):
+    m = nm.Module()
+    reg = 2
+    cpu_inst = m.submodules.cpu = pipelined_cpu.PipelinedCPU(debug_reg=reg)
+    dcache = m.submodules.dcache = data_cache.DataCache(lines=2, line_words=2)
+
+    def addi(rd, rs1, imm):
+        return encoding.IType.encode(
+                imm & 0xfff,
+                rs1,
+                encoding.IntRegImmFunct.ADDI,
+                rd,
+                encoding.Opcode.OP_IMM)
+
+    def store(funct, rs2, rs1, imm):
+        return encoding.SType.encode(imm & 0xfff, rs1, rs2, funct)
+
+    def load(funct, rd, rs1, imm):
+        return encoding.IType.encode(
+                imm & 0xfff,
+                rs1,
+                funct,
+                rd,
+                encoding.Opcode.LOAD)
+
+    program = [
+            addi(1, 0, 0x7f),
+            store(encoding.StoreFunct.SW, 1, 0, 0x40),
+            addi(1, 0, -2),
+            store(encoding.StoreFunct.SB, 1, 0, 0x41),
+            # Evict the stored line, then read it back
+            load(encoding.LoadFunct.LW, 3, 0, 0x80),
+            load(encoding.LoadFunct.LW, 3, 0, 0xc0),
+            load(encoding.LoadFunct.LW, reg, 0, 0x40),
+            load(encoding.LoadFunct.LB, 4, 0, 0x41),
+            store(encoding.StoreFunct.SH, 4, 0, 0x42),
+            load(encoding.LoadFunct.LW, 5, 0, 0x40),
+            addi(reg, 5, 0),
+            encoding.JType.encode(0, 0),
+    ]
+    imem = nm.Memory(width=32, depth=64, init=program)
+    imem_rp = m.submodules.imem_rp = imem.read_port()
+    backing_store(m, dcache, [], latency=3)
+    m.d.comb += [
+            imem_rp.addr.eq(cpu_inst.imem_addr[2:]),
+            cpu_inst.imem_data.eq(imem_rp.data),
+
+            dcache.addr.eq(cpu_inst.dmem_r_addr),
+            dcache.r_en.eq(cpu_inst.dmem_r_en),
+            dcache.w_en.eq(cpu_inst.dmem_w_en),
+            dcache.w_data.eq(cpu_inst.dmem_w_data),
+            cpu_inst.dmem_r_data.eq(dcache.r_data),
+            cpu_inst.dmem_valid.eq(dcache.valid),
+    ]
+
+    def testbench():
+        for _ in range(150):
+            yield
+        assert (yield cpu_inst.debug_out) == 0xfffefe7f
+        assert (yield dcache.writebacks) >= 1
+
+    sync_sim(m, testbench)
@@ -0,0 +1,55 @@
+"""Data memory interface tests"""
+import nmigen.sim
+import pytest
+
+from riscy_boi import data_memory
+
+
+@pytest.mark.parametrize(
+        "address, mode, signed, load_value", [
+            (0, data_memory.AddressMode.WORD, 1, 0x80f1e2d3),
+            (1, data_memory.AddressMode.BYTE, 0, 0xe2),
+            (1, data_memory.AddressMode.BYTE, 1, 0xffffffe2),
+            (0, data_memory.AddressMode.BYTE, 1, 0xd3 | 0xffffff00),
+            (2, data_memory.AddressMode.HALF, 1, 0xffff80f1),
+            (2, data_memory.AddressMode.HALF, 0, 0x80f1),
+            (0, data_memory.AddressMode.HALF, 0, 0xe2d3)])
+def test_load_value(comb_sim, address, mode, signed, load_value):
+    dmem = data_memory.DataMemory()
+
+    def testbench():
+        yield dmem.dmem_r_data.eq(0x80f1e2d3)
+        yield dmem.byte_address.eq(0x100 + address)
+        yield dmem.address_mode.eq(mode)
+        yield dmem.signed.eq(signed)
+        yield nmigen.sim.Settle()
+        assert (yield dmem.dmem_r_addr) == 0x100 >> 2
+        assert (yield dmem.load_value) == load_value
+
+    comb_sim(dmem, testbench)
+
+
+@pytest.mark.parametrize(
+        "address, mode, w_data, w_en", [
+            (0, data_memory.AddressMode.WORD, 0x12345678, 0b1111),
+            (3, data_memory.AddressMode.BYTE, 0x78787878, 0b1000),
+            (1, data_memory.AddressMode.BYTE, 0x78787878, 0b0010),
+            (2, data_memory.AddressMode.HALF, 0x56785678, 0b1100),
+            (0, data_memory.AddressMode.HALF, 0x56785678, 0b0011)])
+def test_store_lanes(comb_sim, address, mode, w_data, w_en):
+    dmem = data_memory.DataMemory()
+
+    def testbench():
+        yield dmem.store_value.eq(0x12345678)
+        yield dmem.byte_address.eq(0x100 + address)
+        yield dmem.address_mode.eq(mode)
+        yield nmigen.sim.Settle()
+        assert (yield dmem.dmem_w_en) == 0
+
+        yield dmem.store.eq(1)
+        yield nmigen.sim.Settle()
+        assert (yield dmem.dmem_w_addr) == 0x100 >> 2
+        assert (yield dmem.dmem_w_data) == w_data
+        assert (yield dmem.dmem_w_en) == w_en
+
+    comb_sim(dmem, testbench)
@@ -0,0 +1,78 @@
+"""Dual-issue CPU tests"""
+import pytest
+
+from riscy_boi import (assembler, benchmarks, counters, dual_issue_cpu,
+                       isa_simulator)
+
+
+def run_program(sync_sim, source, cycles, check):
+    program = assembler.assemble(source).tolist()
+    golden = isa_simulator.ISASimulator(program)
+    golden.run()
+    cpu_inst = dual_issue_cpu.DualIssueCPU(
+            events=dual_issue_cpu.PAIRING_EVENTS)
+    m, _, _ = benchmarks.harness(
+            cpu_inst,
+            benchmarks.Kernel(program, [], 0, 0))
+    csrs = cpu_inst.counters
+
+    def testbench():
+        for _ in range(cycles):
+            yield
+        assert (yield cpu_inst.debug_out) == golden.registers[2]
+        counts = {}
+        for event, count in zip(csrs.event_list, csrs.event_counts):
+            counts[event] = yield count
+        check(counts)
+
+    sync_sim(m, testbench)
+
+
+def test_dual_issue_cpu_pairing_rules(sync_sim):
+    source = """
+            nop
+            nop                 # paired
+            li x1, 5
+            li x3, 7            # paired
+            add x2, x1, x3
+            add x4, x2, x2      # dependent
+            sw x4, 0(x0)
+            add x2, x2, x4      # paired
+            lw x5, 0(x0)
+            add x2, x2, x5      # dependent
+            beq x0, x1, .       # control
+            addi x2, x2, 1
+            addi x2, x2, 1
+            csrr x6, instret    # structural
+            addi x2, x2, 2
+            j .                 # structural
+    """
+
+    def check(counts):
+        assert counts[counters.Event.DUAL_ISSUE] == 3
+        assert counts[counters.Event.PAIR_DEPENDENCY] == 2
+        assert counts[counters.Event.PAIR_STRUCTURAL] == 2
+        assert counts[counters.Event.PAIR_CONTROL] == 1
+
+    run_program(sync_sim, source, 30, check)
+
+
+@pytest.mark.parametrize("iterations", [1, 10])
+def test_dual_issue_cpu_loop(sync_sim, iterations):
+    # Each iteration is two pairs, the second ending in the loop's branch
+    source = f"""
+            nop
+            nop
+            li x1, {iterations}
+            li x2, 0
+    loop:   addi x2, x2, 3
+            addi x1, x1, -1
+            addi x3, x3, 1
+            bnez x1, loop
+            j .
+    """
+
+    def check(counts):
+        assert counts[counters.Event.DUAL_ISSUE] == 2 + 2 * iterations
+
+    run_program(sync_sim, source, 4 + 2 * iterations, check)
@@ -53,3 +53,49 @@ def test_itype_same_immediate_out_as_in(comb_sim, imm):
         assert (yield encoding.IType(addi).immediate()) == extended_imm
 
     comb_sim(m, testbench)
+
+
+@pytest.mark.parametrize(
+        "offset",
+        [   # note LSB is always zero
+            0b0000111100000,
+            0b1000000000000,
+            0b1111100001110,
+            0b0101010101010,
+            0b1111111111110,
+            0b0100000000000,
+        ])
+def test_btype_same_offset_out_as_in(comb_sim, offset):
+    m = nm.Module()
+    beq = nm.Const(
+            encoding.BType.encode(offset, 1, 2, encoding.BranchFunct.BEQ),
+            shape=32)
+    extended_offset = int(f"{offset:013b}"[0]*19 + f"{offset:013b}", 2)
+    assert (extended_offset & 0x1ffe) == offset
+
+    def testbench():
+        assert (yield encoding.BType(beq).immediate()) == extended_offset
+
+    comb_sim(m, testbench)
+
+
+@pytest.mark.parametrize(
+        "imm",
+        [
+            0b111110000111,
+            0b010101010101,
+            0b000000011111,
+            0b100000100000,
+        ])
+def test_stype_same_immediate_out_as_in(comb_sim, imm):
+    m = nm.Module()
+    store = nm.Const(
+            encoding.SType.encode(imm, 1, 2, encoding.StoreFunct.SW),
+            shape=32)
+    extended_imm = int(f"{imm:012b}"[0]*20 + f"{imm:012b}", 2)
+
+    def testbench():
+        assert (yield encoding.SType(store).immediate()) == extended_imm
+        assert (yield encoding.SType(store).funct()) == encoding.StoreFunct.SW
+
+    comb_sim(m, testbench)
@@ -0,0 +1,90 @@
+"""Differential fuzzing tests"""
+import random
+
+import pytest
+
+from riscy_boi import alu, assembler, dual_issue_cpu, encoding, fuzz
+from riscy_boi import instruction_decoder, isa_simulator
+
+
+@pytest.mark.parametrize("muldiv", [False, True])
+def test_generated_programs(muldiv):
+    for seed in range(20):
+        ops = fuzz.generate(random.Random(seed), 30, muldiv)
+        program = fuzz.encode(ops)
+        assert len(program) == 31
+        assert program[-1] == fuzz.HALT
+        for index, (word, target) in enumerate(ops[:-1]):
+            instruction = instruction_decoder.lookup(program[index], muldiv)
+            assert instruction in fuzz.instructions(muldiv)
+            assert target is None or index < target <= 30
+            assert word & 0x7f == program[index] & 0x7f
+
+        golden = isa_simulator.ISASimulator(program, dmem_bytes=1024)
+        golden.run(max_instructions=len(program))
+        assert golden.halted
+
+
+def test_counter_csrs():
+    assert encoding.CSR.HPMCOUNTER3 in fuzz.counter_csrs()
+    # The dual-issue CPU's hpmcounter3 counts the cycles retiring two
+    csrs = fuzz.counter_csrs(dual_issue_cpu.PAIRING_EVENTS)
+    assert encoding.CSR.HPMCOUNTER3 not in csrs
+    assert encoding.CSR.HPMCOUNTER3 + 5 in csrs
+    assert fuzz.counter_csrs(dual_issue_cpu.EVENTS * 4) == [
+            encoding.CSR.INSTRET, encoding.CSR.INSTRETH]
+
+
+def test_minimise():
+    program = assembler.assemble("""
+            addi x1, x0, 1
+            beq x0, x0, skip
+            addi x2, x0, 2
+            xor x3, x1, x2
+    skip:   addi x4, x0, 4
+            j .
+    """).tolist()
+    ops = [fuzz.Op(word, None) for word in program]
+    ops[1] = fuzz.Op(program[1], 4)
+
+    def has_xor(candidate):
+        return any(
+                instruction_decoder.lookup(word).name == "XOR"
+                for word in fuzz.encode(candidate))
+
+    assert fuzz.minimise(ops, has_xor) == [ops[3], ops[5]]
+
+    def has_beq_and_xor(candidate):
+        return has_xor(candidate) and any(
+                instruction_decoder.lookup(word).name == "BEQ"
+                for word in fuzz.encode(candidate))
+
+    # The branch to the removed instruction goes to the one after it
+    assert fuzz.encode(fuzz.minimise(ops, has_beq_and_xor)) == (
+            assembler.assemble("""
+                    beq x0, x0, skip
+                    xor x3, x1, x2
+            skip:   j .
+            """).tolist())
+
+
+def test_fuzz_single_cycle():
+    for seed in range(2):
+        assert fuzz.fuzz_one(("single_cycle", seed, 20, "pysim")) == {
+                "seed": seed}
+
+
+def test_compare_finds_difference(monkeypatch):
+    monkeypatch.setitem(
+            isa_simulator.ALU_FUNCTIONS,
+            alu.ALUOp.XOR,
+            lambda a, b: a | b)
+    program = assembler.assemble("""
+            addi x1, x0, 3
+            xori x2, x1, 1
+            j .
+    """).tolist()
+    ops = [fuzz.Op(word, None) for word in program]
+    assert fuzz.compare("single_cycle", ops, []) == (
+            "XORI 0x0010c113 at 0x4 wrote x2 = 0x2, not x2 = 0x3")
+    assert fuzz.compare("single_cycle", ops[:1] + ops[2:], []) is None
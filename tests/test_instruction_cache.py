@@ -0,0 +1,131 @@
+"""Instruction cache tests"""
+import nmigen as nm
+import nmigen.sim
+import pytest
+
+from riscy_boi import encoding, instruction_cache, pipelined_cpu
+
+
+def backing_store(m, icache, init, latency):
+    """Add a backing store which acknowledges reads after latency cycles"""
+    store = nm.Memory(width=32, depth=1024, init=init)
+    store_rp = m.submodules.store_rp = store.read_port(domain="comb")
+    wait = nm.Signal(range(latency + 1))
+
+    m.d.comb += [
+            store_rp.addr.eq(icache.mem_addr),
+            icache.mem_data.eq(store_rp.data),
+    ]
+    with m.If(icache.mem_req & (wait == latency)):
+        m.d.comb += icache.mem_ack.eq(1)
+        m.d.sync += wait.eq(0)
+    with m.Elif(icache.mem_req):
+        m.d.sync += wait.eq(wait + 1)
+
+
+def fetch(icache, addr):
+    yield icache.addr.eq(addr)
+    yield
+    yield nmigen.sim.Settle()
+    cycles = 1
+    while not (yield icache.valid):
+        yield
+        yield nmigen.sim.Settle()
+        cycles += 1
+    return (yield icache.data), cycles
+
+
+@pytest.mark.parametrize("ways", [1, 2])
+def test_icache_hits_after_refill(sync_sim, ways):
+    m = nm.Module()
+    icache = m.submodules.icache = instruction_cache.InstructionCache(
+            lines=4,
+            ways=ways,
+            line_words=4)
+    init = [0x1000 + i for i in range(1024)]
+    backing_store(m, icache, init, latency=3)
+
+    def testbench():
+        data, cycles = yield from fetch(icache, 0x4)
+        assert data == init[0x4 // 4]
+        assert cycles > 4 * 4
+
+        for addr in (0x0, 0x8, 0xc, 0x4):
+            data, cycles = yield from fetch(icache, addr)
+            assert data == init[addr // 4]
+            assert cycles == 1
+
+        assert (yield icache.misses) == 1
+
+    sync_sim(m, testbench)
+
+
+@pytest.mark.parametrize(
+        "ways, conflict_misses", [
+            (1, 4),
+            (2, 2)])
+def test_icache_associativity(sync_sim, ways, conflict_misses):
+    m = nm.Module()
+    icache = m.submodules.icache = instruction_cache.InstructionCache(
+            lines=4,
+            ways=ways,
+            line_words=2)
+    init = list(range(1024))
+    backing_store(m, icache, init, latency=1)
+
+    def testbench():
+        # Two addresses mapping to the same set of either configuration
+        conflicting = [0x0, 0x100]
+        for addr in conflicting * 2:
+            data, _ = yield from fetch(icache, addr)
+            assert data == init[addr // 4]
+
+        assert (yield icache.misses) == conflict_misses
+
+    sync_sim(m, testbench)
+
+
+def test_pipelined_cpu_through_icache(sync_sim):
+    m = nm.Module()
+    reg = 2
+    cpu_inst = m.submodules.cpu = pipelined_cpu.PipelinedCPU(debug_reg=reg)
+    icache = m.submodules.icache = instruction_cache.InstructionCache(
+            lines=8,
+            line_words=4)
+
+    def addi(rd, rs1, imm):
+        return encoding.IType.encode(
+                imm & 0xfff,
+                rs1,
+                encoding.IntRegImmFunct.ADDI,
+                rd,
+                encoding.Opcode.OP_IMM)
+
+    iterations = 5
+    program = [
+            addi(1, 0, iterations),
+            addi(reg, 0, 0),
+            addi(reg, reg, 3),
+            addi(1, 1, -1),
+            encoding.BType.encode(
+                -8 & 0x1fff,
+                1,
+                0,
+                encoding.BranchFunct.BNE),
+            addi(reg, reg, 1000),
+            encoding.JType.encode(0, 0),
+    ]
+    backing_store(m, icache, program, latency=4)
+    m.d.comb += [
+            icache.addr.eq(cpu_inst.imem_addr),
+            cpu_inst.imem_data.eq(icache.data),
+            cpu_inst.imem_valid.eq(icache.valid),
+    ]
+
+    def testbench():
+        for _ in range(100):
+            yield
+        assert (yield cpu_inst.debug_out) == iterations * 3 + 1000
+        assert (yield icache.misses) == 2
+
+    sync_sim(m, testbench)
@@ -1,5 +1,8 @@
 """Instruction decoder tests"""
+import random
+
 import nmigen.sim
+import pytest
 
 from riscy_boi import alu
 from riscy_boi import data_memory
@@ -7,8 +10,8 @@ from riscy_boi import encoding
 from riscy_boi import instruction_decoder
 
 
-def test_decoding_addi(comb_sim):
-    idec = instruction_decoder.InstructionDecoder()
+def test_decoding_addi(comb_sim, shared_design):
+    idec = shared_design(instruction_decoder.InstructionDecoder)
 
     def testbench():
         immediate = 0b100011110000
@@ -34,8 +37,8 @@ def test_decoding_addi(comb_sim):
     comb_sim(idec, testbench)
 
 
-def test_decoding_jal(comb_sim):
-    idec = instruction_decoder.InstructionDecoder()
+def test_decoding_jal(comb_sim, shared_design):
+    idec = shared_design(instruction_decoder.InstructionDecoder)
 
     def testbench():
         immediate = int("1" * 20 + "0", base=2)
@@ -51,8 +54,8 @@ def test_decoding_jal(comb_sim):
     comb_sim(idec, testbench)
 
 
-def test_decoding_load_word(comb_sim):
-    idec = instruction_decoder.InstructionDecoder()
+def test_decoding_load_word(comb_sim, shared_design):
+    idec = shared_design(instruction_decoder.InstructionDecoder)
 
     def testbench():
         immediate = 0b100011110000
@@ -79,3 +82,214 @@ def test_decoding_load_word(comb_sim):
         assert (yield idec.dmem_address_mode) == data_memory.AddressMode.WORD
 
     comb_sim(idec, testbench)
+
+
+def test_decoding_bne(comb_sim, shared_design):
+    idec = shared_design(instruction_decoder.InstructionDecoder)
+
+    def testbench():
+        immediate = int("1" * 9 + "1000", base=2)
+        rs1 = 3
+        rs2 = 4
+        instruction = encoding.BType.encode(
+                immediate,
+                rs1,
+                rs2,
+                encoding.BranchFunct.BNE)
+
+        yield idec.instr.eq(instruction)
+        yield nmigen.sim.Settle()
+        assert (yield idec.pc_load) == 0
+        assert (yield idec.branch) == 1
+        assert (yield idec.branch_funct) == encoding.BranchFunct.BNE
+        assert (yield idec.rf_read_select_1) == rs1
+        assert (yield idec.rf_read_select_2) == rs2
+        assert (yield idec.alu_op) == alu.ALUOp.ADD
+        assert (yield idec.alu_imm) == int("1" * 28 + "1000", base=2)
+        assert (yield idec.alu_mux_op) == instruction_decoder.ALUInput.PC
+        assert (yield idec.rf_write_enable) == 0
+
+    comb_sim(idec, testbench)
+
+
+def test_decoding_store_half(comb_sim, shared_design):
+    idec = shared_design(instruction_decoder.InstructionDecoder)
+
+    def testbench():
+        immediate = 0b100011110001
+        rs1 = 1
+        rs2 = 6
+        instruction = encoding.SType.encode(
+                immediate,
+                rs1,
+                rs2,
+                encoding.StoreFunct.SH)
+
+        yield idec.instr.eq(instruction)
+        yield nmigen.sim.Settle()
+        assert (yield idec.pc_load) == 0
+        assert (yield idec.rf_read_select_1) == rs1
+        assert (yield idec.rf_read_select_2) == rs2
+        assert (yield idec.alu_op) == alu.ALUOp.ADD
+        assert (yield idec.alu_imm) == 0b11111111111111111111100011110001
+        assert (yield idec.alu_mux_op) == (
+                instruction_decoder.ALUInput.READ_DATA_1)
+        assert (yield idec.rf_write_enable) == 0
+        assert (yield idec.dmem_store) == 1
+        assert (yield idec.dmem_address_mode) == data_memory.AddressMode.HALF
+
+    comb_sim(idec, testbench)
+
+
+def test_decoding_csrr(comb_sim, shared_design):
+    idec = shared_design(instruction_decoder.InstructionDecoder)
+
+    def testbench():
+        rd = 7
+        instruction = encoding.IType.encode(
+                encoding.CSR.INSTRETH,
+                0,
+                encoding.SystemFunct.CSRRS,
+                rd,
+                encoding.Opcode.SYSTEM)
+
+        yield idec.instr.eq(instruction)
+        yield nmigen.sim.Settle()
+        assert (yield idec.pc_load) == 0
+        assert (yield idec.rf_write_enable) == 1
+        assert (yield idec.rf_write_select) == rd
+        assert (yield idec.rd_mux_op) == instruction_decoder.RdValue.CSR
+        assert (yield idec.csr) == encoding.CSR.INSTRETH
+
+        yield idec.instr.eq(encoding.IType.encode(
+                0,
+                0,
+                encoding.SystemFunct.PRIV,
+                0,
+                encoding.Opcode.SYSTEM))
+        yield nmigen.sim.Settle()
+        assert (yield idec.rf_write_enable) == 0
+
+    comb_sim(idec, testbench)
+
+
+@pytest.mark.parametrize(
+        "funct, funct7, op, alu_mux_op, alu_a_mux_op", [
+            (encoding.IntRegRegFunct.ADD_OR_SUB, encoding.AddSubType.ADD,
+             alu.ALUOp.ADD,
+             instruction_decoder.ALUInput.READ_DATA_1,
+             instruction_decoder.ALUOperand.READ_DATA_2),
+            (encoding.IntRegRegFunct.ADD_OR_SUB, encoding.AddSubType.SUB,
+             alu.ALUOp.SUB,
+             instruction_decoder.ALUInput.READ_DATA_2,
+             instruction_decoder.ALUOperand.READ_DATA_1),
+            (encoding.IntRegRegFunct.SRL_OR_SRA, encoding.RightShiftType.SRAI,
+             alu.ALUOp.SRA,
+             instruction_decoder.ALUInput.READ_DATA_1,
+             instruction_decoder.ALUOperand.READ_DATA_2)])
+def test_decoding_register_register(
+        comb_sim,
+        funct,
+        funct7,
+        op,
+        alu_mux_op,
+        alu_a_mux_op):
+    idec = instruction_decoder.InstructionDecoder()
+
+    def testbench():
+        yield idec.instr.eq(encoding.RType.encode(1, 2, funct, funct7, 3))
+        yield nmigen.sim.Settle()
+        assert (yield idec.pc_load) == 0
+        assert (yield idec.rf_write_enable) == 1
+        assert (yield idec.rf_write_select) == 3
+        assert (yield idec.rf_read_select_1) == 1
+        assert (yield idec.rf_read_select_2) == 2
+        assert (yield idec.alu_op) == op
+        assert (yield idec.alu_mux_op) == alu_mux_op
+        assert (yield idec.alu_a_mux_op) == alu_a_mux_op
+        assert (yield idec.rd_mux_op) == (
+                instruction_decoder.RdValue.ALU_OUTPUT)
+
+    comb_sim(idec, testbench)
+
+
+@pytest.mark.parametrize("muldiv", [False, True])
+def test_decoding_muldiv(comb_sim, shared_design, muldiv):
+    idec = shared_design(
+            instruction_decoder.InstructionDecoder,
+            muldiv=muldiv)
+
+    def testbench():
+        yield idec.instr.eq(encoding.RType.encode(
+                1,
+                2,
+                encoding.MulDivFunct.DIVU,
+                encoding.MULDIV_FUNCT7,
+                3))
+        yield nmigen.sim.Settle()
+        assert (yield idec.rf_write_enable) == 1
+        assert (yield idec.rf_write_select) == 3
+        assert (yield idec.rf_read_select_1) == 1
+        assert (yield idec.rf_read_select_2) == 2
+        if muldiv:
+            assert (yield idec.rd_mux_op) == (
+                    instruction_decoder.RdValue.MULDIV)
+            assert (yield idec.muldiv_op) == encoding.MulDivFunct.DIVU
+        else:
+            assert (yield idec.rd_mux_op) == (
+                    instruction_decoder.RdValue.ALU_OUTPUT)
+
+    comb_sim(idec, testbench)
+
+
+@pytest.mark.parametrize("muldiv", [False, True])
+def test_decoding_matches_table(comb_sim, shared_design, muldiv):
+    idec = shared_design(
+            instruction_decoder.InstructionDecoder,
+            muldiv=muldiv)
+    rng = random.Random(0)
+
+    def testbench():
+        for instruction in idec.instructions:
+            pattern = instruction_decoder.pattern(instruction)
+            bits = "".join(rng.choice("01") if bit == "-" else bit
+                           for bit in pattern)
+            key = int(bits, 2)
+            value = rng.getrandbits(32)
+            offset = 0
+            for start, end in instruction_decoder.KEY_FIELDS:
+                width = end - start
+                value &= ~(((1 << width) - 1) << start)
+                value |= ((key >> offset) & ((1 << width) - 1)) << start
+                offset += width
+            assert instruction_decoder.lookup(value, muldiv) == instruction
+
+            controls = instruction.controls
+            yield idec.instr.eq(value)
+            yield nmigen.sim.Settle()
+            assert (yield idec.pc_load) == controls.pc_load
+            assert (yield idec.branch) == controls.branch
+            assert (yield idec.dmem_store) == controls.dmem_store
+            assert (yield idec.alu_op) == controls.alu_op
+            assert (yield idec.alu_mux_op) == controls.alu_mux_op
+            assert (yield idec.alu_a_mux_op) == controls.alu_a_mux_op
+            assert (yield idec.rf_write_enable) == (
+                    controls.rd_mux_op is not None)
+            if controls.rd_mux_op is not None:
+                assert (yield idec.rd_mux_op) == controls.rd_mux_op
+            if controls.immediate is None:
+                assert (yield idec.alu_imm) == 0
+
+    comb_sim(idec, testbench)
+
+
+def test_lookup_illegal_and_ambiguous():
+    slti = encoding.IType.encode(
+            1, 2, encoding.IntRegImmFunct.SLTI, 3, encoding.Opcode.OP_IMM)
+    assert instruction_decoder.lookup(slti) is None
+
+    add = next(instruction for instruction in instruction_decoder.RV32I
+               if instruction.name == "ADD")
+    with pytest.raises(ValueError):
+        instruction_decoder.precedence(
+                (add, add._replace(name="WIDE", funct7="0-0----")))
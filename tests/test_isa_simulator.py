@@ -0,0 +1,225 @@
+"""Instruction-level simulator tests"""
+import nmigen as nm
+import pytest
+
+from riscy_boi import encoding, isa_simulator, pipelined_cpu
+
+
+def addi(rd, rs1, imm):
+    return encoding.IType.encode(
+            imm & 0xfff,
+            rs1,
+            encoding.IntRegImmFunct.ADDI,
+            rd,
+            encoding.Opcode.OP_IMM)
+
+
+def op(funct, rd, rs1, rs2, funct7=0):
+    return encoding.RType.encode(rs1, rs2, funct, funct7, rd)
+
+
+def load(funct, rd, rs1, imm):
+    return encoding.IType.encode(
+            imm & 0xfff,
+            rs1,
+            funct,
+            rd,
+            encoding.Opcode.LOAD)
+
+
+def store(funct, rs2, rs1, imm):
+    return encoding.SType.encode(imm & 0xfff, rs1, rs2, funct)
+
+
+def branch(funct, rs1, rs2, offset):
+    return encoding.BType.encode(offset & 0x1fff, rs1, rs2, funct)
+
+
+HALT = encoding.JType.encode(0, 0)
+
+
+def test_iss_loop():
+    iterations = 1000
+    program = [
+            addi(1, 0, iterations),
+            addi(2, 2, 3),
+            addi(1, 1, -1),
+            branch(encoding.BranchFunct.BNE, 1, 0, -8),
+            HALT,
+    ]
+    sim = isa_simulator.ISASimulator(program)
+
+    assert sim.run() == 2 + 3 * iterations
+    assert sim.halted
+    assert sim.pc == 4 * 4
+    assert sim.registers[2] == 3 * iterations
+    assert sim.instret == 2 + 3 * iterations
+
+
+def test_iss_max_instructions():
+    sim = isa_simulator.ISASimulator([addi(1, 1, 1), HALT])
+    assert sim.run(max_instructions=1) == 1
+    assert not sim.halted
+    assert sim.registers[1] == 1
+    sim.run()
+    assert sim.halted
+
+
+@pytest.mark.parametrize(
+        "funct, funct7, a, b, result", [
+            (encoding.IntRegRegFunct.ADD_OR_SUB, encoding.AddSubType.SUB,
+             1, 2, 0xffffffff),
+            (encoding.IntRegRegFunct.SLT, 0, 0xffffffff, 1, 1),
+            (encoding.IntRegRegFunct.SLTU, 0, 0xffffffff, 1, 0),
+            (encoding.IntRegRegFunct.SRL_OR_SRA, encoding.RightShiftType.SRAI,
+             0x80000000, 4, 0xf8000000),
+            (encoding.IntRegRegFunct.SRL_OR_SRA, 0, 0x80000000, 4, 0x08000000),
+            (encoding.IntRegRegFunct.SLL, 0, 0x80000001, 33, 0x00000002),
+            (encoding.IntRegRegFunct.XOR, 0, 0b1100, 0b1010, 0b0110),
+            (encoding.MulDivFunct.MULH, encoding.MULDIV_FUNCT7,
+             0xffffffff, 0x80000000, 0),
+            (encoding.MulDivFunct.DIV, encoding.MULDIV_FUNCT7,
+             0xfffffff9, 2, 0xfffffffd),
+            (encoding.MulDivFunct.DIV, encoding.MULDIV_FUNCT7,
+             0x80000000, 0xffffffff, 0x80000000),
+            (encoding.MulDivFunct.REM, encoding.MULDIV_FUNCT7,
+             0xfffffff9, 0, 0xfffffff9),
+            (encoding.MulDivFunct.DIVU, encoding.MULDIV_FUNCT7,
+             7, 0, 0xffffffff),
+        ])
+def test_iss_register_register(funct, funct7, a, b, result):
+    sim = isa_simulator.ISASimulator([op(funct, 3, 1, 2, funct7), HALT])
+    sim.registers[1] = a
+    sim.registers[2] = b
+    sim.run()
+    assert sim.registers[3] == result
+
+
+@pytest.mark.parametrize(
+        "funct, a, b, taken", [
+            (encoding.BranchFunct.BEQ, 5, 5, True),
+            (encoding.BranchFunct.BNE, 5, 5, False),
+            (encoding.BranchFunct.BLT, 0xffffffff, 0, True),
+            (encoding.BranchFunct.BGE, 0xffffffff, 0, False),
+            (encoding.BranchFunct.BLTU, 0xffffffff, 0, False),
+            (encoding.BranchFunct.BGEU, 0xffffffff, 0, True),
+        ])
+def test_iss_branches(funct, a, b, taken):
+    program = [branch(funct, 1, 2, 8), addi(3, 0, 1), HALT]
+    sim = isa_simulator.ISASimulator(program)
+    sim.registers[1] = a
+    sim.registers[2] = b
+    sim.run()
+    assert sim.registers[3] == (0 if taken else 1)
+
+
+def test_iss_loads_and_stores():
+    program = [
+            addi(1, 0, -2),
+            store(encoding.StoreFunct.SB, 1, 0, 0x41),
+            store(encoding.StoreFunct.SH, 1, 0, 0x46),
+            load(encoding.LoadFunct.LW, 2, 0, 0x40),
+            load(encoding.LoadFunct.LB, 3, 0, 0x41),
+            load(encoding.LoadFunct.LBU, 4, 0, 0x41),
+            load(encoding.LoadFunct.LHU, 5, 0, 0x46),
+            # Misaligned accesses are aligned down, like the data memory
+            load(encoding.LoadFunct.LW, 6, 0, 0x45),
+            encoding.UType.encode(0x12345, 7, encoding.Opcode.LUI),
+            encoding.UType.encode(0x1, 8, encoding.Opcode.AUIPC),
+            HALT,
+    ]
+    sim = isa_simulator.ISASimulator(program, data=[0] * 16 + [0x7f])
+    sim.run()
+    assert sim.registers[1:9] == [
+            0xfffffffe,
+            0xfe7f,
+            0xfffffffe,
+            0xfe,
+            0xfffe,
+            0xfffe0000,
+            0x12345000,
+            0x1000 + 9 * 4,
+    ]
+    assert sim.load_word(0x44) == 0xfffe0000
+
+
+def test_iss_counters():
+    def csrr(rd, csr):
+        return encoding.IType.encode(
+                csr,
+                0,
+                encoding.SystemFunct.CSRRS,
+                rd,
+                encoding.Opcode.SYSTEM)
+
+    program = [
+            addi(1, 0, 1),
+            csrr(2, encoding.CSR.INSTRET),
+            csrr(3, encoding.CSR.CYCLE),
+            csrr(4, encoding.CSR.INSTRETH),
+            csrr(5, encoding.CSR.HPMCOUNTER3),
+            csrr(0, encoding.CSR.TIME),
+            HALT,
+    ]
+    sim = isa_simulator.ISASimulator(program)
+    sim.instret = 0x1_0000_0000
+    sim.run()
+    assert sim.registers[:6] == [0, 1, 1, 2, 1, 0]
+    assert sim.instret == 0x1_0000_0000 + 7
+
+
+def test_iss_illegal_instruction():
+    sim = isa_simulator.ISASimulator([addi(1, 0, 1), 0])
+    with pytest.raises(ValueError):
+        sim.run()
+    assert sim.registers[1] == 1
+
+
+def test_iss_matches_pipelined_cpu(sync_sim):
+    # Count down through a table of bytes, adding 3 to a total for each
+    # non-negative byte and subtracting 1 for each negative byte, with the
+    # total kept in memory
+    data = [0x01fe7f80, 0x00ff10ef]
+    program = [
+            addi(0, 0, 0),
+            addi(1, 0, 8),
+            addi(2, 0, 0),
+            load(encoding.LoadFunct.LB, 3, 1, -1),
+            branch(encoding.BranchFunct.BLT, 3, 0, 12),
+            addi(2, 2, 3),
+            encoding.JType.encode(8, 0),
+            addi(2, 2, -1),
+            store(encoding.StoreFunct.SW, 2, 0, 0x20),
+            load(encoding.LoadFunct.LW, 2, 0, 0x20),
+            addi(1, 1, -1),
+            branch(encoding.BranchFunct.BNE, 1, 0, -32),
+            HALT,
+    ]
+    golden = isa_simulator.ISASimulator(program, data=data)
+    golden.run()
+    assert golden.registers[2] == 4 * 3 - 4
+
+    m = nm.Module()
+    cpu_inst = m.submodules.cpu = pipelined_cpu.PipelinedCPU(debug_reg=2)
+    imem = nm.Memory(width=32, depth=64, init=program)
+    imem_rp = m.submodules.imem_rp = imem.read_port()
+    dmem = nm.Memory(width=32, depth=64, init=data)
+    dmem_rp = m.submodules.dmem_rp = dmem.read_port()
+    dmem_wp = m.submodules.dmem_wp = dmem.write_port(granularity=8)
+    m.d.comb += [
+            imem_rp.addr.eq(cpu_inst.imem_addr[2:]),
+            cpu_inst.imem_data.eq(imem_rp.data),
+            dmem_rp.addr.eq(cpu_inst.dmem_r_addr),
+            cpu_inst.dmem_r_data.eq(dmem_rp.data),
+            dmem_wp.addr.eq(cpu_inst.dmem_w_addr),
+            dmem_wp.data.eq(cpu_inst.dmem_w_data),
+            dmem_wp.en.eq(cpu_inst.dmem_w_en),
+    ]
+
+    def testbench():
+        for _ in range(150):
+            yield
+        assert (yield cpu_inst.debug_out) == golden.registers[2]
+        assert (yield dmem[0x20 // 4]) == golden.load_word(0x20)
+
+    sync_sim(m, testbench)
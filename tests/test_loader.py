@@ -0,0 +1,156 @@
+"""Program loader tests"""
+import struct
+
+import numpy as np
+import pytest
+
+from riscy_boi import assembler, isa_simulator, loader, top
+
+DMEM_BASE = 0x10000
+
+
+def write_elf(path, segments, entry=0, machine=loader.EM_RISCV):
+    """Write an ELF file of (address, contents, memory size, flags)"""
+    phoff = loader.ELF_HEADER.size
+    offset = phoff + loader.PROGRAM_HEADER.size * len(segments)
+    headers = b""
+    contents = b""
+    for address, data, memory_size, flags in segments:
+        headers += loader.PROGRAM_HEADER.pack(
+                loader.PT_LOAD,
+                offset + len(contents),
+                address,
+                address,
+                len(data),
+                memory_size,
+                flags,
+                4)
+        contents += data
+    ident = b"\x7fELF" + bytes([loader.ELFCLASS32, loader.ELFDATA2LSB, 1])
+    header = loader.ELF_HEADER.pack(
+            ident.ljust(16, b"\0"),
+            2,
+            machine,
+            1,
+            entry,
+            phoff,
+            0,
+            0,
+            loader.ELF_HEADER.size,
+            loader.PROGRAM_HEADER.size,
+            len(segments),
+            0,
+            0,
+            0)
+    path.write_bytes(header + headers + contents)
+
+
+def test_load_elf(tmp_path):
+    program = assembler.assemble(f"""
+            nop
+            li a0, {DMEM_BASE}
+            lw a1, 0(a0)
+            lw a2, 4(a0)
+            add a1, a1, a2
+            sw a1, 8(a0)
+            j .
+    """)
+    data = struct.pack("<2I", 0x1200, 0x34)
+    path = tmp_path / "program.elf"
+    write_elf(path, [
+            (0, program.tobytes(), len(program) * 4, loader.PF_X | 4),
+            (DMEM_BASE, data, 16, 4 | 2),
+    ])
+
+    image = loader.load(path, dmem_base=DMEM_BASE)
+    assert np.array_equal(image.imem, program)
+    assert image.dmem.tolist() == [0x1200, 0x34, 0, 0]
+    assert image.entry == 0
+
+    sim = isa_simulator.ISASimulator(image.imem, image.dmem)
+    sim.run()
+    assert sim.load_word(8) == 0x1234
+
+
+@pytest.mark.parametrize(
+        "machine, dmem_base, message",
+        [
+            (3, DMEM_BASE, "not RISC-V"),
+            (loader.EM_RISCV, DMEM_BASE + 4, "below the start of data"),
+        ])
+def test_load_elf_errors(tmp_path, machine, dmem_base, message):
+    path = tmp_path / "program.elf"
+    write_elf(path, [(DMEM_BASE, b"\0" * 4, 4, 4)], machine=machine)
+    with pytest.raises(ValueError, match=message):
+        loader.load(path, dmem_base=dmem_base)
+
+
+@pytest.mark.parametrize(
+        "pipelined, dual_issue",
+        [(False, False), (True, False), (False, True)])
+def test_load_elf_into_system(tmp_path, sync_sim, pipelined, dual_issue):
+    # gcc's default .data address, which isn't aligned to the memory's size
+    dmem_base = 0x11234
+    program = assembler.assemble(f"""
+            li a0, {dmem_base}
+            lw a1, 4(a0)
+            lw a2, 8(a0)
+            add a1, a1, a2
+            sw a1, 12(a0)
+            lw x2, 12(a0)
+            j .
+    """)
+    data = struct.pack("<3I", 0xdead, 0x1200, 0x34)
+    path = tmp_path / "program.elf"
+    write_elf(path, [
+            (0, program.tobytes(), len(program) * 4, loader.PF_X | 4),
+            (dmem_base, data, 16, 4 | 2),
+    ])
+    system = top.System(
+            4,
+            pipelined=pipelined,
+            image=loader.load(path, dmem_base=dmem_base),
+            dmem_base=dmem_base,
+            dual_issue=dual_issue)
+
+    def testbench():
+        for _ in range(30):
+            yield
+        assert (yield system.debug_out) == 0x1234
+
+    sync_sim(system, testbench)
+
+
+@pytest.mark.parametrize(
+        "dmem_base, message",
+        [
+            (0x2, "word aligned"),
+            (top.UART_BASE - 4, "below the UART"),
+        ])
+def test_system_data_memory_errors(dmem_base, message):
+    with pytest.raises(ValueError, match=message):
+        top.System(4, dmem_base=dmem_base)
+
+
+def test_load_too_large(tmp_path):
+    path = tmp_path / "program.elf"
+    # A data segment far from the start of data memory
+    write_elf(path, [(DMEM_BASE + 0x1000_0000, b"\0" * 4, 4, 4)])
+    with pytest.raises(ValueError, match="more than the 1024"):
+        loader.load(path, dmem_base=DMEM_BASE, max_words=1024)
+
+    path = tmp_path / "program.bin"
+    path.write_bytes(bytes(4 * 1025))
+    with pytest.raises(ValueError, match="more than the 1024"):
+        loader.load(path, max_words=1024)
+    with pytest.raises(ValueError, match="more than the"):
+        top.System(4, image=loader.load(path))
+
+
+def test_load_binary(tmp_path):
+    path = tmp_path / "program.bin"
+    path.write_bytes(bytes(range(1, 11)))
+
+    image = loader.load(path)
+    assert image.imem.tolist() == [0x04030201, 0x08070605, 0x00000a09]
+    assert len(image.dmem) == 0
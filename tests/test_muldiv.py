@@ -0,0 +1,91 @@
+"""Multiply and divide unit tests"""
+import nmigen.sim
+import pytest
+
+from riscy_boi import encoding, muldiv
+
+MIN = 0x80000000
+MINUS_ONE = 0xffffffff
+
+CASES = [
+        (encoding.MulDivFunct.MUL, 7, 6, 42),
+        (encoding.MulDivFunct.MUL, MINUS_ONE, 3, 0xfffffffd),
+        (encoding.MulDivFunct.MUL, 0x12345678, 0x9abcdef0, 0x242d2080),
+        (encoding.MulDivFunct.MULH, MINUS_ONE, MINUS_ONE, 0),
+        (encoding.MulDivFunct.MULH, MIN, MIN, 0x40000000),
+        (encoding.MulDivFunct.MULH, MIN, 2, MINUS_ONE),
+        (encoding.MulDivFunct.MULHSU, MINUS_ONE, MINUS_ONE, MINUS_ONE),
+        (encoding.MulDivFunct.MULHSU, 2, MINUS_ONE, 1),
+        (encoding.MulDivFunct.MULHU, MINUS_ONE, MINUS_ONE, 0xfffffffe),
+
+        (encoding.MulDivFunct.DIV, 42, 6, 7),
+        (encoding.MulDivFunct.DIV, (-7) & MINUS_ONE, 2, (-3) & MINUS_ONE),
+        (encoding.MulDivFunct.DIV, 7, (-2) & MINUS_ONE, (-3) & MINUS_ONE),
+        (encoding.MulDivFunct.DIV, 7, 0, MINUS_ONE),
+        (encoding.MulDivFunct.DIV, (-7) & MINUS_ONE, 0, MINUS_ONE),
+        (encoding.MulDivFunct.DIV, MIN, MINUS_ONE, MIN),
+        (encoding.MulDivFunct.DIVU, MINUS_ONE, 2, 0x7fffffff),
+        (encoding.MulDivFunct.DIVU, 7, 0, MINUS_ONE),
+        (encoding.MulDivFunct.REM, (-7) & MINUS_ONE, 2, MINUS_ONE),
+        (encoding.MulDivFunct.REM, 7, (-2) & MINUS_ONE, 1),
+        (encoding.MulDivFunct.REM, (-7) & MINUS_ONE, 0, (-7) & MINUS_ONE),
+        (encoding.MulDivFunct.REM, MIN, MINUS_ONE, 0),
+        (encoding.MulDivFunct.REMU, MINUS_ONE, 10, 5),
+        (encoding.MulDivFunct.REMU, 7, 0, 7),
+]
+
+
+@pytest.mark.parametrize("op, a, b, o", CASES)
+def test_muldiv_unrolled(comb_sim, op, a, b, o):
+    muldiv_inst = muldiv.MulDiv(muldiv.Implementation.UNROLLED)
+
+    def testbench():
+        yield muldiv_inst.op.eq(op)
+        yield muldiv_inst.a.eq(a)
+        yield muldiv_inst.b.eq(b)
+        yield nmigen.sim.Settle()
+        assert not (yield muldiv_inst.busy)
+        assert (yield muldiv_inst.o) == o
+
+    comb_sim(muldiv_inst, testbench)
+
+
+@pytest.mark.parametrize("op, a, b, o", CASES)
+@pytest.mark.parametrize("radix", [2, 4])
+def test_muldiv_iterative(sync_sim, radix, op, a, b, o):
+    muldiv_inst = muldiv.MulDiv(muldiv.Implementation.ITERATIVE, radix)
+    # A step of 1 bit at radix 2, or 2 bits at radix 4, per cycle
+    busy_cycles = 32 if radix == 2 else 16
+
+    def testbench():
+        # Abandon the operation started on the inputs' reset values
+        yield muldiv_inst.valid.eq(0)
+        yield
+        yield muldiv_inst.valid.eq(1)
+        yield muldiv_inst.op.eq(op)
+        yield muldiv_inst.a.eq(a)
+        yield muldiv_inst.b.eq(b)
+        for _ in range(busy_cycles):
+            yield nmigen.sim.Settle()
+            assert (yield muldiv_inst.busy)
+            yield
+        yield nmigen.sim.Settle()
+        assert not (yield muldiv_inst.busy)
+        assert (yield muldiv_inst.o) == o
+
+        # A result not yet used is held, rather than the operation restarted
+        yield muldiv_inst.advance.eq(0)
+        for _ in range(2):
+            yield
+            yield nmigen.sim.Settle()
+            assert not (yield muldiv_inst.busy)
+            assert (yield muldiv_inst.o) == o
+        yield muldiv_inst.advance.eq(1)
+
+        # Invalid operations are not started
+        yield muldiv_inst.valid.eq(0)
+        yield
+        yield nmigen.sim.Settle()
+        assert not (yield muldiv_inst.busy)
+
+    sync_sim(muldiv_inst, testbench)
@@ -0,0 +1,367 @@
+"""Pipelined CPU tests"""
+import nmigen as nm
+import pytest
+
+from riscy_boi import alu, branch_predictor, counters, encoding
+from riscy_boi import isa_simulator, muldiv, pipelined_cpu
+
+
+def addi(rd, rs1, imm):
+    return encoding.IType.encode(
+            imm & 0xfff,
+            rs1,
+            encoding.IntRegImmFunct.ADDI,
+            rd,
+            encoding.Opcode.OP_IMM)
+
+
+def load_word(rd, rs1, imm):
+    return encoding.IType.encode(
+            imm & 0xfff,
+            rs1,
+            encoding.LoadFunct.LW,
+            rd,
+            encoding.Opcode.LOAD)
+
+
+def jal(rd, offset):
+    return encoding.JType.encode(offset & 0x1fffff, rd)
+
+
+def bne(rs1, rs2, offset):
+    return encoding.BType.encode(
+            offset & 0x1fff,
+            rs1,
+            rs2,
+            encoding.BranchFunct.BNE)
+
+
+def op(funct, rd, rs1, rs2, funct7=0):
+    return encoding.RType.encode(rs1, rs2, funct, funct7, rd)
+
+
+def csrr(rd, csr):
+    return encoding.IType.encode(
+            csr,
+            0,
+            encoding.SystemFunct.CSRRS,
+            rd,
+            encoding.Opcode.SYSTEM)
+
+
+def cpu_harness(program, data=(), predictor=None, events=(), alu_unit=None,
+                muldiv_unit=None, registered_reads=False, dmem_wait=0):
+    # pylint: disable=too-many-arguments
+    m = nm.Module()
+    reg = 2
+    cpu_inst = m.submodules.cpu = pipelined_cpu.PipelinedCPU(
+            debug_reg=reg,
+            predictor=predictor,
+            events=events,
+            alu_unit=alu_unit,
+            muldiv_unit=muldiv_unit,
+            registered_reads=registered_reads)
+
+    imem = nm.Memory(width=32, depth=64, init=program)
+    imem_rp = m.submodules.imem_rp = imem.read_port(domain="sync")
+    dmem = nm.Memory(width=32, depth=64, init=data)
+    dmem_rp = m.submodules.dmem_rp = dmem.read_port(
+            transparent=False,
+            domain="sync")
+    m.d.comb += [
+            imem_rp.addr.eq(cpu_inst.imem_addr[2:]),
+            cpu_inst.imem_data.eq(imem_rp.data),
+            dmem_rp.addr.eq(cpu_inst.dmem_r_addr),
+            cpu_inst.dmem_r_data.eq(dmem_rp.data),
+    ]
+
+    if dmem_wait:
+        # Each access completes after its number of wait cycles in MEM,
+        # staying complete while it is presented again
+        dmem_waited = nm.Signal(range(dmem_wait + 1))
+        m.d.comb += cpu_inst.dmem_valid.eq(dmem_waited == dmem_wait)
+        with m.If(~cpu_inst.dmem_repeat):
+            m.d.sync += dmem_waited.eq(0)
+        with m.Elif(dmem_waited != dmem_wait):
+            m.d.sync += dmem_waited.eq(dmem_waited + 1)
+    return m, cpu_inst
+
+
+def test_pipelined_cpu_loop(sync_sim):
+    reg = 2
+    program = [addi(reg, reg, 1), jal(5, -4)]
+    m, cpu_inst = cpu_harness(program)
+
+    def testbench():
+        values = []
+        for _ in range(40):
+            values.append((yield cpu_inst.debug_out))
+            yield
+
+        increments = {b - a for a, b in zip(values, values[1:])}
+        assert increments == {0, 1}
+        assert values[-1] > 5
+
+    sync_sim(m, testbench)
+
+
+@pytest.mark.parametrize("registered_reads", [False, True])
+def test_pipelined_cpu_forwarding(sync_sim, registered_reads):
+    program = [
+            addi(1, 0, 1),
+            addi(1, 1, 2),   # forwarded from MEM
+            addi(3, 0, 4),
+            addi(1, 1, 8),   # forwarded from WB
+            addi(4, 0, 0),
+            addi(5, 0, 0),
+            addi(2, 1, 16),  # bypassed from WB to ID
+            addi(2, 2, 32),
+            jal(0, 0),
+    ]
+    m, cpu_inst = cpu_harness(program, registered_reads=registered_reads)
+
+    def testbench():
+        for _ in range(30):
+            yield
+        assert (yield cpu_inst.debug_out) == 1 + 2 + 8 + 16 + 32
+
+    sync_sim(m, testbench)
+
+
+@pytest.mark.parametrize("registered_reads", [False, True])
+def test_pipelined_cpu_load_use(sync_sim, registered_reads):
+    data = [0, 0xabc, 0x123]
+    program = [
+            load_word(1, 0, 4),
+            addi(2, 1, 1),
+            load_word(3, 0, 8),
+            addi(4, 0, 0),
+            addi(2, 2, 0x100),
+            addi(2, 2, -1),
+            jal(0, 0),
+    ]
+    m, cpu_inst = cpu_harness(program, data, registered_reads=registered_reads)
+
+    def testbench():
+        for _ in range(30):
+            yield
+        assert (yield cpu_inst.debug_out) == 0xabc + 0x100
+
+    sync_sim(m, testbench)
+
+
+def test_pipelined_cpu_jump_flushes(sync_sim):
+    program = [
+            addi(2, 0, 1),
+            jal(0, 8),
+            addi(2, 2, 100),  # skipped
+            addi(2, 2, 2),
+            jal(0, 0),
+            addi(2, 2, 200),  # never reached
+    ]
+    m, cpu_inst = cpu_harness(program)
+
+    def testbench():
+        for _ in range(30):
+            yield
+        assert (yield cpu_inst.debug_out) == 3
+
+    sync_sim(m, testbench)
+
+
+@pytest.mark.parametrize(
+        "predictor_type, max_cycles", [
+            (None, 46),
+            (branch_predictor.PredictorType.STATIC, 39),
+            (branch_predictor.PredictorType.BIMODAL, 39)])
+def test_pipelined_cpu_branch_loop(sync_sim, predictor_type, max_cycles):
+    iterations = 10
+    program = [
+            addi(1, 0, iterations),
+            addi(2, 0, 0),
+            addi(2, 2, 3),
+            addi(1, 1, -1),
+            bne(1, 0, -8),
+            addi(2, 2, 1000),
+            jal(0, 0),
+    ]
+    predictor = None
+    if predictor_type is not None:
+        predictor = branch_predictor.BranchPredictor(predictor_type)
+    m, cpu_inst = cpu_harness(program, predictor=predictor)
+
+    def testbench():
+        cycles = 0
+        while (yield cpu_inst.debug_out) < 1000:
+            assert cycles <= max_cycles
+            cycles += 1
+            yield
+        assert (yield cpu_inst.debug_out) == iterations * 3 + 1000
+
+        if predictor is not None:
+            assert (yield predictor.hits) >= iterations - 3
+            assert (yield predictor.misses) <= 3
+
+    sync_sim(m, testbench)
+
+
+def test_pipelined_cpu_register_register(sync_sim):
+    program = [
+            addi(1, 0, 7),
+            addi(2, 0, 1),
+            # Operands forwarded from MEM and WB, and a load used by both
+            op(encoding.IntRegRegFunct.SLL, 3, 1, 2),
+            op(encoding.IntRegRegFunct.ADD_OR_SUB, 4, 2, 3,
+               encoding.AddSubType.SUB),
+            load_word(5, 0, 0),
+            op(encoding.IntRegRegFunct.XOR, 6, 5, 4),
+            op(encoding.IntRegRegFunct.SRL_OR_SRA, 2, 6, 1,
+               encoding.RightShiftType.SRAI),
+            jal(0, 0),
+    ]
+    data = [0x80000000]
+    golden = isa_simulator.ISASimulator(program, data=data)
+    golden.run()
+    assert golden.registers[2] == 0x00ffffff
+    m, cpu_inst = cpu_harness(program, data=data)
+
+    def testbench():
+        for _ in range(20):
+            yield
+        assert (yield cpu_inst.debug_out) == golden.registers[2]
+
+    sync_sim(m, testbench)
+
+
+@pytest.mark.parametrize("implementation", muldiv.Implementation)
+def test_pipelined_cpu_muldiv(sync_sim, implementation):
+    program = [
+            addi(1, 0, -100),
+            addi(3, 0, 7),
+            load_word(9, 0, 0),
+            # Operands forwarded from MEM and WB, and a load used by both
+            op(encoding.MulDivFunct.MUL, 4, 1, 9, encoding.MULDIV_FUNCT7),
+            op(encoding.MulDivFunct.DIV, 5, 4, 3, encoding.MULDIV_FUNCT7),
+            op(encoding.MulDivFunct.REM, 6, 4, 3, encoding.MULDIV_FUNCT7),
+            op(encoding.IntRegRegFunct.ADD_OR_SUB, 2, 5, 6),
+            jal(0, 0),
+    ]
+    data = [3]
+    golden = isa_simulator.ISASimulator(program, data=data)
+    golden.run()
+    # DIV and REM round towards zero
+    assert golden.registers[2] == -42 - 6 & 0xffffffff
+    m, cpu_inst = cpu_harness(
+            program,
+            data=data,
+            muldiv_unit=muldiv.MulDiv(implementation))
+
+    def testbench():
+        for _ in range(3 * 17 + 15):
+            yield
+        assert (yield cpu_inst.debug_out) == golden.registers[2]
+
+    sync_sim(m, testbench)
+
+
+@pytest.mark.parametrize("dmem_wait", [0, 8, 24])
+def test_pipelined_cpu_muldiv_dmem_stall(sync_sim, dmem_wait):
+    program = [
+            addi(1, 0, -100),
+            addi(3, 0, 7),
+            load_word(9, 0, 0),
+            # In EX while the load waits in MEM
+            op(encoding.MulDivFunct.DIV, 5, 1, 3, encoding.MULDIV_FUNCT7),
+            op(encoding.IntRegRegFunct.ADD_OR_SUB, 2, 5, 9),
+            jal(0, 0),
+    ]
+    data = [3]
+    golden = isa_simulator.ISASimulator(program, data=data)
+    golden.run()
+    m, cpu_inst = cpu_harness(
+            program,
+            data=data,
+            muldiv_unit=muldiv.MulDiv(),
+            dmem_wait=dmem_wait)
+
+    def testbench():
+        cycles = 0
+        while (yield cpu_inst.debug_out) != golden.registers[2]:
+            assert cycles < 100
+            cycles += 1
+            yield
+        # The divide's 16 busy cycles and the load's wait overlap, and a
+        # divide finished before the load is not started again
+        assert cycles == 9 + max(dmem_wait, 16)
+
+    sync_sim(m, testbench)
+
+
+@pytest.mark.parametrize("dmem_wait", [0, 8, 24])
+def test_pipelined_cpu_multi_cycle_shift_dmem_stall(sync_sim, dmem_wait):
+    program = [
+            addi(1, 0, -100),
+            load_word(9, 0, 0),
+            # In EX while the load waits in MEM
+            encoding.IType.encode(
+                30,
+                1,
+                encoding.IntRegImmFunct.SRLI_OR_SRAI,
+                5,
+                encoding.Opcode.OP_IMM),
+            op(encoding.IntRegRegFunct.ADD_OR_SUB, 2, 5, 9),
+            jal(0, 0),
+    ]
+    data = [3]
+    golden = isa_simulator.ISASimulator(program, data=data)
+    golden.run()
+    m, cpu_inst = cpu_harness(
+            program,
+            data=data,
+            alu_unit=alu.ALU(32, shifter=alu.Shifter.MULTI_CYCLE),
+            dmem_wait=dmem_wait)
+
+    def testbench():
+        cycles = 0
+        while (yield cpu_inst.debug_out) != golden.registers[2]:
+            assert cycles < 100
+            cycles += 1
+            yield
+        # The shift's 9 busy cycles and the load's wait overlap, and a shift
+        # finished before the load is not started again
+        assert cycles == 8 + max(dmem_wait, 9)
+
+    sync_sim(m, testbench)
+
+
+@pytest.mark.parametrize(
+        "csr, expected", [
+            (encoding.CSR.INSTRET, None),
+            (encoding.CSR.INSTRETH, 0),
+            (encoding.CSR.HPMCOUNTER3, 5 - 1),
+            (encoding.CSR.HPMCOUNTER3 + 1, 5 - 1),
+            (encoding.CSR.HPMCOUNTER3 + 2, 0)])
+def test_pipelined_cpu_counters(sync_sim, csr, expected):
+    iterations = 5
+    program = [
+            addi(1, 0, iterations),
+            addi(1, 1, -1),
+            bne(1, 0, -4),
+            csrr(2, csr),
+            csrr(3, encoding.CSR.CYCLE),
+            jal(0, 0),
+    ]
+    golden = isa_simulator.ISASimulator(program)
+    golden.run()
+    if expected is None:
+        expected = golden.registers[2]
+    # Without a branch predictor, each taken branch is a misprediction
+    events = [counters.Event.TAKEN_JUMP, counters.Event.MISPREDICT]
+    m, cpu_inst = cpu_harness(program, events=events)
+
+    def testbench():
+        for _ in range(40):
+            yield
+        assert (yield cpu_inst.debug_out) == expected
+
+    sync_sim(m, testbench)
@@ -0,0 +1,23 @@
+"""PLL configuration tests"""
+import pytest
+
+from riscy_boi import pll
+
+
+def test_default():
+    assert pll.frequency(pll.DEFAULT) == pytest.approx(16.015625)
+    assert pll.filter_range(pll.DEFAULT) == 2
+
+
+def test_configs_in_range():
+    configs = list(pll.configs())
+    assert pll.DEFAULT in configs
+    for config in configs:
+        assert (pll.OUTPUT_MHZ[0] <= pll.frequency(config) <=
+                pll.OUTPUT_MHZ[1])
+
+
+@pytest.mark.parametrize("target", [16, 20, 33.3, 48, 75, 100])
+def test_closest(target):
+    config = pll.closest(target)
+    assert pll.frequency(config) == pytest.approx(target, rel=0.01)
@@ -1,5 +1,6 @@
 """Register file tests"""
 import nmigen as nm
+import nmigen.sim
 
 from riscy_boi import register_file
 
@@ -23,3 +24,54 @@ def test_write_to_read_register(sync_sim):
         assert (yield rf.read_data_1) == expected_value
 
     sync_sim(m, testbench)
+
+
+def test_second_write_port_wins(sync_sim):
+    rf = register_file.RegisterFile(read_ports=4, write_ports=2)
+
+    def testbench():
+        yield rf.write_enable.eq(1)
+        yield rf.write_select.eq(3)
+        yield rf.write_data.eq(1)
+        yield rf.write_enable_2.eq(1)
+        yield rf.write_select_2.eq(3)
+        yield rf.write_data_2.eq(2)
+        yield
+        yield rf.write_select.eq(4)
+        yield rf.write_enable_2.eq(0)
+        yield
+        yield rf.write_enable.eq(0)
+        yield rf.read_select_3.eq(3)
+        yield rf.read_select_4.eq(4)
+        yield
+        assert (yield rf.read_data_3) == 2
+        assert (yield rf.read_data_4) == 1
+
+    sync_sim(rf, testbench)
+
+
+def test_registered_reads(sync_sim):
+    rf = register_file.RegisterFile(debug_reg=3, registered_reads=True)
+
+    def testbench():
+        yield rf.write_enable.eq(1)
+        yield rf.write_select.eq(3)
+        yield rf.write_data.eq(5)
+        yield rf.read_select_1.eq(3)
+        yield
+        yield rf.write_data.eq(6)
+        yield rf.read_select_2.eq(3)
+        yield rf.read_enable.eq(0)
+        yield
+        # The write is bypassed, and the held read is not updated
+        yield nmigen.sim.Settle()
+        assert (yield rf.read_data_1) == 5
+        yield rf.read_enable.eq(1)
+        yield rf.write_enable.eq(0)
+        yield
+        yield nmigen.sim.Settle()
+        assert (yield rf.read_data_1) == 6
+        assert (yield rf.read_data_2) == 6
+        assert (yield rf.debug_out) == 6
+
+    sync_sim(rf, testbench)
@@ -0,0 +1,76 @@
+"""Reusable simulator tests"""
+import nmigen as nm
+import nmigen.sim
+import pytest
+
+from riscy_boi import reusable_sim
+
+
+class Summer(nm.Elaboratable):
+    """Sums the words of a memory, one a cycle"""
+
+    def __init__(self):
+        self.memory = nm.Memory(width=8, depth=4, init=[1, 2, 3, 4])
+        self.index = nm.Signal(2)
+        self.word = nm.Signal(8)
+        self.total = nm.Signal(10)
+
+    def elaborate(self, _):
+        m = nm.Module()
+        memory_rp = m.submodules.memory_rp = self.memory.read_port(
+                domain="comb")
+        m.d.comb += [
+                memory_rp.addr.eq(self.index),
+                self.word.eq(memory_rp.data),
+        ]
+        m.d.sync += [
+                self.index.eq(self.index + 1),
+                self.total.eq(self.total + self.word),
+        ]
+        return m
+
+
+def test_rerun_from_reset(sim_engine):
+    summer = Summer()
+    sim = reusable_sim.ReusableSimulator(summer, sim_engine, 1e-6)
+    totals = []
+
+    def testbench():
+        assert (yield summer.index) == 0
+        for _ in range(4):
+            yield
+        totals.append((yield summer.total))
+
+    sim.run(testbench)
+    sim.run(testbench, [(summer.memory, [5, 6])])
+    sim.run(testbench)
+    assert totals == [10, 11, 10]
+    assert sim.runs == 3
+
+
+def test_rerun_combinational(sim_engine):
+    summer = Summer()
+    sim = reusable_sim.ReusableSimulator(summer, sim_engine)
+    words = []
+
+    def testbench():
+        yield nmigen.sim.Settle()
+        words.append((yield summer.word))
+        yield summer.index.eq(3)
+        yield nmigen.sim.Settle()
+        words.append((yield summer.word))
+
+    sim.run(testbench, [(summer.memory, [9])], deadline=1e-6)
+    sim.run(testbench, deadline=1e-6)
+    assert words == [9, 0, 1, 4]
+
+
+def test_memory_too_small():
+    summer = Summer()
+    sim = reusable_sim.ReusableSimulator(summer, clock_period=1e-6)
+
+    def testbench():
+        yield
+
+    with pytest.raises(ValueError):
+        sim.run(testbench, [(summer.memory, [0] * 5)])
@@ -0,0 +1,26 @@
+"""PLL and seed sweep tests"""
+from riscy_boi import pll
+from riscy_boi import sweep
+
+
+def test_candidates():
+    configs = sweep.candidates(20, 40, 5)
+    frequencies = [pll.frequency(config) for config in configs]
+    assert frequencies == sorted(frequencies, reverse=True)
+    assert frequencies[0] == 40
+    assert frequencies[-1] == 20
+
+
+def test_best():
+    slow = pll.closest(20)
+    fast = pll.closest(40)
+    results = {
+            (False, slow, 1): {"sync": 45.0},
+            (False, fast, 1): {"sync": 38.0},
+            (False, fast, 2): {"sync": 41.0},
+            (False, fast, 3): {"sync": 39.0},
+    }
+    assert sweep.best(results) == ((False, fast, 2), results[(False, fast, 2)])
+    del results[(False, fast, 2)]
+    assert sweep.best(results)[0] == (False, slow, 1)
+    assert sweep.best({(False, fast, 1): {}}) is None
@@ -0,0 +1,62 @@
+"""Synthesis tests"""
+import pytest
+
+from riscy_boi import alu, build_cache, synthesis
+
+
+def test_synthesise_harnessed_alu():
+    pytest.importorskip("yowasp_yosys")
+    alu_inst = alu.ALU(8, adder=alu.Adder.SHARED, shifter=alu.Shifter.BARREL)
+    harness = synthesis.Harness(
+            alu_inst,
+            [alu_inst.op, alu_inst.a, alu_inst.b],
+            [alu_inst.o])
+    cache = build_cache.BuildCache(synthesis.WORK_DIR / "test_cache")
+    result = synthesis.synthesise(harness, harness.ports, cache=cache)
+    assert synthesis.synthesise(harness, harness.ports, cache=cache) == result
+    assert result["luts"] > 0
+    assert result["carries"] > 0
+    # The input and output shift registers
+    assert result["flip_flops"] == 3 + 8 + 8 + 8
+    assert result["brams"] == 0
+    assert result["logic_depth"] > 0
+
+
+def test_regressions():
+    baseline = {"alu": {"luts": 100, "carries": 10, "flip_flops": 50,
+                        "brams": 0, "fmax_mhz": {"sync": 50.0}}}
+
+    def results(luts, fmax):
+        return {"alu": {"luts": luts, "carries": 10, "flip_flops": 50,
+                        "brams": 0, "fmax_mhz": fmax}}
+
+    assert not synthesis.regressions(results(102, {"sync": 48.0}), baseline)
+    assert not synthesis.regressions(results(90, None), baseline)
+    assert len(synthesis.regressions(results(103, None), baseline)) == 1
+    assert len(synthesis.regressions(
+            results(103, {"sync": 47.0}), baseline)) == 2
+    assert not synthesis.regressions(
+            {"other": results(1000, None)["alu"]},
+            baseline)
+
+
+def test_unchecked():
+    baseline = {"alu": {"luts": 100, "carries": 10, "flip_flops": 50,
+                        "brams": 0, "fmax_mhz": None}}
+    result = {"luts": 100, "carries": 10, "flip_flops": 50, "brams": 0,
+              "fmax_mhz": None}
+    assert synthesis.unchecked({"alu": result}, baseline) == ([], ["alu"])
+    assert synthesis.unchecked(
+            {"alu": dict(result, fmax_mhz={"sync": 50.0}), "top": result},
+            baseline) == (["alu: no sync fmax baseline", "top: no baseline"],
+                          [])
+
+
+@pytest.mark.parametrize("net, domain", [
+        ("clk", "sync"),
+        ("clk$SB_IO_IN_$glb_clk", "sync"),
+        ("fast_clk", "fast"),
+        ("fast_clk_$glb_clk", "fast"),
+])
+def test_clock_domain(net, domain):
+    assert synthesis.clock_domain(net) == domain
@@ -0,0 +1,96 @@
+"""Trace tests"""
+import nmigen.sim
+import pytest
+
+from riscy_boi import benchmarks
+from riscy_boi import cpu
+from riscy_boi import encoding
+from riscy_boi import isa_simulator
+from riscy_boi import trace
+
+
+def test_round_trip(tmp_path):
+    records = [
+            trace.Record(0, 0, 0x00100093, 1, 1, None),
+            trace.Record(1, 4, 0x00102023, 0, 0, 0),
+            # A jump back, after a stall
+            trace.Record(5, 0, 0x00100093, 1, 1, None),
+            trace.Record(6, 4, 0x00102023, 0, 0, 0),
+            # The register decreases and the address wraps around
+            trace.Record(7, 8, 0xffc0a083, 1, 0, 0xfffffffc),
+            trace.Record(2**40, 0xfffffffc, 0x0000006f, 0, 0, None),
+    ]
+    path = tmp_path / "run.trace"
+    with trace.TraceWriter(path) as writer:
+        for record in records:
+            writer.write(record)
+    assert writer.records == len(records)
+    assert list(trace.read(path)) == records
+
+    data = path.read_bytes()
+    path.write_bytes(data[:-1])
+    with pytest.raises(ValueError, match="corrupt"):
+        list(trace.read(path))
+    path.write_bytes(b"ELF" + data[3:])
+    with pytest.raises(ValueError, match="not b'RBTR'"):
+        list(trace.read(path))
+    path.write_bytes(data[:4] + b"\x09\x00" + data[6:])
+    with pytest.raises(ValueError, match="version"):
+        list(trace.read(path))
+
+
+def test_cpu_trace(sim_engine, tmp_path):
+    kernel = benchmarks.KERNELS["sort"]()
+    cpu_inst = cpu.CPU()
+    m, _, dmem = benchmarks.harness(cpu_inst, kernel)
+    path = tmp_path / "sort.trace"
+
+    def testbench():
+        while not (yield dmem[benchmarks.DONE_ADDRESS // 4]):
+            yield
+        # Retire the jump to itself the program ends with
+        yield
+        yield
+
+    with trace.TraceWriter(path) as writer:
+        sim = nmigen.sim.Simulator(m, engine=sim_engine)
+        sim.add_clock(1e-6)
+        sim.add_sync_process(trace.recorder(cpu_inst, writer))
+        sim.add_sync_process(testbench)
+        sim.run()
+
+    golden = isa_simulator.ISASimulator(kernel.program, kernel.data)
+    records = list(trace.read(path))
+    for record in records:
+        if golden.halted:
+            # The CPU keeps retiring the jump to itself
+            assert record.pc == golden.pc
+            continue
+        instr = golden.program[golden.pc // 4]
+        assert (record.pc, record.instr) == (golden.pc, instr)
+
+        opcode = instr & 0x7f
+        rs1 = isa_simulator.field(
+                instr,
+                encoding.RS1_START,
+                encoding.RS1_END)
+        if opcode == encoding.Opcode.LOAD:
+            address = golden.registers[rs1] + isa_simulator.itype_immediate(
+                    instr)
+        elif opcode == encoding.Opcode.STORE:
+            address = golden.registers[rs1] + isa_simulator.stype_immediate(
+                    instr)
+        else:
+            address = None
+        assert record.mem_addr == (
+                None if address is None else address & trace.MASK)
+
+        registers = list(golden.registers)
+        golden.step()
+        if record.rd:
+            registers[record.rd] = record.rd_data
+        assert registers == golden.registers
+
+    assert golden.halted
+    assert all(a.cycle < b.cycle for a, b in zip(records, records[1:]))
+    assert path.stat().st_size < 4 * len(records)
@@ -0,0 +1,141 @@
+"""UART tests"""
+import nmigen.sim
+import pytest
+
+from riscy_boi import uart
+
+
+def write(uart_inst, register, value, w_en=0b1111):
+    yield uart_inst.addr.eq(register)
+    yield uart_inst.w_data.eq(value)
+    yield uart_inst.w_en.eq(w_en)
+    yield
+    yield uart_inst.w_en.eq(0)
+
+
+def read(uart_inst, register):
+    yield uart_inst.addr.eq(register)
+    yield uart_inst.r_en.eq(1)
+    yield
+    yield uart_inst.r_en.eq(0)
+    yield nmigen.sim.Settle()
+    return (yield uart_inst.r_data)
+
+
+def status_bit(bit):
+    return 1 << bit
+
+
+def test_loopback(sync_sim):
+    uart_inst = uart.UART(divisor=4, tx_depth=4, rx_depth=4)
+    message = b"hi!"
+
+    def testbench():
+        yield from write(
+                uart_inst,
+                uart.Register.CONTROL,
+                1 << uart.Control.LOOPBACK)
+        for byte in message:
+            yield from write(uart_inst, uart.Register.DATA, byte, w_en=0b0001)
+        assert (yield from read(uart_inst, uart.Register.LEVELS)) > 0
+
+        cycles = 0
+        while (yield from read(uart_inst, uart.Register.LEVELS)) != (
+                len(message) << 16):
+            # Looped back, nothing is sent on the pin
+            assert (yield uart_inst.tx)
+            cycles += 1
+        # Back to back, each frame is ten bits of four cycles
+        assert cycles < len(message) * 10 * 4 + 10
+        status = yield from read(uart_inst, uart.Register.STATUS)
+        assert status == (status_bit(uart.Status.RX_VALID) |
+                          status_bit(uart.Status.TX_READY) |
+                          status_bit(uart.Status.TX_IDLE))
+
+        for byte in message:
+            assert (yield from read(uart_inst, uart.Register.DATA)) == (
+                    0x100 | byte)
+        assert (yield from read(uart_inst, uart.Register.DATA)) == 0
+
+    sync_sim(uart_inst, testbench)
+
+
+def test_serial_frames(sync_sim):
+    divisor = 3
+    uart_inst = uart.UART(divisor=5)
+
+    def send_frame(bits):
+        for bit in bits:
+            yield uart_inst.rx.eq(bit)
+            for _ in range(divisor):
+                yield
+
+    def testbench():
+        yield from write(uart_inst, uart.Register.DIVISOR, divisor)
+        assert (yield from read(uart_inst, uart.Register.DIVISOR)) == divisor
+
+        yield from write(uart_inst, uart.Register.DATA, 0xa5)
+        while (yield uart_inst.tx):
+            yield
+        sent = []
+        for _ in range(10):
+            sent.append((yield uart_inst.tx))
+            for _ in range(divisor):
+                yield
+        assert sent == [0, 1, 0, 1, 0, 0, 1, 0, 1, 1]
+
+        enable = status_bit(uart.Status.RX_VALID)
+        yield from write(uart_inst, uart.Register.CONTROL, enable)
+        assert not (yield uart_inst.irq)
+        yield from send_frame([0, 0, 1, 1, 0, 1, 1, 0, 0, 1, 1])
+        yield from send_frame([0, 1, 1, 1, 1, 1, 1, 1, 1, 0, 1])
+        yield nmigen.sim.Settle()
+        assert (yield uart_inst.irq)
+        status = yield from read(uart_inst, uart.Register.STATUS)
+        assert status & status_bit(uart.Status.FRAME_ERROR)
+        assert (yield from read(uart_inst, uart.Register.DATA)) == 0x136
+        assert (yield from read(uart_inst, uart.Register.DATA)) == 0
+        yield nmigen.sim.Settle()
+        assert not (yield uart_inst.irq)
+
+        yield from write(
+                uart_inst,
+                uart.Register.STATUS,
+                status_bit(uart.Status.FRAME_ERROR))
+        status = yield from read(uart_inst, uart.Register.STATUS)
+        assert not status & status_bit(uart.Status.FRAME_ERROR)
+
+    sync_sim(uart_inst, testbench)
+
+
+def test_rx_overrun(sync_sim):
+    uart_inst = uart.UART(divisor=2, tx_depth=8, rx_depth=2)
+
+    def testbench():
+        yield from write(
+                uart_inst,
+                uart.Register.CONTROL,
+                1 << uart.Control.LOOPBACK)
+        for byte in range(4):
+            yield from write(uart_inst, uart.Register.DATA, byte)
+        while not (yield from read(uart_inst, uart.Register.STATUS)) & (
+                status_bit(uart.Status.TX_IDLE)):
+            pass
+        # Let the last byte through the receiver
+        for _ in range(10):
+            yield
+
+        status = yield from read(uart_inst, uart.Register.STATUS)
+        assert status & status_bit(uart.Status.RX_OVERRUN)
+        assert (yield from read(uart_inst, uart.Register.DATA)) == 0x100
+        assert (yield from read(uart_inst, uart.Register.DATA)) == 0x101
+        assert (yield from read(uart_inst, uart.Register.DATA)) == 0
+
+    sync_sim(uart_inst, testbench)
+
+
+def test_divisor_range():
+    with pytest.raises(ValueError):
+        uart.UART(divisor=1)
+    with pytest.raises(ValueError):
+        uart.UART(divisor=2**uart.DIVISOR_WIDTH)